@@ -32,12 +32,97 @@ class Settings:
     llm_model_sql_generation = os.getenv("LLM_MODEL_SQL_GENERATION", "qwen3-coder-plus")
     _raw_llm_response_format_sql = os.getenv("LLM_RESPONSE_FORMAT_SQL", "").strip().lower()
     llm_response_format_sql = _raw_llm_response_format_sql if _raw_llm_response_format_sql in {"json_object"} else ""
+    llm_max_connections = int(os.getenv("LLM_MAX_CONNECTIONS", "20"))
+    llm_max_keepalive_connections = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "10"))
+    llm_keepalive_expiry = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "60"))
+    llm_connect_timeout = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+    _raw_llm_model_max_connections = os.getenv("LLM_MODEL_MAX_CONNECTIONS", "")
+    llm_model_max_connections = {
+        item.split("=", 1)[0].strip(): int(item.split("=", 1)[1].strip())
+        for item in _raw_llm_model_max_connections.split(",")
+        if "=" in item and item.split("=", 1)[1].strip().isdigit()
+    }
+    _raw_llm_http2 = os.getenv("LLM_HTTP2", "auto").strip().lower()
+    llm_http2 = _raw_llm_http2 if _raw_llm_http2 in {"auto", "on", "off"} else "auto"
     intent_confidence_threshold = float(os.getenv("INTENT_CONFIDENCE_THRESHOLD", "0.7"))
+    schema_kb_path = os.getenv("SCHEMA_KB_PATH", "app/knowledge/schema_kb_core.json")
+    query_cache_enabled = os.getenv("QUERY_CACHE_ENABLED", "true").strip().lower() in {"1", "true", "yes", "on"}
+    query_cache_max_entries = int(os.getenv("QUERY_CACHE_MAX_ENTRIES", "256"))
+    query_cache_ttl_seconds = int(os.getenv("QUERY_CACHE_TTL_SECONDS", "86400"))
+    query_cache_touch_interval_seconds = int(os.getenv("QUERY_CACHE_TOUCH_INTERVAL_SECONDS", "60"))
+    sql_result_cache_enabled = os.getenv("SQL_RESULT_CACHE_ENABLED", "true").strip().lower() in {"1", "true", "yes", "on"}
+    sql_result_cache_max_entries = int(os.getenv("SQL_RESULT_CACHE_MAX_ENTRIES", "512"))
+    sql_result_cache_max_cells = int(os.getenv("SQL_RESULT_CACHE_MAX_CELLS", "2000000"))
+    sql_result_cache_ttl_seconds = int(os.getenv("SQL_RESULT_CACHE_TTL_SECONDS", "600"))
+    sql_guard_enabled = os.getenv("SQL_GUARD_ENABLED", "true").strip().lower() in {"1", "true", "yes", "on"}
+    sql_guard_max_estimated_rows = int(os.getenv("SQL_GUARD_MAX_ESTIMATED_ROWS", "2000000"))
+    sql_guard_max_query_cost = float(os.getenv("SQL_GUARD_MAX_QUERY_COST", "1000000"))
+    sql_guard_detail_limit = int(os.getenv("SQL_GUARD_DETAIL_LIMIT", "1000"))
+    sql_guard_max_fetch_rows = int(os.getenv("SQL_GUARD_MAX_FETCH_ROWS", "5000"))
+    sql_guard_max_execution_ms = int(os.getenv("SQL_GUARD_MAX_EXECUTION_MS", "15000"))
+    sql_result_preview_rows = int(os.getenv("SQL_RESULT_PREVIEW_ROWS", "200"))
+    hidden_context_probe_limit = int(os.getenv("HIDDEN_CONTEXT_PROBE_LIMIT", "20"))
+    hidden_context_probe_cache_enabled = os.getenv("HIDDEN_CONTEXT_PROBE_CACHE_ENABLED", "true").strip().lower() in {"1", "true", "yes", "on"}
+    hidden_context_probe_cache_ttl_seconds = int(os.getenv("HIDDEN_CONTEXT_PROBE_CACHE_TTL_SECONDS", "300"))
+    value_dictionary_enabled = os.getenv("VALUE_DICTIONARY_ENABLED", "true").strip().lower() in {"1", "true", "yes", "on"}
+    value_dictionary_fields = [
+        item.strip() for item in os.getenv("VALUE_DICTIONARY_FIELDS", "").split(",") if item.strip()
+    ]
+    value_dictionary_max_values = int(os.getenv("VALUE_DICTIONARY_MAX_VALUES", "5000"))
+    value_dictionary_ttl_seconds = int(os.getenv("VALUE_DICTIONARY_TTL_SECONDS", "3600"))
+    value_dictionary_min_score = float(os.getenv("VALUE_DICTIONARY_MIN_SCORE", "0.3"))
+    sql_repair_enabled = os.getenv("SQL_REPAIR_ENABLED", "true").strip().lower() in {"1", "true", "yes", "on"}
+    sql_repair_min_value_score = float(os.getenv("SQL_REPAIR_MIN_VALUE_SCORE", "0.6"))
+    _raw_log_level = os.getenv("LOG_LEVEL", "INFO").strip().upper()
+    log_level = _raw_log_level if _raw_log_level in {"DEBUG", "INFO", "WARNING", "ERROR"} else "INFO"
+    log_node_sample_rate = float(os.getenv("LOG_NODE_SAMPLE_RATE", "1.0"))
+    log_payload_max_items = int(os.getenv("LOG_PAYLOAD_MAX_ITEMS", "5"))
+    log_payload_max_chars = int(os.getenv("LOG_PAYLOAD_MAX_CHARS", "500"))
     node_io_log_dir = os.getenv("NODE_IO_LOG_DIR", "local_logs/node_io")
+    node_io_segment_max_bytes = int(os.getenv("NODE_IO_SEGMENT_MAX_BYTES", str(64 * 1024 * 1024)))
+    node_io_max_segments = int(os.getenv("NODE_IO_MAX_SEGMENTS", "32"))
+    _raw_node_io_compression = os.getenv("NODE_IO_COMPRESSION", "gzip").strip().lower()
+    node_io_compression = _raw_node_io_compression if _raw_node_io_compression in {"none", "gzip", "zstd"} else "gzip"
     chat_export_dir = os.getenv("CHAT_EXPORT_DIR", "local_logs/chat_exports")
+    _raw_chat_workflow_mode = os.getenv("CHAT_WORKFLOW_MODE", "two_call").strip().lower()
+    chat_workflow_mode = (
+        _raw_chat_workflow_mode if _raw_chat_workflow_mode in {"two_call", "single_call", "speculative"} else "two_call"
+    )
+    speculative_match_threshold = float(os.getenv("SPECULATIVE_MATCH_THRESHOLD", "0.85"))
+    db_executor_workers = int(os.getenv("DB_EXECUTOR_WORKERS", "10"))
+    db_pool_size = int(os.getenv("DB_POOL_SIZE", "10"))
+    db_max_overflow = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+    db_pool_timeout = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+    chat_admission_enabled = os.getenv("CHAT_ADMISSION_ENABLED", "true").strip().lower() in {"1", "true", "yes", "on"}
+    chat_max_concurrent = int(os.getenv("CHAT_MAX_CONCURRENT", "8"))
+    chat_max_concurrent_per_admin = int(os.getenv("CHAT_MAX_CONCURRENT_PER_ADMIN", "2"))
+    chat_queue_max = int(os.getenv("CHAT_QUEUE_MAX", "100"))
+    chat_queue_max_per_admin = int(os.getenv("CHAT_QUEUE_MAX_PER_ADMIN", "5"))
+    chat_queue_timeout_seconds = float(os.getenv("CHAT_QUEUE_TIMEOUT_SECONDS", "30"))
+    chat_single_flight_enabled = os.getenv("CHAT_SINGLE_FLIGHT_ENABLED", "true").strip().lower() in {"1", "true", "yes", "on"}
+    write_behind_enabled = os.getenv("WRITE_BEHIND_ENABLED", "true").strip().lower() in {"1", "true", "yes", "on"}
+    write_behind_queue_size = int(os.getenv("WRITE_BEHIND_QUEUE_SIZE", "2000"))
+    write_behind_batch_rows = int(os.getenv("WRITE_BEHIND_BATCH_ROWS", "200"))
+    write_behind_flush_interval_ms = int(os.getenv("WRITE_BEHIND_FLUSH_INTERVAL_MS", "500"))
+    workflow_log_result_sample_rows = int(os.getenv("WORKFLOW_LOG_RESULT_SAMPLE_ROWS", "5"))
+    schema_retrieval_enabled = os.getenv("SCHEMA_RETRIEVAL_ENABLED", "true").strip().lower() in {"1", "true", "yes", "on"}
+    schema_retrieval_max_tables = int(os.getenv("SCHEMA_RETRIEVAL_MAX_TABLES", "5"))
+    schema_retrieval_max_columns = int(os.getenv("SCHEMA_RETRIEVAL_MAX_COLUMNS", "10"))
+    schema_retrieval_min_score_ratio = float(os.getenv("SCHEMA_RETRIEVAL_MIN_SCORE_RATIO", "0.35"))
+    sql_example_enabled = os.getenv("SQL_EXAMPLE_ENABLED", "true").strip().lower() in {"1", "true", "yes", "on"}
+    sql_example_testset_path = os.getenv("SQL_EXAMPLE_TESTSET_PATH", "AI_EVAL_TESTSET.md")
+    sql_example_top_k = int(os.getenv("SQL_EXAMPLE_TOP_K", "3"))
+    sql_example_min_similarity = float(os.getenv("SQL_EXAMPLE_MIN_SIMILARITY", "0.2"))
+    sql_example_max_session = int(os.getenv("SQL_EXAMPLE_MAX_SESSION", "500"))
+    sql_example_refresh_seconds = int(os.getenv("SQL_EXAMPLE_REFRESH_SECONDS", "600"))
+    chat_deadline_sync_seconds = float(os.getenv("CHAT_DEADLINE_SYNC_SECONDS", "60"))
+    chat_deadline_stream_seconds = float(os.getenv("CHAT_DEADLINE_STREAM_SECONDS", "90"))
+    chat_deadline_min_retry_seconds = float(os.getenv("CHAT_DEADLINE_MIN_RETRY_SECONDS", "20"))
+    chat_deadline_summary_reserve_seconds = float(os.getenv("CHAT_DEADLINE_SUMMARY_RESERVE_SECONDS", "5"))
     _raw_chat_stream_mode = os.getenv("CHAT_STREAM_MODE", "stream").strip().lower()
     chat_stream_mode = _raw_chat_stream_mode if _raw_chat_stream_mode in {"stream", "sync"} else "stream"
     chat_stream_workflow_start_message = "收到！让我帮您查一查"
+    chat_stream_queued_message = "前面还有人在问，稍等一下"
     chat_stream_workflow_end_message = "搞定啦，结果在这儿"
     chat_stream_step_message_placeholders = {
         "intent_recognition": {
@@ -60,6 +145,10 @@ class Settings:
             "start": "看样子SQL生成有误，别慌，我会救场！",
             "end": "救场完毕！重新生成试试！"
         },
+        "sql_repair": {
+            "start": "先试试直接修正语句",
+            "end": "修正完毕"
+        },
         "result_return": {
             "start": "整理一下结果给您",
             "end": "整理好咯"
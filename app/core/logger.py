@@ -0,0 +1,171 @@
+from __future__ import annotations
+
+import json
+import logging
+import queue
+import random
+import sys
+import threading
+from datetime import date, datetime, timezone
+from decimal import Decimal
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any
+
+from app.core.config import settings
+
+APP_LOGGER_NAME = "app"
+
+_LOGGING_LOCK = threading.Lock()
+_LISTENER: QueueListener | None = None
+
+
+class JsonLineFormatter(logging.Formatter):
+    """作用：将日志记录格式化为单行 JSON（在后台线程中执行，序列化开销不落在请求路径上）。"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: dict[str, Any] = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key in ("session_id", "step", "payload"):
+            value = getattr(record, key, None)
+            if value is not None:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _DeferredQueueHandler(QueueHandler):
+    """作用：入队时不做格式化，保留原始记录，由监听线程统一格式化与输出。"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def setup_logging() -> None:
+    """作用：配置应用日志：app 命名空间下的记录经队列交给后台线程按 JSON 行写到标准输出（可重复调用）。
+
+    输入参数：
+    - 无。
+
+    输出参数：
+    - 无。
+    """
+
+    global _LISTENER
+    with _LOGGING_LOCK:
+        if _LISTENER is not None:
+            return
+        log_queue: queue.SimpleQueue[logging.LogRecord] = queue.SimpleQueue()
+        stream_handler = logging.StreamHandler(sys.stdout)
+        stream_handler.setFormatter(JsonLineFormatter())
+        listener = QueueListener(log_queue, stream_handler, respect_handler_level=False)
+        app_logger = logging.getLogger(APP_LOGGER_NAME)
+        app_logger.setLevel(settings.log_level)
+        app_logger.handlers = [_DeferredQueueHandler(log_queue)]
+        app_logger.propagate = False
+        listener.start()
+        _LISTENER = listener
+
+
+def shutdown_logging() -> None:
+    """作用：停止后台日志线程并输出队列中剩余的记录（应用退出时调用）。
+
+    输入参数：
+    - 无。
+
+    输出参数：
+    - 无。
+    """
+
+    global _LISTENER
+    with _LOGGING_LOCK:
+        listener = _LISTENER
+        _LISTENER = None
+    if listener is not None:
+        listener.stop()
+
+
+def get_logger(name: str) -> logging.Logger:
+    """作用：获取 app 命名空间下的日志记录器。
+
+    输入参数：
+    - name: str，如 chat_graph。
+
+    输出参数：
+    - 返回值类型: logging.Logger。
+    """
+
+    return logging.getLogger(f"{APP_LOGGER_NAME}.{name}")
+
+
+def truncate_payload(value: Any, max_items: int, max_chars: int) -> Any:
+    """作用：按条数与字符数截断日志载荷，返回新构造的容器（不共享调用方的可变对象）。
+
+    max_items/max_chars 小于等于 0 时不截断，仅做拷贝。
+
+    输入参数：
+    - value: Any。
+    - max_items: int，列表保留的最大条数。
+    - max_chars: int，字符串保留的最大字符数。
+
+    输出参数：
+    - 返回值类型: Any。
+    """
+
+    if isinstance(value, dict):
+        return {str(key): truncate_payload(item, max_items, max_chars) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        items = list(value)
+        if max_items > 0 and len(items) > max_items:
+            kept = [truncate_payload(item, max_items, max_chars) for item in items[:max_items]]
+            kept.append(f"...(+{len(items) - max_items})")
+            return kept
+        return [truncate_payload(item, max_items, max_chars) for item in items]
+    if isinstance(value, str):
+        if max_chars > 0 and len(value) > max_chars:
+            return f"{value[:max_chars]}...(+{len(value) - max_chars})"
+        return value
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if isinstance(value, (Decimal, date, datetime)):
+        return str(value)
+    return truncate_payload(str(value), max_items, max_chars)
+
+
+def log_node_output(logger: logging.Logger, step: str, payload: Any, session_id: str | None = None) -> None:
+    """作用：记录工作流节点输出：INFO 级按采样率记录截断后的载荷，DEBUG 级记录完整载荷。
+
+    未启用对应级别时不做任何拷贝或序列化。
+
+    输入参数：
+    - logger: logging.Logger。
+    - step: str，节点名。
+    - payload: Any，节点输出。
+    - session_id: str | None。
+
+    输出参数：
+    - 无。
+    """
+
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(
+            "node output",
+            extra={"step": step, "session_id": session_id, "payload": truncate_payload(payload, 0, 0)},
+        )
+        return
+    if not logger.isEnabledFor(logging.INFO):
+        return
+    if settings.log_node_sample_rate < 1.0 and random.random() >= settings.log_node_sample_rate:
+        return
+    logger.info(
+        "node output",
+        extra={
+            "step": step,
+            "session_id": session_id,
+            "payload": truncate_payload(payload, settings.log_payload_max_items, settings.log_payload_max_chars),
+        },
+    )
@@ -0,0 +1,72 @@
+from __future__ import annotations
+
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, TypeVar
+
+from app.core.config import settings
+
+T = TypeVar("T")
+
+_DB_EXECUTOR_LOCK = threading.Lock()
+_DB_EXECUTOR: ThreadPoolExecutor | None = None
+
+
+def get_db_executor() -> ThreadPoolExecutor:
+    """作用：获取进程级数据库调用线程池（首次调用时创建）。
+
+    异步工作流只在这里执行同步 Session 的阻塞调用；线程数固定，与并发会话数无关。
+
+    输入参数：
+    - 无。
+
+    输出参数：
+    - 返回值类型: ThreadPoolExecutor。
+    """
+
+    global _DB_EXECUTOR
+    if _DB_EXECUTOR is None:
+        with _DB_EXECUTOR_LOCK:
+            if _DB_EXECUTOR is None:
+                _DB_EXECUTOR = ThreadPoolExecutor(
+                    max_workers=settings.db_executor_workers,
+                    thread_name_prefix="db-call",
+                )
+    return _DB_EXECUTOR
+
+
+async def run_db_call(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """作用：在数据库线程池中执行同步调用并等待结果，不阻塞事件循环。
+
+    同一个 Session 的调用须由调用方保证串行（工作流按节点顺序 await，天然满足）。
+
+    输入参数：
+    - func: Callable[..., T]。
+    - args/kwargs: 传给 func 的参数。
+
+    输出参数：
+    - 返回值类型: T。
+    """
+
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_db_executor(), functools.partial(func, *args, **kwargs))
+
+
+def shutdown_db_executor() -> None:
+    """作用：关闭数据库线程池（应用退出时调用）。
+
+    输入参数：
+    - 无。
+
+    输出参数：
+    - 无。
+    """
+
+    global _DB_EXECUTOR
+    with _DB_EXECUTOR_LOCK:
+        executor = _DB_EXECUTOR
+        _DB_EXECUTOR = None
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
@@ -1,16 +1,39 @@
-﻿import uvicorn
+﻿from contextlib import asynccontextmanager
+
+import uvicorn
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.exceptions import RequestValidationError
 from fastapi.responses import JSONResponse
 from sqlalchemy import text
 
+from app.core.logger import setup_logging, shutdown_logging
+from app.db.executor import shutdown_db_executor
 from app.db.session import SessionLocal
 from app.routers import admin, auth, chat, data, importer, metric, cockpit
 from app.schemas.response import ErrorResponse
+from app.services.chat_graph import get_chat_graph
+from app.services.llm_client import llm_client_manager
+from app.services.node_io_store import node_io_store
+from app.services.write_behind_service import write_behind_queue
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 启动时配置异步日志并预编译问答工作流图；退出时关闭大模型长连接池，写完后写队列，关闭数据库调用线程池、日志线程与节点日志写线程
+    setup_logging()
+    get_chat_graph()
+    try:
+        yield
+    finally:
+        await llm_client_manager.aclose()
+        write_behind_queue.close()
+        shutdown_db_executor()
+        node_io_store.close()
+        shutdown_logging()
 
 
 def create_app() -> FastAPI:
-    app = FastAPI(title="Edu Cockpit API", version="1.0.0")
+    app = FastAPI(title="Edu Cockpit API", version="1.0.0", lifespan=lifespan)
 
     app.include_router(auth.router, prefix="/api/auth", tags=["auth"])
     app.include_router(admin.router, prefix="/api/admin", tags=["admin"])
@@ -34,7 +57,7 @@ def create_app() -> FastAPI:
     @app.exception_handler(HTTPException)
     async def http_exception_handler(request: Request, exc: HTTPException):
         payload = ErrorResponse(code=exc.status_code, message=str(exc.detail))
-        return JSONResponse(status_code=exc.status_code, content=payload.dict())
+        return JSONResponse(status_code=exc.status_code, content=payload.dict(), headers=exc.headers)
 
     @app.exception_handler(RequestValidationError)
     async def validation_exception_handler(request: Request, exc: RequestValidationError):
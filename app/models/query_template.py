@@ -1,4 +1,4 @@
-from sqlalchemy import JSON, Integer, String, Text
+from sqlalchemy import JSON, DateTime, Integer, String, Text
 from sqlalchemy.orm import Mapped, mapped_column
 
 from app.db.base import Base
@@ -14,4 +14,5 @@ class QueryTemplate(AuditMixin, Base):
     template_sql: Mapped[str] = mapped_column(Text, nullable=False, comment="模板SQL")
     params_schema: Mapped[dict | None] = mapped_column(JSON, nullable=True, comment="参数结构")
     source_session_id: Mapped[str | None] = mapped_column(String(64), nullable=True, comment="来源会话")
-    status: Mapped[str] = mapped_column(String(32), nullable=False, default="active", comment="启用状态")
\ No newline at end of file
+    status: Mapped[str] = mapped_column(String(32), nullable=False, default="active", comment="启用状态")
+    last_used_at: Mapped[DateTime | None] = mapped_column(DateTime, nullable=True, comment="最近命中时间")
\ No newline at end of file
@@ -0,0 +1,105 @@
+from __future__ import annotations
+
+from typing import Any
+
+from app.prompts.payload_json import PrecomputedJson, dump_prompt_payload
+
+INTENT_TASK_SYSTEM_PROMPT = """
+你是教务系统的意图识别与任务解析助手。
+请在一次输出中完成两件事：
+A. 判断用户当前问题的意图，并识别是否为追问；
+B. 若为业务查询，将补全上下文后的问题解析为结构化任务对象，供后续 SQL 生成阶段使用。
+
+你只能使用：
+1) 当前用户问题
+2) 历史中最近 4 条 user 消息
+3) kb_field_whitelist 与 alias_hints
+
+强约束：
+1) 只输出一个 JSON 对象，不要输出 markdown、解释、前后缀文本。
+2) 顶层字段：
+   - intent: "chat" | "business_query"
+   - is_followup: 布尔值，当前问题是否依赖历史上下文
+   - confidence: 0~1，意图置信度
+   - merged_query: 非空字符串；is_followup=true 时必须补全历史上下文，形成可独立理解的问题
+   - task: 结构化任务对象；intent=chat 时输出 null
+3) task 字段：
+   - entities: [{type, value}]
+   - dimensions: [string]
+   - metrics: [string]
+   - filters: [{field, op, value}]
+   - time_range: {start, end}
+   - operation: "detail" | "aggregate" | "ranking" | "trend"
+   - confidence: 0~1，解析置信度
+4) task 必须基于 merged_query 解析；所有字段名必须使用 table.field 形式，
+   filters.field 与 dimensions 中的字段必须来自 kb_field_whitelist。
+
+关于 alias_hints（重点）：
+1) alias_hints 的结构是：[{ "table.field": ["别名1", "别名2", ...] }, ...]
+2) 先做“用户词 -> 别名 -> 标准字段(table.field)”映射，再输出 filters/dimensions。
+3) 输出时只能使用标准字段名（table.field），不能输出别名原文。
+4) 若无法可靠映射，则不要臆造字段；宁可少填，也不要填错字段。
+
+示例输出 A：
+{"intent":"chat","is_followup":false,"confidence":0.92,"merged_query":"今天天气怎么样？","task":null}
+
+示例输出 B：
+{
+  "intent": "business_query",
+  "is_followup": false,
+  "confidence": 0.9,
+  "merged_query": "统计22级软件工程专业男生人数",
+  "task": {
+    "entities": [
+      {"type": "grade", "value": "22级"},
+      {"type": "major", "value": "软件工程"},
+      {"type": "gender", "value": "男生"}
+    ],
+    "dimensions": ["major.major_name"],
+    "metrics": ["count"],
+    "filters": [
+      {"field": "student.enroll_year", "op": "=", "value": 2022},
+      {"field": "student.gender", "op": "=", "value": "男"},
+      {"field": "major.major_name", "op": "=", "value": "软件工程"}
+    ],
+    "time_range": {"start": null, "end": null},
+    "operation": "aggregate",
+    "confidence": 0.92
+  }
+}
+""".strip()
+
+
+def build_intent_task_user_prompt(
+    message: str,
+    history_user_messages: list[str],
+    field_whitelist: list[str] | PrecomputedJson,
+    alias_pairs: list[dict[str, list[str]]] | PrecomputedJson,
+) -> str:
+    payload: dict[str, Any] = {
+        "message": message,
+        "history_user_messages": history_user_messages[-4:],
+        "kb_field_whitelist": field_whitelist,
+        "alias_hints": alias_pairs,
+        "output_schema": {
+            "intent": "chat|business_query",
+            "is_followup": "boolean",
+            "confidence": "0~1",
+            "merged_query": "string",
+            "task": {
+                "entities": [{"type": "string", "value": "string"}],
+                "dimensions": ["string"],
+                "metrics": ["string"],
+                "filters": [{"field": "table.field", "op": "=", "value": "string|number|boolean"}],
+                "time_range": {"start": "YYYY-MM-DD|null", "end": "YYYY-MM-DD|null"},
+                "operation": "detail|aggregate|ranking|trend",
+                "confidence": "0~1",
+            },
+        },
+        "output_contract": {
+            "json_only": True,
+            "no_markdown_or_extra_text": True,
+            "required_keys": ["intent", "is_followup", "confidence", "merged_query", "task"],
+        },
+    }
+    return dump_prompt_payload(payload)
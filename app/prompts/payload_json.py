@@ -0,0 +1,32 @@
+import json
+from typing import Any
+
+
+class PrecomputedJson(str):
+    """作用：标记已预先序列化好的 JSON 片段，拼装提示词时原样嵌入，不再二次序列化。"""
+
+
+def dump_prompt_payload(payload: dict[str, Any]) -> str:
+    """作用：序列化提示词 payload，顶层值为 PrecomputedJson 时直接嵌入。
+
+    输出与 json.dumps(payload, ensure_ascii=False) 完全一致（默认分隔符 ", " 与 ": "），
+    只是跳过了对知识库等静态大字段的重复序列化。
+
+    输入参数：
+    - payload: dict[str, Any]。
+
+    输出参数：
+    - 返回值类型: str。
+    """
+
+    if not any(isinstance(value, PrecomputedJson) for value in payload.values()):
+        return json.dumps(payload, ensure_ascii=False)
+
+    parts: list[str] = []
+    for key, value in payload.items():
+        if isinstance(value, PrecomputedJson):
+            value_json = str(value)
+        else:
+            value_json = json.dumps(value, ensure_ascii=False)
+        parts.append(f"{json.dumps(str(key), ensure_ascii=False)}: {value_json}")
+    return "{" + ", ".join(parts) + "}"
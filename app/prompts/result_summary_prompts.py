@@ -16,6 +16,8 @@ RESULT_SUMMARY_SYSTEM_PROMPT = """
 5) 若 final_status=partial_success 或 failed，summary 要说明当前结果与 reason_code 的含义，并给出简短建议。
 6) 不要虚构不存在的数据，只基于输入结果描述。
 7) 若输入包含 field_display_hints，summary 引用字段时优先使用其中的中文展示名，不要直接输出 table.field 或 snake_case 技术字段名。
+8) reason_code 为 result_truncated / sql_cost_exceeded / sql_timeout 时，分别说明结果已按行数上限截断、查询预估代价过高被拒绝执行、查询执行超时被中断，
+   可参考 sql_validate_result.guard 中的说明，并建议用户增加筛选条件或缩小范围。
 """.strip()
 
 
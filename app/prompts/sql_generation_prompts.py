@@ -1,8 +1,9 @@
 from __future__ import annotations
 
-import json
 from typing import Any
 
+from app.prompts.payload_json import PrecomputedJson, dump_prompt_payload
+
 SQL_GENERATION_SYSTEM_PROMPT = """
 你是教务系统 SQL 生成助手。
 请基于任务解析结果生成 MySQL 8 可执行 SQL，并严格遵守以下约束：
@@ -35,6 +36,7 @@ SQL_GENERATION_SYSTEM_PROMPT = """
 22) 若 retry_constraints.retry_reason=empty_result 且存在 retry_constraints.value_replacements，SQL 过滤值必须优先从 to_candidates 选择，不得直接沿用 task.filters 的原始 value。
 23) 若 retry_constraints.retry_reason=empty_result 且无法安全采用任何候选值，返回空 SQL 字符串，并在 entity_mappings.reason 说明原因。
 24) 若无法完成字段替换修复，不要使用非法字段，返回空 SQL 字符串并保持 json 格式有效。
+25) reference_examples 为相似问题的已验证 SQL（均已满足以上约束），仅用于参考表连接路径与统计口径，输出仍须满足以上全部约束。
 
 完整输出示例（必须严格输出 JSON，不要附加解释）：
 {
@@ -156,10 +158,11 @@ def _helper_build_retry_constraints(hidden_context: dict[str, Any] | None) -> di
 def build_sql_generation_user_prompt(
     rewritten_query: str,
     task: dict[str, Any],
-    field_whitelist: list[str],
-    alias_pairs: list[dict[str, list[str]]],
-    schema_hints: list[dict[str, Any]],
+    field_whitelist: list[str] | PrecomputedJson,
+    alias_pairs: list[dict[str, list[str]]] | PrecomputedJson,
+    schema_hints: list[dict[str, Any]] | PrecomputedJson,
     hidden_context: dict[str, Any] | None = None,
+    examples: list[dict[str, Any]] | None = None,
 ) -> str:
     retry_constraints = _helper_build_retry_constraints(hidden_context)
     payload: dict[str, Any] = {
@@ -170,6 +173,9 @@ def build_sql_generation_user_prompt(
         "kb_schema_hints": schema_hints,
         "hidden_context": hidden_context,
         "retry_constraints": retry_constraints,
+        "reference_examples": [
+            {"question": item.get("question"), "sql": item.get("sql")} for item in examples or []
+        ],
         "output_schema": {
             "sql": "WITH ... SELECT ...",
             "entity_mappings": [
@@ -183,4 +189,4 @@ def build_sql_generation_user_prompt(
             "sql_fields": ["table.field"],
         },
     }
-    return json.dumps(payload, ensure_ascii=False)
+    return dump_prompt_payload(payload)
@@ -1,8 +1,9 @@
 from __future__ import annotations
 
-import json
 from typing import Any
 
+from app.prompts.payload_json import PrecomputedJson, dump_prompt_payload
+
 TASK_PARSE_SYSTEM_PROMPT = """
 你是教务查询任务解析助手。
 请将用户问题解析为结构化任务对象，供后续 SQL 生成阶段使用。
@@ -53,8 +54,8 @@ TASK_PARSE_SYSTEM_PROMPT = """
 
 def build_task_parse_user_prompt(
     query: str,
-    field_whitelist: list[str],
-    alias_pairs: list[dict[str, list[str]]],
+    field_whitelist: list[str] | PrecomputedJson,
+    alias_pairs: list[dict[str, list[str]]] | PrecomputedJson,
 ) -> str:
     payload: dict[str, Any] = {
         "query": query,
@@ -71,4 +72,4 @@ def build_task_parse_user_prompt(
             "confidence": "0~1",
         },
     }
-    return json.dumps(payload, ensure_ascii=False)
\ No newline at end of file
+    return dump_prompt_payload(payload)
\ No newline at end of file
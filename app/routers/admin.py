@@ -1,8 +1,14 @@
-﻿from fastapi import APIRouter, Depends
+﻿from fastapi import APIRouter, Depends, Query
 
 from app.deps import get_current_admin
 from app.models.admin import Admin
 from app.schemas.admin import AdminProfile
+from app.schemas.response import ListResponse, Meta, OkResponse
+from app.services.admission_service import admission_controller
+from app.services.example_store_service import get_example_stats
+from app.services.llm_client import llm_client_manager
+from app.services.node_io_store import node_io_store
+from app.services.single_flight_service import single_flight_group
 
 router = APIRouter()
 
@@ -10,3 +16,43 @@ router = APIRouter()
 @router.get("/profile", response_model=AdminProfile)
 def get_profile(current_admin: Admin = Depends(get_current_admin)):
     return current_admin
+
+
+@router.get("/node-io/{session_id}", response_model=ListResponse)
+def list_node_io_records(
+    session_id: str,
+    step: str | None = Query(None),
+    offset: int = Query(0, ge=0),
+    limit: int = Query(50, ge=1, le=500),
+    current_admin: Admin = Depends(get_current_admin),
+):
+    records = [
+        record
+        for record in node_io_store.read_session(session_id)
+        if record.get("admin_id") == current_admin.id and (step is None or record.get("step_name") == step)
+    ]
+    return ListResponse(
+        data=records[offset:offset + limit],
+        meta=Meta(offset=offset, limit=limit, total=len(records)),
+    )
+
+
+@router.get("/sql-examples/stats", response_model=OkResponse)
+def get_sql_example_stats(current_admin: Admin = Depends(get_current_admin)):
+    return OkResponse(data=get_example_stats())
+
+
+@router.get("/chat-admission/stats", response_model=OkResponse)
+async def get_chat_admission_stats(current_admin: Admin = Depends(get_current_admin)):
+    # 准入控制器只在事件循环线程中读写，这里用 async 端点避免在线程池中读取
+    return OkResponse(data=admission_controller.get_stats())
+
+
+@router.get("/llm-clients/stats", response_model=OkResponse)
+def get_llm_client_stats(current_admin: Admin = Depends(get_current_admin)):
+    return OkResponse(data=llm_client_manager.stats())
+
+
+@router.get("/chat-single-flight/stats", response_model=OkResponse)
+async def get_chat_single_flight_stats(current_admin: Admin = Depends(get_current_admin)):
+    return OkResponse(data=single_flight_group.get_stats())
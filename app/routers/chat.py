@@ -8,42 +8,85 @@ from sqlalchemy.orm import Session
 
 from app.core.config import settings
 from app.core.security import decode_access_token
+from app.db.executor import run_db_call
 from app.db.session import SessionLocal
 from app.deps import get_current_admin, get_db
 from app.models.admin import Admin
 from app.models.chat_history import ChatHistory
 from app.schemas.chat import ChatIntentRequest, ChatParseData, ChatParseResponse
 from app.schemas.response import ListResponse, Meta, OkResponse
+from app.services.admission_service import AdmissionRejectedError, AdmissionTicket, admission_controller
 from app.services.chat_graph import execute_chat_workflow
-from app.services.chat_stream_service import generate_chat_stream
+from app.services.chat_stream_service import open_chat_stream
+from app.services.write_behind_service import write_behind_queue
 
 router = APIRouter()
 
 
+def _helper_too_many_requests(exc: AdmissionRejectedError) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail=str(exc),
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
+async def _helper_acquire_admission(admin_id: int) -> AdmissionTicket:
+    # 非流式接口在排队期间不回传进度，排队已满或等待超时统一返回 429
+    try:
+        return await admission_controller.acquire(admin_id)
+    except AdmissionRejectedError as exc:
+        raise _helper_too_many_requests(exc) from exc
+
+
 @router.post("", response_model=ChatParseResponse)
-def chat_entry(
+async def chat_entry(
     payload: ChatIntentRequest,
     db: Session = Depends(get_db),
     current_admin=Depends(get_current_admin),
 ):
-    data = execute_chat_workflow(db=db, admin_id=current_admin.id, payload=payload)
+    ticket = await _helper_acquire_admission(current_admin.id)
+    try:
+        data = await execute_chat_workflow(
+            db=db,
+            admin_id=current_admin.id,
+            payload=payload,
+            deadline_seconds=settings.chat_deadline_sync_seconds,
+        )
+    finally:
+        admission_controller.release(ticket)
     return ChatParseResponse(data=ChatParseData(**data))
 
 
 @router.post("/stream")
-def chat_stream_entry(
+async def chat_stream_entry(
     payload: ChatIntentRequest,
+    request: Request,
     current_admin=Depends(get_current_admin),
 ):
     if settings.chat_stream_mode == "sync":
+        ticket = await _helper_acquire_admission(current_admin.id)
         db = SessionLocal()
         try:
-            data = execute_chat_workflow(db=db, admin_id=current_admin.id, payload=payload)
+            data = await execute_chat_workflow(
+                db=db,
+                admin_id=current_admin.id,
+                payload=payload,
+                deadline_seconds=settings.chat_deadline_sync_seconds,
+            )
             return ChatParseResponse(data=ChatParseData(**data))
         finally:
-            db.close()
+            admission_controller.release(ticket)
+            await run_db_call(db.close)
 
-    stream_iterator = generate_chat_stream(admin_id=current_admin.id, payload=payload)
+    try:
+        stream_iterator = open_chat_stream(
+            admin_id=current_admin.id,
+            payload=payload,
+            is_disconnected=request.is_disconnected,
+        )
+    except AdmissionRejectedError as exc:
+        raise _helper_too_many_requests(exc) from exc
     headers = {
         "Cache-Control": "no-cache, no-transform",
         "Connection": "keep-alive",
@@ -59,6 +102,9 @@ def list_chat_sessions(
     db: Session = Depends(get_db),
     current_admin=Depends(get_current_admin),
 ):
+    if write_behind_queue.has_pending(ChatHistory.__tablename__, admin_id=current_admin.id):
+        # 刚结束的问答可能仍在后写队列中，先刷盘保证会话列表包含最新一轮
+        write_behind_queue.flush()
     base_filters = (
         ChatHistory.admin_id == current_admin.id,
         ChatHistory.is_deleted.is_(False),
@@ -126,6 +172,9 @@ def list_chat_session_messages(
     db: Session = Depends(get_db),
     current_admin=Depends(get_current_admin),
 ):
+    if write_behind_queue.has_pending(ChatHistory.__tablename__, session_id, admin_id=current_admin.id):
+        # 流式中断时前端据此补取最新回复，刚结束的一轮可能仍在后写队列中，先刷盘再读
+        write_behind_queue.flush()
     message_query = db.query(ChatHistory).filter(
         ChatHistory.admin_id == current_admin.id,
         ChatHistory.session_id == session_id,
@@ -160,6 +209,9 @@ def delete_chat_session(
     db: Session = Depends(get_db),
     current_admin=Depends(get_current_admin),
 ):
+    if write_behind_queue.has_pending(ChatHistory.__tablename__, session_id, admin_id=current_admin.id):
+        # 先写完后写队列中的会话历史，避免删除后又被补写出来
+        write_behind_queue.flush()
     filters = (
         ChatHistory.admin_id == current_admin.id,
         ChatHistory.session_id == session_id,
@@ -190,6 +242,8 @@ def clear_chat_sessions(
     db: Session = Depends(get_db),
     current_admin=Depends(get_current_admin),
 ):
+    if write_behind_queue.has_pending(ChatHistory.__tablename__, admin_id=current_admin.id):
+        write_behind_queue.flush()
     deleted = (
         db.query(ChatHistory)
         .filter(
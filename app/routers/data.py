@@ -16,6 +16,7 @@ from app.schemas.major import MajorCreate, MajorOut, MajorUpdate
 from app.schemas.response import ListResponse, Meta, OkResponse
 from app.schemas.student import StudentCreate, StudentOut, StudentUpdate
 from app.schemas.teacher import TeacherCreate, TeacherOut, TeacherUpdate
+from app.services.data_version_service import bump_data_version
 
 router = APIRouter()
 
@@ -393,6 +394,7 @@ def create_item(
     item = model(**data)
     db.add(item)
     db.commit()
+    bump_data_version(model.__tablename__)
     db.refresh(item)
     return OkResponse(data=jsonable_encoder(item))
 
@@ -440,6 +442,7 @@ def update_item(
     item.updated_by = current_admin.id
     db.add(item)
     db.commit()
+    bump_data_version(model.__tablename__)
     db.refresh(item)
     return OkResponse(data=jsonable_encoder(item))
 
@@ -471,6 +474,7 @@ def delete_item(
     item.updated_by = current_admin.id
     db.add(item)
     db.commit()
+    bump_data_version(model.__tablename__)
     db.refresh(item)
     return OkResponse(data=jsonable_encoder(item))
 
@@ -3,11 +3,22 @@ from sqlalchemy.orm import Session
 
 from app.deps import get_current_admin, get_db
 from app.schemas.response import OkResponse
-from app.services.import_service import import_data
+from app.services.import_service import import_data, import_workbook
 
 router = APIRouter()
 
 
+@router.post("/api/import/workbook", response_model=OkResponse)
+async def import_workbook_file(
+    file: UploadFile = File(...),
+    db: Session = Depends(get_db),
+    current_admin = Depends(get_current_admin),
+):
+    content = await file.read()
+    result = import_workbook(file.filename or "", content, db, current_admin.id)
+    return OkResponse(data=result)
+
+
 @router.post("/api/import/{table}", response_model=OkResponse)
 async def import_file(
     table: str,
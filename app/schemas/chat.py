@@ -96,6 +96,15 @@ class ChatParseData(BaseModel):
     sql_validate_result: SqlValidateResult | None = Field(default=None, description="SQL 验证节点输出")
     hidden_context_result: HiddenContextResult | None = Field(default=None, description="隐藏上下文探索结果")
     hidden_context_retry_count: int = Field(default=0, ge=0, description="隐藏上下文重试次数")
+    query_cache: Literal["hit", "miss", "stale", "bypass"] | None = Field(
+        default=None, description="问题→SQL 缓存状态（仅业务查询）"
+    )
+    single_flight: Literal["leader", "follower"] | None = Field(
+        default=None, description="相同问题合并执行中的角色：leader（发起执行）/follower（挂到进行中的执行）"
+    )
+    deadline: dict[str, Any] | None = Field(
+        default=None, description="时间预算使用情况：budget_seconds/elapsed_ms/skipped（因预算不足跳过的步骤）"
+    )
 
 
 class ChatParseResponse(BaseModel):
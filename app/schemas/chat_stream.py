@@ -8,7 +8,7 @@ from pydantic import BaseModel, Field
 class ChatStreamEventData(BaseModel):
     session_id: str = Field(..., description="session id")
     step: str = Field(..., description="workflow step name")
-    status: Literal["start", "end", "error"] = Field(..., description="step status")
+    status: Literal["start", "end", "error", "delta", "queued"] = Field(..., description="step status")
     message: str = Field(..., description="status text")
     timestamp: str = Field(..., description="event timestamp")
     seq: int = Field(..., ge=1, description="event sequence")
@@ -17,5 +17,5 @@ class ChatStreamEventData(BaseModel):
 
 
 class ChatStreamEvent(BaseModel):
-    event: Literal["workflow_start", "step_start", "step_end", "workflow_error", "workflow_end"]
+    event: Literal["queued", "workflow_start", "step_start", "step_end", "summary_delta", "workflow_error", "workflow_end"]
     data: ChatStreamEventData
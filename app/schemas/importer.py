@@ -2,6 +2,7 @@
 
 
 class ImportErrorItem(BaseModel):
+    sheet: str | None = None
     row: int
     field: str
     message: str
@@ -18,3 +19,28 @@ class ImportSummary(BaseModel):
 class ImportResult(BaseModel):
     summary: ImportSummary
     errors: list[ImportErrorItem]
+
+
+class WorkbookSheetResult(BaseModel):
+    table: str
+    sheet: str
+    order: int
+    status: str
+    total: int
+    success: int
+    failed: int
+    errors: list[ImportErrorItem]
+
+
+class WorkbookImportSummary(BaseModel):
+    filename: str
+    sheets: int
+    total: int
+    success: int
+    failed: int
+
+
+class WorkbookImportResult(BaseModel):
+    summary: WorkbookImportSummary
+    sheets: list[WorkbookSheetResult]
+    errors: list[ImportErrorItem]
@@ -0,0 +1,242 @@
+from __future__ import annotations
+
+import asyncio
+import math
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from typing import Any, Callable
+
+from app.core.config import settings
+
+SERVICE_TIME_INITIAL_SECONDS = 10.0
+SERVICE_TIME_EWMA_ALPHA = 0.2
+RETRY_AFTER_MIN_SECONDS = 1
+RETRY_AFTER_MAX_SECONDS = 120
+
+
+class AdmissionRejectedError(Exception):
+    """作用：问答请求未被接纳（排队已满或排队超时），retry_after 为建议的重试等待秒数。"""
+
+    def __init__(self, message: str, retry_after: int) -> None:
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+@dataclass(eq=False)
+class AdmissionTicket:
+    """作用：一次问答请求的准入凭证：排队中 future 未完成，被接纳后 admitted 为 True。"""
+
+    admin_id: int
+    future: asyncio.Future[None] | None = None
+    on_position: Callable[[int], None] | None = None
+    admitted: bool = False
+    released: bool = False
+    admitted_at: float = 0.0
+    last_position: int = 0
+
+
+class AdmissionController:
+    """作用：问答工作流准入控制：全局并发上限 + 每个管理员并发上限，超出时排队，管理员之间轮转公平调度。
+
+    只在事件循环线程中使用，不需要加锁。排队位置按轮转顺序估算，变化时通过 on_position 回调通知；
+    排队已满时直接拒绝，由路由返回 429 与 Retry-After（按近期工作流平均耗时估算）。
+    """
+
+    def __init__(self) -> None:
+        self._running_total = 0
+        self._running: dict[int, int] = {}
+        # 按轮转顺序排列的各管理员等待队列：队首管理员下一个被调度，被调度后移到队尾
+        self._queues: OrderedDict[int, deque[AdmissionTicket]] = OrderedDict()
+        self._waiting_total = 0
+        self._service_seconds = SERVICE_TIME_INITIAL_SECONDS
+        self._rejected = 0
+
+    def enqueue(self, admin_id: int) -> AdmissionTicket:
+        """作用：申请准入：有空闲名额且该管理员没有排队中的请求时立即接纳，否则进入排队。
+
+        输入参数：
+        - admin_id: int。
+
+        输出参数：
+        - 返回值类型: AdmissionTicket，排队已满时抛出 AdmissionRejectedError。
+        """
+
+        ticket = AdmissionTicket(admin_id=admin_id)
+        if not settings.chat_admission_enabled:
+            ticket.admitted = True
+            return ticket
+        if admin_id not in self._queues and self._helper_has_capacity(admin_id):
+            self._helper_admit(ticket)
+            return ticket
+        admin_waiting = len(self._queues.get(admin_id, ()))
+        if self._waiting_total >= settings.chat_queue_max or admin_waiting >= settings.chat_queue_max_per_admin:
+            self._rejected += 1
+            raise AdmissionRejectedError("问答请求过多，请稍后重试", self.retry_after_seconds())
+        ticket.future = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(admin_id, deque()).append(ticket)
+        self._waiting_total += 1
+        return ticket
+
+    async def wait(
+            self,
+            ticket: AdmissionTicket,
+            on_position: Callable[[int], None] | None = None,
+            timeout: float | None = None,
+    ) -> None:
+        """作用：等待排队中的请求被接纳；排队位置变化时回调 on_position。
+
+        输入参数：
+        - ticket: AdmissionTicket。
+        - on_position: Callable[[int], None] | None，排队位置回调（1 表示下一个被接纳）。
+        - timeout: float | None，最长排队秒数，默认 CHAT_QUEUE_TIMEOUT_SECONDS。
+
+        输出参数：
+        - 无；超时抛出 AdmissionRejectedError，被取消时移出队列。
+        """
+
+        if ticket.admitted:
+            return
+        ticket.on_position = on_position
+        self._helper_notify_positions()
+        timeout = settings.chat_queue_timeout_seconds if timeout is None else timeout
+        try:
+            await asyncio.wait_for(asyncio.shield(ticket.future), timeout)
+        except asyncio.TimeoutError:
+            if ticket.admitted:
+                return
+            self._helper_remove_waiting(ticket)
+            self._rejected += 1
+            raise AdmissionRejectedError("排队等待超时，请稍后重试", self.retry_after_seconds()) from None
+        except asyncio.CancelledError:
+            if not ticket.admitted:
+                self._helper_remove_waiting(ticket)
+            raise
+
+    async def acquire(self, admin_id: int, timeout: float | None = None) -> AdmissionTicket:
+        """作用：申请准入并等待接纳（非流式接口使用，不上报排队位置）。
+
+        输入参数：
+        - admin_id: int。
+        - timeout: float | None，最长排队秒数。
+
+        输出参数：
+        - 返回值类型: AdmissionTicket，用完须调用 release。
+        """
+
+        ticket = self.enqueue(admin_id)
+        await self.wait(ticket, timeout=timeout)
+        return ticket
+
+    def release(self, ticket: AdmissionTicket) -> None:
+        """作用：释放准入名额（或放弃排队），并调度后续排队请求。可重复调用。
+
+        输入参数：
+        - ticket: AdmissionTicket。
+
+        输出参数：
+        - 无。
+        """
+
+        if ticket.released:
+            return
+        ticket.released = True
+        if not ticket.admitted:
+            self._helper_remove_waiting(ticket)
+            return
+        if ticket.admitted_at == 0.0:
+            # 未启用准入控制时直接放行的请求不占名额
+            return
+        self._running_total -= 1
+        remaining = self._running.get(ticket.admin_id, 0) - 1
+        if remaining > 0:
+            self._running[ticket.admin_id] = remaining
+        else:
+            self._running.pop(ticket.admin_id, None)
+        elapsed = time.monotonic() - ticket.admitted_at
+        self._service_seconds += SERVICE_TIME_EWMA_ALPHA * (elapsed - self._service_seconds)
+        self._helper_dispatch()
+
+    def retry_after_seconds(self) -> int:
+        """作用：按近期工作流平均耗时与当前排队长度估算建议的重试等待秒数。"""
+
+        slots = max(settings.chat_max_concurrent, 1)
+        estimate = self._service_seconds * (self._waiting_total + 1) / slots
+        return min(max(math.ceil(estimate), RETRY_AFTER_MIN_SECONDS), RETRY_AFTER_MAX_SECONDS)
+
+    def get_stats(self) -> dict[str, Any]:
+        """作用：返回当前运行数、排队数、累计拒绝数与平均工作流耗时。"""
+
+        return {
+            "running": self._running_total,
+            "waiting": self._waiting_total,
+            "running_by_admin": dict(self._running),
+            "waiting_by_admin": {admin_id: len(queue) for admin_id, queue in self._queues.items()},
+            "rejected": self._rejected,
+            "avg_service_seconds": round(self._service_seconds, 2),
+        }
+
+    def _helper_has_capacity(self, admin_id: int) -> bool:
+        return (
+            self._running_total < settings.chat_max_concurrent
+            and self._running.get(admin_id, 0) < settings.chat_max_concurrent_per_admin
+        )
+
+    def _helper_admit(self, ticket: AdmissionTicket) -> None:
+        ticket.admitted = True
+        ticket.admitted_at = time.monotonic()
+        self._running_total += 1
+        self._running[ticket.admin_id] = self._running.get(ticket.admin_id, 0) + 1
+        if ticket.future is not None and not ticket.future.done():
+            ticket.future.set_result(None)
+
+    def _helper_remove_waiting(self, ticket: AdmissionTicket) -> None:
+        queue = self._queues.get(ticket.admin_id)
+        if queue is None or ticket not in queue:
+            return
+        queue.remove(ticket)
+        self._waiting_total -= 1
+        if not queue:
+            del self._queues[ticket.admin_id]
+        self._helper_dispatch()
+
+    def _helper_dispatch(self) -> None:
+        """作用：按管理员轮转顺序接纳排队请求，直到全局名额用满或剩余排队者都受限于各自的并发上限。"""
+
+        while self._running_total < settings.chat_max_concurrent:
+            admin_id = next((item for item in self._queues if self._helper_has_capacity(item)), None)
+            if admin_id is None:
+                break
+            queue = self._queues[admin_id]
+            ticket = queue.popleft()
+            self._waiting_total -= 1
+            if queue:
+                self._queues.move_to_end(admin_id)
+            else:
+                del self._queues[admin_id]
+            self._helper_admit(ticket)
+        self._helper_notify_positions()
+
+    def _helper_notify_positions(self) -> None:
+        """作用：按轮转顺序估算每个排队请求前面的请求数，位置变化时回调通知。"""
+
+        order = list(self._queues.values())
+        for admin_index, queue in enumerate(order):
+            for rank, ticket in enumerate(queue):
+                if ticket.on_position is None:
+                    continue
+                ahead = rank
+                for other_index, other_queue in enumerate(order):
+                    if other_index == admin_index:
+                        continue
+                    ahead += min(len(other_queue), rank + 1 if other_index < admin_index else rank)
+                position = ahead + 1
+                if position != ticket.last_position:
+                    ticket.last_position = position
+                    try:
+                        ticket.on_position(position)
+                    except Exception:
+                        pass
+
+
+admission_controller = AdmissionController()
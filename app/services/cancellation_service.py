@@ -0,0 +1,203 @@
+from __future__ import annotations
+
+import asyncio
+import threading
+from typing import Awaitable, TypeVar
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import NullPool
+
+from app.core.logger import get_logger
+
+T = TypeVar("T")
+
+logger = get_logger("cancellation")
+
+_KILL_ENGINES_LOCK = threading.Lock()
+_KILL_ENGINES: dict[str, Engine] = {}
+
+
+def _helper_get_kill_engine(bind: Engine) -> Engine:
+    """作用：获取发出 KILL QUERY 专用的不带连接池的引擎（每个数据库地址创建一次）。
+
+    KILL 连接不从业务连接池中取：连接池耗尽时，被取消的语句本身正占着连接，从同一个池取连接会一直等到超时。
+
+    输入参数：
+    - bind: Engine，业务引擎。
+
+    输出参数：
+    - 返回值类型: Engine。
+    """
+
+    key = bind.url.render_as_string(hide_password=False)
+    with _KILL_ENGINES_LOCK:
+        kill_engine = _KILL_ENGINES.get(key)
+        if kill_engine is None:
+            kill_engine = create_engine(bind.url, poolclass=NullPool)
+            _KILL_ENGINES[key] = kill_engine
+        return kill_engine
+
+
+def get_mysql_connection_id(db: Session) -> int | None:
+    """作用：读取会话当前所用 MySQL 连接的线程号（KILL QUERY 的目标）；非 MySQL 时为 None。
+
+    输入参数：
+    - db: Session。
+
+    输出参数：
+    - 返回值类型: int | None。
+    """
+
+    if db.get_bind().dialect.name != "mysql":
+        return None
+    thread_id = getattr(db.connection().connection.dbapi_connection, "thread_id", None)
+    if not callable(thread_id):
+        return None
+    return int(thread_id())
+
+
+def kill_mysql_query(bind: Engine, connection_id: int) -> bool:
+    """作用：经不带连接池的连接对指定线程发出 KILL QUERY。
+
+    输入参数：
+    - bind: Engine。
+    - connection_id: int。
+
+    输出参数：
+    - 返回值类型: bool，KILL 是否已发出。
+    """
+
+    try:
+        with _helper_get_kill_engine(bind).connect() as conn:
+            conn.execute(text(f"KILL QUERY {int(connection_id)}"))
+    except Exception:
+        logger.exception("kill query failed", extra={"payload": {"connection_id": connection_id}})
+        return False
+    return True
+
+
+class WorkflowCancelledError(RuntimeError):
+    """作用：工作流已被取消（如 SSE 客户端断开），后续节点、模型调用与 SQL 不再执行。"""
+
+
+class CancellationToken:
+    """作用：单次问答工作流的取消令牌。
+
+    节点入口检查令牌；模型调用与令牌竞速，取消时中断进行中的 HTTP 请求；
+    数据库步骤执行期间登记所用 MySQL 连接，取消时另开一条不经连接池的连接发出 KILL QUERY 中断正在执行的语句。
+    """
+
+    def __init__(self) -> None:
+        self._cancelled = False
+        self.reason = ""
+        self._event = asyncio.Event()
+        self._lock = threading.Lock()
+        self._bind: Engine | None = None
+        self._connection_id: int | None = None
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled
+
+    def cancel(self, reason: str) -> None:
+        """作用：取消工作流（须在事件循环线程中调用）：唤醒等待中的模型调用，并中断正在执行的 SQL。
+
+        输入参数：
+        - reason: str，取消原因（写入日志）。
+
+        输出参数：
+        - 无。
+        """
+
+        if self._cancelled:
+            return
+        self._cancelled = True
+        self.reason = reason
+        self._event.set()
+        with self._lock:
+            has_running_query = self._connection_id is not None
+        if has_running_query:
+            # KILL QUERY 需要一次额外的数据库往返，放到独立线程中执行，不阻塞事件循环。
+            threading.Thread(target=self._helper_kill_running_query, name="kill-query", daemon=True).start()
+
+    def raise_if_cancelled(self) -> None:
+        """作用：已取消时抛出 WorkflowCancelledError。"""
+
+        if self._cancelled:
+            raise WorkflowCancelledError(f"工作流已取消: {self.reason}")
+
+    async def run(self, awaitable: Awaitable[T]) -> T:
+        """作用：执行一个可等待对象，令牌先被取消时中断它并抛出 WorkflowCancelledError。
+
+        输入参数：
+        - awaitable: Awaitable[T]，如一次模型调用。
+
+        输出参数：
+        - 返回值类型: T。
+        """
+
+        self.raise_if_cancelled()
+        task = asyncio.ensure_future(awaitable)
+        waiter = asyncio.ensure_future(self._event.wait())
+        try:
+            await asyncio.wait({task, waiter}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            waiter.cancel()
+        if not task.done():
+            task.cancel()
+            try:
+                await task
+            except BaseException:
+                pass
+            self.raise_if_cancelled()
+        return task.result()
+
+    def attach_connection(self, db: Session) -> None:
+        """作用：在数据库线程中登记当前会话所用的 MySQL 连接（仅 MySQL），取消时据此 KILL QUERY。
+
+        输入参数：
+        - db: Session。
+
+        输出参数：
+        - 无。
+        """
+
+        connection_id = get_mysql_connection_id(db)
+        if connection_id is None:
+            return
+        with self._lock:
+            self._bind = db.get_bind()
+            self._connection_id = connection_id
+
+    def detach_connection(self) -> None:
+        """作用：数据库步骤结束（连接归还连接池之前）时注销连接，避免误杀复用该连接的其他请求。
+
+        KILL 正在发出时等待其完成（只等一次数据库往返，不等待建连）。
+        """
+
+        with self._lock:
+            self._bind = None
+            self._connection_id = None
+
+    def _helper_kill_running_query(self) -> None:
+        """作用：对登记中的连接发出 KILL QUERY。
+
+        建立 KILL 连接时不持锁，数据库线程注销连接不必等待建连；只在发出 KILL 时持锁并复核登记，
+        保证被 KILL 的仍是本工作流的语句，连接不会在此期间归还连接池并被其他请求复用。
+        """
+
+        with self._lock:
+            bind = self._bind
+            connection_id = self._connection_id
+        if bind is None or connection_id is None:
+            return
+        try:
+            with _helper_get_kill_engine(bind).connect() as conn:
+                with self._lock:
+                    if self._connection_id != connection_id:
+                        return
+                    conn.execute(text(f"KILL QUERY {int(connection_id)}"))
+        except Exception:
+            logger.exception("kill query failed", extra={"payload": {"connection_id": connection_id}})
@@ -1,27 +1,93 @@
 from __future__ import annotations
 
+import asyncio
+import copy
 import csv
+import difflib
 import json
 import re
+import threading
+import time
 import uuid
+from dataclasses import dataclass, field as dataclass_field
 from datetime import date, datetime
 from decimal import Decimal
 from pathlib import Path
-from typing import Any, Callable, TypedDict
+from typing import Any, Awaitable, Callable, TypedDict
 
+from langchain_core.runnables import RunnableConfig
 from langgraph.constants import START
 from langgraph.graph import END, StateGraph
 from sqlalchemy import text
 from sqlalchemy.orm import Session
 
 from app.core.config import settings
+from app.core.logger import get_logger, log_node_output
+from app.db.executor import run_db_call
 from app.models.chat_history import ChatHistory
 from app.models.workflow_log import WorkflowLog
 from app.prompts.intent_prompts import INTENT_SYSTEM_PROMPT_FULL, build_intent_user_prompt
+from app.prompts.intent_task_prompts import INTENT_TASK_SYSTEM_PROMPT, build_intent_task_user_prompt
 from app.prompts.result_summary_prompts import RESULT_SUMMARY_SYSTEM_PROMPT, build_result_summary_user_prompt
 from app.prompts.sql_generation_prompts import SQL_GENERATION_SYSTEM_PROMPT, build_sql_generation_user_prompt
 from app.prompts.task_parse_prompts import TASK_PARSE_SYSTEM_PROMPT, build_task_parse_user_prompt
 from app.schemas.chat import ChatIntentRequest
+from app.services.cancellation_service import CancellationToken, WorkflowCancelledError
+from app.services.data_version_service import get_data_versions
+from app.services.example_store_service import (
+    add_session_example,
+    record_generation_outcome,
+    refresh_session_examples,
+    retrieve_sql_examples,
+    session_examples_due,
+)
+from app.services.llm_client import JsonStringFieldExtractor, build_llm_timeout, llm_client_manager
+from app.services.node_io_store import node_io_store
+from app.services.probe_value_service import probe_field_values
+from app.services.query_cache_service import (
+    build_cached_sql_result,
+    invalidate_query_cache,
+    lookup_query_cache,
+    normalize_query,
+    store_query_cache,
+)
+from app.services.result_spill_service import (
+    CHAT_DOWNLOAD_URL_PREFIX,
+    build_result_digest,
+    build_result_download_url,
+    build_result_file_name,
+    clone_result_file,
+    collect_result_rows,
+    hash_result_rows,
+)
+from app.services.schema_kb_service import get_schema_kb
+from app.services.schema_retrieval_service import estimate_prompt_tokens, select_schema_subset
+from app.services.single_flight_service import FlightSubscriber, SharedFlight, build_flight_key, single_flight_group
+from app.services.sql_guard_service import (
+    LIMITED_OPERATIONS,
+    SqlGuardReport,
+    apply_result_limit,
+    check_sql_cost,
+    estimate_sql_cost,
+    execute_guarded_sql,
+    is_statement_timeout_error,
+)
+from app.services.sql_repair_service import (
+    get_repair_stats,
+    pick_field_replacement,
+    record_llm_generation_latency,
+    record_repair_attempt,
+    record_repair_verified,
+    repair_sql,
+)
+from app.services.sql_result_cache_service import (
+    build_sql_fingerprint,
+    extract_sql_tables,
+    get_cached_sql_result,
+    put_cached_sql_result,
+)
+from app.services.value_dictionary_service import ensure_value_indexes, match_field_value
+from app.services.write_behind_service import write_behind_queue
 
 
 class UnifiedChatGraphState(TypedDict):
@@ -35,2041 +101,3050 @@ class UnifiedChatGraphState(TypedDict):
     sql_validate_result: dict[str, Any] | None
     hidden_context_result: dict[str, Any] | None
     hidden_context_retry_count: int
+    sql_repair_result: dict[str, Any] | None
     result_return_result: dict[str, Any] | None
+    query_cache: dict[str, Any] | None
 
+ALLOWED_INTENTS = {"chat", "business_query"}
+ALLOWED_OPERATIONS = {"detail", "aggregate", "ranking", "trend"}
+ALLOWED_FILTER_OPS = {"=", "!=", ">", "<", ">=", "<=", "like", "in", "not in", "between"}
+HIDDEN_CONTEXT_MAX_RETRY = 2
+SPECULATIVE_TASK_PARSE_WAIT_SECONDS = 25.0
+INTENT_LLM_TIMEOUT_SECONDS = 20.0
+TASK_PARSE_LLM_TIMEOUT_SECONDS = 25.0
+INTENT_TASK_LLM_TIMEOUT_SECONDS = 30.0
+SQL_GENERATION_LLM_TIMEOUT_SECONDS = 30.0
+RESULT_SUMMARY_LLM_TIMEOUT_SECONDS = 12.0
+DEADLINE_MIN_CALL_SECONDS = 1.0
+RESULT_DOWNLOAD_HINT = "数据量过多，请下载完整 CSV 查看："
+RESULT_EXPORT_FAILED_HINT = "数据量过多，CSV 导出失败，请稍后重试。"
+CHAT_CONTEXT_CONFIG_KEY = "chat_context"
 
-def execute_chat_workflow(
-        db: Session,
-        admin_id: int,
-        payload: ChatIntentRequest,
-        on_step_event: Callable[[str, str, str | None, dict[str, Any] | None], None] | None = None,
-) -> dict[str, Any]:
-    """作用：执行统一聊天工作流。
-    
-    输入参数：
-    - db: Session。
-    - admin_id: int。
-    - payload: ChatIntentRequest。
-    
-    输出参数：
-    - 返回值类型: dict[str, Any]。
-    """
+logger = get_logger("chat_graph")
 
-    ALLOWED_INTENTS = {"chat", "business_query"}
-    ALLOWED_OPERATIONS = {"detail", "aggregate", "ranking", "trend"}
-    ALLOWED_FILTER_OPS = {"=", "!=", ">", "<", ">=", "<=", "like", "in", "not in", "between"}
-    HIDDEN_CONTEXT_MAX_RETRY = 2
-
-    def _helper_emit_step_event(
-            step_name: str,
-            status: str,
-            error_message: str | None = None,
-            step_payload: dict[str, Any] | None = None,
-    ) -> None:
-        if not on_step_event:
-            return
-        try:
-            on_step_event(step_name, status, error_message, step_payload)
-        except Exception:
-            return
-
-    def _helper_to_json_safe(value: Any) -> Any:
-        """作用：递归转换为 JSON 安全类型，避免 date/datetime 序列化失败。"""
-        if isinstance(value, datetime):
-            return value.isoformat()
-        if isinstance(value, date):
-            return value.isoformat()
-        if isinstance(value, Decimal):
-            # MySQL 聚合表达式常返回 Decimal，需转为 JSON 可序列化数字。
-            return int(value) if value == value.to_integral_value() else float(value)
-        if isinstance(value, dict):
-            return {str(key): _helper_to_json_safe(item) for key, item in value.items()}
-        if isinstance(value, list):
-            return [_helper_to_json_safe(item) for item in value]
-        if isinstance(value, tuple):
-            return [_helper_to_json_safe(item) for item in value]
-        return value
-
-    def _helper_get_recent_user_messages(session_id: str, limit: int = 4) -> list[str]:
-        """作用：读取同一会话最近的用户消息。
-        
-        输入参数：
-        - session_id: str。
-        - limit: int。
-        
-        输出参数：
-        - 返回值类型: list[str]。
-        """
 
-        rows = (
-            db.query(ChatHistory)
-            .filter(
-                ChatHistory.session_id == session_id,
-                ChatHistory.message_role == "user",
-                ChatHistory.is_deleted == False,
-            )
-            .order_by(ChatHistory.created_at.desc(), ChatHistory.id.desc())
-            .limit(limit)
-            .all()
-        )
-        return [row.message_content for row in reversed(rows)]
+class DeadlineExceededError(TimeoutError):
+    """作用：本次请求的剩余时间预算不足以发起下一次模型调用。"""
 
-    def _helper_extract_json_object(text_value: str) -> dict[str, Any] | None:
-        """作用：从模型输出文本中提取 JSON。
-        
-        输入参数：
-        - text_value: str。
-        
-        输出参数：
-        - 返回值类型: dict[str, Any] | None。
-        """
 
-        match = re.search(r"\{.*\}", text_value, flags=re.S)
-        if not match:
-            return None
-        try:
-            return json.loads(match.group(0))
-        except Exception:
-            return None
+class SqlGenerationError(ValueError):
+    """作用：SQL 生成结果未通过校验，携带该 SQL 供确定性修复与隐藏上下文使用。"""
 
-    def _helper_safe_float(value: Any, default: float = 0.0) -> float:
-        """作用：安全转换浮点并裁剪到 [0,1]。
-        
-        输入参数：
-        - value: Any。
-        - default: float。
-        
-        输出参数：
-        - 返回值类型: float。
-        """
+    def __init__(self, message: str, sql: str) -> None:
+        super().__init__(message)
+        self.sql = sql
 
-        try:
-            number = float(value)
-        except Exception:
-            number = default
-        return max(0.0, min(1.0, number))
 
-    def _helper_to_unique_str_list(value: Any) -> list[str]:
-        """作用：标准化字符串数组并去重。
-        
-        输入参数：
-        - value: Any。
-        
-        输出参数：
-        - 返回值类型: list[str]。
-        """
+@dataclass
+class ChatWorkflowContext:
+    """作用：单次请求的工作流上下文。
 
-        if not isinstance(value, list):
-            return []
-        result: list[str] = []
-        seen: set[str] = set()
-        for item in value:
-            text_value = str(item).strip()
-            if not text_value:
-                continue
-            key = text_value.lower()
-            if key in seen:
-                continue
-            seen.add(key)
-            result.append(text_value)
-        return result
+    图在进程内只编译一次，请求级依赖（数据库会话、管理员、会话 ID、步骤回调）
+    通过 RunnableConfig.configurable 传入各节点，而不是闭包捕获。
+    deadline 为本次请求的截止时刻（time.monotonic），为 None 时不限时；
+    deadline_skips 记录因预算不足而跳过的步骤（retry/summary）；
+    cancel_token 为取消令牌（如 SSE 客户端断开），为 None 时不可取消；
+    step_logs 收集图内节点的工作流日志，结束时由每个请求方以自己的会话身份落库。
+    """
 
-    def _helper_normalize_entities(value: Any) -> list[dict[str, str]]:
-        """作用：标准化实体列表。
-        
-        输入参数：
-        - value: Any。
-        
-        输出参数：
-        - 返回值类型: list[dict[str, str]]。
-        """
+    db: Session
+    admin_id: int
+    session_id: str
+    on_step_event: Callable[[str, str, str | None, dict[str, Any] | None], None] | None = None
+    on_summary_delta: Callable[[str], None] | None = None
+    deadline: float | None = None
+    deadline_skips: list[str] = dataclass_field(default_factory=list)
+    cancel_token: CancellationToken | None = None
+    step_logs: list[dict[str, Any]] = dataclass_field(default_factory=list)
 
-        if not isinstance(value, list):
-            return []
-        entities: list[dict[str, str]] = []
-        for item in value:
-            if not isinstance(item, dict):
-                continue
-            entity_type = str(item.get("type", "")).strip()
-            entity_value = str(item.get("value", "")).strip()
-            if not entity_type or not entity_value:
-                continue
-            entities.append({"type": entity_type, "value": entity_value})
-        return entities
 
-    def _helper_normalize_filters(value: Any, whitelist: set[str]) -> list[dict[str, Any]]:
-        """作用：标准化过滤条件并校验字段白名单。
-        
-        输入参数：
-        - value: Any。
-        - whitelist: set[str]。
-        
-        输出参数：
-        - 返回值类型: list[dict[str, Any]]。
-        """
+def _helper_get_context(config: RunnableConfig) -> ChatWorkflowContext:
+    """作用：从节点 config 中取出本次请求的工作流上下文；各节点与路由入口都经过这里，顺带检查取消令牌。"""
+    ctx = ((config or {}).get("configurable") or {}).get(CHAT_CONTEXT_CONFIG_KEY)
+    if not isinstance(ctx, ChatWorkflowContext):
+        raise RuntimeError("工作流缺少请求上下文")
+    if ctx.cancel_token is not None:
+        ctx.cancel_token.raise_if_cancelled()
+    return ctx
 
-        def _helper_normalize_filter_value(raw_value: Any) -> Any:
-            """作用：标准化单个过滤值，清理字符串两端空格并兼容字符串列表值。
-            
-            输入参数：
-            - raw_value: Any。
-            
-            输出参数：
-            - 返回值类型: Any。
-            """
-            if isinstance(raw_value, str):
-                return raw_value.strip()
-            if isinstance(raw_value, list):
-                return [item.strip() if isinstance(item, str) else item for item in raw_value]
-            return raw_value
-
-        if not isinstance(value, list):
-            return []
-        filters: list[dict[str, Any]] = []
-        for item in value:
-            if not isinstance(item, dict):
-                continue
-            field = str(item.get("field", "")).strip()
-            if field not in whitelist:
-                continue
-            op = str(item.get("op", "=")).strip().lower() or "="
-            if op not in ALLOWED_FILTER_OPS:
-                continue
-            filters.append({"field": field, "op": op, "value": _helper_normalize_filter_value(item.get("value"))})
-        return filters
 
-    def _helper_trim_sql_fields_and_values(sql: str) -> str:
-        """作用：清理 SQL 字段与字符串字面值两端空格。
-        
-        输入参数：
-        - sql: str。
-        
-        输出参数：
-        - 返回值类型: str。
-        """
+async def _helper_await_cancellable(ctx: ChatWorkflowContext, awaitable: Awaitable[Any]) -> Any:
+    """作用：等待节点中的模型调用；请求被取消时立即中断进行中的 HTTP 请求并抛出 WorkflowCancelledError。"""
+    if ctx.cancel_token is None:
+        return await awaitable
+    return await ctx.cancel_token.run(awaitable)
 
-        normalized_sql = re.sub(
-            r"\b([a-zA-Z_][a-zA-Z0-9_]*)\s*\.\s*([a-zA-Z_][a-zA-Z0-9_]*)\b",
-            r"\1.\2",
-            sql,
-        )
 
-        def _helper_trim_quoted_value(match: re.Match[str]) -> str:
-            """作用：清理 SQL 单引号字符串字面值的两端空格并保持引号结构。
-            
-            输入参数：
-            - match: re.Match[str]。
-            
-            输出参数：
-            - 返回值类型: str。
-            """
-            raw_value = match.group(1)
-            return f"'{raw_value.strip()}'"
-
-        normalized_sql = re.sub(r"'((?:''|[^'])*)'", _helper_trim_quoted_value, normalized_sql)
-        return normalized_sql
-
-    def _helper_extract_sql_fields(sql: str) -> list[str]:
-        """作用：提取 SQL 中的表字段引用并去重。
-        
-        输入参数：
-        - sql: str。
-        
-        输出参数：
-        - 返回值类型: list[str]。
-        """
+def _helper_remaining_seconds(ctx: ChatWorkflowContext) -> float | None:
+    """作用：返回本次请求剩余的时间预算（秒），未设置截止时间时为 None。"""
+    if ctx.deadline is None:
+        return None
+    return ctx.deadline - time.monotonic()
 
-        matches = re.findall(r"\b([a-zA-Z_][a-zA-Z0-9_]*)\.([a-zA-Z_][a-zA-Z0-9_]*)\b", sql)
-        result: list[str] = []
-        seen: set[str] = set()
-        for table_name, column_name in matches:
-            field = f"{table_name}.{column_name}"
-            key = field.lower()
-            if key in seen:
-                continue
-            seen.add(key)
-            result.append(field)
-        return result
 
-    def _helper_extract_cte_names(sql: str) -> set[str]:
-        """作用：提取 WITH 子句中定义的 CTE 名称。
-        
-        输入参数：
-        - sql: str。
-        
-        输出参数：
-        - 返回值类型: set[str]。
-        """
+def _helper_budget_timeout(ctx: ChatWorkflowContext, cap: float, reserve: float | None = None) -> float:
+    """作用：按剩余预算计算一次模型调用的超时：不超过节点自身上限，并为结果总结预留时间。
 
-        names = re.findall(r"(?is)(?:\bwith\b|,)\s*([a-zA-Z_][a-zA-Z0-9_]*)\s+as\s*\(", sql)
-        return {name.lower() for name in names}
+    输入参数：
+    - ctx: ChatWorkflowContext。
+    - cap: float，节点自身的超时上限（秒）。
+    - reserve: float | None，需预留的秒数，默认 CHAT_DEADLINE_SUMMARY_RESERVE_SECONDS。
 
-    def _helper_normalize_entity_mappings(value: Any, whitelist: set[str]) -> list[dict[str, str]]:
-        """作用：标准化实体映射并校验字段白名单。
-        
-        输入参数：
-        - value: Any。
-        - whitelist: set[str]。
-        
-        输出参数：
-        - 返回值类型: list[dict[str, str]]。
-        """
+    输出参数：
+    - 返回值类型: float，剩余预算不足 DEADLINE_MIN_CALL_SECONDS 时抛出 DeadlineExceededError。
+    """
 
-        if not isinstance(value, list):
-            return []
-        mappings: list[dict[str, str]] = []
-        for item in value:
-            if not isinstance(item, dict):
-                continue
-            entity_type = str(item.get("type", "")).strip()
-            entity_value = str(item.get("value", "")).strip()
-            field = str(item.get("field", "")).strip()
-            reason = str(item.get("reason", "")).strip()
-            if not entity_type or not entity_value or not field:
-                continue
-            if field not in whitelist:
-                continue
-            mappings.append(
-                {
-                    "type": entity_type,
-                    "value": entity_value,
-                    "field": field,
-                    "reason": reason,
-                }
-            )
-        return mappings
+    remaining = _helper_remaining_seconds(ctx)
+    if remaining is None:
+        return cap
+    if reserve is None:
+        reserve = settings.chat_deadline_summary_reserve_seconds
+    budget = remaining - max(reserve, 0.0)
+    if budget < DEADLINE_MIN_CALL_SECONDS:
+        raise DeadlineExceededError(f"请求剩余时间预算不足（{max(remaining, 0.0):.1f}s）")
+    return min(cap, budget)
+
+
+def _helper_budget_execution_ms(ctx: ChatWorkflowContext) -> int:
+    """作用：按剩余预算计算 SQL 执行时限（毫秒）：不超过 SQL_GUARD_MAX_EXECUTION_MS，并为结果总结预留时间。"""
+    max_execution_ms = settings.sql_guard_max_execution_ms
+    remaining = _helper_remaining_seconds(ctx)
+    if remaining is None:
+        return max_execution_ms
+    budget_ms = int((remaining - settings.chat_deadline_summary_reserve_seconds) * 1000)
+    if max_execution_ms > 0:
+        budget_ms = min(budget_ms, max_execution_ms)
+    return max(budget_ms, int(DEADLINE_MIN_CALL_SECONDS * 1000))
+
+
+def _helper_budget_allows_retry(ctx: ChatWorkflowContext) -> bool:
+    """作用：判断剩余预算是否还够再走一轮隐藏上下文重试（含一次 SQL 生成调用）；不够时记录跳过。"""
+    remaining = _helper_remaining_seconds(ctx)
+    if remaining is None or remaining >= settings.chat_deadline_min_retry_seconds:
+        return True
+    if "retry" not in ctx.deadline_skips:
+        ctx.deadline_skips.append("retry")
+    return False
+
+
+def _helper_emit_step_event(
+        ctx: ChatWorkflowContext,
+        step_name: str,
+        status: str,
+        error_message: str | None = None,
+        step_payload: dict[str, Any] | None = None,
+) -> None:
+    if not ctx.on_step_event:
+        return
+    try:
+        ctx.on_step_event(step_name, status, error_message, step_payload)
+    except Exception:
+        return
 
-    def _helper_is_readonly_sql(sql: str) -> bool:
-        """作用：仅允许查询 SQL。
-        
-        输入参数：
-        - sql: str。
-        
-        输出参数：
-        - 返回值类型: bool。
-        """
 
-        stripped = sql.strip().lower()
-        if not stripped:
-            return False
-        if not (stripped.startswith("select") or stripped.startswith("with")):
-            return False
-        forbidden_tokens = [
-            "insert",
-            "update",
-            "delete",
-            "replace",
-            "alter",
-            "drop",
-            "truncate",
-            "create",
-            "grant",
-            "revoke",
-        ]
-        for token in forbidden_tokens:
-            if re.search(rf"\b{token}\b", stripped):
-                return False
-        return True
+async def _helper_run_db_step(ctx: ChatWorkflowContext, func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """作用：在数据库线程池中执行一步数据库操作并随即提交，归还连接后再回到事件循环。
 
-    def _helper_build_kb_hints() -> tuple[list[str], list[dict[str, list[str]]], list[dict[str, Any]]]:
-        """作用：构建字段白名单、字段别名提示与结构化描述提示。
-        
-        输入参数：
-        - 无。
-        
-        输出参数：
-        - 返回值类型: tuple[list[str], list[dict[str, list[str]]], list[dict[str, Any]]]。
-        """
+    会话事务若跨越模型调用，连接会在整个工作流期间被占用，并发会话数将受连接池大小限制；
+    因此工作流中途的读取、探测与缓存失效都按步提交，最终的会话与日志写入仍在结束时统一提交。
+    请求可取消时，执行期间在取消令牌上登记所用连接，取消即对其 KILL QUERY；连接在提交（归还连接池）前注销。
 
-        kb_path = Path(__file__).resolve().parents[1] / "knowledge" / "schema_kb_core.json"
-        kb = json.loads(kb_path.read_text(encoding="utf-8"))
-        fields: list[str] = []
-        alias_pairs: list[dict[str, list[str]]] = []
-        schema_hints: list[dict[str, Any]] = []
+    输入参数：
+    - ctx: ChatWorkflowContext。
+    - func: Callable[..., Any]，在数据库线程中执行的同步函数。
+    - args/kwargs: 传给 func 的参数。
 
-        for table in kb.get("tables", []):
-            table_name = str(table.get("name", "")).strip()
-            if not table_name:
-                continue
-            table_description = str(table.get("description", "")).strip()
-            table_columns: list[dict[str, Any]] = []
-            for column in table.get("columns", []):
-                column_name = str(column.get("name", "")).strip()
-                if not column_name:
-                    continue
-                field = f"{table_name}.{column_name}"
-                fields.append(field)
-
-                raw_aliases = column.get("aliases", []) or []
-                aliases = [str(item).strip() for item in raw_aliases if str(item).strip()]
-                aliases.extend([column_name, field])
-
-                dedup_aliases: list[str] = []
-                seen: set[str] = set()
-                for alias in aliases:
-                    key = alias.lower()
-                    if key in seen:
-                        continue
-                    seen.add(key)
-                    dedup_aliases.append(alias)
-                alias_pairs.append({field: dedup_aliases})
-                table_columns.append(
-                    {
-                        "field": field,
-                        "field_description": str(column.get("description", "")).strip(),
-                        "aliases": dedup_aliases,
-                    }
-                )
+    输出参数：
+    - 返回值类型: Any，func 的返回值。
+    """
 
-            schema_hints.append(
-                {
-                    "table": table_name,
-                    "table_description": table_description,
-                    "columns": table_columns,
-                }
-            )
+    def _helper_call() -> Any:
+        token = ctx.cancel_token
+        try:
+            if token is not None:
+                token.raise_if_cancelled()
+                token.attach_connection(ctx.db)
+            try:
+                result = func(*args, **kwargs)
+            finally:
+                if token is not None:
+                    token.detach_connection()
+            ctx.db.commit()
+            return result
+        except Exception:
+            ctx.db.rollback()
+            raise
 
-        return fields, alias_pairs, schema_hints
+    return await run_db_call(_helper_call)
+
+
+def _helper_to_json_safe(value: Any) -> Any:
+    """作用：递归转换为 JSON 安全类型，避免 date/datetime 序列化失败。"""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        # MySQL 聚合表达式常返回 Decimal，需转为 JSON 可序列化数字。
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, dict):
+        return {str(key): _helper_to_json_safe(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_helper_to_json_safe(item) for item in value]
+    if isinstance(value, tuple):
+        return [_helper_to_json_safe(item) for item in value]
+    return value
+
+
+def _helper_get_recent_user_messages(db: Session, session_id: str, limit: int = 4) -> list[str]:
+    """作用：读取同一会话最近的用户消息。
+    
+    输入参数：
+    - db: Session。
+    - session_id: str。
+    - limit: int。
+    
+    输出参数：
+    - 返回值类型: list[str]。
+    """
 
-    def _helper_call_llm(
-            system_prompt: str,
-            user_prompt: str,
-            model_name: str,
-            timeout: float,
-            response_format: dict[str, Any] | None = None,
-    ) -> dict[str, Any]:
-        """作用：调用大模型并解析 JSON。
-        
-        输入参数：
-        - system_prompt: str。
-        - user_prompt: str。
-        - model_name: str。
-        - timeout: float。
-        
-        输出参数：
-        - 返回值类型: dict[str, Any]。
-        """
+    if write_behind_queue.has_pending(ChatHistory.__tablename__, session_id):
+        # 上一轮问答仍在后写队列中（快速追问），先刷盘保证读到完整历史
+        write_behind_queue.flush()
+    rows = (
+        db.query(ChatHistory)
+        .filter(
+            ChatHistory.session_id == session_id,
+            ChatHistory.message_role == "user",
+            ChatHistory.is_deleted == False,
+        )
+        .order_by(ChatHistory.created_at.desc(), ChatHistory.id.desc())
+        .limit(limit)
+        .all()
+    )
+    return [row.message_content for row in reversed(rows)]
 
-        import httpx
-        from openai import OpenAI
 
-        if not settings.llm_api_key:
-            raise RuntimeError("未配置 LLM_API_KEY，无法执行工作流")
-        if not model_name:
-            raise RuntimeError("未配置模型名，无法执行工作流")
+def _helper_extract_json_object(text_value: str) -> dict[str, Any] | None:
+    """作用：从模型输出文本中提取 JSON。
+    
+    输入参数：
+    - text_value: str。
+    
+    输出参数：
+    - 返回值类型: dict[str, Any] | None。
+    """
 
-        try:
-            kwargs: dict[str, Any] = {"api_key": settings.llm_api_key}
-            if settings.llm_base_url:
-                kwargs["base_url"] = settings.llm_base_url
-            with httpx.Client(trust_env=False, timeout=timeout) as http_client:
-                client = OpenAI(**kwargs, http_client=http_client)
-                completion_payload: dict[str, Any] = {
-                    "model": model_name,
-                    "messages": [
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": user_prompt},
-                    ],
-                    "temperature": 0.1,
-                }
-                if response_format:
-                    completion_payload["response_format"] = response_format
-                response = client.chat.completions.create(**completion_payload)
-        except Exception as exc:
-            raise RuntimeError(f"大模型调用失败: {exc}") from exc
-
-        output_text = ""
-        if response.choices and response.choices[0].message:
-            output_text = response.choices[0].message.content or ""
-        output_data = _helper_extract_json_object(output_text)
-        if not output_data:
-            raise ValueError("模型输出不是有效 JSON")
-        return output_data
-
-    def _helper_intent_node_logic(
-            message: str,
-            history_user_messages: list[str],
-            threshold: float,
-            model_name: str,
-    ) -> dict[str, Any]:
-        """作用：意图识别节点业务逻辑。
-        
-        输入参数：
-        - message: str。
-        - history_user_messages: list[str]。
-        - threshold: float。
-        - model_name: str。
-        
-        输出参数：
-        - 返回值类型: dict[str, Any]。
-        """
+    match = re.search(r"\{.*\}", text_value, flags=re.S)
+    if not match:
+        return None
+    try:
+        return json.loads(match.group(0))
+    except Exception:
+        return None
 
-        llm_data = _helper_call_llm(
-            system_prompt=INTENT_SYSTEM_PROMPT_FULL,
-            user_prompt=build_intent_user_prompt(message, history_user_messages),
-            model_name=model_name,
-            timeout=20.0,
-        )
 
-        intent = str(llm_data.get("intent", "")).strip().lower()
-        if intent not in ALLOWED_INTENTS:
-            raise ValueError(f"意图识别输出了非法 intent: {intent}")
-
-        confidence = _helper_safe_float(llm_data.get("confidence", None), default=-1.0)
-        if confidence < 0.0:
-            raise ValueError("意图识别缺少有效 confidence 字段")
-
-        merged_query = str(llm_data.get("merged_query", "")).strip()
-        rewritten_query = str(llm_data.get("rewritten_query", merged_query)).strip()
-        if not merged_query or not rewritten_query:
-            raise ValueError("意图识别缺少 merged_query 或 rewritten_query")
-
-        if confidence < threshold:
-            intent = "chat"
-        result = {
-            "intent": intent,
-            "is_followup": bool(llm_data.get("is_followup", False)),
-            "confidence": confidence,
-            "merged_query": merged_query,
-            "rewritten_query": rewritten_query,
-            "threshold": threshold,
-        }
-        print("意图识别节点输出:")
-        print(json.dumps(result, indent=2, ensure_ascii=False, default=str))
-        return result
+def _helper_safe_float(value: Any, default: float = 0.0) -> float:
+    """作用：安全转换浮点并裁剪到 [0,1]。
+    
+    输入参数：
+    - value: Any。
+    - default: float。
+    
+    输出参数：
+    - 返回值类型: float。
+    """
+
+    try:
+        number = float(value)
+    except Exception:
+        number = default
+    return max(0.0, min(1.0, number))
+
+
+def _helper_to_unique_str_list(value: Any) -> list[str]:
+    """作用：标准化字符串数组并去重。
+    
+    输入参数：
+    - value: Any。
+    
+    输出参数：
+    - 返回值类型: list[str]。
+    """
+
+    if not isinstance(value, list):
+        return []
+    result: list[str] = []
+    seen: set[str] = set()
+    for item in value:
+        text_value = str(item).strip()
+        if not text_value:
+            continue
+        key = text_value.lower()
+        if key in seen:
+            continue
+        seen.add(key)
+        result.append(text_value)
+    return result
+
+
+def _helper_normalize_entities(value: Any) -> list[dict[str, str]]:
+    """作用：标准化实体列表。
+    
+    输入参数：
+    - value: Any。
+    
+    输出参数：
+    - 返回值类型: list[dict[str, str]]。
+    """
+
+    if not isinstance(value, list):
+        return []
+    entities: list[dict[str, str]] = []
+    for item in value:
+        if not isinstance(item, dict):
+            continue
+        entity_type = str(item.get("type", "")).strip()
+        entity_value = str(item.get("value", "")).strip()
+        if not entity_type or not entity_value:
+            continue
+        entities.append({"type": entity_type, "value": entity_value})
+    return entities
+
+
+def _helper_normalize_filters(value: Any, whitelist: set[str]) -> list[dict[str, Any]]:
+    """作用：标准化过滤条件并校验字段白名单。
+    
+    输入参数：
+    - value: Any。
+    - whitelist: set[str]。
+    
+    输出参数：
+    - 返回值类型: list[dict[str, Any]]。
+    """
 
-    def _helper_task_parse_node_logic(intent_result: dict[str, Any], model_name: str) -> dict[str, Any]:
-        """作用：任务解析节点业务逻辑。
+    def _helper_normalize_filter_value(raw_value: Any) -> Any:
+        """作用：标准化单个过滤值，清理字符串两端空格并兼容字符串列表值。
         
         输入参数：
-        - intent_result: dict[str, Any]。
-        - model_name: str。
+        - raw_value: Any。
         
         输出参数：
-        - 返回值类型: dict[str, Any]。
+        - 返回值类型: Any。
         """
+        if isinstance(raw_value, str):
+            return raw_value.strip()
+        if isinstance(raw_value, list):
+            return [item.strip() if isinstance(item, str) else item for item in raw_value]
+        return raw_value
+
+    if not isinstance(value, list):
+        return []
+    filters: list[dict[str, Any]] = []
+    for item in value:
+        if not isinstance(item, dict):
+            continue
+        field = str(item.get("field", "")).strip()
+        if field not in whitelist:
+            continue
+        op = str(item.get("op", "=")).strip().lower() or "="
+        if op not in ALLOWED_FILTER_OPS:
+            continue
+        filters.append({"field": field, "op": op, "value": _helper_normalize_filter_value(item.get("value"))})
+    return filters
+
+
+def _helper_trim_sql_fields_and_values(sql: str) -> str:
+    """作用：清理 SQL 字段与字符串字面值两端空格。
+    
+    输入参数：
+    - sql: str。
+    
+    输出参数：
+    - 返回值类型: str。
+    """
 
-        query = str(
-            intent_result.get("rewritten_query")
-            or intent_result.get("merged_query")
-            or intent_result.get("message")
-            or ""
-        ).strip()
-        if not query:
-            raise ValueError("任务解析缺少 query")
-
-        field_whitelist, alias_pairs, _ = _helper_build_kb_hints()
-        whitelist_set = set(field_whitelist)
-
-        llm_output = _helper_call_llm(
-            system_prompt=TASK_PARSE_SYSTEM_PROMPT,
-            user_prompt=build_task_parse_user_prompt(
-                query=query,
-                field_whitelist=field_whitelist,
-                alias_pairs=alias_pairs,
-            ),
-            model_name=model_name,
-            timeout=25.0,
-        )
-
-        intent = str(llm_output.get("intent", "")).strip().lower()
-        if intent not in ALLOWED_INTENTS:
-            raise ValueError(f"任务解析输出了非法 intent: {intent}")
-
-        operation = str(llm_output.get("operation", "")).strip().lower()
-        if operation not in ALLOWED_OPERATIONS:
-            raise ValueError(f"任务解析输出了非法 operation: {operation}")
-
-        time_range_raw = llm_output.get("time_range")
-        if not isinstance(time_range_raw, dict):
-            raise ValueError("任务解析缺少有效 time_range")
-
-        confidence = _helper_safe_float(llm_output.get("confidence", None), default=-1.0)
-        if confidence < 0.0:
-            raise ValueError("任务解析缺少有效 confidence 字段")
-
-        result = {
-            "intent": "business_query",
-            "entities": _helper_normalize_entities(llm_output.get("entities")),
-            "dimensions": _helper_to_unique_str_list(llm_output.get("dimensions")),
-            "metrics": _helper_to_unique_str_list(llm_output.get("metrics")),
-            "filters": _helper_normalize_filters(llm_output.get("filters"), whitelist_set),
-            "time_range": {
-                "start": str(time_range_raw.get("start")).strip() if time_range_raw.get("start") not in (
-                None, "") else None,
-                "end": str(time_range_raw.get("end")).strip() if time_range_raw.get("end") not in (None, "") else None,
-            },
-            "operation": operation,
-            "confidence": confidence,
-        }
-        print("任务解析节点输出:")
-        print(json.dumps(result, indent=2, ensure_ascii=False, default=str))
-        return result
+    normalized_sql = re.sub(
+        r"\b([a-zA-Z_][a-zA-Z0-9_]*)\s*\.\s*([a-zA-Z_][a-zA-Z0-9_]*)\b",
+        r"\1.\2",
+        sql,
+    )
 
-    def _helper_sql_generation_node_logic(
-            rewritten_query: str,
-            parse_result: dict[str, Any],
-            hidden_context_result: dict[str, Any] | None,
-            model_name: str,
-    ) -> dict[str, Any]:
-        """作用：SQL 生成节点业务逻辑。
+    def _helper_trim_quoted_value(match: re.Match[str]) -> str:
+        """作用：清理 SQL 单引号字符串字面值的两端空格并保持引号结构。
         
         输入参数：
-        - rewritten_query: str。
-        - parse_result: dict[str, Any]。
-        - hidden_context_result: dict[str, Any] | None。
-        - model_name: str。
+        - match: re.Match[str]。
         
         输出参数：
-        - 返回值类型: dict[str, Any]。
+        - 返回值类型: str。
         """
+        raw_value = match.group(1)
+        return f"'{raw_value.strip()}'"
 
-        if not isinstance(parse_result, dict):
-            raise ValueError("SQL 生成缺少有效任务解析结果")
-        if str(parse_result.get("intent", "")).strip().lower() != "business_query":
-            raise ValueError("SQL 生成仅支持 business_query")
-
-        field_whitelist, alias_pairs, schema_hints = _helper_build_kb_hints()
-        whitelist_set = set(field_whitelist)
-
-        sql_response_format = {"type": "json_object"} if settings.llm_response_format_sql == "json_object" else None
-
-        llm_output = _helper_call_llm(
-            system_prompt=SQL_GENERATION_SYSTEM_PROMPT,
-            user_prompt=build_sql_generation_user_prompt(
-                rewritten_query=rewritten_query,
-                task=parse_result,
-                field_whitelist=field_whitelist,
-                alias_pairs=alias_pairs,
-                schema_hints=schema_hints,
-                hidden_context=hidden_context_result,
-            ),
-            model_name=model_name,
-            timeout=30.0,
-            response_format=sql_response_format,
-        )
+    normalized_sql = re.sub(r"'((?:''|[^'])*)'", _helper_trim_quoted_value, normalized_sql)
+    return normalized_sql
 
-        sql = str(llm_output.get("sql", "")).strip()
-        sql = _helper_trim_sql_fields_and_values(sql)
-        if not sql:
-            raise ValueError("SQL 生成缺少 sql 字段")
-        if not re.search(r"^\s*with\b", sql, flags=re.I):
-            raise ValueError("SQL 生成未使用 WITH（CTE）")
-
-        sql_fields = _helper_extract_sql_fields(sql)
-        if not sql_fields:
-            raise ValueError("SQL 中未识别到 table.field 字段")
-        cte_names = _helper_extract_cte_names(sql)
-        invalid_fields: list[str] = []
-        for field in sql_fields:
-            table_name = field.split(".", 1)[0].lower()
-            if table_name in cte_names:
-                continue
-            if field not in whitelist_set:
-                invalid_fields.append(field)
-        applied_field_replacements: list[dict[str, str]] = []
-        if invalid_fields and isinstance(hidden_context_result, dict):
-            raw_field_candidates = hidden_context_result.get("field_candidates")
-            candidate_map: dict[str, list[str]] = {}
-            if isinstance(raw_field_candidates, list):
-                for item in raw_field_candidates:
-                    if not isinstance(item, dict):
-                        continue
-                    missing_field = str(item.get("missing", "")).strip()
-                    if not missing_field:
-                        continue
-                    candidates_raw = item.get("candidates")
-                    if not isinstance(candidates_raw, list):
-                        continue
-                    normalized_candidates: list[str] = []
-                    seen_candidates: set[str] = set()
-                    for candidate in candidates_raw:
-                        candidate_text = str(candidate).strip()
-                        if not candidate_text:
-                            continue
-                        if candidate_text not in whitelist_set:
-                            continue
-                        candidate_key = candidate_text.lower()
-                        if candidate_key in seen_candidates:
-                            continue
-                        seen_candidates.add(candidate_key)
-                        normalized_candidates.append(candidate_text)
-                    if normalized_candidates:
-                        candidate_map[missing_field.lower()] = normalized_candidates
-
-            replacement_sql = sql
-            for invalid_field in invalid_fields:
-                replacement_candidates = candidate_map.get(invalid_field.lower(), [])
-                if not replacement_candidates:
-                    continue
-                invalid_table = invalid_field.split(".", 1)[0].lower() if "." in invalid_field else ""
-                invalid_suffix = invalid_field.split(".", 1)[1].lower() if "." in invalid_field else invalid_field.lower()
-                target_field = ""
-                if invalid_suffix.endswith("_id"):
-                    for candidate in replacement_candidates:
-                        candidate_lower = candidate.lower()
-                        if candidate_lower.endswith("_id") and (not candidate_lower.endswith(".id")):
-                            if invalid_table and (not candidate_lower.startswith(f"{invalid_table}.")):
-                                continue
-                            target_field = candidate
-                            break
-                for candidate in replacement_candidates:
-                    if target_field:
-                        break
-                    if invalid_table and candidate.lower().startswith(f"{invalid_table}."):
-                        target_field = candidate
-                        break
-                if not target_field:
-                    target_field = replacement_candidates[0]
-
-                replace_pattern = re.compile(rf"\b{re.escape(invalid_field)}\b", flags=re.I)
-                if not replace_pattern.search(replacement_sql):
-                    continue
-                replacement_sql = replace_pattern.sub(target_field, replacement_sql)
-                applied_field_replacements.append({"from": invalid_field, "to": target_field})
-
-            if applied_field_replacements:
-                sql = _helper_trim_sql_fields_and_values(replacement_sql)
-                sql_fields = _helper_extract_sql_fields(sql)
-                cte_names = _helper_extract_cte_names(sql)
-                invalid_fields = []
-                for field in sql_fields:
-                    table_name = field.split(".", 1)[0].lower()
-                    if table_name in cte_names:
-                        continue
-                    if field not in whitelist_set:
-                        invalid_fields.append(field)
 
-        if invalid_fields:
-            raise ValueError(f"SQL 包含非白名单字段: {invalid_fields}")
-
-        entity_mappings = _helper_normalize_entity_mappings(llm_output.get("entity_mappings"), whitelist_set)
-        entities = _helper_normalize_entities(parse_result.get("entities"))
-        for entity in entities:
-            entity_type = entity["type"]
-            entity_value = entity["value"]
-            target_mapping = next(
-                (
-                    mapping
-                    for mapping in entity_mappings
-                    if mapping["type"] == entity_type and mapping["value"] == entity_value
-                ),
-                None,
-            )
-            if not target_mapping:
-                raise ValueError(f"关键实体映射失败: type={entity_type}, value={entity_value}")
-            if target_mapping["field"] not in sql_fields:
-                raise ValueError(
-                    f"关键实体映射字段未出现在 SQL 中: type={entity_type}, value={entity_value}, field={target_mapping['field']}"
-                )
+def _helper_extract_sql_fields(sql: str) -> list[str]:
+    """作用：提取 SQL 中的表字段引用并去重。
+    
+    输入参数：
+    - sql: str。
+    
+    输出参数：
+    - 返回值类型: list[str]。
+    """
 
-        result = {
-            "sql": sql,
-            "entity_mappings": entity_mappings,
-            "sql_fields": sql_fields,
-            "applied_field_replacements": applied_field_replacements,
-        }
-        print("SQL 生成节点输出:")
-        print(json.dumps(result, indent=2, ensure_ascii=False, default=str))
-        return result
+    matches = re.findall(r"\b([a-zA-Z_][a-zA-Z0-9_]*)\.([a-zA-Z_][a-zA-Z0-9_]*)\b", sql)
+    result: list[str] = []
+    seen: set[str] = set()
+    for table_name, column_name in matches:
+        field = f"{table_name}.{column_name}"
+        key = field.lower()
+        if key in seen:
+            continue
+        seen.add(key)
+        result.append(field)
+    return result
+
+
+def _helper_extract_cte_names(sql: str) -> set[str]:
+    """作用：提取 WITH 子句中定义的 CTE 名称。
+    
+    输入参数：
+    - sql: str。
+    
+    输出参数：
+    - 返回值类型: set[str]。
+    """
 
-    def _helper_sql_validate_node_logic(sql_result: dict[str, Any] | None) -> dict[str, Any]:
-        """作用：SQL 校验节点业务逻辑：执行 SQL 并返回结果或错误信息。
-        
-        输入参数：
-        - sql_result: dict[str, Any] | None。
-        
-        输出参数：
-        - 返回值类型: dict[str, Any]。
-        """
+    names = re.findall(r"(?is)(?:\bwith\b|,)\s*([a-zA-Z_][a-zA-Z0-9_]*)\s+as\s*\(", sql)
+    return {name.lower() for name in names}
 
-        def _helper_extract_metric_aliases(sql_text: str) -> list[str]:
-            """作用：从 SQL 中提取指标型别名（如 count/sum/avg）用于后续零值判断。
-            
-            输入参数：
-            - sql_text: str。
-            
-            输出参数：
-            - 返回值类型: list[str]。
-            """
-            aliases = re.findall(r"(?is)\bas\s+([a-zA-Z_][a-zA-Z0-9_]*)", sql_text)
-            keywords = (
-                "count", "sum", "avg", "total", "num", "cnt",
-                "ren_shu", "shu_liang", "zong_shu", "he_ji", "ping_jun", "jun_zhi",
-                "ratio", "rate", "percent",
-            )
-            result: list[str] = []
-            seen: set[str] = set()
-            for alias in aliases:
-                alias_text = alias.strip()
-                alias_key = alias_text.lower()
-                if not alias_key or alias_key in seen:
-                    continue
-                if any(keyword in alias_key for keyword in keywords):
-                    seen.add(alias_key)
-                    result.append(alias_text)
-            return result
 
-        def _helper_has_zero_metric(result_rows: list[dict[str, Any]], metric_aliases: list[str]) -> bool:
-            """作用：根据指标别名检查查询结果首行是否存在数值型指标等于0的情况。
-            
-            输入参数：
-            - result_rows: list[dict[str, Any]]。
-            - metric_aliases: list[str]。
-            
-            输出参数：
-            - 返回值类型: bool。
-            """
-            if not result_rows or not metric_aliases:
-                return False
-            first_row = result_rows[0] if isinstance(result_rows[0], dict) else {}
-            for alias in metric_aliases:
-                if alias not in first_row:
-                    continue
-                value = first_row.get(alias)
-                try:
-                    if float(value) == 0.0:
-                        return True
-                except Exception:
-                    continue
-            return False
+def _helper_normalize_entity_mappings(value: Any, whitelist: set[str]) -> list[dict[str, str]]:
+    """作用：标准化实体映射并校验字段白名单。
+    
+    输入参数：
+    - value: Any。
+    - whitelist: set[str]。
+    
+    输出参数：
+    - 返回值类型: list[dict[str, str]]。
+    """
 
-        sql = str((sql_result or {}).get("sql", "")).strip()
-        sql = _helper_trim_sql_fields_and_values(sql)
-        if not sql:
-            v_result = {
-                "is_valid": False,
-                "error": "sql_validate_missing_sql",
-                "rows": 0,
-                "result": [],
-                "executed_sql": "",
-                "empty_result": False,
-                "zero_metric_result": False,
+    if not isinstance(value, list):
+        return []
+    mappings: list[dict[str, str]] = []
+    for item in value:
+        if not isinstance(item, dict):
+            continue
+        entity_type = str(item.get("type", "")).strip()
+        entity_value = str(item.get("value", "")).strip()
+        field = str(item.get("field", "")).strip()
+        reason = str(item.get("reason", "")).strip()
+        if not entity_type or not entity_value or not field:
+            continue
+        if field not in whitelist:
+            continue
+        mappings.append(
+            {
+                "type": entity_type,
+                "value": entity_value,
+                "field": field,
+                "reason": reason,
             }
-            print("SQL验证节点输出:")
-            print(json.dumps(v_result, indent=2, ensure_ascii=False, default=str))
-            return v_result
-
-        if not _helper_is_readonly_sql(sql):
-            v_result = {
-                "is_valid": False,
-                "error": "sql_validate_readonly_violation",
-                "rows": 0,
-                "result": [],
-                "executed_sql": sql,
-                "empty_result": False,
-                "zero_metric_result": False,
-            }
-            print("SQL验证节点输出:")
-            print(json.dumps(v_result, indent=2, ensure_ascii=False, default=str))
-            return v_result
+        )
+    return mappings
 
-        try:
-            rows = db.execute(text(sql)).mappings().all()
-            result_rows = _helper_to_json_safe([dict(row) for row in rows])
-            metric_aliases = _helper_extract_metric_aliases(sql)
-            empty_result = len(result_rows) == 0
-            if (not empty_result) and len(result_rows) == 1 and isinstance(result_rows[0], dict):
-                # 聚合查询在无命中数据时常返回 1 行全 NULL，这里按空结果处理以触发重试链路。
-                has_aggregate = bool(re.search(r"(?is)\b(min|max|sum|avg|count)\s*\(", sql))
-                if has_aggregate:
-                    first_row = result_rows[0]
-                    if all(value is None for value in first_row.values()):
-                        empty_result = True
-            zero_metric_result = _helper_has_zero_metric(result_rows, metric_aliases)
-            v_result = {
-                "is_valid": True,
-                "error": None,
-                "rows": len(result_rows),
-                "result": result_rows,
-                "executed_sql": sql,
-                "empty_result": empty_result,
-                "zero_metric_result": zero_metric_result,
-            }
-            print("SQL验证节点输出:")
-            print(json.dumps(v_result, indent=2, ensure_ascii=False, default=str))
-            return v_result
-        except Exception as exc:
-            v_result = {
-                "is_valid": False,
-                "error": str(exc),
-                "rows": 0,
-                "result": [],
-                "executed_sql": sql,
-                "empty_result": False,
-                "zero_metric_result": False,
-            }
-            print("SQL验证节点输出:")
-            print(json.dumps(v_result, indent=2, ensure_ascii=False, default=str))
-            return v_result
-
-    def _helper_hidden_context_node_logic(
-            rewritten_query: str,
-            parse_result: dict[str, Any] | None,
-            sql_result: dict[str, Any] | None,
-            sql_validate_result: dict[str, Any] | None,
-    ) -> dict[str, Any]:
-        """作用：隐藏上下文探索节点：基于 SQL 报错做只读探测并产出补充上下文。
-        
-        输入参数：
-        - rewritten_query: str。
-        - parse_result: dict[str, Any] | None。
-        - sql_result: dict[str, Any] | None。
-        - sql_validate_result: dict[str, Any] | None。
-        
-        输出参数：
-        - 返回值类型: dict[str, Any]。
-        """
 
-        error_text = str((sql_validate_result or {}).get("error") or "").strip()
-        validate_result = sql_validate_result if isinstance(sql_validate_result, dict) else {}
-        is_valid = bool(validate_result.get("is_valid"))
-        empty_result = bool(validate_result.get("empty_result"))
-        zero_metric_result = bool(validate_result.get("zero_metric_result"))
-        failed_sql = str((sql_result or {}).get("sql") or "").strip()
-        error_lower = error_text.lower()
-        retry_reason = "sql_error"
-        if is_valid and empty_result:
-            retry_reason = "empty_result"
-        elif is_valid and zero_metric_result:
-            retry_reason = "zero_metric_result"
-
-        error_type = "execution_error"
-        if "unknown column" in error_lower:
-            error_type = "unknown_column"
-        elif "unknown table" in error_lower:
-            error_type = "unknown_table"
-        elif "syntax" in error_lower:
-            error_type = "syntax_error"
-        elif "doesn't exist" in error_lower:
-            error_type = "object_not_found"
-
-        field_whitelist, alias_pairs, schema_hints = _helper_build_kb_hints()
-        whitelist_set = set(field_whitelist)
-
-        sql_fields = (sql_result or {}).get("sql_fields") if isinstance(sql_result, dict) else []
-        candidate_fields: list[str] = []
-        if isinstance(sql_fields, list):
-            for field in sql_fields:
-                field_text = str(field).strip()
-                if not field_text:
+def _helper_is_readonly_sql(sql: str) -> bool:
+    """作用：仅允许查询 SQL。
+    
+    输入参数：
+    - sql: str。
+    
+    输出参数：
+    - 返回值类型: bool。
+    """
+
+    stripped = sql.strip().lower()
+    if not stripped:
+        return False
+    if not (stripped.startswith("select") or stripped.startswith("with")):
+        return False
+    forbidden_tokens = [
+        "insert",
+        "update",
+        "delete",
+        "replace",
+        "alter",
+        "drop",
+        "truncate",
+        "create",
+        "grant",
+        "revoke",
+    ]
+    for token in forbidden_tokens:
+        if re.search(rf"\b{token}\b", stripped):
+            return False
+    return True
+
+
+async def _helper_call_llm(
+        system_prompt: str,
+        user_prompt: str,
+        model_name: str,
+        timeout: float,
+        response_format: dict[str, Any] | None = None,
+) -> dict[str, Any]:
+    """作用：异步调用大模型并解析 JSON（等待响应期间不占用线程）。
+    
+    输入参数：
+    - system_prompt: str。
+    - user_prompt: str。
+    - model_name: str。
+    - timeout: float。
+    
+    输出参数：
+    - 返回值类型: dict[str, Any]。
+    """
+
+    if not settings.llm_api_key:
+        raise RuntimeError("未配置 LLM_API_KEY，无法执行工作流")
+    if not model_name:
+        raise RuntimeError("未配置模型名，无法执行工作流")
+
+    try:
+        client = llm_client_manager.get_async_client(model_name)
+        completion_payload: dict[str, Any] = {
+            "model": model_name,
+            "messages": [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt},
+            ],
+            "temperature": 0.1,
+            "timeout": build_llm_timeout(timeout),
+        }
+        if response_format:
+            completion_payload["response_format"] = response_format
+        response = await client.chat.completions.create(**completion_payload)
+    except Exception as exc:
+        raise RuntimeError(f"大模型调用失败: {exc}") from exc
+
+    usage = getattr(response, "usage", None)
+    if usage is not None:
+        logger.info(
+            "llm usage",
+            extra={
+                "payload": {
+                    "model": model_name,
+                    "prompt_tokens": getattr(usage, "prompt_tokens", None),
+                    "completion_tokens": getattr(usage, "completion_tokens", None),
+                }
+            },
+        )
+    output_text = ""
+    if response.choices and response.choices[0].message:
+        output_text = response.choices[0].message.content or ""
+    output_data = _helper_extract_json_object(output_text)
+    if not output_data:
+        raise ValueError("模型输出不是有效 JSON")
+    return output_data
+
+
+async def _helper_call_llm_stream(
+        system_prompt: str,
+        user_prompt: str,
+        model_name: str,
+        timeout: float,
+        field_name: str,
+        on_field_delta: Callable[[str], None],
+) -> dict[str, Any]:
+    """作用：以流式方式调用大模型，边接收边回调指定 JSON 字符串字段的增量文本，结束后解析完整 JSON。
+
+    timeout 为整次调用的总时限（与非流式调用语义一致），超时即中断流。
+    
+    输入参数：
+    - system_prompt: str。
+    - user_prompt: str。
+    - model_name: str。
+    - timeout: float。
+    - field_name: str，需要增量转发的字段名（如 summary）。
+    - on_field_delta: Callable[[str], None]，增量文本回调。
+    
+    输出参数：
+    - 返回值类型: dict[str, Any]。
+    """
+
+    if not settings.llm_api_key:
+        raise RuntimeError("未配置 LLM_API_KEY，无法执行工作流")
+    if not model_name:
+        raise RuntimeError("未配置模型名，无法执行工作流")
+
+    deadline = time.monotonic() + timeout
+    extractor = JsonStringFieldExtractor(field_name)
+    output_parts: list[str] = []
+    try:
+        client = llm_client_manager.get_async_client(model_name)
+        stream = await client.chat.completions.create(
+            model=model_name,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt},
+            ],
+            temperature=0.1,
+            timeout=build_llm_timeout(timeout),
+            stream=True,
+        )
+        async with stream:
+            async for chunk in stream:
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"流式输出超过 {timeout:.0f}s")
+                if not chunk.choices:
                     continue
-                if field_text in whitelist_set:
-                    candidate_fields.append(field_text)
-        # 当 SQL 生成失败且 sql_fields 为空时，回退到任务解析字段作为探测候选，帮助下一轮重试修复。
-        if isinstance(parse_result, dict):
-            dimensions_raw = parse_result.get("dimensions")
-            if isinstance(dimensions_raw, list):
-                for field in dimensions_raw:
-                    field_text = str(field).strip()
-                    if field_text in whitelist_set:
-                        candidate_fields.append(field_text)
-
-            filters_raw = parse_result.get("filters")
-            if isinstance(filters_raw, list):
-                for item in filters_raw:
-                    if not isinstance(item, dict):
+                text_piece = chunk.choices[0].delta.content or ""
+                if not text_piece:
+                    continue
+                output_parts.append(text_piece)
+                field_delta = extractor.feed(text_piece)
+                if field_delta:
+                    on_field_delta(field_delta)
+    except Exception as exc:
+        raise RuntimeError(f"大模型调用失败: {exc}") from exc
+
+    output_data = _helper_extract_json_object("".join(output_parts))
+    if not output_data:
+        raise ValueError("模型输出不是有效 JSON")
+    return output_data
+
+
+async def _helper_intent_node_logic(
+        message: str,
+        history_user_messages: list[str],
+        threshold: float,
+        model_name: str,
+        timeout: float = INTENT_LLM_TIMEOUT_SECONDS,
+) -> dict[str, Any]:
+    """作用：意图识别节点业务逻辑。
+    
+    输入参数：
+    - message: str。
+    - history_user_messages: list[str]。
+    - threshold: float。
+    - model_name: str。
+    - timeout: float，模型调用超时（由请求剩余预算推导）。
+    
+    输出参数：
+    - 返回值类型: dict[str, Any]。
+    """
+
+    llm_data = await _helper_call_llm(
+        system_prompt=INTENT_SYSTEM_PROMPT_FULL,
+        user_prompt=build_intent_user_prompt(message, history_user_messages),
+        model_name=model_name,
+        timeout=timeout,
+    )
+    result = _helper_normalize_intent_output(llm_data, threshold)
+    log_node_output(logger, "intent_recognition", result)
+    return result
+
+
+def _helper_normalize_intent_output(llm_data: dict[str, Any], threshold: float) -> dict[str, Any]:
+    """作用：校验并规范化模型输出的意图识别结果。
+    
+    输入参数：
+    - llm_data: dict[str, Any]。
+    - threshold: float。
+    
+    输出参数：
+    - 返回值类型: dict[str, Any]。
+    """
+
+    intent = str(llm_data.get("intent", "")).strip().lower()
+    if intent not in ALLOWED_INTENTS:
+        raise ValueError(f"意图识别输出了非法 intent: {intent}")
+
+    confidence = _helper_safe_float(llm_data.get("confidence", None), default=-1.0)
+    if confidence < 0.0:
+        raise ValueError("意图识别缺少有效 confidence 字段")
+
+    merged_query = str(llm_data.get("merged_query", "")).strip()
+    rewritten_query = str(llm_data.get("rewritten_query", merged_query)).strip()
+    if not merged_query or not rewritten_query:
+        raise ValueError("意图识别缺少 merged_query 或 rewritten_query")
+
+    if confidence < threshold:
+        intent = "chat"
+    result = {
+        "intent": intent,
+        "is_followup": bool(llm_data.get("is_followup", False)),
+        "confidence": confidence,
+        "merged_query": merged_query,
+        "rewritten_query": rewritten_query,
+        "threshold": threshold,
+    }
+    return result
+
+
+async def _helper_task_parse_node_logic(
+        intent_result: dict[str, Any],
+        model_name: str,
+        timeout: float = TASK_PARSE_LLM_TIMEOUT_SECONDS,
+) -> dict[str, Any]:
+    """作用：任务解析节点业务逻辑。
+    
+    输入参数：
+    - intent_result: dict[str, Any]。
+    - model_name: str。
+    - timeout: float，模型调用超时（由请求剩余预算推导）。
+    
+    输出参数：
+    - 返回值类型: dict[str, Any]。
+    """
+
+    query = str(
+        intent_result.get("rewritten_query")
+        or intent_result.get("merged_query")
+        or intent_result.get("message")
+        or ""
+    ).strip()
+    if not query:
+        raise ValueError("任务解析缺少 query")
+
+    kb = get_schema_kb()
+    whitelist_set = kb.whitelist_set
+
+    llm_output = await _helper_call_llm(
+        system_prompt=TASK_PARSE_SYSTEM_PROMPT,
+        user_prompt=build_task_parse_user_prompt(
+            query=query,
+            field_whitelist=kb.field_whitelist_json,
+            alias_pairs=kb.alias_pairs_json,
+        ),
+        model_name=model_name,
+        timeout=timeout,
+    )
+
+    intent = str(llm_output.get("intent", "")).strip().lower()
+    if intent not in ALLOWED_INTENTS:
+        raise ValueError(f"任务解析输出了非法 intent: {intent}")
+    result = _helper_normalize_task_output(llm_output, whitelist_set)
+    log_node_output(logger, "task_parse", result)
+    return result
+
+
+def _helper_normalize_task_output(llm_output: dict[str, Any], whitelist_set: frozenset[str] | set[str]) -> dict[str, Any]:
+    """作用：校验并规范化模型输出的结构化任务（operation/time_range/confidence 等）。
+    
+    输入参数：
+    - llm_output: dict[str, Any]。
+    - whitelist_set: frozenset[str] | set[str]，字段白名单。
+    
+    输出参数：
+    - 返回值类型: dict[str, Any]。
+    """
+
+    operation = str(llm_output.get("operation", "")).strip().lower()
+    if operation not in ALLOWED_OPERATIONS:
+        raise ValueError(f"任务解析输出了非法 operation: {operation}")
+
+    time_range_raw = llm_output.get("time_range")
+    if not isinstance(time_range_raw, dict):
+        raise ValueError("任务解析缺少有效 time_range")
+
+    confidence = _helper_safe_float(llm_output.get("confidence", None), default=-1.0)
+    if confidence < 0.0:
+        raise ValueError("任务解析缺少有效 confidence 字段")
+
+    result = {
+        "intent": "business_query",
+        "entities": _helper_normalize_entities(llm_output.get("entities")),
+        "dimensions": _helper_to_unique_str_list(llm_output.get("dimensions")),
+        "metrics": _helper_to_unique_str_list(llm_output.get("metrics")),
+        "filters": _helper_normalize_filters(llm_output.get("filters"), whitelist_set),
+        "time_range": {
+            "start": str(time_range_raw.get("start")).strip() if time_range_raw.get("start") not in (
+            None, "") else None,
+            "end": str(time_range_raw.get("end")).strip() if time_range_raw.get("end") not in (None, "") else None,
+        },
+        "operation": operation,
+        "confidence": confidence,
+    }
+    return result
+
+
+async def _helper_intent_task_node_logic(
+        message: str,
+        history_user_messages: list[str],
+        threshold: float,
+        model_name: str,
+        timeout: float = INTENT_TASK_LLM_TIMEOUT_SECONDS,
+) -> tuple[dict[str, Any], dict[str, Any] | None, str | None]:
+    """作用：单次调用完成意图识别与任务解析（single_call 模式）。
+
+    意图部分不合法时直接报错；任务部分不合法时返回 None 与原因，由图回退到独立的任务解析节点。
+    
+    输入参数：
+    - message: str。
+    - history_user_messages: list[str]。
+    - threshold: float。
+    - model_name: str。
+    - timeout: float，模型调用超时（由请求剩余预算推导）。
+    
+    输出参数：
+    - 返回值类型: tuple[dict[str, Any], dict[str, Any] | None, str | None]，意图结果、任务结果与任务回退原因。
+    """
+
+    kb = get_schema_kb()
+    llm_data = await _helper_call_llm(
+        system_prompt=INTENT_TASK_SYSTEM_PROMPT,
+        user_prompt=build_intent_task_user_prompt(
+            message=message,
+            history_user_messages=history_user_messages,
+            field_whitelist=kb.field_whitelist_json,
+            alias_pairs=kb.alias_pairs_json,
+        ),
+        model_name=model_name,
+        timeout=timeout,
+    )
+    intent_result = _helper_normalize_intent_output(llm_data, threshold)
+    parse_result: dict[str, Any] | None = None
+    task_error: str | None = None
+    if intent_result["intent"] == "business_query":
+        task_raw = llm_data.get("task")
+        if isinstance(task_raw, dict):
+            try:
+                parse_result = _helper_normalize_task_output(task_raw, kb.whitelist_set)
+            except ValueError as exc:
+                task_error = str(exc)
+        else:
+            task_error = "合并输出缺少 task 对象"
+    log_node_output(
+        logger,
+        "intent_task",
+        {"intent_result": intent_result, "parse_result": parse_result, "task_error": task_error},
+    )
+    return intent_result, parse_result, task_error
+
+
+async def _helper_sql_generation_node_logic(
+        rewritten_query: str,
+        parse_result: dict[str, Any],
+        hidden_context_result: dict[str, Any] | None,
+        model_name: str,
+        timeout: float = SQL_GENERATION_LLM_TIMEOUT_SECONDS,
+) -> dict[str, Any]:
+    """作用：SQL 生成节点业务逻辑。
+    
+    输入参数：
+    - rewritten_query: str。
+    - parse_result: dict[str, Any]。
+    - hidden_context_result: dict[str, Any] | None。
+    - model_name: str。
+    - timeout: float，模型调用超时（由请求剩余预算推导）。
+    
+    输出参数：
+    - 返回值类型: dict[str, Any]。
+    """
+
+    if not isinstance(parse_result, dict):
+        raise ValueError("SQL 生成缺少有效任务解析结果")
+    if str(parse_result.get("intent", "")).strip().lower() != "business_query":
+        raise ValueError("SQL 生成仅支持 business_query")
+
+    kb = get_schema_kb()
+    whitelist_set = kb.whitelist_set
+
+    sql_response_format = {"type": "json_object"} if settings.llm_response_format_sql == "json_object" else None
+
+    # 只把与任务相关的表/字段放进提示词；生成结果仍按完整白名单校验
+    schema_subset = select_schema_subset(kb, rewritten_query, parse_result, hidden_context_result)
+    examples = retrieve_sql_examples(rewritten_query)
+    user_prompt = build_sql_generation_user_prompt(
+        rewritten_query=rewritten_query,
+        task=parse_result,
+        field_whitelist=schema_subset.field_whitelist_json,
+        alias_pairs=schema_subset.alias_pairs_json,
+        schema_hints=schema_subset.schema_hints_json,
+        hidden_context=hidden_context_result,
+        examples=examples,
+    )
+    schema_retrieval = {
+        **schema_subset.stats,
+        "prompt_chars": len(SQL_GENERATION_SYSTEM_PROMPT) + len(user_prompt),
+        "estimated_prompt_tokens": estimate_prompt_tokens(f"{SQL_GENERATION_SYSTEM_PROMPT}{user_prompt}"),
+    }
+    llm_output = await _helper_call_llm(
+        system_prompt=SQL_GENERATION_SYSTEM_PROMPT,
+        user_prompt=user_prompt,
+        model_name=model_name,
+        timeout=timeout,
+        response_format=sql_response_format,
+    )
+
+    sql = str(llm_output.get("sql", "")).strip()
+    sql = _helper_trim_sql_fields_and_values(sql)
+    if not sql:
+        raise ValueError("SQL 生成缺少 sql 字段")
+    if not re.search(r"^\s*with\b", sql, flags=re.I):
+        raise ValueError("SQL 生成未使用 WITH（CTE）")
+
+    sql_fields = _helper_extract_sql_fields(sql)
+    if not sql_fields:
+        raise ValueError("SQL 中未识别到 table.field 字段")
+    cte_names = _helper_extract_cte_names(sql)
+    invalid_fields: list[str] = []
+    for field in sql_fields:
+        table_name = field.split(".", 1)[0].lower()
+        if table_name in cte_names:
+            continue
+        if field not in whitelist_set:
+            invalid_fields.append(field)
+    applied_field_replacements: list[dict[str, str]] = []
+    if invalid_fields and isinstance(hidden_context_result, dict):
+        raw_field_candidates = hidden_context_result.get("field_candidates")
+        candidate_map: dict[str, list[str]] = {}
+        if isinstance(raw_field_candidates, list):
+            for item in raw_field_candidates:
+                if not isinstance(item, dict):
+                    continue
+                missing_field = str(item.get("missing", "")).strip()
+                if not missing_field:
+                    continue
+                candidates_raw = item.get("candidates")
+                if not isinstance(candidates_raw, list):
+                    continue
+                normalized_candidates: list[str] = []
+                seen_candidates: set[str] = set()
+                for candidate in candidates_raw:
+                    candidate_text = str(candidate).strip()
+                    if not candidate_text:
                         continue
-                    field_text = str(item.get("field", "")).strip()
-                    if field_text in whitelist_set:
-                        candidate_fields.append(field_text)
-
-            metrics_raw = parse_result.get("metrics")
-            if isinstance(metrics_raw, list):
-                for metric in metrics_raw:
-                    metric_text = str(metric).strip()
-                    if not metric_text:
+                    if candidate_text not in whitelist_set:
                         continue
-                    metric_fields = re.findall(
-                        r"\b([a-zA-Z_][a-zA-Z0-9_]*\.[a-zA-Z_][a-zA-Z0-9_]*)\b",
-                        metric_text,
-                    )
-                    for metric_field in metric_fields:
-                        if metric_field in whitelist_set:
-                            candidate_fields.append(metric_field)
+                    candidate_key = candidate_text.lower()
+                    if candidate_key in seen_candidates:
+                        continue
+                    seen_candidates.add(candidate_key)
+                    normalized_candidates.append(candidate_text)
+                if normalized_candidates:
+                    candidate_map[missing_field.lower()] = normalized_candidates
+
+        replacement_sql = sql
+        for invalid_field in invalid_fields:
+            replacement_candidates = candidate_map.get(invalid_field.lower(), [])
+            if not replacement_candidates:
+                continue
+            target_field = pick_field_replacement(invalid_field, replacement_candidates)
 
-        dedup_fields: list[str] = []
-        seen_fields: set[str] = set()
-        for field in candidate_fields:
-            key = field.lower()
-            if key in seen_fields:
+            replace_pattern = re.compile(rf"\b{re.escape(invalid_field)}\b", flags=re.I)
+            if not replace_pattern.search(replacement_sql):
                 continue
-            seen_fields.add(key)
-            dedup_fields.append(field)
-
-        missing_tokens: list[str] = []
-        match_single = re.search(r"Unknown column '([^']+)'", error_text, flags=re.I)
-        match_tick = re.search(r"Unknown column `([^`]+)`", error_text, flags=re.I)
-        if match_single:
-            missing_tokens.append(match_single.group(1).strip())
-        elif match_tick:
-            missing_tokens.append(match_tick.group(1).strip())
-        seen_missing_tokens = {item.lower() for item in missing_tokens}
-        extra_field_tokens = re.findall(
-            r"\b([a-zA-Z_][a-zA-Z0-9_]*\.[a-zA-Z_][a-zA-Z0-9_]*)\b",
-            error_text,
+            replacement_sql = replace_pattern.sub(target_field, replacement_sql)
+            applied_field_replacements.append({"from": invalid_field, "to": target_field})
+
+        if applied_field_replacements:
+            sql = _helper_trim_sql_fields_and_values(replacement_sql)
+            sql_fields = _helper_extract_sql_fields(sql)
+            cte_names = _helper_extract_cte_names(sql)
+            invalid_fields = []
+            for field in sql_fields:
+                table_name = field.split(".", 1)[0].lower()
+                if table_name in cte_names:
+                    continue
+                if field not in whitelist_set:
+                    invalid_fields.append(field)
+
+    if invalid_fields:
+        raise SqlGenerationError(f"SQL 包含非白名单字段: {invalid_fields}", sql)
+
+    entity_mappings = _helper_normalize_entity_mappings(llm_output.get("entity_mappings"), whitelist_set)
+    entities = _helper_normalize_entities(parse_result.get("entities"))
+    for entity in entities:
+        entity_type = entity["type"]
+        entity_value = entity["value"]
+        target_mapping = next(
+            (
+                mapping
+                for mapping in entity_mappings
+                if mapping["type"] == entity_type and mapping["value"] == entity_value
+            ),
+            None,
+        )
+        if not target_mapping:
+            raise ValueError(f"关键实体映射失败: type={entity_type}, value={entity_value}")
+        if target_mapping["field"] not in sql_fields:
+            raise ValueError(
+                f"关键实体映射字段未出现在 SQL 中: type={entity_type}, value={entity_value}, field={target_mapping['field']}"
+            )
+
+    result = {
+        "sql": sql,
+        "entity_mappings": entity_mappings,
+        "sql_fields": sql_fields,
+        "applied_field_replacements": applied_field_replacements,
+        "schema_retrieval": schema_retrieval,
+        "examples": [
+            {"question": item["question"], "source": item["source"], "similarity": item["similarity"]}
+            for item in examples
+        ],
+    }
+    log_node_output(logger, "sql_generation", result)
+    return result
+
+
+def _helper_sql_validate_node_logic(
+        db: Session,
+        sql_result: dict[str, Any] | None,
+        operation: str | None = None,
+        result_file_prefix: str = "result",
+        max_execution_ms: int | None = None,
+) -> dict[str, Any]:
+    """作用：SQL 校验节点业务逻辑：执行 SQL 并返回结果或错误信息。
+
+    开启执行防护时：明细/排名类查询注入 LIMIT；执行前 EXPLAIN 预估代价，超限直接拒绝；
+    执行时带 MAX_EXECUTION_TIME 提示并按行数上限增量读取。防护结果写入 guard 字段。
+    结果只在 result 中保留前 SQL_RESULT_PREVIEW_ROWS 行，超出时完整结果流式写入 result_file，rows 为总行数。
+    
+    输入参数：
+    - db: Session。
+    - sql_result: dict[str, Any] | None。
+    - operation: str | None，任务解析的 operation（detail/aggregate/ranking/trend）。
+    - result_file_prefix: str，结果文件名前缀（下载接口按 admin_{id}_ 前缀鉴权）。
+    - max_execution_ms: int | None，执行时限（由请求剩余预算推导），默认 SQL_GUARD_MAX_EXECUTION_MS。
+    
+    输出参数：
+    - 返回值类型: dict[str, Any]。
+    """
+
+    def _helper_extract_metric_aliases(sql_text: str) -> list[str]:
+        """作用：从 SQL 中提取指标型别名（如 count/sum/avg）用于后续零值判断。
+        
+        输入参数：
+        - sql_text: str。
+        
+        输出参数：
+        - 返回值类型: list[str]。
+        """
+        aliases = re.findall(r"(?is)\bas\s+([a-zA-Z_][a-zA-Z0-9_]*)", sql_text)
+        keywords = (
+            "count", "sum", "avg", "total", "num", "cnt",
+            "ren_shu", "shu_liang", "zong_shu", "he_ji", "ping_jun", "jun_zhi",
+            "ratio", "rate", "percent",
         )
-        for token in extra_field_tokens:
-            token_text = token.strip()
-            if not token_text:
+        result: list[str] = []
+        seen: set[str] = set()
+        for alias in aliases:
+            alias_text = alias.strip()
+            alias_key = alias_text.lower()
+            if not alias_key or alias_key in seen:
                 continue
-            token_key = token_text.lower()
-            if token_key in seen_missing_tokens:
+            if any(keyword in alias_key for keyword in keywords):
+                seen.add(alias_key)
+                result.append(alias_text)
+        return result
+
+    def _helper_has_zero_metric(result_rows: list[dict[str, Any]], metric_aliases: list[str]) -> bool:
+        """作用：根据指标别名检查查询结果首行是否存在数值型指标等于0的情况。
+        
+        输入参数：
+        - result_rows: list[dict[str, Any]]。
+        - metric_aliases: list[str]。
+        
+        输出参数：
+        - 返回值类型: bool。
+        """
+        if not result_rows or not metric_aliases:
+            return False
+        first_row = result_rows[0] if isinstance(result_rows[0], dict) else {}
+        for alias in metric_aliases:
+            if alias not in first_row:
                 continue
-            seen_missing_tokens.add(token_key)
-            missing_tokens.append(token_text)
-
-        alias_lookup: dict[str, list[str]] = {}
-        for alias_item in alias_pairs:
-            if isinstance(alias_item, dict):
-                for field, aliases in alias_item.items():
-                    alias_lookup[field] = [str(alias).strip().lower() for alias in aliases if str(alias).strip()]
-
-        field_candidates: list[dict[str, Any]] = []
-        for missing_token in missing_tokens:
-            missing_suffix = missing_token.split(".")[-1].strip().lower()
-            missing_table = missing_token.split(".", 1)[0].strip().lower() if "." in missing_token else ""
-            candidates: list[str] = []
-            for field in field_whitelist:
-                field_lower = field.lower()
-                if field_lower.endswith(f".{missing_suffix}"):
-                    candidates.append(field)
-                    continue
-                aliases = alias_lookup.get(field, [])
-                if missing_suffix in aliases:
-                    candidates.append(field)
-            if not candidates and missing_table:
-                for field in field_whitelist:
-                    if field.lower().startswith(f"{missing_table}."):
-                        candidates.append(field)
-            field_candidates.append(
-                {
-                    "missing": missing_token,
-                    "candidates": candidates[:12],
-                }
+            value = first_row.get(alias)
+            try:
+                if float(value) == 0.0:
+                    return True
+            except Exception:
+                continue
+        return False
+
+    sql = str((sql_result or {}).get("sql", "")).strip()
+    sql = _helper_trim_sql_fields_and_values(sql)
+    if not sql:
+        v_result = {
+            "is_valid": False,
+            "error": "sql_validate_missing_sql",
+            "rows": 0,
+            "result": [],
+            "executed_sql": "",
+            "empty_result": False,
+            "zero_metric_result": False,
+        }
+        log_node_output(logger, "sql_validate", v_result)
+        return v_result
+
+    if not _helper_is_readonly_sql(sql):
+        v_result = {
+            "is_valid": False,
+            "error": "sql_validate_readonly_violation",
+            "rows": 0,
+            "result": [],
+            "executed_sql": sql,
+            "empty_result": False,
+            "zero_metric_result": False,
+        }
+        log_node_output(logger, "sql_validate", v_result)
+        return v_result
+
+    if max_execution_ms is None:
+        max_execution_ms = settings.sql_guard_max_execution_ms
+    guard = SqlGuardReport(row_cap=settings.sql_guard_max_fetch_rows)
+    if settings.sql_guard_enabled and str(operation or "").strip().lower() in LIMITED_OPERATIONS:
+        sql, guard.limit_applied = apply_result_limit(sql, settings.sql_guard_detail_limit)
+
+    try:
+        # 数据版本须在执行前读取：执行期间发生的写入会让该条缓存立即失效，而不是被误认为已包含在结果中。
+        # 引用的表无法可靠确定时不读写结果缓存：写入这些表后缓存无法按表失效。
+        sql_tables = extract_sql_tables(sql)
+        table_versions = get_data_versions(sql_tables) if sql_tables is not None else {}
+        result_rows = get_cached_sql_result(sql) if sql_tables is not None else None
+        result_cache = "hit"
+        result_file: str | None = None
+        total_rows = len(result_rows or [])
+        content_hash = hash_result_rows(result_rows) if result_rows is not None else ""
+        if result_rows is None:
+            result_cache = "miss" if sql_tables is not None else "bypass"
+            guarded_rows = None
+            if settings.sql_guard_enabled:
+                estimate = estimate_sql_cost(db, sql)
+                if estimate is not None:
+                    guard.estimated_rows, guard.estimated_cost = estimate
+                    rejection = check_sql_cost(guard.estimated_rows, guard.estimated_cost)
+                    if rejection:
+                        guard.status = "rejected"
+                        guard.detail = rejection
+                        raise ValueError(f"sql_guard_rejected: {rejection}")
+                guarded_rows = execute_guarded_sql(db, sql, settings.sql_guard_max_fetch_rows, max_execution_ms)
+                row_source = guarded_rows
+            else:
+                row_source = (dict(row) for row in db.execute(text(sql)).mappings())
+            spilled = collect_result_rows(
+                (_helper_to_json_safe(row) for row in row_source),
+                preview_limit=settings.sql_result_preview_rows,
+                file_prefix=result_file_prefix,
             )
+            result_rows = spilled.preview_rows
+            total_rows = spilled.total_rows
+            result_file = spilled.file_name
+            content_hash = spilled.content_hash
+            if guarded_rows is not None and guarded_rows.truncated:
+                guard.status = "truncated"
+                guard.detail = f"结果超过 {settings.sql_guard_max_fetch_rows} 行，已截断"
+            if guard.status != "truncated" and result_file is None:
+                put_cached_sql_result(sql, result_rows, table_versions)
+        if guard.status == "ok" and guard.limit_applied and total_rows >= guard.limit_applied:
+            guard.status = "truncated"
+            guard.detail = f"明细结果已按 LIMIT {guard.limit_applied} 截断"
+        metric_aliases = _helper_extract_metric_aliases(sql)
+        empty_result = len(result_rows) == 0
+        if (not empty_result) and len(result_rows) == 1 and isinstance(result_rows[0], dict):
+            # 聚合查询在无命中数据时常返回 1 行全 NULL，这里按空结果处理以触发重试链路。
+            has_aggregate = bool(re.search(r"(?is)\b(min|max|sum|avg|count)\s*\(", sql))
+            if has_aggregate:
+                first_row = result_rows[0]
+                if all(value is None for value in first_row.values()):
+                    empty_result = True
+        zero_metric_result = _helper_has_zero_metric(result_rows, metric_aliases)
+        v_result = {
+            "is_valid": True,
+            "error": None,
+            "rows": total_rows,
+            "result": result_rows,
+            "result_file": result_file,
+            "content_hash": content_hash,
+            "executed_sql": sql,
+            "empty_result": empty_result,
+            "zero_metric_result": zero_metric_result,
+            "result_cache": result_cache,
+            "guard": guard.to_dict(),
+        }
+        log_node_output(logger, "sql_validate", v_result)
+        return v_result
+    except Exception as exc:
+        if is_statement_timeout_error(exc):
+            guard.status = "timeout"
+            guard.detail = f"执行超过 {max_execution_ms}ms，已被中断"
+        v_result = {
+            "is_valid": False,
+            "error": str(exc),
+            "rows": 0,
+            "result": [],
+            "executed_sql": sql,
+            "empty_result": False,
+            "zero_metric_result": False,
+            "guard": guard.to_dict(),
+        }
+        log_node_output(logger, "sql_validate", v_result)
+        return v_result
+
+
+def _helper_hidden_context_node_logic(
+        db: Session,
+        rewritten_query: str,
+        parse_result: dict[str, Any] | None,
+        sql_result: dict[str, Any] | None,
+        sql_validate_result: dict[str, Any] | None,
+) -> dict[str, Any]:
+    """作用：隐藏上下文探索节点：基于 SQL 报错做只读探测并产出补充上下文。
+    
+    输入参数：
+    - db: Session。
+    - rewritten_query: str。
+    - parse_result: dict[str, Any] | None。
+    - sql_result: dict[str, Any] | None。
+    - sql_validate_result: dict[str, Any] | None。
+    
+    输出参数：
+    - 返回值类型: dict[str, Any]。
+    """
 
-        probe_target_fields = list(dedup_fields)
-        seen_probe_fields = {item.lower() for item in probe_target_fields}
-        for item in field_candidates:
-            candidates = item.get("candidates")
-            if not isinstance(candidates, list):
+    error_text = str((sql_validate_result or {}).get("error") or "").strip()
+    validate_result = sql_validate_result if isinstance(sql_validate_result, dict) else {}
+    is_valid = bool(validate_result.get("is_valid"))
+    empty_result = bool(validate_result.get("empty_result"))
+    zero_metric_result = bool(validate_result.get("zero_metric_result"))
+    failed_sql = str((sql_result or {}).get("sql") or (sql_result or {}).get("failed_sql") or "").strip()
+    error_lower = error_text.lower()
+    retry_reason = "sql_error"
+    if is_valid and empty_result:
+        retry_reason = "empty_result"
+    elif is_valid and zero_metric_result:
+        retry_reason = "zero_metric_result"
+
+    error_type = "execution_error"
+    if "unknown column" in error_lower:
+        error_type = "unknown_column"
+    elif "unknown table" in error_lower:
+        error_type = "unknown_table"
+    elif "syntax" in error_lower:
+        error_type = "syntax_error"
+    elif "doesn't exist" in error_lower:
+        error_type = "object_not_found"
+
+    kb = get_schema_kb()
+    field_whitelist = kb.field_whitelist
+    whitelist_set = kb.whitelist_set
+
+    sql_fields = (sql_result or {}).get("sql_fields") if isinstance(sql_result, dict) else []
+    candidate_fields: list[str] = []
+    if isinstance(sql_fields, list):
+        for field in sql_fields:
+            field_text = str(field).strip()
+            if not field_text:
                 continue
-            for candidate in candidates[:6]:
-                candidate_text = str(candidate).strip()
-                if not candidate_text:
-                    continue
-                candidate_key = candidate_text.lower()
-                if candidate_key in seen_probe_fields:
+            if field_text in whitelist_set:
+                candidate_fields.append(field_text)
+    # 当 SQL 生成失败且 sql_fields 为空时，回退到任务解析字段作为探测候选，帮助下一轮重试修复。
+    if isinstance(parse_result, dict):
+        dimensions_raw = parse_result.get("dimensions")
+        if isinstance(dimensions_raw, list):
+            for field in dimensions_raw:
+                field_text = str(field).strip()
+                if field_text in whitelist_set:
+                    candidate_fields.append(field_text)
+
+        filters_raw = parse_result.get("filters")
+        if isinstance(filters_raw, list):
+            for item in filters_raw:
+                if not isinstance(item, dict):
                     continue
-                if candidate_text not in whitelist_set:
+                field_text = str(item.get("field", "")).strip()
+                if field_text in whitelist_set:
+                    candidate_fields.append(field_text)
+
+        metrics_raw = parse_result.get("metrics")
+        if isinstance(metrics_raw, list):
+            for metric in metrics_raw:
+                metric_text = str(metric).strip()
+                if not metric_text:
                     continue
-                seen_probe_fields.add(candidate_key)
-                probe_target_fields.append(candidate_text)
-
-        probe_samples: list[dict[str, Any]] = []
-        for field in probe_target_fields[:24]:
-            table_name, column_name = field.split(".", 1)
-            probe_sql = (
-                f"SELECT DISTINCT {table_name}.{column_name} AS value "
-                f"FROM {table_name} "
-                f"WHERE {table_name}.{column_name} IS NOT NULL AND {table_name}.is_deleted = 0"
-            )
-            if table_name != "class":
-                probe_sql = f"{probe_sql} LIMIT 20"
-            try:
-                rows = db.execute(text(probe_sql)).mappings().all()
-                values = [str(row.get("value")) for row in rows if row.get("value") is not None]
-                probe_samples.append(
-                    {
-                        "field": field,
-                        "probe_sql": probe_sql,
-                        "values": values,
-                    }
-                )
-            except Exception as exc:
-                probe_samples.append(
-                    {
-                        "field": field,
-                        "probe_sql": probe_sql,
-                        "values": [],
-                        "error": str(exc),
-                    }
+                metric_fields = re.findall(
+                    r"\b([a-zA-Z_][a-zA-Z0-9_]*\.[a-zA-Z_][a-zA-Z0-9_]*)\b",
+                    metric_text,
                 )
+                for metric_field in metric_fields:
+                    if metric_field in whitelist_set:
+                        candidate_fields.append(metric_field)
+
+    dedup_fields: list[str] = []
+    seen_fields: set[str] = set()
+    for field in candidate_fields:
+        key = field.lower()
+        if key in seen_fields:
+            continue
+        seen_fields.add(key)
+        dedup_fields.append(field)
+
+    missing_tokens: list[str] = []
+    match_single = re.search(r"Unknown column '([^']+)'", error_text, flags=re.I)
+    match_tick = re.search(r"Unknown column `([^`]+)`", error_text, flags=re.I)
+    if match_single:
+        missing_tokens.append(match_single.group(1).strip())
+    elif match_tick:
+        missing_tokens.append(match_tick.group(1).strip())
+    seen_missing_tokens = {item.lower() for item in missing_tokens}
+    extra_field_tokens = re.findall(
+        r"\b([a-zA-Z_][a-zA-Z0-9_]*\.[a-zA-Z_][a-zA-Z0-9_]*)\b",
+        error_text,
+    )
+    for token in extra_field_tokens:
+        token_text = token.strip()
+        if not token_text:
+            continue
+        token_key = token_text.lower()
+        if token_key in seen_missing_tokens:
+            continue
+        seen_missing_tokens.add(token_key)
+        missing_tokens.append(token_text)
+
+    alias_lookup = kb.alias_lookup
+
+    field_candidates: list[dict[str, Any]] = []
+    for missing_token in missing_tokens:
+        missing_suffix = missing_token.split(".")[-1].strip().lower()
+        missing_table = missing_token.split(".", 1)[0].strip().lower() if "." in missing_token else ""
+        candidates: list[str] = []
+        for field in field_whitelist:
+            field_lower = field.lower()
+            if field_lower.endswith(f".{missing_suffix}"):
+                candidates.append(field)
+                continue
+            aliases = alias_lookup.get(field, [])
+            if missing_suffix in aliases:
+                candidates.append(field)
+        if not candidates and missing_table:
+            for field in field_whitelist:
+                if field.lower().startswith(f"{missing_table}."):
+                    candidates.append(field)
+        field_candidates.append(
+            {
+                "missing": missing_token,
+                "candidates": candidates[:12],
+            }
+        )
 
-        probe_value_map: dict[str, list[str]] = {}
-        for sample in probe_samples:
-            if not isinstance(sample, dict):
+    probe_target_fields = list(dedup_fields)
+    seen_probe_fields = {item.lower() for item in probe_target_fields}
+    for item in field_candidates:
+        candidates = item.get("candidates")
+        if not isinstance(candidates, list):
+            continue
+        for candidate in candidates[:6]:
+            candidate_text = str(candidate).strip()
+            if not candidate_text:
                 continue
-            field_text = str(sample.get("field", "")).strip()
-            values_raw = sample.get("values")
-            if not field_text or not isinstance(values_raw, list):
+            candidate_key = candidate_text.lower()
+            if candidate_key in seen_probe_fields:
                 continue
-            normalized_values: list[str] = []
-            seen_values: set[str] = set()
-            for value in values_raw:
-                value_text = str(value).strip()
-                if not value_text:
-                    continue
-                value_key = value_text.lower()
-                if value_key in seen_values:
+            if candidate_text not in whitelist_set:
+                continue
+            seen_probe_fields.add(candidate_key)
+            probe_target_fields.append(candidate_text)
+
+    # 所有字段的取值探测合并为一次往返，并按字段缓存，重试与会话内的重复修复不再重复查询。
+    probe_samples = probe_field_values(db, probe_target_fields[:24])
+
+    probe_value_map: dict[str, list[str]] = {}
+    for sample in probe_samples:
+        if not isinstance(sample, dict):
+            continue
+        field_text = str(sample.get("field", "")).strip()
+        values_raw = sample.get("values")
+        if not field_text or not isinstance(values_raw, list):
+            continue
+        normalized_values: list[str] = []
+        seen_values: set[str] = set()
+        for value in values_raw:
+            value_text = str(value).strip()
+            if not value_text:
+                continue
+            value_key = value_text.lower()
+            if value_key in seen_values:
+                continue
+            seen_values.add(value_key)
+            normalized_values.append(value_text)
+        if normalized_values:
+            probe_value_map[field_text] = normalized_values
+
+    value_candidates: list[dict[str, Any]] = []
+    filters_raw = parse_result.get("filters") if isinstance(parse_result, dict) else []
+    if isinstance(filters_raw, list):
+        # 分类/名称字段优先在进程内取值字典中做 n-gram/拼音模糊匹配，未覆盖的字段再回退到探测样例。
+        value_indexes = ensure_value_indexes(
+            db,
+            [str(item.get("field", "")).strip() for item in filters_raw if isinstance(item, dict)],
+        )
+        for filter_item in filters_raw:
+            if not isinstance(filter_item, dict):
+                continue
+            field_text = str(filter_item.get("field", "")).strip()
+            if not field_text:
+                continue
+            original_value_text = str(filter_item.get("value", "")).strip()
+            if not original_value_text:
+                continue
+            value_index = value_indexes.get(field_text)
+            if value_index is not None:
+                dictionary_matches = match_field_value(value_index, original_value_text)
+                if dictionary_matches:
+                    value_candidates.append(
+                        {
+                            "field": field_text,
+                            "original_value": original_value_text,
+                            "candidates": [match.value for match in dictionary_matches],
+                            "scores": [match.score for match in dictionary_matches],
+                            "match_strategy": f"dictionary_{dictionary_matches[0].strategy}",
+                        }
+                    )
                     continue
-                seen_values.add(value_key)
-                normalized_values.append(value_text)
-            if normalized_values:
-                probe_value_map[field_text] = normalized_values
+            probe_values = probe_value_map.get(field_text, [])
+            if not probe_values:
+                continue
 
-        value_candidates: list[dict[str, Any]] = []
-        filters_raw = parse_result.get("filters") if isinstance(parse_result, dict) else []
-        if isinstance(filters_raw, list):
-            for filter_item in filters_raw:
-                if not isinstance(filter_item, dict):
+            exact_matches: list[str] = []
+            normalized_matches: list[str] = []
+            fuzzy_matches: list[str] = []
+            original_value_normalized = re.sub(r"\s+", "", original_value_text).lower()
+            for probe_value in probe_values:
+                probe_key = probe_value.lower()
+                if probe_key == original_value_text.lower():
+                    exact_matches.append(probe_value)
                     continue
-                field_text = str(filter_item.get("field", "")).strip()
-                if not field_text:
+
+                probe_normalized = re.sub(r"\s+", "", probe_value).lower()
+                if probe_normalized == original_value_normalized:
+                    normalized_matches.append(probe_value)
                     continue
-                probe_values = probe_value_map.get(field_text, [])
-                if not probe_values:
+                if (
+                        original_value_normalized
+                        and (
+                        original_value_normalized in probe_normalized
+                        or probe_normalized in original_value_normalized
+                )
+                ):
+                    fuzzy_matches.append(probe_value)
+
+            candidate_values = exact_matches or normalized_matches or fuzzy_matches or probe_values[:5]
+            dedup_candidate_values: list[str] = []
+            seen_candidate_values: set[str] = set()
+            for candidate_value in candidate_values:
+                candidate_text = str(candidate_value).strip()
+                if not candidate_text:
                     continue
-                original_value_text = str(filter_item.get("value", "")).strip()
-                if not original_value_text:
+                candidate_key = candidate_text.lower()
+                if candidate_key in seen_candidate_values:
                     continue
+                seen_candidate_values.add(candidate_key)
+                dedup_candidate_values.append(candidate_text)
+                if len(dedup_candidate_values) >= 8:
+                    break
+            if not dedup_candidate_values:
+                continue
 
-                exact_matches: list[str] = []
-                normalized_matches: list[str] = []
-                fuzzy_matches: list[str] = []
-                original_value_normalized = re.sub(r"\s+", "", original_value_text).lower()
-                for probe_value in probe_values:
-                    probe_key = probe_value.lower()
-                    if probe_key == original_value_text.lower():
-                        exact_matches.append(probe_value)
-                        continue
+            match_strategy = "fallback_probe_topn"
+            if exact_matches:
+                match_strategy = "exact"
+            elif normalized_matches:
+                match_strategy = "normalized"
+            elif fuzzy_matches:
+                match_strategy = "fuzzy"
 
-                    probe_normalized = re.sub(r"\s+", "", probe_value).lower()
-                    if probe_normalized == original_value_normalized:
-                        normalized_matches.append(probe_value)
-                        continue
-                    if (
-                            original_value_normalized
-                            and (
-                            original_value_normalized in probe_normalized
-                            or probe_normalized in original_value_normalized
-                    )
-                    ):
-                        fuzzy_matches.append(probe_value)
+            value_candidates.append(
+                {
+                    "field": field_text,
+                    "original_value": original_value_text,
+                    "candidates": dedup_candidate_values,
+                    "match_strategy": match_strategy,
+                }
+            )
 
-                candidate_values = exact_matches or normalized_matches or fuzzy_matches or probe_values[:5]
-                dedup_candidate_values: list[str] = []
-                seen_candidate_values: set[str] = set()
-                for candidate_value in candidate_values:
-                    candidate_text = str(candidate_value).strip()
-                    if not candidate_text:
-                        continue
-                    candidate_key = candidate_text.lower()
-                    if candidate_key in seen_candidate_values:
-                        continue
-                    seen_candidate_values.add(candidate_key)
-                    dedup_candidate_values.append(candidate_text)
-                    if len(dedup_candidate_values) >= 8:
-                        break
-                if not dedup_candidate_values:
-                    continue
+    hints: list[str] = [f"error_type={error_type}"]
+    if missing_tokens:
+        hints.append(f"missing_tokens={','.join(missing_tokens[:3])}")
+    if field_candidates:
+        hints.append("enforce_field_replacements_from_field_candidates")
+    if probe_samples:
+        hints.append("use_probe_samples_to_rewrite_filters_or_entities")
+    if retry_reason == "empty_result" and value_candidates:
+        hints.append("prioritize_value_candidates_for_empty_result")
+    hints.append("retry_sql_generation_with_hidden_context")
+
+    hc_result = {
+        "retry_reason": retry_reason,
+        "error_type": error_type,
+        "error": error_text,
+        "failed_sql": failed_sql,
+        "rewritten_query": rewritten_query,
+        "field_candidates": field_candidates,
+        "probe_samples": probe_samples,
+        "value_candidates": value_candidates,
+        "hints": hints,
+        "kb_summary": {
+            "table_count": len(kb.schema_hints),
+            "field_count": len(field_whitelist),
+        },
+    }
+    log_node_output(logger, "hidden_context", hc_result)
+    return hc_result
 
-                match_strategy = "fallback_probe_topn"
-                if exact_matches:
-                    match_strategy = "exact"
-                elif normalized_matches:
-                    match_strategy = "normalized"
-                elif fuzzy_matches:
-                    match_strategy = "fuzzy"
-
-                value_candidates.append(
-                    {
-                        "field": field_text,
-                        "original_value": original_value_text,
-                        "candidates": dedup_candidate_values,
-                        "match_strategy": match_strategy,
-                    }
-                )
 
-        hints: list[str] = [f"error_type={error_type}"]
-        if missing_tokens:
-            hints.append(f"missing_tokens={','.join(missing_tokens[:3])}")
-        if field_candidates:
-            hints.append("enforce_field_replacements_from_field_candidates")
-        if probe_samples:
-            hints.append("use_probe_samples_to_rewrite_filters_or_entities")
-        if retry_reason == "empty_result" and value_candidates:
-            hints.append("prioritize_value_candidates_for_empty_result")
-        hints.append("retry_sql_generation_with_hidden_context")
-
-        hc_result = {
-            "retry_reason": retry_reason,
-            "error_type": error_type,
+def _helper_sql_repair_node_logic(
+        sql_result: dict[str, Any] | None,
+        hidden_context_result: dict[str, Any] | None,
+        attempted_fingerprints: list[str],
+) -> dict[str, Any]:
+    """作用：确定性 SQL 修复节点业务逻辑：按报错与隐藏上下文规则化改写失败 SQL，不调用大模型。
+
+    改写结果须通过与 SQL 生成相同的白名单校验，且未在本次请求中尝试过，否则视为修复失败。
+
+    输入参数：
+    - sql_result: dict[str, Any] | None。
+    - hidden_context_result: dict[str, Any] | None。
+    - attempted_fingerprints: list[str]，本次请求已尝试过的修复 SQL 指纹。
+
+    输出参数：
+    - 返回值类型: dict[str, Any]。
+    """
+
+    started_at = time.perf_counter()
+    kb = get_schema_kb()
+    failed_sql = str((sql_result or {}).get("sql") or (sql_result or {}).get("failed_sql") or "").strip()
+    outcome = repair_sql(
+        failed_sql=failed_sql,
+        hidden_context_result=hidden_context_result or {},
+        whitelist=kb.field_whitelist,
+        table_names={name.lower() for name in kb.table_hints},
+        alias_lookup=kb.alias_lookup,
+    )
+    sql_fields: list[str] = []
+    fingerprints = list(attempted_fingerprints)
+    if outcome.repaired:
+        repaired_sql = _helper_trim_sql_fields_and_values(outcome.sql)
+        sql_fields = _helper_extract_sql_fields(repaired_sql)
+        cte_names = _helper_extract_cte_names(repaired_sql)
+        invalid_fields = [
+            field for field in sql_fields
+            if field.split(".", 1)[0].lower() not in cte_names and field not in kb.whitelist_set
+        ]
+        fingerprint = build_sql_fingerprint(repaired_sql)
+        if invalid_fields:
+            outcome.repaired = False
+            outcome.detail = f"改写后 SQL 仍包含非白名单字段: {invalid_fields}"
+        elif fingerprint in fingerprints:
+            outcome.repaired = False
+            outcome.detail = "改写结果已尝试过"
+        else:
+            outcome.sql = repaired_sql
+            fingerprints.append(fingerprint)
+    elapsed_ms = round((time.perf_counter() - started_at) * 1000, 3)
+    record_repair_attempt(outcome.repaired, elapsed_ms)
+    result = {
+        **outcome.to_dict(),
+        "sql_fields": sql_fields,
+        "elapsed_ms": elapsed_ms,
+        "attempted_fingerprints": fingerprints,
+        "stats": get_repair_stats(),
+    }
+    log_node_output(logger, "sql_repair", result)
+    return result
+
+
+def _helper_persist_rows(ctx: ChatWorkflowContext, model: type[Any], rows: list[dict[str, Any]]) -> None:
+    """作用：写入日志/历史行：优先交给后写队列跨请求攒批写入，未启用或队列已满时加入当前 Session 同步写入。
+    
+    输入参数：
+    - ctx: ChatWorkflowContext。
+    - model: ORM 模型类。
+    - rows: list[dict[str, Any]]。
+    
+    输出参数：
+    - 返回值类型: None。
+    """
+
+    if write_behind_queue.submit(ctx.db.get_bind(), model.__table__, rows):
+        return
+    ctx.db.add_all([model(**row) for row in rows])
+
+
+def _helper_insert_workflow_log(
+        ctx: ChatWorkflowContext,
+        step_name: str,
+        input_json: dict[str, Any],
+        output_json: dict[str, Any] | None,
+        status: str,
+        error_message: str | None,
+) -> None:
+    """作用：插入工作流日志。
+    
+    输入参数：
+    - ctx: ChatWorkflowContext。
+    - step_name: str。
+    - input_json: dict[str, Any]。
+    - output_json: dict[str, Any] | None。
+    - status: str。
+    - error_message: str | None。
+    
+    输出参数：
+    - 返回值类型: None。
+    """
+
+    _helper_persist_rows(
+        ctx,
+        WorkflowLog,
+        [
+            {
+                "session_id": ctx.session_id,
+                "step_name": step_name,
+                "input_json": _helper_to_json_safe(input_json),
+                "output_json": _helper_to_json_safe(output_json),
+                "status": status,
+                "error_message": error_message,
+                "risk_level": "low",
+                "created_by": ctx.admin_id,
+                "updated_by": ctx.admin_id,
+                "is_deleted": False,
+            }
+        ],
+    )
+
+
+def _helper_record_step_log(
+        ctx: ChatWorkflowContext,
+        step_name: str,
+        input_json: dict[str, Any],
+        output_json: dict[str, Any] | None,
+        status: str,
+        error_message: str | None,
+) -> None:
+    """作用：记录图内节点（hidden_context/sql_repair）的工作流日志，工作流结束时由 _helper_insert_step_logs 落库。
+
+    相同问题合并执行时节点运行在共享上下文中，直接写库只会记在发起方名下，且共享的数据库会话不负责日志提交。
+
+    输入参数：
+    - ctx: ChatWorkflowContext。
+    - step_name: str。
+    - input_json: dict[str, Any]。
+    - output_json: dict[str, Any] | None。
+    - status: str。
+    - error_message: str | None。
+
+    输出参数：
+    - 返回值类型: None。
+    """
+
+    ctx.step_logs.append(
+        {
+            "step_name": step_name,
+            "input_json": _helper_to_json_safe(input_json),
+            "output_json": _helper_to_json_safe(output_json),
+            "status": status,
+            "error_message": error_message,
+        }
+    )
+
+
+def _helper_insert_step_logs(ctx: ChatWorkflowContext) -> None:
+    """作用：以当前请求方的会话身份写入图内节点记录的工作流日志。
+
+    输入参数：
+    - ctx: ChatWorkflowContext。
+
+    输出参数：
+    - 返回值类型: None。
+    """
+
+    # 共享执行仍在进行时（本请求方已取消）列表可能还在增长，先取快照
+    for step_log in list(ctx.step_logs):
+        _helper_insert_workflow_log(ctx=ctx, **step_log)
+
+
+def _helper_insert_chat_history(
+        ctx: ChatWorkflowContext,
+        user_message: str,
+        assistant_message: str,
+        model_name: str,
+) -> None:
+    """作用：插入一轮用户与助手会话（两行同批写入）。
+    
+    输入参数：
+    - ctx: ChatWorkflowContext。
+    - user_message: str。
+    - assistant_message: str。
+    - model_name: str。
+    
+    输出参数：
+    - 返回值类型: None。
+    """
+
+    _helper_persist_rows(
+        ctx,
+        ChatHistory,
+        [
+            {
+                "admin_id": ctx.admin_id,
+                "session_id": ctx.session_id,
+                "message_role": role,
+                "message_content": content,
+                "model_name": model_name,
+                "created_by": ctx.admin_id,
+                "updated_by": ctx.admin_id,
+                "is_deleted": False,
+            }
+            for role, content in (("user", user_message), ("assistant", assistant_message))
+        ],
+    )
+
+
+def _helper_save_node_io_local(
+        ctx: ChatWorkflowContext,
+        step_name: str,
+        node_input: dict[str, Any],
+        node_output: dict[str, Any] | None,
+        status: str,
+        error_message: str | None,
+) -> None:
+    """作用：保存节点输入输出到本地（追加到分段 NDJSON 日志，由后台线程写盘，不阻塞节点）。
+    
+    输入参数：
+    - ctx: ChatWorkflowContext。
+    - step_name: str。
+    - node_input: dict[str, Any]。
+    - node_output: dict[str, Any] | None。
+    - status: str。
+    - error_message: str | None。
+    
+    输出参数：
+    - 返回值类型: None。
+    """
+
+    payload_data = {
+        "session_id": ctx.session_id,
+        "admin_id": ctx.admin_id,
+        "step_name": step_name,
+        "status": status,
+        "error_message": error_message,
+        "timestamp": datetime.now().isoformat(timespec="milliseconds"),
+        "input": node_input,
+        "output": node_output,
+    }
+    node_io_store.append(_helper_to_json_safe(payload_data))
+
+
+def _helper_node_logger(
+        ctx: ChatWorkflowContext,
+        step_name: str,
+        node_input: dict[str, Any],
+        node_output: dict[str, Any] | None,
+        status: str,
+        error_message: str | None,
+) -> None:
+    """作用：节点日志包装。
+    
+    输入参数：
+    - ctx: ChatWorkflowContext。
+    - step_name: str。
+    - node_input: dict[str, Any]。
+    - node_output: dict[str, Any] | None。
+    - status: str。
+    - error_message: str | None。
+    
+    输出参数：
+    - 返回值类型: None。
+    """
+
+    _helper_save_node_io_local(
+        ctx=ctx,
+        step_name=step_name,
+        node_input=node_input,
+        node_output=node_output,
+        status=status,
+        error_message=error_message,
+    )
+
+
+async def _helper_query_cache_lookup(ctx: ChatWorkflowContext, intent_result: dict[str, Any]) -> dict[str, Any] | None:
+    """作用：意图识别后按改写问题查询问题→SQL 缓存。
+
+    命中时附带缓存的任务解析结果与 SQL，供图直接跳到 sql_validate；缓存异常不影响主流程。
+
+    输入参数：
+    - ctx: ChatWorkflowContext。
+    - intent_result: dict[str, Any]。
+
+    输出参数：
+    - 返回值类型: dict[str, Any] | None，非业务查询时为 None。
+    """
+
+    if str(intent_result.get("intent", "")).strip().lower() != "business_query":
+        return None
+    rewritten_query = str(intent_result.get("rewritten_query") or "").strip()
+    if session_examples_due():
+        # 顺带按周期从问题→SQL 缓存刷新线上已验证示例，供 SQL 生成检索 few-shot
+        try:
+            await _helper_run_db_step(ctx, refresh_session_examples, ctx.db)
+        except Exception:
+            pass
+    try:
+        cache_key, entry = await _helper_run_db_step(ctx, lookup_query_cache, ctx.db, rewritten_query)
+    except Exception:
+        return {"key": None, "status": "bypass"}
+    if entry is None or not isinstance(entry.parse_result, dict):
+        return {"key": cache_key, "status": "miss"}
+    return {
+        "key": cache_key,
+        "status": "hit",
+        "parse_result": dict(entry.parse_result),
+        "sql_result": build_cached_sql_result(entry),
+    }
+
+
+async def _helper_intent_node(state: UnifiedChatGraphState, config: RunnableConfig) -> UnifiedChatGraphState:
+    """作用：图中的意图识别节点。
+    
+    输入参数：
+    - state: UnifiedChatGraphState。
+    - config: RunnableConfig，携带本次请求的 ChatWorkflowContext。
+    
+    输出参数：
+    - 返回值类型: UnifiedChatGraphState。
+    """
+    ctx = _helper_get_context(config)
+
+    node_input = {
+        "message": state["message"],
+        "history_user_messages": state["history_user_messages"],
+        "threshold": state["threshold"],
+        "model_name": state["model_name"],
+    }
+    _helper_emit_step_event(ctx, "intent_recognition", "start", None)
+    try:
+        intent_result = await _helper_await_cancellable(ctx, _helper_intent_node_logic(
+            message=state["message"],
+            history_user_messages=state["history_user_messages"],
+            threshold=state["threshold"],
+            model_name=state["model_name"],
+            timeout=_helper_budget_timeout(ctx, INTENT_LLM_TIMEOUT_SECONDS),
+        ))
+        _helper_node_logger(ctx, "intent_recognition", node_input, intent_result, "success", None)
+        cache_state = await _helper_query_cache_lookup(ctx, intent_result)
+        step_payload = {"query_cache": cache_state["status"]} if cache_state else None
+        _helper_emit_step_event(ctx, "intent_recognition", "end", None, step_payload)
+        next_state: UnifiedChatGraphState = {**state, "intent_result": intent_result, "query_cache": cache_state}
+        if cache_state and cache_state["status"] == "hit":
+            next_state["parse_result"] = cache_state.pop("parse_result")
+            next_state["sql_result"] = cache_state.pop("sql_result")
+        return next_state
+    except Exception as exc:
+        _helper_node_logger(ctx, "intent_recognition", node_input, None, "failed", str(exc))
+        _helper_emit_step_event(ctx, "intent_recognition", "error", str(exc))
+        raise
+
+
+async def _helper_intent_task_node(state: UnifiedChatGraphState, config: RunnableConfig) -> UnifiedChatGraphState:
+    """作用：single_call 模式下的意图识别节点，一次调用同时产出意图与任务解析结果。
+    
+    输入参数：
+    - state: UnifiedChatGraphState。
+    - config: RunnableConfig，携带本次请求的 ChatWorkflowContext。
+    
+    输出参数：
+    - 返回值类型: UnifiedChatGraphState。
+    """
+    ctx = _helper_get_context(config)
+
+    node_input = {
+        "message": state["message"],
+        "history_user_messages": state["history_user_messages"],
+        "threshold": state["threshold"],
+        "model_name": state["model_name"],
+        "workflow_mode": "single_call",
+    }
+    _helper_emit_step_event(ctx, "intent_recognition", "start", None)
+    try:
+        intent_result, parse_result, task_error = await _helper_await_cancellable(ctx, _helper_intent_task_node_logic(
+            message=state["message"],
+            history_user_messages=state["history_user_messages"],
+            threshold=state["threshold"],
+            model_name=state["model_name"],
+            timeout=_helper_budget_timeout(ctx, INTENT_TASK_LLM_TIMEOUT_SECONDS),
+        ))
+        node_output = {"intent_result": intent_result, "parse_result": parse_result, "task_error": task_error}
+        _helper_node_logger(ctx, "intent_recognition", node_input, node_output, "success", None)
+        cache_state = await _helper_query_cache_lookup(ctx, intent_result)
+        step_payload: dict[str, Any] = {}
+        if intent_result["intent"] == "business_query":
+            step_payload["task_parse"] = "merged" if parse_result is not None else "fallback"
+        if cache_state:
+            step_payload["query_cache"] = cache_state["status"]
+        _helper_emit_step_event(ctx, "intent_recognition", "end", None, step_payload or None)
+        next_state: UnifiedChatGraphState = {
+            **state,
+            "intent_result": intent_result,
+            "parse_result": parse_result,
+            "query_cache": cache_state,
+        }
+        if cache_state and cache_state["status"] == "hit":
+            next_state["parse_result"] = cache_state.pop("parse_result")
+            next_state["sql_result"] = cache_state.pop("sql_result")
+        return next_state
+    except Exception as exc:
+        _helper_node_logger(ctx, "intent_recognition", node_input, None, "failed", str(exc))
+        _helper_emit_step_event(ctx, "intent_recognition", "error", str(exc))
+        raise
+
+
+async def _helper_intent_speculative_node(state: UnifiedChatGraphState, config: RunnableConfig) -> UnifiedChatGraphState:
+    """作用：speculative 模式下的意图识别节点。
+
+    意图识别开始的同时，以并发任务按原始问题推测执行任务解析；意图确认为业务查询且改写后问题
+    与原始问题足够相近时直接采用推测结果，否则丢弃并由任务解析节点按改写问题重新解析。
+    
+    输入参数：
+    - state: UnifiedChatGraphState。
+    - config: RunnableConfig，携带本次请求的 ChatWorkflowContext。
+    
+    输出参数：
+    - 返回值类型: UnifiedChatGraphState。
+    """
+    ctx = _helper_get_context(config)
+
+    node_input = {
+        "message": state["message"],
+        "history_user_messages": state["history_user_messages"],
+        "threshold": state["threshold"],
+        "model_name": state["model_name"],
+        "workflow_mode": "speculative",
+    }
+    speculative_input = {"rewritten_query": state["message"]}
+    speculative_task = asyncio.create_task(
+        _helper_task_parse_node_logic(
+            intent_result=speculative_input,
+            model_name=state["model_name"],
+            timeout=_helper_budget_timeout(ctx, TASK_PARSE_LLM_TIMEOUT_SECONDS),
+        )
+    )
+    # 推测结果可能不被等待，主动取走异常避免事件循环告警。
+    speculative_task.add_done_callback(lambda task: task.cancelled() or task.exception())
+    _helper_emit_step_event(ctx, "intent_recognition", "start", None)
+    try:
+        intent_result = await _helper_await_cancellable(ctx, _helper_intent_node_logic(
+            message=state["message"],
+            history_user_messages=state["history_user_messages"],
+            threshold=state["threshold"],
+            model_name=state["model_name"],
+            timeout=_helper_budget_timeout(ctx, INTENT_LLM_TIMEOUT_SECONDS),
+        ))
+        _helper_node_logger(ctx, "intent_recognition", node_input, intent_result, "success", None)
+        cache_state = await _helper_query_cache_lookup(ctx, intent_result)
+
+        parse_result: dict[str, Any] | None = None
+        step_payload: dict[str, Any] = {}
+        if intent_result["intent"] == "business_query" and not (cache_state and cache_state["status"] == "hit"):
+            similarity = difflib.SequenceMatcher(
+                None,
+                normalize_query(state["message"]),
+                normalize_query(intent_result["rewritten_query"]),
+            ).ratio()
+            step_payload["speculative_similarity"] = round(similarity, 3)
+            if similarity >= settings.speculative_match_threshold:
+                try:
+                    parse_result = await _helper_await_cancellable(ctx, asyncio.wait_for(
+                        speculative_task,
+                        _helper_budget_timeout(ctx, SPECULATIVE_TASK_PARSE_WAIT_SECONDS),
+                    ))
+                    step_payload["task_parse"] = "speculative_hit"
+                    _helper_node_logger(ctx, "task_parse", {"intent_result": speculative_input}, parse_result,
+                                        "success", None)
+                except Exception as exc:
+                    step_payload["task_parse"] = "speculative_error"
+                    _helper_node_logger(ctx, "task_parse", {"intent_result": speculative_input}, None, "failed",
+                                        str(exc))
+            else:
+                step_payload["task_parse"] = "speculative_miss"
+        if cache_state:
+            step_payload["query_cache"] = cache_state["status"]
+        _helper_emit_step_event(ctx, "intent_recognition", "end", None, step_payload or None)
+
+        next_state: UnifiedChatGraphState = {
+            **state,
+            "intent_result": intent_result,
+            "parse_result": parse_result,
+            "query_cache": cache_state,
+        }
+        if cache_state and cache_state["status"] == "hit":
+            next_state["parse_result"] = cache_state.pop("parse_result")
+            next_state["sql_result"] = cache_state.pop("sql_result")
+        return next_state
+    except Exception as exc:
+        _helper_node_logger(ctx, "intent_recognition", node_input, None, "failed", str(exc))
+        _helper_emit_step_event(ctx, "intent_recognition", "error", str(exc))
+        raise
+    finally:
+        # 未被采用的推测任务直接取消，其进行中的模型请求随之中止。
+        speculative_task.cancel()
+
+
+async def _helper_task_parse_node(state: UnifiedChatGraphState, config: RunnableConfig) -> UnifiedChatGraphState:
+    """作用：图中的任务解析节点。
+    
+    输入参数：
+    - state: UnifiedChatGraphState。
+    - config: RunnableConfig，携带本次请求的 ChatWorkflowContext。
+    
+    输出参数：
+    - 返回值类型: UnifiedChatGraphState。
+    """
+    ctx = _helper_get_context(config)
+
+    intent_result = state.get("intent_result") or {}
+    node_input = {"intent_result": intent_result}
+    _helper_emit_step_event(ctx, "task_parse", "start", None)
+    try:
+        parse_result = await _helper_await_cancellable(ctx, _helper_task_parse_node_logic(
+            intent_result=intent_result,
+            model_name=state["model_name"],
+            timeout=_helper_budget_timeout(ctx, TASK_PARSE_LLM_TIMEOUT_SECONDS),
+        ))
+        _helper_node_logger(ctx, "task_parse", node_input, parse_result, "success", None)
+        _helper_emit_step_event(ctx, "task_parse", "end", None)
+        return {**state, "parse_result": parse_result}
+    except Exception as exc:
+        _helper_node_logger(ctx, "task_parse", node_input, None, "failed", str(exc))
+        _helper_emit_step_event(ctx, "task_parse", "error", str(exc))
+        raise
+
+
+async def _helper_sql_generation_node(state: UnifiedChatGraphState, config: RunnableConfig) -> UnifiedChatGraphState:
+    """作用：图中的 SQL 生成节点。
+    
+    输入参数：
+    - state: UnifiedChatGraphState。
+    - config: RunnableConfig，携带本次请求的 ChatWorkflowContext。
+    
+    输出参数：
+    - 返回值类型: UnifiedChatGraphState。
+    """
+    ctx = _helper_get_context(config)
+
+    parse_result = state.get("parse_result") or {}
+    hidden_context_result = state.get("hidden_context_result")
+    rewritten_query = str((state.get("intent_result") or {}).get("rewritten_query", state["message"])).strip()
+    sql_generation_model_name = settings.llm_model_sql_generation or state["model_name"]
+    node_input = {
+        "rewritten_query": rewritten_query,
+        "parse_result": parse_result,
+        "hidden_context_result": hidden_context_result,
+        "model_name": sql_generation_model_name,
+    }
+    _helper_emit_step_event(ctx, "sql_generation", "start", None)
+    started_at = time.perf_counter()
+    try:
+        sql_result = await _helper_await_cancellable(ctx, _helper_sql_generation_node_logic(
+            rewritten_query=rewritten_query,
+            parse_result=parse_result,
+            hidden_context_result=hidden_context_result,
+            model_name=sql_generation_model_name,
+            timeout=_helper_budget_timeout(ctx, SQL_GENERATION_LLM_TIMEOUT_SECONDS),
+        ))
+        record_llm_generation_latency((time.perf_counter() - started_at) * 1000)
+        _helper_node_logger(ctx, "sql_generation", node_input, sql_result, "success", None)
+        sql_preview = str(sql_result.get("sql") or "").strip()
+        step_payload = {"sql": sql_preview} if sql_preview else None
+        _helper_emit_step_event(ctx, "sql_generation", "end", None, step_payload)
+        return {**state, "sql_result": sql_result}
+    except WorkflowCancelledError as exc:
+        _helper_node_logger(ctx, "sql_generation", node_input, None, "cancelled", str(exc))
+        _helper_emit_step_event(ctx, "sql_generation", "error", str(exc))
+        raise
+    except Exception as exc:
+        error_text = str(exc)
+        fallback_sql_result = {
+            "sql": "",
+            "entity_mappings": [],
+            "sql_fields": [],
+            "generation_failed": True,
+            "generation_error": error_text,
+            "failed_sql": getattr(exc, "sql", ""),
+        }
+        fallback_validate_result = {
+            "is_valid": False,
             "error": error_text,
-            "failed_sql": failed_sql,
-            "rewritten_query": rewritten_query,
-            "field_candidates": field_candidates,
-            "probe_samples": probe_samples,
-            "value_candidates": value_candidates,
-            "hints": hints,
-            "kb_summary": {
-                "table_count": len(schema_hints),
-                "field_count": len(field_whitelist),
-            },
+            "rows": 0,
+            "result": [],
+            "executed_sql": "",
+            "empty_result": False,
+            "zero_metric_result": False,
+        }
+        _helper_node_logger(ctx, "sql_generation", node_input, fallback_sql_result, "failed", error_text)
+        # SQL 生成失败不再中断工作流，交由 hidden_context 继续修复。
+        _helper_emit_step_event(ctx, "sql_generation", "end", None)
+        return {
+            **state,
+            "sql_result": fallback_sql_result,
+            "sql_validate_result": fallback_validate_result,
         }
-        print("隐藏上下文探索节点输出:")
-        print(json.dumps(hc_result, indent=2, ensure_ascii=False, default=str))
-        return hc_result
-
-    def _helper_insert_workflow_log(
-            session_id: str,
-            step_name: str,
-            input_json: dict[str, Any],
-            output_json: dict[str, Any] | None,
-            status: str,
-            error_message: str | None,
-    ) -> None:
-        """作用：插入工作流日志。
-        
-        输入参数：
-        - session_id: str。
-        - step_name: str。
-        - input_json: dict[str, Any]。
-        - output_json: dict[str, Any] | None。
-        - status: str。
-        - error_message: str | None。
-        
-        输出参数：
-        - 返回值类型: None。
-        """
 
-        db.add(
-            WorkflowLog(
-                session_id=session_id,
-                step_name=step_name,
-                input_json=_helper_to_json_safe(input_json),
-                output_json=_helper_to_json_safe(output_json),
-                status=status,
-                error_message=error_message,
-                risk_level="low",
-                created_by=admin_id,
-                updated_by=admin_id,
-                is_deleted=False,
-            )
+
+async def _helper_sql_validate_node(state: UnifiedChatGraphState, config: RunnableConfig) -> UnifiedChatGraphState:
+    """作用：图中的 SQL 验证节点。
+    
+    输入参数：
+    - state: UnifiedChatGraphState。
+    - config: RunnableConfig，携带本次请求的 ChatWorkflowContext。
+    
+    输出参数：
+    - 返回值类型: UnifiedChatGraphState。
+    """
+    ctx = _helper_get_context(config)
+
+    node_input = {"sql_result": state.get("sql_result")}
+    _helper_emit_step_event(ctx, "sql_validate", "start", None)
+    try:
+        validate_result = await _helper_run_db_step(
+            ctx,
+            _helper_sql_validate_node_logic,
+            db=ctx.db,
+            sql_result=state.get("sql_result"),
+            operation=(state.get("parse_result") or {}).get("operation"),
+            result_file_prefix=f"admin_{ctx.admin_id}_session_{ctx.session_id}",
+            max_execution_ms=_helper_budget_execution_ms(ctx),
         )
+        status = "success" if validate_result.get("is_valid") else "failed"
+        _helper_node_logger(ctx, "sql_validate", node_input, validate_result, status, validate_result.get("error"))
+        if (
+                (state.get("sql_result") or {}).get("repaired")
+                and validate_result.get("is_valid")
+                and not validate_result.get("empty_result")
+                and not validate_result.get("zero_metric_result")
+        ):
+            record_repair_verified()
+        step_payload: dict[str, Any] = {}
+        if validate_result.get("result_cache"):
+            step_payload["result_cache"] = validate_result["result_cache"]
+        guard_status = (validate_result.get("guard") or {}).get("status")
+        if guard_status and guard_status != "ok":
+            step_payload["guard"] = guard_status
+        _helper_emit_step_event(ctx, "sql_validate", "end", None, step_payload or None)
+        cache_state = state.get("query_cache") or {}
+        if cache_state.get("status") == "hit" and (
+                (not validate_result.get("is_valid"))
+                or validate_result.get("empty_result")
+                or validate_result.get("zero_metric_result")
+        ):
+            # 缓存 SQL 已不再给出有效结果：失效后回到完整流程重新解析与生成。
+            await _helper_run_db_step(ctx, invalidate_query_cache, ctx.db, cache_state["key"])
+            return {
+                **state,
+                "parse_result": None,
+                "sql_result": None,
+                "sql_validate_result": None,
+                "query_cache": {"key": cache_state["key"], "status": "stale"},
+            }
+        return {**state, "sql_validate_result": validate_result}
+    except Exception as exc:
+        _helper_emit_step_event(ctx, "sql_validate", "error", str(exc))
+        raise
 
-    def _helper_insert_chat_history(
-            session_id: str,
-            user_message: str,
-            assistant_message: str,
-            model_name: str,
-    ) -> None:
-        """作用：插入一轮用户与助手会话。
-        
-        输入参数：
-        - session_id: str。
-        - user_message: str。
-        - assistant_message: str。
-        - model_name: str。
-        
-        输出参数：
-        - 返回值类型: None。
-        """
 
-        db.add(
-            ChatHistory(
-                admin_id=admin_id,
-                session_id=session_id,
-                message_role="user",
-                message_content=user_message,
-                model_name=model_name,
-                created_by=admin_id,
-                updated_by=admin_id,
-                is_deleted=False,
+async def _helper_hidden_context_node(state: UnifiedChatGraphState, config: RunnableConfig) -> UnifiedChatGraphState:
+    """作用：图中的 隐藏上下文 探索节点。
+    
+    输入参数：
+    - state: UnifiedChatGraphState。
+    - config: RunnableConfig，携带本次请求的 ChatWorkflowContext。
+    
+    输出参数：
+    - 返回值类型: UnifiedChatGraphState。
+    """
+    ctx = _helper_get_context(config)
+
+    current_retry_count = int(state.get("hidden_context_retry_count") or 0)
+    rewritten_query = str((state.get("intent_result") or {}).get("rewritten_query", state["message"])).strip()
+    parse_result = state.get("parse_result")
+    sql_result = state.get("sql_result")
+    sql_validate_result = state.get("sql_validate_result")
+    node_input = {
+        "rewritten_query": rewritten_query,
+        "parse_result": parse_result,
+        "sql_result": sql_result,
+        "sql_validate_result": sql_validate_result,
+        "hidden_context_retry_count": current_retry_count,
+    }
+    _helper_emit_step_event(ctx, "hidden_context", "start", None)
+    try:
+        hidden_context_result = await _helper_run_db_step(
+            ctx,
+            _helper_hidden_context_node_logic,
+            db=ctx.db,
+            rewritten_query=rewritten_query,
+            parse_result=parse_result,
+            sql_result=sql_result,
+            sql_validate_result=sql_validate_result,
+        )
+        next_retry_count = current_retry_count + 1
+        hidden_context_result["retry_count"] = next_retry_count
+        _helper_node_logger(ctx, "hidden_context", node_input, hidden_context_result, "success", None)
+        _helper_record_step_log(
+            ctx=ctx,
+            step_name="hidden_context",
+            input_json=node_input,
+            output_json=hidden_context_result,
+            status="success",
+            error_message=None,
+        )
+        _helper_emit_step_event(ctx, "hidden_context", "end", None)
+        return {
+            **state,
+            "hidden_context_result": hidden_context_result,
+            "hidden_context_retry_count": next_retry_count,
+        }
+    except Exception as exc:
+        _helper_node_logger(ctx, "hidden_context", node_input, None, "failed", str(exc))
+        _helper_record_step_log(
+            ctx=ctx,
+            step_name="hidden_context",
+            input_json=node_input,
+            output_json=None,
+            status="failed",
+            error_message=str(exc),
+        )
+        _helper_emit_step_event(ctx, "hidden_context", "error", str(exc))
+        raise
+
+
+async def _helper_sql_repair_node(state: UnifiedChatGraphState, config: RunnableConfig) -> UnifiedChatGraphState:
+    """作用：图中的确定性 SQL 修复节点；改写成功时以新 SQL 直接进入校验，失败时交由大模型重新生成。
+
+    输入参数：
+    - state: UnifiedChatGraphState。
+    - config: RunnableConfig，携带本次请求的 ChatWorkflowContext。
+
+    输出参数：
+    - 返回值类型: UnifiedChatGraphState。
+    """
+    ctx = _helper_get_context(config)
+
+    sql_result = state.get("sql_result") or {}
+    previous_repair = state.get("sql_repair_result") or {}
+    node_input = {
+        "sql_result": sql_result,
+        "hidden_context_result": state.get("hidden_context_result"),
+    }
+    if not settings.sql_repair_enabled:
+        return {**state, "sql_repair_result": {"repaired": False, "detail": "确定性修复未启用"}}
+    _helper_emit_step_event(ctx, "sql_repair", "start", None)
+    try:
+        repair_result = _helper_sql_repair_node_logic(
+            sql_result=sql_result,
+            hidden_context_result=state.get("hidden_context_result"),
+            attempted_fingerprints=list(previous_repair.get("attempted_fingerprints") or []),
+        )
+    except Exception as exc:
+        _helper_node_logger(ctx, "sql_repair", node_input, None, "failed", str(exc))
+        _helper_emit_step_event(ctx, "sql_repair", "error", str(exc))
+        raise
+    status = "success" if repair_result["repaired"] else "skipped"
+    _helper_node_logger(ctx, "sql_repair", node_input, repair_result, status, repair_result.get("detail"))
+    _helper_record_step_log(
+        ctx=ctx,
+        step_name="sql_repair",
+        input_json=node_input,
+        output_json=repair_result,
+        status=status,
+        error_message=None,
+    )
+    step_payload = {"repaired": repair_result["repaired"], "rules": repair_result["rules"]}
+    if repair_result["repaired"]:
+        step_payload["sql"] = repair_result["sql"]
+    _helper_emit_step_event(ctx, "sql_repair", "end", None, step_payload)
+    if not repair_result["repaired"]:
+        return {**state, "sql_repair_result": repair_result}
+    repaired_sql_result = {
+        "sql": repair_result["sql"],
+        "entity_mappings": sql_result.get("entity_mappings") or [],
+        "sql_fields": repair_result["sql_fields"],
+        "applied_field_replacements": [],
+        "repaired": True,
+        "repair_actions": repair_result["actions"],
+    }
+    return {
+        **state,
+        "sql_result": repaired_sql_result,
+        "sql_validate_result": None,
+        "sql_repair_result": repair_result,
+    }
+
+
+async def _helper_result_return_node_logic(
+        ctx: ChatWorkflowContext,
+        message: str,
+        intent_result: dict[str, Any] | None,
+        parse_result: dict[str, Any] | None,
+        sql_result: dict[str, Any] | None,
+        sql_validate_result: dict[str, Any] | None,
+        hidden_context_result: dict[str, Any] | None,
+        hidden_context_retry_count: int,
+        model_name: str,
+) -> dict[str, Any]:
+    """作用：收敛整条图执行结果，判定最终状态并生成面向用户的总结描述。
+    
+    输入参数：
+    - ctx: ChatWorkflowContext。
+    - message: str。
+    - intent_result: dict[str, Any] | None。
+    - parse_result: dict[str, Any] | None。
+    - sql_result: dict[str, Any] | None。
+    - sql_validate_result: dict[str, Any] | None。
+    - hidden_context_result: dict[str, Any] | None。
+    - hidden_context_retry_count: int。
+    - model_name: str。
+    
+    输出参数：
+    - 返回值类型: dict[str, Any]。
+    """
+    intent_payload = intent_result or {}
+    intent = str(intent_payload.get("intent", "chat")).strip().lower()
+    is_followup = bool(intent_payload.get("is_followup", False))
+    merged_query = str(intent_payload.get("merged_query", message)).strip()
+    rewritten_query = str(intent_payload.get("rewritten_query", message)).strip()
+    skipped = parse_result is None
+    operation = str((parse_result or {}).get("operation") or "").strip().lower()
+    deduplicated_row_count = 0
+    field_display_hints: dict[str, str] = {}
+
+    def _helper_pick_display_label(
+            field_name: str,
+            field_description: str,
+            aliases: list[Any],
+    ) -> str:
+        for alias in aliases:
+            alias_text = str(alias).strip()
+            if not alias_text:
+                continue
+            if "." in alias_text:
+                continue
+            if re.search(r"[\u4e00-\u9fff]", alias_text):
+                return alias_text
+
+        desc_text = str(field_description).strip()
+        if desc_text:
+            label = re.split(r"[，。；（(]", desc_text, maxsplit=1)[0].strip()
+            if label:
+                return label
+
+        if "." in field_name:
+            return field_name.split(".", 1)[1]
+        return field_name
+
+    def _helper_build_field_display_hints(
+            rows: list[Any],
+            column_hints: list[dict[str, Any]],
+    ) -> dict[str, str]:
+        exact_labels: dict[str, str] = {}
+        suffix_labels: dict[str, str] = {}
+        suffix_conflicts: set[str] = set()
+
+        for item in column_hints:
+            if not isinstance(item, dict):
+                continue
+            field = str(item.get("field", "")).strip()
+            if not field:
+                continue
+            aliases_raw = item.get("aliases")
+            aliases = aliases_raw if isinstance(aliases_raw, list) else []
+            label = _helper_pick_display_label(
+                field_name=field,
+                field_description=str(item.get("field_description", "")).strip(),
+                aliases=aliases,
             )
+            if not label:
+                continue
+            exact_labels[field] = label
+            suffix = field.split(".", 1)[1] if "." in field else field
+            if suffix not in suffix_labels:
+                suffix_labels[suffix] = label
+            elif suffix_labels[suffix] != label:
+                suffix_conflicts.add(suffix)
+
+        for suffix in suffix_conflicts:
+            suffix_labels.pop(suffix, None)
+
+        hints: dict[str, str] = {}
+        seen_fields: set[str] = set()
+        for row in rows:
+            if not isinstance(row, dict):
+                continue
+            for field_name in row.keys():
+                name = str(field_name).strip()
+                if not name or name in seen_fields:
+                    continue
+                seen_fields.add(name)
+                display = exact_labels.get(name)
+                if (not display) and ("." in name):
+                    display = exact_labels.get(name.split(".", 1)[1])
+                if not display:
+                    suffix = name.split(".", 1)[1] if "." in name else name
+                    display = suffix_labels.get(suffix)
+                if not display:
+                    display = name
+                hints[name] = display
+        return hints
+
+    def _helper_should_deduplicate_student_rows(rows: list[Any]) -> bool:
+        """作用：仅在“学生名单”口径下启用去重，避免误伤成绩/考勤等明细查询。"""
+        dict_rows = [row for row in rows if isinstance(row, dict)]
+        if not dict_rows:
+            return False
+        sampled_keys: set[str] = set()
+        for row in dict_rows[:20]:
+            sampled_keys.update(str(key).strip() for key in row.keys())
+        if "student_no" not in sampled_keys:
+            return False
+
+        # 若结果包含这些明细粒度字段，说明同一学生多行是业务事实，不能按学生去重。
+        detail_indicators = {
+            "course_code",
+            "course_name",
+            "course_id",
+            "course_class_id",
+            "score_value",
+            "score_level",
+            "attend_date",
+            "term",
+            "enroll_time",
+        }
+        return len(sampled_keys & detail_indicators) == 0
+
+    # Guardrail: de-duplicate list-style rows to avoid one student appearing many times due to joins.
+    if isinstance(sql_validate_result, dict):
+        payload_rows = sql_validate_result.get("result")
+        should_deduplicate = (
+            isinstance(payload_rows, list)
+            and bool(payload_rows)
+            and operation in {"detail", "ranking"}
+            and _helper_should_deduplicate_student_rows(payload_rows)
         )
-        db.add(
-            ChatHistory(
-                admin_id=admin_id,
-                session_id=session_id,
-                message_role="assistant",
-                message_content=assistant_message,
+        if should_deduplicate:
+            unique_rows: list[Any] = []
+            seen_keys: set[str] = set()
+            seen_indexes: dict[str, int] = {}
+            for row in payload_rows:
+                if isinstance(row, dict) and row.get("student_no") is not None:
+                    row_key = (
+                        f"student::{str(row.get('student_no', ''))}::"
+                        f"{str(row.get('real_name', ''))}"
+                    )
+                else:
+                    try:
+                        row_key = f"row::{json.dumps(row, ensure_ascii=False, sort_keys=True, default=str)}"
+                    except Exception:
+                        row_key = f"row::{str(row)}"
+                if row_key in seen_keys:
+                    row_index = seen_indexes.get(row_key)
+                    if (
+                            row_index is not None
+                            and isinstance(row, dict)
+                            and isinstance(unique_rows[row_index], dict)
+                    ):
+                        incoming_reason = str(row.get("reason") or "").strip()
+                        if incoming_reason:
+                            existing_reason = str(unique_rows[row_index].get("reason") or "").strip()
+                            if incoming_reason not in existing_reason:
+                                if existing_reason:
+                                    unique_rows[row_index]["reason"] = f"{existing_reason}；{incoming_reason}"
+                                else:
+                                    unique_rows[row_index]["reason"] = incoming_reason
+                    continue
+                seen_keys.add(row_key)
+                seen_indexes[row_key] = len(unique_rows)
+                unique_rows.append(row)
+            deduplicated_row_count = len(payload_rows) - len(unique_rows)
+            if deduplicated_row_count > 0:
+                normalized_validate = dict(sql_validate_result)
+                normalized_validate["result"] = unique_rows
+                # 结果已落盘时 result 仅为预览行，总行数按预览中去掉的重复行相应扣减。
+                normalized_validate["rows"] = int(sql_validate_result.get("rows") or len(payload_rows)) - deduplicated_row_count
+                normalized_validate["empty_result"] = len(unique_rows) == 0
+                sql_validate_result = normalized_validate
+
+    if isinstance(sql_validate_result, dict):
+        payload_rows = sql_validate_result.get("result")
+        if isinstance(payload_rows, list) and payload_rows:
+            column_hints = list(get_schema_kb().column_hints.values())
+            field_display_hints = _helper_build_field_display_hints(payload_rows, column_hints)
+
+    final_status = "failed"
+    reason_code: str | None = None
+    if intent == "chat":
+        final_status = "success"
+        reason_code = "intent_is_chat"
+    elif parse_result is None:
+        final_status = "failed"
+        reason_code = "task_parse_missing"
+    elif sql_validate_result is None:
+        final_status = "failed"
+        reason_code = "sql_validate_missing"
+    else:
+        is_valid = bool(sql_validate_result.get("is_valid"))
+        empty_result = bool(sql_validate_result.get("empty_result"))
+        zero_metric_result = bool(sql_validate_result.get("zero_metric_result"))
+        guard_status = str((sql_validate_result.get("guard") or {}).get("status") or "ok")
+        if is_valid and (not empty_result) and (not zero_metric_result):
+            final_status = "success"
+            reason_code = None
+            if guard_status == "truncated":
+                final_status = "partial_success"
+                reason_code = "result_truncated"
+        elif (not is_valid) and guard_status == "rejected":
+            final_status = "failed"
+            reason_code = "sql_cost_exceeded"
+        elif (not is_valid) and guard_status == "timeout":
+            final_status = "failed"
+            reason_code = "sql_timeout"
+        elif empty_result:
+            final_status = "partial_success"
+            reason_code = "empty_result_after_retry"
+        elif zero_metric_result:
+            final_status = "partial_success"
+            reason_code = "zero_metric_after_retry"
+        else:
+            final_status = "failed"
+            reason_code = "sql_invalid_after_retry"
+    if (
+            final_status == "failed"
+            and reason_code in {"sql_invalid_after_retry", "sql_validate_missing"}
+            and "retry" in ctx.deadline_skips
+    ):
+        reason_code = "deadline_exceeded"
+
+    summary = ""
+    try:
+        summary_user_prompt = build_result_summary_user_prompt(
+            user_query=message,
+            rewritten_query=rewritten_query,
+            final_status=final_status,
+            reason_code=reason_code,
+            task=parse_result if isinstance(parse_result, dict) else None,
+            sql_validate_result=sql_validate_result if isinstance(sql_validate_result, dict) else None,
+            hidden_context_retry_count=hidden_context_retry_count,
+            field_display_hints=field_display_hints,
+        )
+        # 总结可用全部剩余预算；预算耗尽时跳过，回退为模板总结加原始明细行。
+        summary_timeout = _helper_budget_timeout(ctx, RESULT_SUMMARY_LLM_TIMEOUT_SECONDS, reserve=0.0)
+        if ctx.on_summary_delta is not None:
+            # 流式模式：总结逐段推送给前端，最终结果仍以完整解析后的 summary 为准。
+            summary_data = await _helper_await_cancellable(ctx, _helper_call_llm_stream(
+                system_prompt=RESULT_SUMMARY_SYSTEM_PROMPT,
+                user_prompt=summary_user_prompt,
+                model_name=model_name,
+                timeout=summary_timeout,
+                field_name="summary",
+                on_field_delta=ctx.on_summary_delta,
+            ))
+        else:
+            summary_data = await _helper_await_cancellable(ctx, _helper_call_llm(
+                system_prompt=RESULT_SUMMARY_SYSTEM_PROMPT,
+                user_prompt=summary_user_prompt,
                 model_name=model_name,
-                created_by=admin_id,
-                updated_by=admin_id,
-                is_deleted=False,
-            )
-        )
-
-    def _helper_save_node_io_local(
-            session_id: str,
-            step_name: str,
-            node_input: dict[str, Any],
-            node_output: dict[str, Any] | None,
-            status: str,
-            error_message: str | None,
-    ) -> None:
-        """作用：保存节点输入输出到本地。
-        
-        输入参数：
-        - session_id: str。
-        - step_name: str。
-        - node_input: dict[str, Any]。
-        - node_output: dict[str, Any] | None。
-        - status: str。
-        - error_message: str | None。
-        
-        输出参数：
-        - 返回值类型: None。
-        """
+                timeout=summary_timeout,
+            ))
+        summary = str(summary_data.get("summary", "")).strip()
+    except DeadlineExceededError:
+        ctx.deadline_skips.append("summary")
+        summary = ""
+    except WorkflowCancelledError:
+        raise
+    except Exception:
+        summary = ""
 
-        root = Path(settings.node_io_log_dir)
-        step_dir = root / session_id / step_name
-        step_dir.mkdir(parents=True, exist_ok=True)
-        ts = datetime.now().strftime("%Y%m%d-%H-%M-%S-%f")
-        file_path = step_dir / f"{ts}-{status}.json"
-        payload_data = {
-            "session_id": session_id,
-            "admin_id": admin_id,
-            "step_name": step_name,
-            "status": status,
-            "error_message": error_message,
-            "timestamp": datetime.now().isoformat(timespec="seconds"),
-            "input": node_input,
-            "output": node_output,
-        }
-        file_path.write_text(
-            json.dumps(_helper_to_json_safe(payload_data), ensure_ascii=False, indent=2, default=str),
-            encoding="utf-8",
-        )
+    if not summary:
+        if final_status == "success":
+            if intent == "chat":
+                summary = "当前问题被识别为闲聊，已跳过数据查询流程。"
+            else:
+                rows = int((sql_validate_result or {}).get("rows") or 0)
+                summary = f"查询执行成功，已返回结果，共{rows}行。"
+        elif reason_code == "zero_metric_after_retry":
+            summary = "查询流程已完成，但统计指标结果为0，建议检查筛选条件或换用更明确的实体名称。"
+        elif reason_code == "empty_result_after_retry":
+            summary = "查询流程已完成，但未命中符合条件的数据，建议放宽筛选条件后重试。"
+        elif reason_code == "result_truncated":
+            rows = int((sql_validate_result or {}).get("rows") or 0)
+            summary = f"查询结果较多，已按上限截断，当前返回前{rows}行，建议增加筛选条件缩小范围。"
+        elif reason_code == "sql_cost_exceeded":
+            summary = "查询预估代价过高，已拒绝执行，请缩小时间范围或增加筛选条件后重试。"
+        elif reason_code == "sql_timeout":
+            summary = "查询执行超时，已被中断，请缩小时间范围或增加筛选条件后重试。"
+        elif reason_code == "sql_invalid_after_retry":
+            summary = "查询流程执行失败，SQL在重试后仍未通过校验，请调整问题描述后重试。"
+        elif reason_code == "deadline_exceeded":
+            summary = "查询未能在时限内完成，请简化问题或缩小查询范围后重试。"
+        elif reason_code == "task_parse_missing":
+            summary = "任务解析结果缺失，当前无法生成有效查询，请补充更明确的问题描述。"
+        elif reason_code == "sql_validate_missing":
+            summary = "SQL校验结果缺失，当前无法确认查询结果，请稍后重试。"
+        else:
+            summary = "查询未成功完成，请稍后重试。"
+    assistant_reply = summary
+    download_url: str | None = None
+    if intent == "business_query" and (final_status == "success" or reason_code == "result_truncated"):
+        result_rows: list[Any] = []
+        if isinstance(sql_validate_result, dict):
+            payload_rows = sql_validate_result.get("result")
+            if isinstance(payload_rows, list):
+                result_rows = payload_rows
+        if result_rows:
+            max_detail_rows = 10
+            total_rows = int((sql_validate_result or {}).get("rows") or len(result_rows))
+            result_file = str((sql_validate_result or {}).get("result_file") or "").strip()
+            detail_lines: list[str] = [summary, "", "详细信息："]
+            for index, row in enumerate(result_rows[:max_detail_rows], start=1):
+                if not isinstance(row, dict):
+                    detail_lines.append(f"{index}. {row}")
+                    continue
+                row_pairs: list[str] = []
+                for field_name, field_value in row.items():
+                    raw_name = str(field_name)
+                    display_name = field_display_hints.get(raw_name, raw_name)
+                    display_value = "无" if field_value is None else field_value
+                    row_pairs.append(f"{display_name}={display_value}")
+                detail_lines.append(f"{index}. {'；'.join(row_pairs)}")
+            if result_file:
+                # SQL 校验阶段已将完整结果流式落盘，直接作为下载文件，不再重复导出。
+                download_url = build_result_download_url(result_file)
+            elif total_rows > max_detail_rows:
+                try:
+                    export_dir = Path(settings.chat_export_dir)
+                    export_dir.mkdir(parents=True, exist_ok=True)
+                    export_name = build_result_file_name(f"admin_{ctx.admin_id}_session_{ctx.session_id}")
+                    export_path = export_dir / export_name
+                    normalized_rows: list[dict[str, Any]] = []
+                    for item in result_rows:
+                        if isinstance(item, dict):
+                            normalized_rows.append(item)
+                        else:
+                            normalized_rows.append({"value": item})
+                    fieldnames: list[str] = []
+                    seen_fields: set[str] = set()
+                    for row in normalized_rows:
+                        for key in row.keys():
+                            if key not in seen_fields:
+                                seen_fields.add(key)
+                                fieldnames.append(key)
+                    if not fieldnames:
+                        fieldnames = ["value"]
+                    with export_path.open("w", encoding="utf-8-sig", newline="") as fp:
+                        writer = csv.DictWriter(fp, fieldnames=fieldnames)
+                        writer.writeheader()
+                        for row in normalized_rows:
+                            writer.writerow({field: row.get(field, "") for field in fieldnames})
+                    download_url = build_result_download_url(export_name)
+                except Exception:
+                    download_url = None
+            if total_rows > max_detail_rows:
+                detail_lines.append(
+                    f"数据共 {total_rows} 行，当前仅展示前 {min(max_detail_rows, len(result_rows))} 行。"
+                )
+                if deduplicated_row_count > 0:
+                    detail_lines.append(f"已自动去重 {deduplicated_row_count} 条重复记录。")
+                if download_url:
+                    detail_lines.append(RESULT_DOWNLOAD_HINT)
+                    detail_lines.append(download_url)
+                else:
+                    detail_lines.append(RESULT_EXPORT_FAILED_HINT)
+            elif deduplicated_row_count > 0:
+                detail_lines.append(f"已自动去重 {deduplicated_row_count} 条重复记录。")
+            assistant_reply = "\n".join(detail_lines)
+    result = {
+        "session_id": ctx.session_id,
+        "intent": intent,
+        "is_followup": is_followup,
+        "merged_query": merged_query,
+        "rewritten_query": rewritten_query,
+        "skipped": skipped,
+        "reason": reason_code,
+        "final_status": final_status,
+        "reason_code": reason_code,
+        "summary": summary,
+        "assistant_reply": assistant_reply,
+        "download_url": download_url,
+        "task": parse_result,
+        "sql_result": sql_result,
+        "sql_validate_result": sql_validate_result,
+        "hidden_context_result": hidden_context_result,
+        "hidden_context_retry_count": hidden_context_retry_count,
+    }
+    log_node_output(logger, "result_return", result, ctx.session_id)
+    return result
 
-    def _helper_node_logger(
-            step_name: str,
-            node_input: dict[str, Any],
-            node_output: dict[str, Any] | None,
-            status: str,
-            error_message: str | None,
-    ) -> None:
-        """作用：节点日志包装。
-        
-        输入参数：
-        - step_name: str。
-        - node_input: dict[str, Any]。
-        - node_output: dict[str, Any] | None。
-        - status: str。
-        - error_message: str | None。
-        
-        输出参数：
-        - 返回值类型: None。
-        """
 
-        _helper_save_node_io_local(
-            session_id=session_id,
-            step_name=step_name,
-            node_input=node_input,
-            node_output=node_output,
-            status=status,
-            error_message=error_message,
+async def _helper_result_return_node(state: UnifiedChatGraphState, config: RunnableConfig) -> UnifiedChatGraphState:
+    """作用：图中的结果返回节点，负责调用结果收敛逻辑并写回状态。
+    
+    输入参数：
+    - state: UnifiedChatGraphState。
+    - config: RunnableConfig，携带本次请求的 ChatWorkflowContext。
+    
+    输出参数：
+    - 返回值类型: UnifiedChatGraphState。
+    """
+    ctx = _helper_get_context(config)
+    node_input = {
+        "message": state["message"],
+        "intent_result": state.get("intent_result"),
+        "parse_result": state.get("parse_result"),
+        "sql_result": state.get("sql_result"),
+        "sql_validate_result": state.get("sql_validate_result"),
+        "hidden_context_result": state.get("hidden_context_result"),
+        "hidden_context_retry_count": int(state.get("hidden_context_retry_count") or 0),
+    }
+    _helper_emit_step_event(ctx, "result_return", "start", None)
+    try:
+        result_return_result = await _helper_result_return_node_logic(
+            ctx=ctx,
+            message=state["message"],
+            intent_result=state.get("intent_result"),
+            parse_result=state.get("parse_result"),
+            sql_result=state.get("sql_result"),
+            sql_validate_result=state.get("sql_validate_result"),
+            hidden_context_result=state.get("hidden_context_result"),
+            hidden_context_retry_count=int(state.get("hidden_context_retry_count") or 0),
+            model_name=state["model_name"],
         )
+        _helper_node_logger(ctx, "result_return", node_input, result_return_result, "success", None)
+        _helper_emit_step_event(ctx, "result_return", "end", None)
+        return {**state, "result_return_result": result_return_result}
+    except Exception as exc:
+        _helper_node_logger(ctx, "result_return", node_input, None, "failed", str(exc))
+        _helper_emit_step_event(ctx, "result_return", "error", str(exc))
+        raise
 
-    def _helper_intent_node(state: UnifiedChatGraphState) -> UnifiedChatGraphState:
-        """作用：图中的意图识别节点。
-        
-        输入参数：
-        - state: UnifiedChatGraphState。
-        
-        输出参数：
-        - 返回值类型: UnifiedChatGraphState。
-        """
-
-        node_input = {
-            "message": state["message"],
-            "history_user_messages": state["history_user_messages"],
-            "threshold": state["threshold"],
-            "model_name": state["model_name"],
-        }
-        _helper_emit_step_event("intent_recognition", "start", None)
-        try:
-            intent_result = _helper_intent_node_logic(
-                message=state["message"],
-                history_user_messages=state["history_user_messages"],
-                threshold=state["threshold"],
-                model_name=state["model_name"],
-            )
-            _helper_node_logger("intent_recognition", node_input, intent_result, "success", None)
-            _helper_emit_step_event("intent_recognition", "end", None)
-            return {**state, "intent_result": intent_result}
-        except Exception as exc:
-            _helper_node_logger("intent_recognition", node_input, None, "failed", str(exc))
-            _helper_emit_step_event("intent_recognition", "error", str(exc))
-            raise
 
-    def _helper_task_parse_node(state: UnifiedChatGraphState) -> UnifiedChatGraphState:
-        """作用：图中的任务解析节点。
-        
-        输入参数：
-        - state: UnifiedChatGraphState。
-        
-        输出参数：
-        - 返回值类型: UnifiedChatGraphState。
-        """
+def _helper_build_graph(workflow_mode: str | None = None):
+    """作用：构建统一工作流图。
 
-        intent_result = state.get("intent_result") or {}
-        node_input = {"intent_result": intent_result}
-        _helper_emit_step_event("task_parse", "start", None)
-        try:
-            parse_result = _helper_task_parse_node_logic(intent_result=intent_result, model_name=state["model_name"])
-            _helper_node_logger("task_parse", node_input, parse_result, "success", None)
-            _helper_emit_step_event("task_parse", "end", None)
-            return {**state, "parse_result": parse_result}
-        except Exception as exc:
-            _helper_node_logger("task_parse", node_input, None, "failed", str(exc))
-            _helper_emit_step_event("task_parse", "error", str(exc))
-            raise
+    two_call 模式下意图识别与任务解析为两次独立调用；single_call 模式下意图节点一次调用同时产出
+    任务解析结果并直接进入 SQL 生成，任务部分不合法时回退到任务解析节点；speculative 模式下任务解析
+    与意图识别并行推测执行，推测结果不可用时同样回退到任务解析节点。
+    
+    输入参数：
+    - workflow_mode: str | None，two_call/single_call/speculative，默认取配置 CHAT_WORKFLOW_MODE。
+    
+    输出参数：
+    - 返回值类型: Any。
+    """
+    workflow_mode = workflow_mode or settings.chat_workflow_mode
 
-    def _helper_sql_generation_node(state: UnifiedChatGraphState) -> UnifiedChatGraphState:
-        """作用：图中的 SQL 生成节点。
+    def _helper_route_after_intent(state: UnifiedChatGraphState) -> str:
+        """作用：意图识别后的路由决策，业务查询进入任务解析，闲聊直接返回结果节点。
         
         输入参数：
         - state: UnifiedChatGraphState。
         
         输出参数：
-        - 返回值类型: UnifiedChatGraphState。
+        - 返回值类型: str。
         """
+        intent_result = state.get("intent_result") or {}
+        intent = str(intent_result.get("intent", "chat")).strip().lower()
+        if intent == "business_query":
+            if (state.get("query_cache") or {}).get("status") == "hit":
+                return "sql_validate"
+            if state.get("parse_result") is not None:
+                return "sql_generation"
+            return "task_parse"
+        return "result_return"
+
+    def _helper_route_after_sql_generation(state: UnifiedChatGraphState, config: RunnableConfig) -> str:
+        """作用：SQL 生成后的路由决策，生成失败时优先进入隐藏上下文重试（剩余预算不足时直接返回结果）。"""
+        intent = str((state.get("intent_result") or {}).get("intent", "chat")).strip().lower()
+        retry_count = int(state.get("hidden_context_retry_count") or 0)
+        sql_result = state.get("sql_result") or {}
+        generation_failed = bool(sql_result.get("generation_failed"))
+
+        if intent != "business_query":
+            return "result_return"
+        if (not generation_failed):
+            return "sql_validate"
+        if retry_count >= HIDDEN_CONTEXT_MAX_RETRY:
+            return "result_return"
+        if not _helper_budget_allows_retry(_helper_get_context(config)):
+            return "result_return"
+        return "hidden_context"
 
-        parse_result = state.get("parse_result") or {}
-        hidden_context_result = state.get("hidden_context_result")
-        rewritten_query = str((state.get("intent_result") or {}).get("rewritten_query", state["message"])).strip()
-        sql_generation_model_name = settings.llm_model_sql_generation or state["model_name"]
-        node_input = {
-            "rewritten_query": rewritten_query,
-            "parse_result": parse_result,
-            "hidden_context_result": hidden_context_result,
-            "model_name": sql_generation_model_name,
-        }
-        _helper_emit_step_event("sql_generation", "start", None)
-        try:
-            sql_result = _helper_sql_generation_node_logic(
-                rewritten_query=rewritten_query,
-                parse_result=parse_result,
-                hidden_context_result=hidden_context_result,
-                model_name=sql_generation_model_name,
-            )
-            _helper_node_logger("sql_generation", node_input, sql_result, "success", None)
-            sql_preview = str(sql_result.get("sql") or "").strip()
-            step_payload = {"sql": sql_preview} if sql_preview else None
-            _helper_emit_step_event("sql_generation", "end", None, step_payload)
-            return {**state, "sql_result": sql_result}
-        except Exception as exc:
-            error_text = str(exc)
-            fallback_sql_result = {
-                "sql": "",
-                "entity_mappings": [],
-                "sql_fields": [],
-                "generation_failed": True,
-                "generation_error": error_text,
-            }
-            fallback_validate_result = {
-                "is_valid": False,
-                "error": error_text,
-                "rows": 0,
-                "result": [],
-                "executed_sql": "",
-                "empty_result": False,
-                "zero_metric_result": False,
-            }
-            _helper_node_logger("sql_generation", node_input, fallback_sql_result, "failed", error_text)
-            # SQL 生成失败不再中断工作流，交由 hidden_context 继续修复。
-            _helper_emit_step_event("sql_generation", "end", None)
-            return {
-                **state,
-                "sql_result": fallback_sql_result,
-                "sql_validate_result": fallback_validate_result,
-            }
+    def _helper_route_after_sql_validate(state: UnifiedChatGraphState, config: RunnableConfig) -> str:
+        """作用：SQL 校验后的路由决策，失败/空结果/零指标时进入隐藏上下文重试，否则直接返回结果节点。
 
-    def _helper_sql_validate_node(state: UnifiedChatGraphState) -> UnifiedChatGraphState:
-        """作用：图中的 SQL 验证节点。
+        剩余预算不足 CHAT_DEADLINE_MIN_RETRY_SECONDS 时不再重试，直接返回结果节点。
         
         输入参数：
         - state: UnifiedChatGraphState。
+        - config: RunnableConfig，携带本次请求的 ChatWorkflowContext。
         
         输出参数：
-        - 返回值类型: UnifiedChatGraphState。
+        - 返回值类型: str。
         """
+        intent = str((state.get("intent_result") or {}).get("intent", "chat")).strip().lower()
+        validate_result = state.get("sql_validate_result") or {}
+        retry_count = int(state.get("hidden_context_retry_count") or 0)
 
-        node_input = {"sql_result": state.get("sql_result")}
-        _helper_emit_step_event("sql_validate", "start", None)
-        try:
-            validate_result = _helper_sql_validate_node_logic(sql_result=state.get("sql_result"))
-            status = "success" if validate_result.get("is_valid") else "failed"
-            _helper_node_logger("sql_validate", node_input, validate_result, status, validate_result.get("error"))
-            _helper_emit_step_event("sql_validate", "end", None)
-            return {**state, "sql_validate_result": validate_result}
-        except Exception as exc:
-            _helper_emit_step_event("sql_validate", "error", str(exc))
-            raise
+        if intent != "business_query":
+            return "result_return"
+        if (state.get("query_cache") or {}).get("status") == "stale" and state.get("sql_validate_result") is None:
+            # 缓存 SQL 刚被判定失效（校验结果已清空），回到任务解析走完整流程。
+            if not _helper_budget_allows_retry(_helper_get_context(config)):
+                return "result_return"
+            return "task_parse"
+        if retry_count >= HIDDEN_CONTEXT_MAX_RETRY:
+            return "result_return"
+
+        is_valid = bool(validate_result.get("is_valid"))
+        empty_result = bool(validate_result.get("empty_result"))
+        zero_metric_result = bool(validate_result.get("zero_metric_result"))
+        if (not is_valid) or empty_result or zero_metric_result:
+            if not _helper_budget_allows_retry(_helper_get_context(config)):
+                return "result_return"
+            return "hidden_context"
+        return "result_return"
 
-    def _helper_hidden_context_node(state: UnifiedChatGraphState) -> UnifiedChatGraphState:
-        """作用：图中的 隐藏上下文 探索节点。
+    def _helper_route_after_hidden_context(state: UnifiedChatGraphState) -> str:
+        """作用：隐藏上下文节点后的路由决策，未超重试上限则先尝试确定性修复，超限则返回结果节点。
         
         输入参数：
         - state: UnifiedChatGraphState。
         
         输出参数：
-        - 返回值类型: UnifiedChatGraphState。
+        - 返回值类型: str。
         """
+        retry_count = int(state.get("hidden_context_retry_count") or 0)
+        if retry_count > HIDDEN_CONTEXT_MAX_RETRY:
+            return "result_return"
+        return "sql_repair"
 
-        current_retry_count = int(state.get("hidden_context_retry_count") or 0)
-        rewritten_query = str((state.get("intent_result") or {}).get("rewritten_query", state["message"])).strip()
-        parse_result = state.get("parse_result")
-        sql_result = state.get("sql_result")
-        sql_validate_result = state.get("sql_validate_result")
-        node_input = {
-            "rewritten_query": rewritten_query,
-            "parse_result": parse_result,
-            "sql_result": sql_result,
-            "sql_validate_result": sql_validate_result,
-            "hidden_context_retry_count": current_retry_count,
-        }
-        _helper_emit_step_event("hidden_context", "start", None)
-        try:
-            hidden_context_result = _helper_hidden_context_node_logic(
-                rewritten_query=rewritten_query,
-                parse_result=parse_result,
-                sql_result=sql_result,
-                sql_validate_result=sql_validate_result,
-            )
-            next_retry_count = current_retry_count + 1
-            hidden_context_result["retry_count"] = next_retry_count
-            _helper_node_logger("hidden_context", node_input, hidden_context_result, "success", None)
-            _helper_insert_workflow_log(
-                session_id=session_id,
-                step_name="hidden_context",
-                input_json=node_input,
-                output_json=hidden_context_result,
-                status="success",
-                error_message=None,
-            )
-            _helper_emit_step_event("hidden_context", "end", None)
-            return {
-                **state,
-                "hidden_context_result": hidden_context_result,
-                "hidden_context_retry_count": next_retry_count,
-            }
-        except Exception as exc:
-            _helper_node_logger("hidden_context", node_input, None, "failed", str(exc))
-            _helper_insert_workflow_log(
-                session_id=session_id,
-                step_name="hidden_context",
-                input_json=node_input,
-                output_json=None,
-                status="failed",
-                error_message=str(exc),
-            )
-            _helper_emit_step_event("hidden_context", "error", str(exc))
-            raise
-
-    def _helper_result_return_node_logic(
-            message: str,
-            intent_result: dict[str, Any] | None,
-            parse_result: dict[str, Any] | None,
-            sql_result: dict[str, Any] | None,
-            sql_validate_result: dict[str, Any] | None,
-            hidden_context_result: dict[str, Any] | None,
-            hidden_context_retry_count: int,
-            model_name: str,
-    ) -> dict[str, Any]:
-        """作用：收敛整条图执行结果，判定最终状态并生成面向用户的总结描述。
-        
-        输入参数：
-        - message: str。
-        - intent_result: dict[str, Any] | None。
-        - parse_result: dict[str, Any] | None。
-        - sql_result: dict[str, Any] | None。
-        - sql_validate_result: dict[str, Any] | None。
-        - hidden_context_result: dict[str, Any] | None。
-        - hidden_context_retry_count: int。
-        - model_name: str。
-        
-        输出参数：
-        - 返回值类型: dict[str, Any]。
-        """
-        intent_payload = intent_result or {}
-        intent = str(intent_payload.get("intent", "chat")).strip().lower()
-        is_followup = bool(intent_payload.get("is_followup", False))
-        merged_query = str(intent_payload.get("merged_query", message)).strip()
-        rewritten_query = str(intent_payload.get("rewritten_query", message)).strip()
-        skipped = parse_result is None
-        operation = str((parse_result or {}).get("operation") or "").strip().lower()
-        deduplicated_row_count = 0
-        field_display_hints: dict[str, str] = {}
-
-        def _helper_pick_display_label(
-                field_name: str,
-                field_description: str,
-                aliases: list[Any],
-        ) -> str:
-            for alias in aliases:
-                alias_text = str(alias).strip()
-                if not alias_text:
-                    continue
-                if "." in alias_text:
-                    continue
-                if re.search(r"[\u4e00-\u9fff]", alias_text):
-                    return alias_text
-
-            desc_text = str(field_description).strip()
-            if desc_text:
-                label = re.split(r"[，。；（(]", desc_text, maxsplit=1)[0].strip()
-                if label:
-                    return label
-
-            if "." in field_name:
-                return field_name.split(".", 1)[1]
-            return field_name
-
-        def _helper_build_field_display_hints(
-                rows: list[Any],
-                schema_hints: list[dict[str, Any]],
-        ) -> dict[str, str]:
-            exact_labels: dict[str, str] = {}
-            suffix_labels: dict[str, str] = {}
-            suffix_conflicts: set[str] = set()
-
-            for item in schema_hints:
-                if not isinstance(item, dict):
-                    continue
-                field = str(item.get("field", "")).strip()
-                if not field:
-                    continue
-                aliases_raw = item.get("aliases")
-                aliases = aliases_raw if isinstance(aliases_raw, list) else []
-                label = _helper_pick_display_label(
-                    field_name=field,
-                    field_description=str(item.get("field_description", "")).strip(),
-                    aliases=aliases,
-                )
-                if not label:
-                    continue
-                exact_labels[field] = label
-                suffix = field.split(".", 1)[1] if "." in field else field
-                if suffix not in suffix_labels:
-                    suffix_labels[suffix] = label
-                elif suffix_labels[suffix] != label:
-                    suffix_conflicts.add(suffix)
-
-            for suffix in suffix_conflicts:
-                suffix_labels.pop(suffix, None)
-
-            hints: dict[str, str] = {}
-            seen_fields: set[str] = set()
-            for row in rows:
-                if not isinstance(row, dict):
-                    continue
-                for field_name in row.keys():
-                    name = str(field_name).strip()
-                    if not name or name in seen_fields:
-                        continue
-                    seen_fields.add(name)
-                    display = exact_labels.get(name)
-                    if (not display) and ("." in name):
-                        display = exact_labels.get(name.split(".", 1)[1])
-                    if not display:
-                        suffix = name.split(".", 1)[1] if "." in name else name
-                        display = suffix_labels.get(suffix)
-                    if not display:
-                        display = name
-                    hints[name] = display
-            return hints
-
-        def _helper_should_deduplicate_student_rows(rows: list[Any]) -> bool:
-            """作用：仅在“学生名单”口径下启用去重，避免误伤成绩/考勤等明细查询。"""
-            dict_rows = [row for row in rows if isinstance(row, dict)]
-            if not dict_rows:
-                return False
-            sampled_keys: set[str] = set()
-            for row in dict_rows[:20]:
-                sampled_keys.update(str(key).strip() for key in row.keys())
-            if "student_no" not in sampled_keys:
-                return False
-
-            # 若结果包含这些明细粒度字段，说明同一学生多行是业务事实，不能按学生去重。
-            detail_indicators = {
-                "course_code",
-                "course_name",
-                "course_id",
-                "course_class_id",
-                "score_value",
-                "score_level",
-                "attend_date",
-                "term",
-                "enroll_time",
-            }
-            return len(sampled_keys & detail_indicators) == 0
+    def _helper_route_after_sql_repair(state: UnifiedChatGraphState, config: RunnableConfig) -> str:
+        """作用：确定性修复后的路由决策，改写成功直接重新校验，否则回到大模型 SQL 生成（剩余预算不足时直接返回结果）。"""
+        if (state.get("sql_repair_result") or {}).get("repaired"):
+            return "sql_validate"
+        if not _helper_budget_allows_retry(_helper_get_context(config)):
+            return "result_return"
+        return "sql_generation"
+
+    graph = StateGraph(UnifiedChatGraphState)
+    if workflow_mode == "single_call":
+        graph.add_node("intent_recognition", _helper_intent_task_node)
+    elif workflow_mode == "speculative":
+        graph.add_node("intent_recognition", _helper_intent_speculative_node)
+    else:
+        graph.add_node("intent_recognition", _helper_intent_node)
+    graph.add_node("task_parse", _helper_task_parse_node)
+    graph.add_node("sql_generation", _helper_sql_generation_node)
+    graph.add_node("sql_validate", _helper_sql_validate_node)
+    graph.add_node("hidden_context", _helper_hidden_context_node)
+    graph.add_node("sql_repair", _helper_sql_repair_node)
+    graph.add_node("result_return", _helper_result_return_node)
+    graph.add_edge(START, "intent_recognition")
+    graph.add_conditional_edges(
+        "intent_recognition",
+        _helper_route_after_intent,
+        {
+            "task_parse": "task_parse",
+            "sql_generation": "sql_generation",
+            "sql_validate": "sql_validate",
+            "result_return": "result_return",
+        },
+    )
+    graph.add_edge("task_parse", "sql_generation")
+    graph.add_conditional_edges(
+        "sql_generation",
+        _helper_route_after_sql_generation,
+        {"sql_validate": "sql_validate", "hidden_context": "hidden_context", "result_return": "result_return"},
+    )
+    graph.add_conditional_edges(
+        "sql_validate",
+        _helper_route_after_sql_validate,
+        {"task_parse": "task_parse", "hidden_context": "hidden_context", "result_return": "result_return"},
+    )
+    graph.add_conditional_edges(
+        "hidden_context",
+        _helper_route_after_hidden_context,
+        {"sql_repair": "sql_repair", "result_return": "result_return"},
+    )
+    graph.add_conditional_edges(
+        "sql_repair",
+        _helper_route_after_sql_repair,
+        {"sql_validate": "sql_validate", "sql_generation": "sql_generation", "result_return": "result_return"},
+    )
+    graph.add_edge("result_return", END)
+    return graph.compile()
+
+
+_CHAT_GRAPH_LOCK = threading.Lock()
+_CHAT_GRAPH_APPS: dict[str, Any] = {}
+
+
+def get_chat_graph(workflow_mode: str | None = None) -> Any:
+    """作用：获取进程级共享的已编译工作流图（每种模式首次调用时构建并编译，之后复用）。
 
-        # Guardrail: de-duplicate list-style rows to avoid one student appearing many times due to joins.
-        if isinstance(sql_validate_result, dict):
-            payload_rows = sql_validate_result.get("result")
-            should_deduplicate = (
-                isinstance(payload_rows, list)
-                and bool(payload_rows)
-                and operation in {"detail", "ranking"}
-                and _helper_should_deduplicate_student_rows(payload_rows)
-            )
-            if should_deduplicate:
-                unique_rows: list[Any] = []
-                seen_keys: set[str] = set()
-                seen_indexes: dict[str, int] = {}
-                for row in payload_rows:
-                    if isinstance(row, dict) and row.get("student_no") is not None:
-                        row_key = (
-                            f"student::{str(row.get('student_no', ''))}::"
-                            f"{str(row.get('real_name', ''))}"
-                        )
-                    else:
-                        try:
-                            row_key = f"row::{json.dumps(row, ensure_ascii=False, sort_keys=True, default=str)}"
-                        except Exception:
-                            row_key = f"row::{str(row)}"
-                    if row_key in seen_keys:
-                        row_index = seen_indexes.get(row_key)
-                        if (
-                                row_index is not None
-                                and isinstance(row, dict)
-                                and isinstance(unique_rows[row_index], dict)
-                        ):
-                            incoming_reason = str(row.get("reason") or "").strip()
-                            if incoming_reason:
-                                existing_reason = str(unique_rows[row_index].get("reason") or "").strip()
-                                if incoming_reason not in existing_reason:
-                                    if existing_reason:
-                                        unique_rows[row_index]["reason"] = f"{existing_reason}；{incoming_reason}"
-                                    else:
-                                        unique_rows[row_index]["reason"] = incoming_reason
-                        continue
-                    seen_keys.add(row_key)
-                    seen_indexes[row_key] = len(unique_rows)
-                    unique_rows.append(row)
-                deduplicated_row_count = len(payload_rows) - len(unique_rows)
-                if deduplicated_row_count > 0:
-                    normalized_validate = dict(sql_validate_result)
-                    normalized_validate["result"] = unique_rows
-                    normalized_validate["rows"] = len(unique_rows)
-                    normalized_validate["empty_result"] = len(unique_rows) == 0
-                    sql_validate_result = normalized_validate
+    输入参数：
+    - workflow_mode: str | None，two_call/single_call/speculative，默认取配置 CHAT_WORKFLOW_MODE。
 
-        if isinstance(sql_validate_result, dict):
-            payload_rows = sql_validate_result.get("result")
-            if isinstance(payload_rows, list) and payload_rows:
-                _, _, schema_hints = _helper_build_kb_hints()
-                field_display_hints = _helper_build_field_display_hints(payload_rows, schema_hints)
+    输出参数：
+    - 返回值类型: Any（CompiledStateGraph）。
+    """
+    workflow_mode = workflow_mode or settings.chat_workflow_mode
+    graph_app = _CHAT_GRAPH_APPS.get(workflow_mode)
+    if graph_app is None:
+        with _CHAT_GRAPH_LOCK:
+            graph_app = _CHAT_GRAPH_APPS.get(workflow_mode)
+            if graph_app is None:
+                graph_app = _helper_build_graph(workflow_mode)
+                _CHAT_GRAPH_APPS[workflow_mode] = graph_app
+    return graph_app
+
+
+async def _helper_run_shared_graph(
+        flight: SharedFlight,
+        db: Session,
+        admin_id: int,
+        session_id: str,
+        graph_state: UnifiedChatGraphState,
+        stream_summary: bool,
+        deadline: float | None,
+) -> tuple[dict[str, Any], list[str]]:
+    """作用：执行一次可被相同请求共享的工作流图。
 
-        final_status = "failed"
-        reason_code: str | None = None
-        if intent == "chat":
-            final_status = "success"
-            reason_code = "intent_is_chat"
-        elif parse_result is None:
-            final_status = "failed"
-            reason_code = "task_parse_missing"
-        elif sql_validate_result is None:
-            final_status = "failed"
-            reason_code = "sql_validate_missing"
-        else:
-            is_valid = bool(sql_validate_result.get("is_valid"))
-            empty_result = bool(sql_validate_result.get("empty_result"))
-            zero_metric_result = bool(sql_validate_result.get("zero_metric_result"))
-            if is_valid and (not empty_result) and (not zero_metric_result):
-                final_status = "success"
-                reason_code = None
-            elif empty_result:
-                final_status = "partial_success"
-                reason_code = "empty_result_after_retry"
-            elif zero_metric_result:
-                final_status = "partial_success"
-                reason_code = "zero_metric_after_retry"
-            else:
-                final_status = "failed"
-                reason_code = "sql_invalid_after_retry"
+    以发起请求的管理员与会话身份执行（节点日志与结果文件按其命名），但使用独立的数据库会话与 flight 的取消令牌：
+    发起方断开或先行结束都不影响仍在等待的其他请求方。步骤事件与总结增量经 flight 转发给所有请求方。
 
-        summary = ""
-        try:
-            summary_data = _helper_call_llm(
-                system_prompt=RESULT_SUMMARY_SYSTEM_PROMPT,
-                user_prompt=build_result_summary_user_prompt(
-                    user_query=message,
-                    rewritten_query=rewritten_query,
-                    final_status=final_status,
-                    reason_code=reason_code,
-                    task=parse_result if isinstance(parse_result, dict) else None,
-                    sql_validate_result=sql_validate_result if isinstance(sql_validate_result, dict) else None,
-                    hidden_context_retry_count=hidden_context_retry_count,
-                    field_display_hints=field_display_hints,
-                ),
-                model_name=model_name,
-                timeout=12.0,
-            )
-            summary = str(summary_data.get("summary", "")).strip()
-        except Exception:
-            summary = ""
+    输入参数：
+    - flight: SharedFlight。
+    - db: Session，发起方的会话，仅用于取得同一数据库引擎。
+    - admin_id: int，发起方管理员 ID。
+    - session_id: str，发起方会话 ID。
+    - graph_state: UnifiedChatGraphState，初始图状态。
+    - stream_summary: bool，结果总结是否流式生成（发起方为流式接口时）。
+    - deadline: float | None，发起方的截止时刻（time.monotonic）。
 
-        if not summary:
-            if final_status == "success":
-                if intent == "chat":
-                    summary = "当前问题被识别为闲聊，已跳过数据查询流程。"
-                else:
-                    rows = int((sql_validate_result or {}).get("rows") or 0)
-                    summary = f"查询执行成功，已返回结果，共{rows}行。"
-            elif reason_code == "zero_metric_after_retry":
-                summary = "查询流程已完成，但统计指标结果为0，建议检查筛选条件或换用更明确的实体名称。"
-            elif reason_code == "empty_result_after_retry":
-                summary = "查询流程已完成，但未命中符合条件的数据，建议放宽筛选条件后重试。"
-            elif reason_code == "sql_invalid_after_retry":
-                summary = "查询流程执行失败，SQL在重试后仍未通过校验，请调整问题描述后重试。"
-            elif reason_code == "task_parse_missing":
-                summary = "任务解析结果缺失，当前无法生成有效查询，请补充更明确的问题描述。"
-            elif reason_code == "sql_validate_missing":
-                summary = "SQL校验结果缺失，当前无法确认查询结果，请稍后重试。"
-            else:
-                summary = "查询未成功完成，请稍后重试。"
-        assistant_reply = summary
-        download_url: str | None = None
-        if final_status == "success" and intent == "business_query":
-            result_rows: list[Any] = []
-            if isinstance(sql_validate_result, dict):
-                payload_rows = sql_validate_result.get("result")
-                if isinstance(payload_rows, list):
-                    result_rows = payload_rows
-            if result_rows:
-                max_detail_rows = 10
-                detail_lines: list[str] = [summary, "", "详细信息："]
-                for index, row in enumerate(result_rows[:max_detail_rows], start=1):
-                    if not isinstance(row, dict):
-                        detail_lines.append(f"{index}. {row}")
-                        continue
-                    row_pairs: list[str] = []
-                    for field_name, field_value in row.items():
-                        raw_name = str(field_name)
-                        display_name = field_display_hints.get(raw_name, raw_name)
-                        display_value = "无" if field_value is None else field_value
-                        row_pairs.append(f"{display_name}={display_value}")
-                    detail_lines.append(f"{index}. {'；'.join(row_pairs)}")
-                if len(result_rows) > max_detail_rows:
-                    try:
-                        export_dir = Path(settings.chat_export_dir)
-                        export_dir.mkdir(parents=True, exist_ok=True)
-                        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-                        export_name = f"admin_{admin_id}_session_{session_id}_{timestamp}_{uuid.uuid4().hex[:8]}.csv"
-                        export_path = export_dir / export_name
-                        normalized_rows: list[dict[str, Any]] = []
-                        for item in result_rows:
-                            if isinstance(item, dict):
-                                normalized_rows.append(item)
-                            else:
-                                normalized_rows.append({"value": item})
-                        fieldnames: list[str] = []
-                        seen_fields: set[str] = set()
-                        for row in normalized_rows:
-                            for key in row.keys():
-                                if key not in seen_fields:
-                                    seen_fields.add(key)
-                                    fieldnames.append(key)
-                        if not fieldnames:
-                            fieldnames = ["value"]
-                        with export_path.open("w", encoding="utf-8-sig", newline="") as fp:
-                            writer = csv.DictWriter(fp, fieldnames=fieldnames)
-                            writer.writeheader()
-                            for row in normalized_rows:
-                                writer.writerow({field: row.get(field, "") for field in fieldnames})
-                        download_url = f"/api/chat/downloads/{export_name}"
-                    except Exception:
-                        download_url = None
-                    detail_lines.append(
-                        f"数据共 {len(result_rows)} 行，当前仅展示前 {max_detail_rows} 行。"
-                    )
-                    if deduplicated_row_count > 0:
-                        detail_lines.append(f"已自动去重 {deduplicated_row_count} 条重复记录。")
-                    if download_url:
-                        detail_lines.append("数据量过多，请下载完整 CSV 查看：")
-                        detail_lines.append(download_url)
-                    else:
-                        detail_lines.append("数据量过多，CSV 导出失败，请稍后重试。")
-                elif deduplicated_row_count > 0:
-                    detail_lines.append(f"已自动去重 {deduplicated_row_count} 条重复记录。")
-                assistant_reply = "\n".join(detail_lines)
-        result = {
-            "session_id": session_id,
-            "intent": intent,
-            "is_followup": is_followup,
-            "merged_query": merged_query,
-            "rewritten_query": rewritten_query,
-            "skipped": skipped,
-            "reason": reason_code,
-            "final_status": final_status,
-            "reason_code": reason_code,
-            "summary": summary,
-            "assistant_reply": assistant_reply,
-            "download_url": download_url,
-            "task": parse_result,
-            "sql_result": sql_result,
-            "sql_validate_result": sql_validate_result,
-            "hidden_context_result": hidden_context_result,
-            "hidden_context_retry_count": hidden_context_retry_count,
-        }
-        print("结果返回节点输出：")
-        print(json.dumps(result, indent=2, ensure_ascii=False, default=str))
-        return result
+    输出参数：
+    - 返回值类型: tuple[dict[str, Any], list[str]]，图输出与因预算不足跳过的步骤。
+    """
 
-    def _helper_result_return_node(state: UnifiedChatGraphState) -> UnifiedChatGraphState:
-        """作用：图中的结果返回节点，负责调用结果收敛逻辑并写回状态。
-        
-        输入参数：
-        - state: UnifiedChatGraphState。
-        
-        输出参数：
-        - 返回值类型: UnifiedChatGraphState。
-        """
-        node_input = {
-            "message": state["message"],
-            "intent_result": state.get("intent_result"),
-            "parse_result": state.get("parse_result"),
-            "sql_result": state.get("sql_result"),
-            "sql_validate_result": state.get("sql_validate_result"),
-            "hidden_context_result": state.get("hidden_context_result"),
-            "hidden_context_retry_count": int(state.get("hidden_context_retry_count") or 0),
-        }
-        _helper_emit_step_event("result_return", "start", None)
-        try:
-            result_return_result = _helper_result_return_node_logic(
-                message=state["message"],
-                intent_result=state.get("intent_result"),
-                parse_result=state.get("parse_result"),
-                sql_result=state.get("sql_result"),
-                sql_validate_result=state.get("sql_validate_result"),
-                hidden_context_result=state.get("hidden_context_result"),
-                hidden_context_retry_count=int(state.get("hidden_context_retry_count") or 0),
-                model_name=state["model_name"],
-            )
-            _helper_node_logger("result_return", node_input, result_return_result, "success", None)
-            _helper_emit_step_event("result_return", "end", None)
-            return {**state, "result_return_result": result_return_result}
-        except Exception as exc:
-            _helper_node_logger("result_return", node_input, None, "failed", str(exc))
-            _helper_emit_step_event("result_return", "error", str(exc))
-            raise
+    flight_db = Session(bind=db.get_bind(), autoflush=False)
+    ctx = ChatWorkflowContext(
+        db=flight_db,
+        admin_id=admin_id,
+        session_id=session_id,
+        on_step_event=flight.emit_step_event,
+        on_summary_delta=flight.emit_summary_delta if stream_summary else None,
+        deadline=deadline,
+        cancel_token=flight.cancel_token,
+        step_logs=flight.records,
+    )
+    try:
+        graph_app = get_chat_graph()
+        graph_output = await graph_app.ainvoke(graph_state, config={"configurable": {CHAT_CONTEXT_CONFIG_KEY: ctx}})
+        await run_db_call(flight_db.commit)
+        return graph_output, list(ctx.deadline_skips)
+    finally:
+        await run_db_call(flight_db.close)
 
-    def _helper_build_graph():
-        """作用：构建统一工作流图。
-        
-        输入参数：
-        - 无。
-        
-        输出参数：
-        - 返回值类型: Any。
-        """
 
-        def _helper_route_after_intent(state: UnifiedChatGraphState) -> str:
-            """作用：意图识别后的路由决策，业务查询进入任务解析，闲聊直接返回结果节点。
-            
-            输入参数：
-            - state: UnifiedChatGraphState。
-            
-            输出参数：
-            - 返回值类型: str。
-            """
-            intent_result = state.get("intent_result") or {}
-            intent = str(intent_result.get("intent", "chat")).strip().lower()
-            if intent == "business_query":
-                return "task_parse"
-            return "result_return"
+def _helper_rebind_shared_output(graph_output: dict[str, Any], admin_id: int, session_id: str) -> None:
+    """作用：把共享执行的图输出改写为当前请求方所有：替换 session_id，结果文件复制为以当前管理员与会话为前缀的文件。
 
-        def _helper_route_after_sql_generation(state: UnifiedChatGraphState) -> str:
-            """作用：SQL 生成后的路由决策，生成失败时优先进入隐藏上下文重试。"""
-            intent = str((state.get("intent_result") or {}).get("intent", "chat")).strip().lower()
-            retry_count = int(state.get("hidden_context_retry_count") or 0)
-            sql_result = state.get("sql_result") or {}
-            generation_failed = bool(sql_result.get("generation_failed"))
+    下载接口按 admin_{id}_ 前缀鉴权，共享执行的结果文件以发起方命名；复制失败时不返回下载链接。
+    含文件操作，在数据库线程中调用。
 
-            if intent != "business_query":
-                return "result_return"
-            if (not generation_failed):
-                return "sql_validate"
-            if retry_count >= HIDDEN_CONTEXT_MAX_RETRY:
-                return "result_return"
-            return "hidden_context"
+    输入参数：
+    - graph_output: dict[str, Any]，已深拷贝的图输出（原地修改）。
+    - admin_id: int。
+    - session_id: str。
 
-        def _helper_route_after_sql_validate(state: UnifiedChatGraphState) -> str:
-            """作用：SQL 校验后的路由决策，失败/空结果/零指标时进入隐藏上下文重试，否则直接返回结果节点。
-            
-            输入参数：
-            - state: UnifiedChatGraphState。
-            
-            输出参数：
-            - 返回值类型: str。
-            """
-            intent = str((state.get("intent_result") or {}).get("intent", "chat")).strip().lower()
-            validate_result = state.get("sql_validate_result") or {}
-            retry_count = int(state.get("hidden_context_retry_count") or 0)
-
-            if intent != "business_query":
-                return "result_return"
-            if retry_count >= HIDDEN_CONTEXT_MAX_RETRY:
-                return "result_return"
+    输出参数：
+    - 无。
+    """
 
-            is_valid = bool(validate_result.get("is_valid"))
-            empty_result = bool(validate_result.get("empty_result"))
-            zero_metric_result = bool(validate_result.get("zero_metric_result"))
-            if (not is_valid) or empty_result or zero_metric_result:
-                return "hidden_context"
-            return "result_return"
+    result = graph_output.get("result_return_result")
+    if not isinstance(result, dict):
+        return
+    result["session_id"] = session_id
+    file_prefix = f"admin_{admin_id}_session_{session_id}"
+    cloned_names: dict[str, str | None] = {}
+
+    def _helper_clone(file_name: str) -> str | None:
+        if file_name not in cloned_names:
+            cloned_names[file_name] = clone_result_file(file_name, file_prefix)
+        return cloned_names[file_name]
+
+    # 图状态与结果中的 sql_validate_result 通常是同一对象，按对象去重后只改写一次
+    validate_results = {
+        id(item): item
+        for item in (graph_output.get("sql_validate_result"), result.get("sql_validate_result"))
+        if isinstance(item, dict)
+    }
+    for validate_result in validate_results.values():
+        result_file = str(validate_result.get("result_file") or "").strip()
+        if result_file:
+            validate_result["result_file"] = _helper_clone(result_file)
+
+    download_url = str(result.get("download_url") or "")
+    if not download_url.startswith(CHAT_DOWNLOAD_URL_PREFIX):
+        return
+    cloned_name = _helper_clone(download_url[len(CHAT_DOWNLOAD_URL_PREFIX):])
+    assistant_reply = str(result.get("assistant_reply") or "")
+    if cloned_name:
+        result["download_url"] = build_result_download_url(cloned_name)
+        result["assistant_reply"] = assistant_reply.replace(download_url, result["download_url"])
+    else:
+        result["download_url"] = None
+        result["assistant_reply"] = assistant_reply.replace(
+            f"{RESULT_DOWNLOAD_HINT}\n{download_url}", RESULT_EXPORT_FAILED_HINT
+        )
 
-        def _helper_route_after_hidden_context(state: UnifiedChatGraphState) -> str:
-            """作用：隐藏上下文节点后的路由决策，未超重试上限则回到 SQL 生成，超限则返回结果节点。
-            
-            输入参数：
-            - state: UnifiedChatGraphState。
-            
-            输出参数：
-            - 返回值类型: str。
-            """
-            retry_count = int(state.get("hidden_context_retry_count") or 0)
-            if retry_count > HIDDEN_CONTEXT_MAX_RETRY:
-                return "result_return"
-            return "sql_generation"
 
-        graph = StateGraph(UnifiedChatGraphState)
-        graph.add_node("intent_recognition", _helper_intent_node)
-        graph.add_node("task_parse", _helper_task_parse_node)
-        graph.add_node("sql_generation", _helper_sql_generation_node)
-        graph.add_node("sql_validate", _helper_sql_validate_node)
-        graph.add_node("hidden_context", _helper_hidden_context_node)
-        graph.add_node("result_return", _helper_result_return_node)
-        graph.add_edge(START, "intent_recognition")
-        graph.add_conditional_edges(
-            "intent_recognition",
-            _helper_route_after_intent,
-            {"task_parse": "task_parse", "result_return": "result_return"},
-        )
-        graph.add_edge("task_parse", "sql_generation")
-        graph.add_conditional_edges(
-            "sql_generation",
-            _helper_route_after_sql_generation,
-            {"sql_validate": "sql_validate", "hidden_context": "hidden_context", "result_return": "result_return"},
-        )
-        graph.add_conditional_edges(
-            "sql_validate",
-            _helper_route_after_sql_validate,
-            {"hidden_context": "hidden_context", "result_return": "result_return"},
-        )
-        graph.add_conditional_edges(
-            "hidden_context",
-            _helper_route_after_hidden_context,
-            {"sql_generation": "sql_generation", "result_return": "result_return"},
-        )
-        graph.add_edge("result_return", END)
-        return graph.compile()
+async def execute_chat_workflow(
+        db: Session,
+        admin_id: int,
+        payload: ChatIntentRequest,
+        on_step_event: Callable[[str, str, str | None, dict[str, Any] | None], None] | None = None,
+        on_summary_delta: Callable[[str], None] | None = None,
+        deadline_seconds: float | None = None,
+        cancel_token: CancellationToken | None = None,
+) -> dict[str, Any]:
+    """作用：异步执行统一聊天工作流。
+
+    模型调用以协程方式等待，数据库读写在有界的数据库线程池中执行，不为每个会话占用一个线程。
+    设置 deadline_seconds 时各节点按剩余预算推导模型与 SQL 超时，预算不足时跳过重试与结果总结。
+    传入 cancel_token 时请求可被取消：节点间检查令牌，进行中的模型调用被中断、正在执行的 SQL 被 KILL QUERY，
+    工作流日志以 cancelled 状态记录，不写会话历史。
+    启用 CHAT_SINGLE_FLIGHT_ENABLED 时，问题与会话上下文相同的并发请求合并为一次图执行，各自接收相同的步骤事件与结果，
+    会话历史、工作流日志与结果文件仍按各自的管理员与会话分别落库；问题→SQL 缓存与示例库只由发起方写入一次。
+    
+    输入参数：
+    - db: Session。
+    - admin_id: int。
+    - payload: ChatIntentRequest。
+    - on_step_event: 可选步骤事件回调。
+    - on_summary_delta: 可选结果总结增量文本回调；提供时总结改为流式调用。
+    - deadline_seconds: float | None，端到端时间预算（秒），None 或不大于 0 时不限时。
+    - cancel_token: CancellationToken | None，可选取消令牌。
+    
+    输出参数：
+    - 返回值类型: dict[str, Any]。
+    """
 
+    started_at = time.perf_counter()
     session_id = payload.session_id or uuid.uuid4().hex[:16]
     if not settings.llm_api_key:
         raise RuntimeError("未配置 LLM_API_KEY，无法执行工作流")
@@ -2078,7 +3153,18 @@ def execute_chat_workflow(
         raise RuntimeError("未配置 llm_model_intent，无法执行工作流")
 
     threshold = settings.intent_confidence_threshold
-    history_user_messages = _helper_get_recent_user_messages(session_id=session_id, limit=4)[-4:]
+    ctx = ChatWorkflowContext(
+        db=db,
+        admin_id=admin_id,
+        session_id=session_id,
+        on_step_event=on_step_event,
+        on_summary_delta=on_summary_delta,
+        deadline=time.monotonic() + deadline_seconds if deadline_seconds and deadline_seconds > 0 else None,
+        cancel_token=cancel_token,
+    )
+    history_user_messages = (
+        await _helper_run_db_step(ctx, _helper_get_recent_user_messages, db=db, session_id=session_id, limit=4)
+    )[-4:]
 
     graph_state: UnifiedChatGraphState = {
         "message": payload.message,
@@ -2091,7 +3177,9 @@ def execute_chat_workflow(
         "sql_validate_result": None,
         "hidden_context_result": None,
         "hidden_context_retry_count": 0,
+        "sql_repair_result": None,
         "result_return_result": None,
+        "query_cache": None,
     }
     input_json = {
         "message": payload.message,
@@ -2099,9 +3187,12 @@ def execute_chat_workflow(
         "threshold": threshold,
     }
 
-    try:
-        graph_app = _helper_build_graph()
-        graph_output = graph_app.invoke(graph_state)
+    flight_role: str | None = None
+
+    def _helper_finish(graph_output: dict[str, Any]) -> dict[str, Any]:
+        """作用：在数据库线程中写入会话历史、工作流日志（默认交给后写队列）与问题→SQL 缓存并提交。"""
+        if flight_role == "follower":
+            _helper_rebind_shared_output(graph_output, admin_id=admin_id, session_id=session_id)
         intent_result = graph_output.get("intent_result") or {}
         parse_result = graph_output.get("parse_result")
         sql_result = graph_output.get("sql_result")
@@ -2110,15 +3201,27 @@ def execute_chat_workflow(
         if not isinstance(result, dict):
             raise ValueError("结果返回节点未产出有效结果")
         skipped = bool(result.get("skipped"))
+        cache_state = graph_output.get("query_cache") or {}
+        cache_status = cache_state.get("status")
+        result["query_cache"] = cache_status
+        result["single_flight"] = flight_role
+        if ctx.deadline is not None:
+            result["deadline"] = {
+                "budget_seconds": deadline_seconds,
+                "elapsed_ms": round((time.perf_counter() - started_at) * 1000, 1),
+                "skipped": list(ctx.deadline_skips),
+            }
+        sql_from_cache = bool((sql_result or {}).get("from_cache"))
 
+        _helper_insert_step_logs(ctx)
         _helper_insert_chat_history(
-            session_id=session_id,
+            ctx=ctx,
             user_message=payload.message,
             assistant_message=str(result.get("assistant_reply") or result.get("summary") or ""),
             model_name=model_name,
         )
         _helper_insert_workflow_log(
-            session_id=session_id,
+            ctx=ctx,
             step_name="intent_recognition",
             input_json=input_json,
             output_json=intent_result,
@@ -2128,76 +3231,142 @@ def execute_chat_workflow(
         if not skipped:
             sql_generation_failed = bool((sql_result or {}).get("generation_failed"))
             sql_generation_error = str((sql_result or {}).get("generation_error") or "").strip() or None
+            if not sql_from_cache:
+                _helper_insert_workflow_log(
+                    ctx=ctx,
+                    step_name="task_parse",
+                    input_json={"intent_result": intent_result},
+                    output_json=parse_result,
+                    status="success",
+                    error_message=None,
+                )
+                _helper_insert_workflow_log(
+                    ctx=ctx,
+                    step_name="sql_generation",
+                    input_json={"rewritten_query": result["rewritten_query"], "task": parse_result},
+                    output_json=sql_result,
+                    status="failed" if sql_generation_failed else "success",
+                    error_message=sql_generation_error,
+                )
             _helper_insert_workflow_log(
-                session_id=session_id,
-                step_name="task_parse",
-                input_json={"intent_result": intent_result},
-                output_json=parse_result,
-                status="success",
-                error_message=None,
-            )
-            _helper_insert_workflow_log(
-                session_id=session_id,
-                step_name="sql_generation",
-                input_json={"rewritten_query": result["rewritten_query"], "task": parse_result},
-                output_json=sql_result,
-                status="failed" if sql_generation_failed else "success",
-                error_message=sql_generation_error,
-            )
-            _helper_insert_workflow_log(
-                session_id=session_id,
+                ctx=ctx,
                 step_name="sql_validate",
                 input_json={"sql_result": sql_result},
-                output_json=sql_validate_result,
+                output_json=build_result_digest(sql_validate_result, settings.workflow_log_result_sample_rows),
                 status="success" if (sql_validate_result or {}).get("is_valid") else "failed",
                 error_message=(sql_validate_result or {}).get("error"),
             )
+            if (
+                    flight_role != "follower"
+                    and cache_status in {"miss", "stale"}
+                    and result.get("final_status") == "success"
+                    and isinstance(sql_result, dict)
+                    and not sql_from_cache
+            ):
+                try:
+                    with db.begin_nested():
+                        store_query_cache(
+                            db=db,
+                            cache_key=cache_state["key"],
+                            rewritten_query=result["rewritten_query"],
+                            sql_result=sql_result,
+                            parse_result=parse_result,
+                            admin_id=admin_id,
+                            session_id=session_id,
+                        )
+                except Exception:
+                    pass
+            if isinstance(sql_result, dict) and not sql_from_cache and flight_role != "follower":
+                record_generation_outcome(
+                    with_examples=bool(sql_result.get("examples")),
+                    retried=int(graph_output.get("hidden_context_retry_count") or 0) > 0,
+                    elapsed_ms=(time.perf_counter() - started_at) * 1000,
+                )
+                if result.get("final_status") == "success" and not sql_generation_failed:
+                    add_session_example(result["rewritten_query"], str(sql_result.get("sql") or ""))
         db.commit()
         return result
-    except Exception as exc:
+
+    def _helper_record_failure(exc: Exception) -> None:
+        """作用：在数据库线程中回滚并记录失败日志（因取消而终止时状态记为 cancelled）。"""
         db.rollback()
+        status = "cancelled" if isinstance(exc, WorkflowCancelledError) else "failed"
         try:
+            _helper_insert_step_logs(ctx)
             _helper_insert_workflow_log(
-                session_id=session_id,
+                ctx=ctx,
                 step_name="intent_recognition",
                 input_json=input_json,
                 output_json=None,
-                status="failed",
+                status=status,
                 error_message=str(exc),
             )
             _helper_insert_workflow_log(
-                session_id=session_id,
+                ctx=ctx,
                 step_name="task_parse",
                 input_json={"message": payload.message},
                 output_json=None,
-                status="failed",
+                status=status,
                 error_message=str(exc),
             )
             _helper_insert_workflow_log(
-                session_id=session_id,
+                ctx=ctx,
                 step_name="sql_generation",
                 input_json={"message": payload.message},
                 output_json=None,
-                status="failed",
+                status=status,
                 error_message=str(exc),
             )
             _helper_insert_workflow_log(
-                session_id=session_id,
+                ctx=ctx,
                 step_name="sql_validate",
                 input_json={"message": payload.message},
                 output_json=None,
-                status="failed",
+                status=status,
                 error_message=str(exc),
             )
             _helper_insert_workflow_log(
-                session_id=session_id,
+                ctx=ctx,
                 step_name="hidden_context",
                 input_json={"message": payload.message},
                 output_json=None,
-                status="failed",
+                status=status,
                 error_message=str(exc),
             )
             db.commit()
         except Exception:
             db.rollback()
+
+    try:
+        if settings.chat_single_flight_enabled:
+            flight, is_owner = single_flight_group.join(
+                build_flight_key(payload.message, history_user_messages, model_name, settings.chat_workflow_mode),
+                lambda shared: _helper_run_shared_graph(
+                    shared,
+                    db=db,
+                    admin_id=admin_id,
+                    session_id=session_id,
+                    graph_state=graph_state,
+                    stream_summary=on_summary_delta is not None,
+                    deadline=ctx.deadline,
+                ),
+            )
+            flight_role = "leader" if is_owner else "follower"
+            ctx.step_logs = flight.records
+            shared_output, deadline_skips = await single_flight_group.wait(
+                flight,
+                FlightSubscriber(on_step_event=on_step_event, on_summary_delta=on_summary_delta),
+                cancel_token=cancel_token,
+            )
+            ctx.deadline_skips.extend(deadline_skips)
+            # 有其他请求方时各自深拷贝后再改写与落库，共享输出本身不被修改
+            graph_output = copy.deepcopy(shared_output) if flight.followers else shared_output
+        else:
+            graph_app = get_chat_graph()
+            graph_output = await graph_app.ainvoke(graph_state, config={"configurable": {CHAT_CONTEXT_CONFIG_KEY: ctx}})
+        return await run_db_call(_helper_finish, graph_output)
+    except Exception as exc:
+        if isinstance(exc, WorkflowCancelledError):
+            logger.info("workflow cancelled", extra={"session_id": session_id, "payload": {"reason": str(exc)}})
+        await run_db_call(_helper_record_failure, exc)
         raise
@@ -1,15 +1,18 @@
 from __future__ import annotations
 
+import asyncio
 import json
-import queue
-import threading
 import uuid
+import weakref
 from datetime import datetime, timezone
-from typing import Any, Iterator
+from typing import Any, AsyncIterator, Awaitable, Callable
 
 from app.core.config import settings
+from app.db.executor import run_db_call
 from app.db.session import SessionLocal
 from app.schemas.chat import ChatIntentRequest
+from app.services.admission_service import AdmissionRejectedError, AdmissionTicket, admission_controller
+from app.services.cancellation_service import CancellationToken
 from app.services.chat_graph import execute_chat_workflow
 
 STEP_DISPLAY_NAMES: dict[str, str] = {
@@ -18,6 +21,7 @@ STEP_DISPLAY_NAMES: dict[str, str] = {
     "sql_generation": "sql_generation",
     "sql_validate": "sql_validate",
     "hidden_context": "hidden_context",
+    "sql_repair": "sql_repair",
     "result_return": "result_return",
 }
 
@@ -26,16 +30,55 @@ STEP_ERROR_MESSAGE_TEMPLATE = "{step}步骤执行异常，系统已终止本次
 SSE_HEARTBEAT_INTERVAL_SECONDS = 0.8
 SSE_PRELUDE_PADDING_CHARS = 2048
 
+# 客户端断开后工作流被取消，但仍需写完取消日志，这里持有任务引用避免被提前回收。
+_BACKGROUND_TASKS: set[asyncio.Task[None]] = set()
 
-def generate_chat_stream(admin_id: int, payload: ChatIntentRequest) -> Iterator[str]:
+
+def open_chat_stream(
+    admin_id: int,
+    payload: ChatIntentRequest,
+    is_disconnected: Callable[[], Awaitable[bool]] | None = None,
+) -> AsyncIterator[str]:
+    """作用：申请问答准入并返回 SSE 事件流；排队已满时抛出 AdmissionRejectedError（由路由返回 429）。
+
+    准入在返回响应前申请，才能以 HTTP 状态码拒绝；事件流若未被迭代就被回收（如客户端在响应开始前断开），
+    由回收钩子释放名额，避免占用的并发名额泄漏。
+
+    输入参数：
+    - admin_id: int，当前管理员 ID。
+    - payload: ChatIntentRequest，聊天请求体。
+    - is_disconnected: 可选断开检测回调。
+
+    输出参数：
+    - AsyncIterator[str]：SSE 文本片段异步迭代器。
+    """
+
+    ticket = admission_controller.enqueue(admin_id)
+    stream_iterator = generate_chat_stream(admin_id, payload, is_disconnected=is_disconnected, ticket=ticket)
+    weakref.finalize(stream_iterator, admission_controller.release, ticket)
+    return stream_iterator
+
+
+async def generate_chat_stream(
+    admin_id: int,
+    payload: ChatIntentRequest,
+    is_disconnected: Callable[[], Awaitable[bool]] | None = None,
+    ticket: AdmissionTicket | None = None,
+) -> AsyncIterator[str]:
     """作用：执行聊天工作流并持续输出 SSE 事件流。
 
+    工作流作为事件循环上的任务运行，通过 asyncio.Queue 向本生成器推送事件，不再为每个请求创建线程。
+    客户端断开（生成器被关闭，或心跳时检测到断开）而工作流尚未结束时，取消工作流：
+    不再执行后续节点，中断进行中的模型调用与 SQL。
+
     输入参数：
     - admin_id: int，当前管理员 ID。
     - payload: ChatIntentRequest，聊天请求体。
+    - is_disconnected: 可选断开检测回调（如 Request.is_disconnected），在心跳间隙调用。
+    - ticket: AdmissionTicket | None，准入凭证；仍在排队时先推送 queued 事件（含排队位置）等待接纳，结束后释放。
 
     输出参数：
-    - Iterator[str]：SSE 文本片段迭代器。
+    - AsyncIterator[str]：SSE 文本片段异步迭代器。
     """
 
     def _helper_get_step_message(step_name: str, status: str) -> str:
@@ -70,10 +113,11 @@ def generate_chat_stream(admin_id: int, payload: ChatIntentRequest) -> Iterator[
         message=payload.message,
         model_name=payload.model_name,
     )
-    event_queue: queue.Queue[dict[str, Any] | None] = queue.Queue()
+    event_queue: asyncio.Queue[dict[str, Any] | None] = asyncio.Queue()
+    cancel_token = CancellationToken()
 
-    def _helper_worker() -> None:
-        """作用：后台执行工作流并把事件写入队列。
+    async def _helper_worker() -> None:
+        """作用：执行工作流并把事件写入队列。
 
         输入参数：
         - 无
@@ -94,7 +138,7 @@ def generate_chat_stream(admin_id: int, payload: ChatIntentRequest) -> Iterator[
             输入参数：
             - event_name: str，事件名称。
             - step: str，步骤名。
-            - status: str，状态（start/end/error）。
+            - status: str，状态（start/end/error/delta）。
             - message: str，状态文案。
             - result: dict[str, Any] | None，可选最终结果。
             - step_payload: dict[str, Any] | None，可选步骤附加数据。
@@ -116,7 +160,7 @@ def generate_chat_stream(admin_id: int, payload: ChatIntentRequest) -> Iterator[
                 payload_data["result"] = result
             if step_payload is not None:
                 payload_data["step_payload"] = step_payload
-            event_queue.put({"event": event_name, "data": payload_data})
+            event_queue.put_nowait({"event": event_name, "data": payload_data})
 
         def _helper_step_callback(
                 step_name: str,
@@ -155,16 +199,55 @@ def generate_chat_stream(admin_id: int, payload: ChatIntentRequest) -> Iterator[
                 STEP_ERROR_MESSAGE_TEMPLATE.format(step=step_label),
             )
 
+        def _helper_summary_delta_callback(delta_text: str) -> None:
+            """作用：把结果总结的增量文本转换为 summary_delta 事件。
+
+            输入参数：
+            - delta_text: str，本次新增的总结文本。
+
+            输出参数：
+            - None
+            """
+            _helper_emit_event(
+                "summary_delta",
+                "result_return",
+                "delta",
+                "",
+                step_payload={"delta": delta_text},
+            )
+
+        def _helper_queued_callback(position: int) -> None:
+            """作用：把排队位置变化转换为 queued 事件。
+
+            输入参数：
+            - position: int，排队位置（1 表示下一个被接纳）。
+
+            输出参数：
+            - None
+            """
+            _helper_emit_event(
+                "queued",
+                "workflow",
+                "queued",
+                settings.chat_stream_queued_message,
+                step_payload={"position": position},
+            )
+
         db = SessionLocal()
         seq = 0
 
         try:
             _helper_emit_event("workflow_start", "workflow", "start", settings.chat_stream_workflow_start_message)
-            result = execute_chat_workflow(
+            if ticket is not None and not ticket.admitted:
+                await cancel_token.run(admission_controller.wait(ticket, on_position=_helper_queued_callback))
+            result = await execute_chat_workflow(
                 db=db,
                 admin_id=admin_id,
                 payload=run_payload,
                 on_step_event=_helper_step_callback,
+                on_summary_delta=_helper_summary_delta_callback,
+                deadline_seconds=settings.chat_deadline_stream_seconds,
+                cancel_token=cancel_token,
             )
             _helper_emit_event(
                 "workflow_end",
@@ -173,25 +256,42 @@ def generate_chat_stream(admin_id: int, payload: ChatIntentRequest) -> Iterator[
                 settings.chat_stream_workflow_end_message,
                 result=result,
             )
+        except AdmissionRejectedError as exc:
+            _helper_emit_event(
+                "workflow_error",
+                "workflow",
+                "error",
+                str(exc),
+                step_payload={"retry_after": exc.retry_after},
+            )
         except Exception:
             _helper_emit_event("workflow_error", "workflow", "error", WORKFLOW_ERROR_MESSAGE)
         finally:
-            db.close()
-            event_queue.put(None)
+            if ticket is not None:
+                admission_controller.release(ticket)
+            await run_db_call(db.close)
+            event_queue.put_nowait(None)
 
-    worker_thread = threading.Thread(target=_helper_worker, daemon=True)
-    worker_thread.start()
+    worker_task = asyncio.create_task(_helper_worker())
+    _BACKGROUND_TASKS.add(worker_task)
+    worker_task.add_done_callback(_BACKGROUND_TASKS.discard)
 
-    # 预热注释块：用于穿透部分代理/中间层的小包缓冲阈值。
-    yield f": {' ' * SSE_PRELUDE_PADDING_CHARS}\n\n"
+    try:
+        # 预热注释块：用于穿透部分代理/中间层的小包缓冲阈值。
+        yield f": {' ' * SSE_PRELUDE_PADDING_CHARS}\n\n"
 
-    while True:
-        try:
-            item = event_queue.get(timeout=SSE_HEARTBEAT_INTERVAL_SECONDS)
-        except queue.Empty:
-            # 心跳注释行：保持连接活跃并持续触发流式刷新。
-            yield ": heartbeat\n\n"
-            continue
-        if item is None:
-            break
-        yield _helper_format_sse_chunk(item["event"], item["data"])
+        while True:
+            try:
+                item = await asyncio.wait_for(event_queue.get(), timeout=SSE_HEARTBEAT_INTERVAL_SECONDS)
+            except asyncio.TimeoutError:
+                if is_disconnected is not None and await is_disconnected():
+                    break
+                # 心跳注释行：保持连接活跃并持续触发流式刷新。
+                yield ": heartbeat\n\n"
+                continue
+            if item is None:
+                break
+            yield _helper_format_sse_chunk(item["event"], item["data"])
+    finally:
+        if not worker_task.done():
+            cancel_token.cancel("client_disconnected")
@@ -0,0 +1,40 @@
+from __future__ import annotations
+
+import threading
+from typing import Iterable
+
+_VERSION_LOCK = threading.Lock()
+_DATA_VERSIONS: dict[str, int] = {}
+
+
+def bump_data_version(*table_names: str) -> None:
+    """作用：业务表数据变更后递增其数据版本号，使依赖该表的结果缓存失效。
+
+    版本号仅在进程内维护；应在事务提交成功后调用。
+
+    输入参数：
+    - table_names: str，一个或多个物理表名。
+
+    输出参数：
+    - 无。
+    """
+
+    with _VERSION_LOCK:
+        for table_name in table_names:
+            key = str(table_name).strip().lower()
+            if key:
+                _DATA_VERSIONS[key] = _DATA_VERSIONS.get(key, 0) + 1
+
+
+def get_data_versions(table_names: Iterable[str]) -> dict[str, int]:
+    """作用：读取一组表的当前数据版本号（未变更过的表为 0）。
+
+    输入参数：
+    - table_names: Iterable[str]。
+
+    输出参数：
+    - 返回值类型: dict[str, int]。
+    """
+
+    with _VERSION_LOCK:
+        return {key: _DATA_VERSIONS.get(key, 0) for key in sorted({str(name).strip().lower() for name in table_names})}
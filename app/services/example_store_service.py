@@ -0,0 +1,561 @@
+from __future__ import annotations
+
+import math
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.models.query_template import QueryTemplate
+from app.services.query_cache_service import QUERY_CACHE_KIND, QUERY_CACHE_NAME_PREFIX, normalize_query
+from app.services.schema_kb_service import get_schema_kb
+
+EXAMPLE_NGRAM_SIZES = (2, 3)
+
+_TESTSET_EXAMPLE_PATTERN = re.compile(r"问题：(?P<question>[^\n]+)\n+```sql\n(?P<sql>.*?)```", flags=re.S)
+_TABLE_ALIAS_PATTERN = re.compile(
+    r"(?i)\b(?P<keyword>from|join)\s+`?(?P<table>[a-zA-Z_][a-zA-Z0-9_]*)`?(?:\s+(?:as\s+)?(?P<alias>[a-zA-Z_][a-zA-Z0-9_]*))?"
+)
+_NON_ALIAS_KEYWORDS = frozenset(
+    {"where", "on", "using", "join", "inner", "left", "right", "cross", "outer", "natural",
+     "group", "order", "having", "limit", "union", "straight_join"}
+)
+# 与 SQL 生成节点的校验一致：table.field 字段引用与 WITH 中定义的 CTE 名称
+_SQL_FIELD_PATTERN = re.compile(r"\b([a-zA-Z_][a-zA-Z0-9_]*)\.([a-zA-Z_][a-zA-Z0-9_]*)\b")
+_CTE_NAME_PATTERN = re.compile(r"(?is)(?:\bwith\b|,)\s*([a-zA-Z_][a-zA-Z0-9_]*)\s+as\s*\(")
+_EXAMPLE_CTE_NAME = "base"
+
+
+@dataclass(frozen=True)
+class SqlExample:
+    """作用：问题→SQL 示例。source 取值：testset（评测题库）/ session（线上已验证会话）。"""
+
+    question: str
+    sql: str
+    source: str
+
+
+@dataclass(frozen=True)
+class ExampleIndex:
+    """作用：示例问题的字符 n-gram TF-IDF 倒排索引（只读快照，示例变化后整体重建）。"""
+
+    examples: tuple[SqlExample, ...]
+    idf: dict[str, float]
+    postings: dict[str, tuple[tuple[int, float], ...]]
+
+
+_STORE_LOCK = threading.Lock()
+_TESTSET_EXAMPLES: list[SqlExample] | None = None
+_TESTSET_KB_DIGEST = ""
+_SESSION_EXAMPLES: OrderedDict[str, SqlExample] = OrderedDict()
+_SESSION_LOADED_AT = 0.0
+_INDEX: ExampleIndex | None = None
+
+_STATS_LOCK = threading.Lock()
+_STATS: dict[str, dict[str, float]] = {
+    "with_examples": {"requests": 0, "retried": 0, "latency_ms_total": 0.0},
+    "without_examples": {"requests": 0, "retried": 0, "latency_ms_total": 0.0},
+}
+
+
+def _helper_resolve_testset_path() -> Path:
+    """作用：解析评测题库路径，相对路径按项目根目录解析。
+
+    输入参数：
+    - 无。
+
+    输出参数：
+    - 返回值类型: Path。
+    """
+
+    testset_path = Path(settings.sql_example_testset_path)
+    if not testset_path.is_absolute():
+        testset_path = Path(__file__).resolve().parents[2] / testset_path
+    return testset_path
+
+
+def _helper_top_level_keyword(sql: str, keyword: str, last: bool = False) -> int:
+    """作用：查找不在括号与字符串内的关键字位置。
+
+    输入参数：
+    - sql: str。
+    - keyword: str，可含空白（如 ORDER BY）。
+    - last: bool，True 时返回最后一处。
+
+    输出参数：
+    - 返回值类型: int，未找到时为 -1。
+    """
+
+    pattern = re.compile(r"(?i)\b" + r"\s+".join(keyword.split()) + r"\b")
+    depth = 0
+    in_string = False
+    found = -1
+    for index, ch in enumerate(sql):
+        if ch == "'":
+            in_string = not in_string
+        elif in_string:
+            continue
+        elif ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+        elif depth == 0 and pattern.match(sql, index) and (index == 0 or not (sql[index - 1].isalnum() or sql[index - 1] == "_")):
+            found = index
+            if not last:
+                return found
+    return found
+
+
+def _helper_split_top_level(text_value: str) -> list[str]:
+    """作用：按不在括号与字符串内的逗号切分。
+
+    输入参数：
+    - text_value: str。
+
+    输出参数：
+    - 返回值类型: list[str]。
+    """
+
+    parts: list[str] = []
+    depth = 0
+    in_string = False
+    start = 0
+    for index, ch in enumerate(text_value):
+        if ch == "'":
+            in_string = not in_string
+        elif in_string:
+            continue
+        elif ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+        elif ch == "," and depth == 0:
+            parts.append(text_value[start:index].strip())
+            start = index + 1
+    parts.append(text_value[start:].strip())
+    return parts
+
+
+def _helper_resolve_table_aliases(sql: str) -> str | None:
+    """作用：把表别名还原为物理表名（s.student_no → student.student_no），并去掉反引号与别名声明。
+
+    输入参数：
+    - sql: str。
+
+    输出参数：
+    - 返回值类型: str | None，同一张表出现多次（自连接，别名不可省略）时为 None。
+    """
+
+    alias_tables: dict[str, str] = {}
+    seen_tables: set[str] = set()
+    for match in _TABLE_ALIAS_PATTERN.finditer(sql):
+        table_name = match.group("table")
+        if table_name.lower() in {"select", "dual"}:
+            continue
+        if table_name.lower() in seen_tables:
+            return None
+        seen_tables.add(table_name.lower())
+        alias = match.group("alias")
+        if alias and alias.lower() not in _NON_ALIAS_KEYWORDS and alias.lower() != table_name.lower():
+            alias_tables[alias] = table_name
+
+    def _helper_strip_alias(match: re.Match[str]) -> str:
+        """作用：FROM/JOIN 子句只保留物理表名。"""
+
+        table_name = match.group("table")
+        alias = match.group("alias")
+        if alias and alias.lower() in _NON_ALIAS_KEYWORDS:
+            return f"{match.group('keyword')} {table_name} {alias}"
+        return f"{match.group('keyword')} {table_name}"
+
+    resolved_sql = _TABLE_ALIAS_PATTERN.sub(_helper_strip_alias, sql)
+    for alias, table_name in alias_tables.items():
+        resolved_sql = re.sub(rf"(?<![\w.]){re.escape(alias)}\.", f"{table_name}.", resolved_sql)
+    return resolved_sql
+
+
+def _helper_output_column(select_item: str) -> str | None:
+    """作用：推断 SELECT 列表中一项的输出列名（AS 别名或 table.field 的字段名）。
+
+    输入参数：
+    - select_item: str。
+
+    输出参数：
+    - 返回值类型: str | None，无法确定时为 None。
+    """
+
+    match = re.search(r"(?is)(?:\bas\s+|^(?:[a-zA-Z_][a-zA-Z0-9_]*\.)?)([a-zA-Z_][a-zA-Z0-9_]*)$", select_item.strip())
+    return match.group(1) if match else None
+
+
+def convert_example_sql(sql: str) -> str | None:
+    """作用：把评测题库 SQL 改写为与 SQL 生成约束一致的形式：表别名还原为物理表名，整体包进 WITH base AS (...)，
+    外层以 base.字段 输出，末尾的 ORDER BY / LIMIT 移到外层。
+
+    输入参数：
+    - sql: str。
+
+    输出参数：
+    - 返回值类型: str | None，无法改写时为 None。
+    """
+
+    body = sql.strip().rstrip(";").strip()
+    if re.match(r"(?i)^with\b", body):
+        return body
+    if not re.match(r"(?i)^select\b", body):
+        return None
+    resolved_body = _helper_resolve_table_aliases(body)
+    if resolved_body is None:
+        return None
+    body = re.sub(r"\s+", " ", resolved_body).strip()
+
+    from_index = _helper_top_level_keyword(body, "from")
+    if from_index < 0:
+        return None
+    columns = [_helper_output_column(item) for item in _helper_split_top_level(body[len("select"):from_index])]
+    if not columns or any(column is None for column in columns):
+        return None
+
+    tail = ""
+    order_index = _helper_top_level_keyword(body, "order by", last=True)
+    if order_index >= 0:
+        tail = body[order_index:]
+        output_columns = {column.lower() for column in columns}
+
+        def _helper_to_base_field(match: re.Match[str]) -> str:
+            """作用：把排序字段改写为 base.字段。"""
+
+            return f"{_EXAMPLE_CTE_NAME}.{match.group(2)}"
+
+        base_tail = _SQL_FIELD_PATTERN.sub(_helper_to_base_field, tail)
+        order_terms = re.sub(r"(?is)\blimit\b.*$", "", base_tail[len("order by"):])
+        order_names = [
+            re.sub(r"(?i)\s+(asc|desc)$", "", term).split(".")[-1].lower()
+            for term in _helper_split_top_level(order_terms)
+        ]
+        if all(name in output_columns for name in order_names):
+            body = body[:order_index].strip()
+            tail = " " + base_tail
+        else:
+            # 排序字段不在输出列中：ORDER BY / LIMIT 留在 CTE 内
+            tail = ""
+    select_list = ", ".join(f"{_EXAMPLE_CTE_NAME}.{column}" for column in columns)
+    return f"WITH {_EXAMPLE_CTE_NAME} AS ({body}) SELECT {select_list} FROM {_EXAMPLE_CTE_NAME}{tail}"
+
+
+def _helper_passes_generation_checks(sql: str, whitelist_set: frozenset[str]) -> bool:
+    """作用：按 SQL 生成节点的约束校验示例 SQL：以 WITH 开头、含 table.field 字段、非 CTE 字段均在白名单内。
+
+    输入参数：
+    - sql: str。
+    - whitelist_set: frozenset[str]。
+
+    输出参数：
+    - 返回值类型: bool。
+    """
+
+    if not re.search(r"^\s*with\b", sql, flags=re.I):
+        return False
+    sql_fields = [f"{table_name}.{column_name}" for table_name, column_name in _SQL_FIELD_PATTERN.findall(sql)]
+    if not sql_fields:
+        return False
+    cte_names = {name.lower() for name in _CTE_NAME_PATTERN.findall(sql)}
+    return all(field.split(".", 1)[0].lower() in cte_names or field in whitelist_set for field in sql_fields)
+
+
+def parse_testset_examples(markdown_text: str, whitelist_set: frozenset[str] | None = None) -> list[SqlExample]:
+    """作用：从评测题库 Markdown 中提取“问题：...”及其后紧跟的 SQL 代码块。
+
+    SQL 先改写为生成约束的形式（convert_example_sql），只保留改写后通过与生成 SQL 相同校验的示例，
+    避免示例中的别名、非 CTE 写法被模型照搬后校验失败。
+
+    输入参数：
+    - markdown_text: str。
+    - whitelist_set: frozenset[str] | None，字段白名单；为空时取当前知识库。
+
+    输出参数：
+    - 返回值类型: list[SqlExample]。
+    """
+
+    if whitelist_set is None:
+        whitelist_set = get_schema_kb().whitelist_set
+    examples: list[SqlExample] = []
+    for match in _TESTSET_EXAMPLE_PATTERN.finditer(markdown_text):
+        question = match.group("question").replace("`", "").strip()
+        sql = convert_example_sql(match.group("sql"))
+        if question and sql and _helper_passes_generation_checks(sql, whitelist_set):
+            examples.append(SqlExample(question=question, sql=sql, source="testset"))
+    return examples
+
+
+def _helper_load_testset_examples() -> list[SqlExample]:
+    """作用：首次使用或知识库变更后读取评测题库示例（按当前字段白名单校验）；文件缺失时为空。调用方需持有存储锁。
+
+    输入参数：
+    - 无。
+
+    输出参数：
+    - 返回值类型: list[SqlExample]。
+    """
+
+    global _TESTSET_EXAMPLES, _TESTSET_KB_DIGEST
+    kb = get_schema_kb()
+    if _TESTSET_EXAMPLES is None or _TESTSET_KB_DIGEST != kb.digest:
+        testset_path = _helper_resolve_testset_path()
+        try:
+            _TESTSET_EXAMPLES = parse_testset_examples(testset_path.read_text(encoding="utf-8"), kb.whitelist_set)
+        except OSError:
+            _TESTSET_EXAMPLES = []
+        _TESTSET_KB_DIGEST = kb.digest
+    return _TESTSET_EXAMPLES
+
+
+def _helper_ngrams(text_value: str) -> dict[str, int]:
+    """作用：对归一化问题切分字符 n-gram 并计数（去除空白）。
+
+    输入参数：
+    - text_value: str。
+
+    输出参数：
+    - 返回值类型: dict[str, int]。
+    """
+
+    compact = normalize_query(text_value).replace(" ", "")
+    counts: dict[str, int] = {}
+    for size in EXAMPLE_NGRAM_SIZES:
+        for index in range(len(compact) - size + 1):
+            gram = compact[index:index + size]
+            counts[gram] = counts.get(gram, 0) + 1
+    return counts
+
+
+def _helper_build_index(examples: list[SqlExample]) -> ExampleIndex:
+    """作用：构建示例问题的 TF-IDF 倒排索引（向量已做 L2 归一化）。
+
+    输入参数：
+    - examples: list[SqlExample]。
+
+    输出参数：
+    - 返回值类型: ExampleIndex。
+    """
+
+    gram_counts = [_helper_ngrams(example.question) for example in examples]
+    document_frequency: dict[str, int] = {}
+    for counts in gram_counts:
+        for gram in counts:
+            document_frequency[gram] = document_frequency.get(gram, 0) + 1
+    doc_count = len(examples)
+    idf = {gram: math.log((1 + doc_count) / (1 + frequency)) + 1.0 for gram, frequency in document_frequency.items()}
+
+    postings: dict[str, list[tuple[int, float]]] = {}
+    for doc_index, counts in enumerate(gram_counts):
+        weights = {gram: count * idf[gram] for gram, count in counts.items()}
+        norm = math.sqrt(sum(weight * weight for weight in weights.values())) or 1.0
+        for gram, weight in weights.items():
+            postings.setdefault(gram, []).append((doc_index, weight / norm))
+    return ExampleIndex(
+        examples=tuple(examples),
+        idf=idf,
+        postings={gram: tuple(items) for gram, items in postings.items()},
+    )
+
+
+def _helper_get_index() -> ExampleIndex:
+    """作用：获取当前示例索引；示例集合变化后首次使用时重建。
+
+    输入参数：
+    - 无。
+
+    输出参数：
+    - 返回值类型: ExampleIndex。
+    """
+
+    global _INDEX
+    with _STORE_LOCK:
+        if _INDEX is None or _TESTSET_KB_DIGEST != get_schema_kb().digest:
+            _INDEX = _helper_build_index([*_helper_load_testset_examples(), *_SESSION_EXAMPLES.values()])
+        return _INDEX
+
+
+def add_session_example(question: str, sql: str) -> None:
+    """作用：加入一条线上已验证的问题→SQL 示例（同一归一化问题只保留最新一条，超出上限淘汰最旧的）。
+
+    输入参数：
+    - question: str，改写后问题。
+    - sql: str。
+
+    输出参数：
+    - 无。
+    """
+
+    global _INDEX
+    key = normalize_query(question)
+    if not settings.sql_example_enabled or not key or not str(sql or "").strip():
+        return
+    with _STORE_LOCK:
+        _SESSION_EXAMPLES[key] = SqlExample(question=question, sql=sql, source="session")
+        _SESSION_EXAMPLES.move_to_end(key)
+        while len(_SESSION_EXAMPLES) > max(settings.sql_example_max_session, 0):
+            _SESSION_EXAMPLES.popitem(last=False)
+        _INDEX = None
+
+
+def session_examples_due() -> bool:
+    """作用：判断是否需要从问题→SQL 缓存表刷新线上示例。
+
+    输入参数：
+    - 无。
+
+    输出参数：
+    - 返回值类型: bool。
+    """
+
+    return settings.sql_example_enabled and (
+        time.time() - _SESSION_LOADED_AT > settings.sql_example_refresh_seconds
+    )
+
+
+def refresh_session_examples(db: Session) -> int:
+    """作用：从问题→SQL 缓存（QueryTemplate 中已验证的会话 SQL）加载最近的线上示例。
+
+    仅加载与当前知识库版本一致的条目；进程内新增的示例不会被覆盖。
+
+    输入参数：
+    - db: Session。
+
+    输出参数：
+    - 返回值类型: int，本次加载的示例数。
+    """
+
+    global _SESSION_LOADED_AT, _INDEX
+    _SESSION_LOADED_AT = time.time()
+    kb_digest = get_schema_kb().digest
+    rows = db.execute(
+        select(QueryTemplate)
+        .where(
+            QueryTemplate.template_name.like(f"{QUERY_CACHE_NAME_PREFIX}%"),
+            QueryTemplate.status == "active",
+            QueryTemplate.is_deleted.is_(False),
+        )
+        .order_by(QueryTemplate.updated_at.desc(), QueryTemplate.id.desc())
+        .limit(max(settings.sql_example_max_session, 0))
+    ).scalars().all()
+    loaded = 0
+    with _STORE_LOCK:
+        # rows 按更新时间降序，逐条插到队首后最旧的在最前，超出上限时优先淘汰
+        for row in rows:
+            params = row.params_schema if isinstance(row.params_schema, dict) else {}
+            if params.get("kind") != QUERY_CACHE_KIND or params.get("kb_digest") != kb_digest:
+                continue
+            key = normalize_query(row.template_desc or "")
+            if not key or not row.template_sql or key in _SESSION_EXAMPLES:
+                continue
+            _SESSION_EXAMPLES[key] = SqlExample(question=row.template_desc, sql=row.template_sql, source="session")
+            _SESSION_EXAMPLES.move_to_end(key, last=False)
+            loaded += 1
+        while len(_SESSION_EXAMPLES) > max(settings.sql_example_max_session, 0):
+            _SESSION_EXAMPLES.popitem(last=False)
+        if loaded:
+            _INDEX = None
+    return loaded
+
+
+def retrieve_sql_examples(question: str, top_k: int | None = None) -> list[dict[str, Any]]:
+    """作用：按字符 n-gram TF-IDF 余弦相似度检索与问题最接近的示例。
+
+    输入参数：
+    - question: str，改写后问题。
+    - top_k: int | None，默认 SQL_EXAMPLE_TOP_K。
+
+    输出参数：
+    - 返回值类型: list[dict[str, Any]]，{question, sql, source, similarity}，按相似度降序。
+    """
+
+    if not settings.sql_example_enabled:
+        return []
+    limit = settings.sql_example_top_k if top_k is None else top_k
+    index = _helper_get_index()
+    if limit <= 0 or not index.examples:
+        return []
+
+    weights = {gram: count * index.idf[gram] for gram, count in _helper_ngrams(question).items() if gram in index.idf}
+    norm = math.sqrt(sum(weight * weight for weight in weights.values()))
+    if not norm:
+        return []
+    similarities: dict[int, float] = {}
+    for gram, weight in weights.items():
+        for doc_index, doc_weight in index.postings[gram]:
+            similarities[doc_index] = similarities.get(doc_index, 0.0) + weight / norm * doc_weight
+    ranked = sorted(
+        (
+            (similarity, doc_index)
+            for doc_index, similarity in similarities.items()
+            if similarity >= settings.sql_example_min_similarity
+        ),
+        key=lambda item: -item[0],
+    )
+    return [
+        {
+            "question": index.examples[doc_index].question,
+            "sql": index.examples[doc_index].sql,
+            "source": index.examples[doc_index].source,
+            "similarity": round(similarity, 4),
+        }
+        for similarity, doc_index in ranked[:limit]
+    ]
+
+
+def record_generation_outcome(with_examples: bool, retried: bool, elapsed_ms: float) -> None:
+    """作用：记录一次经过大模型 SQL 生成的问答结果，按是否注入示例分组统计重试率与端到端耗时。
+
+    输入参数：
+    - with_examples: bool。
+    - retried: bool，是否进入了隐藏上下文重试。
+    - elapsed_ms: float，端到端耗时。
+
+    输出参数：
+    - 无。
+    """
+
+    group = "with_examples" if with_examples else "without_examples"
+    with _STATS_LOCK:
+        _STATS[group]["requests"] += 1
+        _STATS[group]["latency_ms_total"] += elapsed_ms
+        if retried:
+            _STATS[group]["retried"] += 1
+
+
+def get_example_stats() -> dict[str, Any]:
+    """作用：汇总进程内示例检索效果：注入/未注入示例两组的请求数、重试率与平均端到端耗时。
+
+    输入参数：
+    - 无。
+
+    输出参数：
+    - 返回值类型: dict[str, Any]。
+    """
+
+    with _STATS_LOCK:
+        snapshot = {group: dict(values) for group, values in _STATS.items()}
+    with _STORE_LOCK:
+        example_counts = {
+            "testset": len(_TESTSET_EXAMPLES or []),
+            "session": len(_SESSION_EXAMPLES),
+        }
+    stats: dict[str, Any] = {"examples": example_counts}
+    for group, values in snapshot.items():
+        requests = int(values["requests"])
+        stats[group] = {
+            "requests": requests,
+            "retried": int(values["retried"]),
+            "retry_rate": round(values["retried"] / requests, 4) if requests else 0.0,
+            "avg_latency_ms": round(values["latency_ms_total"] / requests, 1) if requests else 0.0,
+        }
+    return stats
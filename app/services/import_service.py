@@ -1,13 +1,16 @@
 import csv
 import io
 from datetime import date, datetime
+from graphlib import CycleError, TopologicalSorter
 from typing import Any
 
 from fastapi import HTTPException
 from openpyxl import load_workbook
+from sqlalchemy import insert, select
 from sqlalchemy.orm import Session
 
-from app.models import Course, ImportLog, Student, Teacher
+from app.models import ClassModel, College, Course, CourseClass, Enroll, ImportLog, Major, Student, Teacher
+from app.services.data_version_service import bump_data_version
 
 
 # 仅允许导入的表
@@ -20,6 +23,97 @@ ALLOWED_TABLES = {
 # 导入时排除的系统字段
 EXCLUDED_COLUMNS = {"id", "created_at", "updated_at", "created_by", "updated_by", "is_deleted"}
 
+# 多 Sheet 工作簿导入允许的表（Sheet 名即表名）
+WORKBOOK_TABLES = {
+    "college": College,
+    "major": Major,
+    "teacher": Teacher,
+    "class": ClassModel,
+    "course": Course,
+    "student": Student,
+    "course_class": CourseClass,
+    "enroll": Enroll,
+}
+
+# 跨 Sheet 引用使用的业务自然键；若自然键列本身是外键，则继续按被引用表的自然键递归解析
+NATURAL_KEYS: dict[str, tuple[str, ...]] = {
+    "college": ("college_code",),
+    "major": ("major_code",),
+    "teacher": ("teacher_no",),
+    "class": ("class_code",),
+    "course": ("course_code",),
+    "student": ("student_no",),
+    "course_class": ("course_id", "class_id", "term"),
+}
+
+# 工作簿导入时每批写入的行数
+WORKBOOK_INSERT_BATCH_SIZE = 500
+
+
+def _helper_parse_bool(value: Any) -> bool:
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)):
+        return bool(value)
+    if isinstance(value, str):
+        return value.strip().lower() in {"1", "true", "yes"}
+    return False
+
+
+def _helper_convert_value(column: Any, value: Any) -> Any:
+    if isinstance(value, str) and value.strip() == "":
+        return None
+
+    try:
+        python_type = column.type.python_type
+    except (NotImplementedError, AttributeError):
+        return value
+
+    if python_type is bool:
+        return _helper_parse_bool(value)
+    if python_type is int:
+        return int(value)
+    if python_type is float:
+        return float(value)
+    if python_type is date:
+        if isinstance(value, datetime):
+            return value.date()
+        if isinstance(value, date):
+            return value
+        if isinstance(value, str):
+            return date.fromisoformat(value)
+    if python_type is datetime:
+        if isinstance(value, datetime):
+            return value
+        if isinstance(value, str):
+            return datetime.fromisoformat(value)
+    if python_type is str:
+        return str(value)
+    return python_type(value)
+
+
+def _helper_collect_columns(model: Any) -> tuple[dict[str, Any], set[str]]:
+    """作用：收集模型可导入字段与必填字段（排除系统字段）。"""
+    allowed: dict[str, Any] = {}
+    required: set[str] = set()
+    for column in model.__table__.columns:
+        if column.name in EXCLUDED_COLUMNS:
+            continue
+        allowed[column.name] = column
+        is_autoincrement_pk = bool(column.primary_key and column.autoincrement is True)
+        if (
+            not column.nullable
+            and column.default is None
+            and column.server_default is None
+            and not is_autoincrement_pk
+        ):
+            required.add(column.name)
+    return allowed, required
+
+
+def _helper_is_blank(value: Any) -> bool:
+    return value is None or (isinstance(value, str) and value.strip() == "")
+
 
 # 执行导入（校验失败不落库）
 def import_data(
@@ -29,46 +123,6 @@ def import_data(
     db: Session,
     admin_id: int,
 ) -> dict[str, Any]:
-    def _helper_parse_bool(value: Any) -> bool:
-        if isinstance(value, bool):
-            return value
-        if isinstance(value, (int, float)):
-            return bool(value)
-        if isinstance(value, str):
-            return value.strip().lower() in {"1", "true", "yes"}
-        return False
-
-    def _helper_convert_value(column: Any, value: Any) -> Any:
-        if isinstance(value, str) and value.strip() == "":
-            return None
-
-        try:
-            python_type = column.type.python_type
-        except (NotImplementedError, AttributeError):
-            return value
-
-        if python_type is bool:
-            return _helper_parse_bool(value)
-        if python_type is int:
-            return int(value)
-        if python_type is float:
-            return float(value)
-        if python_type is date:
-            if isinstance(value, datetime):
-                return value.date()
-            if isinstance(value, date):
-                return value
-            if isinstance(value, str):
-                return date.fromisoformat(value)
-        if python_type is datetime:
-            if isinstance(value, datetime):
-                return value
-            if isinstance(value, str):
-                return datetime.fromisoformat(value)
-        if python_type is str:
-            return str(value)
-        return python_type(value)
-
     if table_name not in ALLOWED_TABLES:
         raise HTTPException(status_code=400, detail="Invalid table for import")
 
@@ -110,20 +164,7 @@ def import_data(
         raise HTTPException(status_code=400, detail="Only CSV or XLSX is supported")
 
     model = ALLOWED_TABLES[table_name]
-    allowed: dict[str, Any] = {}
-    required: set[str] = set()
-    for column in model.__table__.columns:
-        if column.name in EXCLUDED_COLUMNS:
-            continue
-        allowed[column.name] = column
-        is_autoincrement_pk = bool(column.primary_key and column.autoincrement is True)
-        if (
-            not column.nullable
-            and column.default is None
-            and column.server_default is None
-            and not is_autoincrement_pk
-        ):
-            required.add(column.name)
+    allowed, required = _helper_collect_columns(model)
 
     errors: list[dict[str, Any]] = []
     records: list[dict[str, Any]] = []
@@ -199,6 +240,7 @@ def import_data(
         )
         db.add(log)
         db.commit()
+        bump_data_version(model.__tablename__)
     except Exception as exc:
         db.rollback()
         log = ImportLog(
@@ -226,3 +268,296 @@ def import_data(
         "errors": [],
     }
 
+
+# 多 Sheet 工作簿导入：按外键依赖顺序逐 Sheet 流式写入，每个 Sheet 一个事务
+def import_workbook(
+    filename: str,
+    content: bytes,
+    db: Session,
+    admin_id: int,
+) -> dict[str, Any]:
+    def _helper_normalize_key_part(value: Any) -> str:
+        if isinstance(value, float) and value.is_integer():
+            value = int(value)
+        return str(value).strip()
+
+    def _helper_load_key_index(table: str) -> dict[tuple[str, ...], int]:
+        """作用：一次性读取表中未删除记录的自然键 -> ID 映射。"""
+        model = WORKBOOK_TABLES[table]
+        key_columns = [getattr(model, name) for name in NATURAL_KEYS[table]]
+        stmt = select(model.id, *key_columns).where(model.is_deleted == False)
+        index: dict[tuple[str, ...], int] = {}
+        for row in db.execute(stmt):
+            key = tuple(_helper_normalize_key_part(part) for part in row[1:])
+            index.setdefault(key, int(row[0]))
+        return index
+
+    def _helper_get_key_index(table: str) -> dict[tuple[str, ...], int]:
+        if table not in key_indexes:
+            key_indexes[table] = _helper_load_key_index(table)
+        return key_indexes[table]
+
+    def _helper_resolve_reference(ref_table: str, row: dict[str, Any]) -> tuple[bool, int | None, str]:
+        """作用：按被引用表的自然键从当前行解析外键 ID。
+
+        输出参数：
+        - tuple[bool, int | None, str]：是否提供了自然键、解析出的 ID、自然键描述（用于错误提示）。
+        """
+        key_names = NATURAL_KEYS.get(ref_table)
+        if not key_names:
+            return False, None, ""
+        ref_fk_columns = fk_columns_by_table.get(ref_table, {})
+        parts: list[str] = []
+        descriptions: list[str] = []
+        provided = False
+        complete = True
+        for key_name in key_names:
+            if key_name in ref_fk_columns:
+                sub_provided, sub_id, sub_desc = _helper_resolve_reference(ref_fk_columns[key_name], row)
+                provided = provided or sub_provided
+                descriptions.append(sub_desc or f"{key_name}=?")
+                if sub_id is None:
+                    complete = False
+                    continue
+                parts.append(_helper_normalize_key_part(sub_id))
+                continue
+            raw = row.get(key_name)
+            if _helper_is_blank(raw):
+                complete = False
+                descriptions.append(f"{key_name}=?")
+                continue
+            provided = True
+            parts.append(_helper_normalize_key_part(raw))
+            descriptions.append(f"{key_name}={parts[-1]}")
+        key_desc = ", ".join(descriptions)
+        if not provided:
+            return False, None, ""
+        if not complete:
+            return True, None, key_desc
+        return True, _helper_get_key_index(ref_table).get(tuple(parts)), key_desc
+
+    def _helper_write_log(table: str, sheet_name: str, total: int, success: int, failed: int, status: str,
+                          error_summary: str | None) -> None:
+        db.add(
+            ImportLog(
+                table_name=table,
+                filename=f"{filename}#{sheet_name}",
+                total_rows=total,
+                success_rows=success,
+                failed_rows=failed,
+                status=status,
+                error_summary=error_summary,
+                created_by=admin_id,
+            )
+        )
+        db.commit()
+
+    if not content:
+        raise HTTPException(status_code=400, detail="Empty file")
+    if not (filename or "").lower().endswith(".xlsx"):
+        raise HTTPException(status_code=400, detail="Only XLSX is supported for workbook import")
+
+    try:
+        wb = load_workbook(io.BytesIO(content), read_only=True, data_only=True)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid XLSX file")
+
+    try:
+        sheet_titles: dict[str, str] = {}
+        unknown_sheets: list[str] = []
+        for title in wb.sheetnames:
+            table = title.strip().lower()
+            if table not in WORKBOOK_TABLES:
+                unknown_sheets.append(title)
+                continue
+            if table in sheet_titles:
+                raise HTTPException(status_code=400, detail=f"Duplicate sheet for table: {table}")
+            sheet_titles[table] = title
+        if unknown_sheets:
+            raise HTTPException(status_code=400, detail=f"Unknown sheets: {', '.join(unknown_sheets)}")
+        if not sheet_titles:
+            raise HTTPException(status_code=400, detail="No importable sheets")
+
+        fk_columns_by_table: dict[str, dict[str, str]] = {}
+        for table, model in WORKBOOK_TABLES.items():
+            fk_columns_by_table[table] = {
+                fk.parent.name: fk.column.table.name for fk in model.__table__.foreign_keys
+            }
+
+        dependencies = {
+            table: {
+                ref_table
+                for ref_table in fk_columns_by_table[table].values()
+                if ref_table in sheet_titles and ref_table != table
+            }
+            for table in sheet_titles
+        }
+        try:
+            load_order = list(TopologicalSorter(dependencies).static_order())
+        except CycleError:
+            raise HTTPException(status_code=400, detail="Circular sheet dependency")
+
+        # 后续 Sheet 需要通过自然键引用的表，写入后需刷新其内存索引
+        referenced_tables: set[str] = set()
+        pending = [ref for table in sheet_titles for ref in fk_columns_by_table[table].values()]
+        while pending:
+            ref_table = pending.pop()
+            if ref_table in referenced_tables or ref_table not in NATURAL_KEYS:
+                continue
+            referenced_tables.add(ref_table)
+            for key_name in NATURAL_KEYS[ref_table]:
+                nested_ref = fk_columns_by_table.get(ref_table, {}).get(key_name)
+                if nested_ref:
+                    pending.append(nested_ref)
+
+        key_indexes: dict[str, dict[tuple[str, ...], int]] = {}
+        sheet_results: list[dict[str, Any]] = []
+        all_errors: list[dict[str, Any]] = []
+        aborted = False
+
+        for order, table in enumerate(load_order, start=1):
+            sheet_name = sheet_titles[table]
+            if aborted:
+                sheet_results.append(
+                    {
+                        "table": table,
+                        "sheet": sheet_name,
+                        "order": order,
+                        "status": "skipped",
+                        "total": 0,
+                        "success": 0,
+                        "failed": 0,
+                        "errors": [],
+                    }
+                )
+                continue
+
+            model = WORKBOOK_TABLES[table]
+            allowed, required = _helper_collect_columns(model)
+            fk_columns = fk_columns_by_table[table]
+            errors: list[dict[str, Any]] = []
+            batch: list[dict[str, Any]] = []
+            total_rows = 0
+            failed_row_indexes: set[int] = set()
+
+            try:
+                rows_iter = wb[sheet_name].iter_rows(values_only=True)
+                header_row = next(rows_iter, None) or ()
+                headers = [str(cell).strip() if cell is not None else "" for cell in header_row]
+                for row_index, raw_row in enumerate(rows_iter, start=2):
+                    if raw_row is None or all(_helper_is_blank(cell) for cell in raw_row):
+                        continue
+                    total_rows += 1
+                    row: dict[str, Any] = {}
+                    for col_idx, header in enumerate(headers):
+                        if header:
+                            row[header] = raw_row[col_idx] if col_idx < len(raw_row) else None
+
+                    row_errors: list[dict[str, Any]] = []
+                    for fk_column, ref_table in fk_columns.items():
+                        if not _helper_is_blank(row.get(fk_column)):
+                            continue
+                        provided, ref_id, key_desc = _helper_resolve_reference(ref_table, row)
+                        if not provided:
+                            continue
+                        if ref_id is None:
+                            row_errors.append(
+                                {
+                                    "sheet": sheet_name,
+                                    "row": row_index,
+                                    "field": fk_column,
+                                    "message": f"reference not found: {ref_table}({key_desc})",
+                                }
+                            )
+                            continue
+                        row[fk_column] = ref_id
+
+                    errored_fields = {item["field"] for item in row_errors}
+                    for field in required:
+                        if field not in errored_fields and _helper_is_blank(row.get(field)):
+                            row_errors.append({"sheet": sheet_name, "row": row_index, "field": field, "message": "required"})
+
+                    data: dict[str, Any] = {}
+                    for field, column in allowed.items():
+                        raw = row.get(field)
+                        if _helper_is_blank(raw):
+                            continue
+                        try:
+                            data[field] = _helper_convert_value(column, raw)
+                        except Exception:
+                            row_errors.append(
+                                {"sheet": sheet_name, "row": row_index, "field": field, "message": "invalid type"}
+                            )
+
+                    if row_errors:
+                        errors.extend(row_errors)
+                        failed_row_indexes.add(row_index)
+                        continue
+                    if errors:
+                        # 已出现校验错误：本 Sheet 不再写库，只继续校验以完整返回错误
+                        continue
+
+                    data["created_by"] = admin_id
+                    data["updated_by"] = admin_id
+                    data["is_deleted"] = False
+                    batch.append(data)
+                    if len(batch) >= WORKBOOK_INSERT_BATCH_SIZE:
+                        db.execute(insert(model.__table__), batch)
+                        batch = []
+
+                if errors:
+                    db.rollback()
+                    _helper_write_log(
+                        table, sheet_name, total_rows, 0, len(failed_row_indexes), "failed", str(errors[:10])
+                    )
+                    status = "failed"
+                    success_rows = 0
+                    failed_rows = len(failed_row_indexes)
+                else:
+                    if batch:
+                        db.execute(insert(model.__table__), batch)
+                    # 日志与本 Sheet 数据同一事务提交
+                    _helper_write_log(table, sheet_name, total_rows, total_rows, 0, "success", None)
+                    bump_data_version(model.__tablename__)
+                    status = "success"
+                    success_rows = total_rows
+                    failed_rows = 0
+                    if table in referenced_tables:
+                        key_indexes[table] = _helper_load_key_index(table)
+            except Exception as exc:
+                db.rollback()
+                _helper_write_log(table, sheet_name, total_rows, 0, total_rows, "failed", str(exc))
+                errors.append({"sheet": sheet_name, "row": 0, "field": "", "message": "Import failed"})
+                status = "failed"
+                success_rows = 0
+                failed_rows = total_rows
+
+            if status == "failed":
+                aborted = True
+            all_errors.extend(errors)
+            sheet_results.append(
+                {
+                    "table": table,
+                    "sheet": sheet_name,
+                    "order": order,
+                    "status": status,
+                    "total": total_rows,
+                    "success": success_rows,
+                    "failed": failed_rows,
+                    "errors": errors,
+                }
+            )
+    finally:
+        wb.close()
+
+    return {
+        "summary": {
+            "filename": filename,
+            "sheets": len(sheet_results),
+            "total": sum(item["total"] for item in sheet_results),
+            "success": sum(item["success"] for item in sheet_results),
+            "failed": sum(item["failed"] for item in sheet_results),
+        },
+        "sheets": sheet_results,
+        "errors": all_errors,
+    }
@@ -0,0 +1,295 @@
+from __future__ import annotations
+
+import asyncio
+import importlib.util
+import json
+import re
+import threading
+import weakref
+from typing import Any
+
+import httpx
+from openai import AsyncOpenAI
+
+from app.core.config import settings
+
+
+class LLMClientManager:
+    """作用：进程级大模型客户端管理器。
+
+    每个模型在每个事件循环下各持有一个长连接池（httpx.AsyncClient），调用间复用 TCP+TLS 连接；
+    超时按调用传入，连接数上限按模型配置。
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._async_clients: weakref.WeakKeyDictionary[
+            asyncio.AbstractEventLoop, dict[str, tuple[httpx.AsyncClient, AsyncOpenAI]]
+        ] = weakref.WeakKeyDictionary()
+        self._stats: dict[str, dict[str, int]] = {}
+
+    def _helper_client_kwargs(self) -> dict[str, Any]:
+        """作用：构建 OpenAI 客户端公共参数。
+
+        输入参数：
+        - 无。
+
+        输出参数：
+        - 返回值类型: dict[str, Any]。
+        """
+
+        if not settings.llm_api_key:
+            raise RuntimeError("未配置 LLM_API_KEY，无法执行工作流")
+        kwargs: dict[str, Any] = {"api_key": settings.llm_api_key}
+        if settings.llm_base_url:
+            kwargs["base_url"] = settings.llm_base_url
+        return kwargs
+
+    def _helper_limits(self, model_name: str) -> httpx.Limits:
+        """作用：按模型解析连接池上限。
+
+        输入参数：
+        - model_name: str。
+
+        输出参数：
+        - 返回值类型: httpx.Limits。
+        """
+
+        max_connections = settings.llm_model_max_connections.get(model_name, settings.llm_max_connections)
+        return httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=min(max_connections, settings.llm_max_keepalive_connections),
+            keepalive_expiry=settings.llm_keepalive_expiry,
+        )
+
+    def _helper_stats_for(self, model_name: str) -> dict[str, int]:
+        """作用：获取（必要时初始化）模型的连接统计项，调用方需持有锁。
+
+        输入参数：
+        - model_name: str。
+
+        输出参数：
+        - 返回值类型: dict[str, int]。
+        """
+
+        stats = self._stats.get(model_name)
+        if stats is None:
+            stats = {"requests": 0, "new_connections": 0}
+            self._stats[model_name] = stats
+        return stats
+
+    def _helper_record(self, model_name: str, key: str) -> None:
+        """作用：累加连接统计计数。
+
+        输入参数：
+        - model_name: str。
+        - key: str。
+
+        输出参数：
+        - 无。
+        """
+
+        with self._lock:
+            self._helper_stats_for(model_name)[key] += 1
+
+    def _helper_trace(self, model_name: str):
+        """作用：构建 httpcore trace 回调（异步连接池要求为协程函数），建立新 TCP 连接时计数。
+
+        输入参数：
+        - model_name: str。
+
+        输出参数：
+        - 返回值类型: Callable[[str, dict], Awaitable[None]]。
+        """
+
+        async def _helper_on_trace(event_name: str, info: dict[str, Any]) -> None:
+            if event_name == "connection.connect_tcp.complete":
+                self._helper_record(model_name, "new_connections")
+
+        return _helper_on_trace
+
+    def get_async_client(self, model_name: str) -> AsyncOpenAI:
+        """作用：获取指定模型在当前事件循环下的异步客户端（同一事件循环内复用）。
+
+        输入参数：
+        - model_name: str。
+
+        输出参数：
+        - 返回值类型: AsyncOpenAI。
+        """
+
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            loop_clients = self._async_clients.get(loop)
+            if loop_clients is None:
+                loop_clients = {}
+                self._async_clients[loop] = loop_clients
+            cached = loop_clients.get(model_name)
+            if cached is not None:
+                return cached[1]
+
+            trace = self._helper_trace(model_name)
+
+            async def _helper_on_request(request: httpx.Request) -> None:
+                request.extensions["trace"] = trace
+                self._helper_record(model_name, "requests")
+
+            http_client = httpx.AsyncClient(
+                trust_env=False,
+                limits=self._helper_limits(model_name),
+                http2=llm_http2_enabled(),
+                event_hooks={"request": [_helper_on_request]},
+            )
+            client = AsyncOpenAI(**self._helper_client_kwargs(), http_client=http_client)
+            loop_clients[model_name] = (http_client, client)
+            return client
+
+    def stats(self) -> dict[str, dict[str, int]]:
+        """作用：返回按模型统计的请求数、新建连接数与复用连接数。
+
+        输入参数：
+        - 无。
+
+        输出参数：
+        - 返回值类型: dict[str, dict[str, int]]。
+        """
+
+        with self._lock:
+            result: dict[str, dict[str, int]] = {}
+            for model_name, stats in self._stats.items():
+                requests = stats["requests"]
+                new_connections = stats["new_connections"]
+                result[model_name] = {
+                    "requests": requests,
+                    "new_connections": new_connections,
+                    "reused_connections": max(requests - new_connections, 0),
+                }
+            return result
+
+    async def aclose(self) -> None:
+        """作用：关闭当前事件循环下的异步连接池。
+
+        输入参数：
+        - 无。
+
+        输出参数：
+        - 无。
+        """
+
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            loop_clients = self._async_clients.pop(loop, None) or {}
+        for http_client, _ in loop_clients.values():
+            await http_client.aclose()
+
+
+class JsonStringFieldExtractor:
+    """作用：从流式输出的 JSON 文本中增量提取某个字符串字段的内容。
+
+    模型按 {"summary": "..."} 输出时，每收到一段文本即可返回该字段新增的已解码文字；
+    转义序列（含 \\uXXXX 代理对）不会被拆开，字段结束引号之后的内容忽略。
+    """
+
+    _DECODER = json.JSONDecoder(strict=False)
+
+    def __init__(self, field_name: str) -> None:
+        self._key_pattern = re.compile(r'"%s"\s*:\s*"' % re.escape(field_name))
+        self._buffer = ""
+        self._pos: int | None = None
+        self._done = False
+
+    def feed(self, chunk: str) -> str:
+        """作用：追加一段模型输出，返回字段新增的已解码文本（可能为空串）。
+
+        输入参数：
+        - chunk: str。
+
+        输出参数：
+        - 返回值类型: str。
+        """
+
+        if self._done or not chunk:
+            return ""
+        self._buffer += chunk
+        if self._pos is None:
+            match = self._key_pattern.search(self._buffer)
+            if not match:
+                return ""
+            self._pos = match.end()
+
+        buffer = self._buffer
+        length = len(buffer)
+        index = self._pos
+        safe_end = index
+        while index < length:
+            char = buffer[index]
+            if char == "\\":
+                if index + 1 >= length:
+                    break
+                if buffer[index + 1] != "u":
+                    index += 2
+                elif index + 6 > length:
+                    break
+                else:
+                    try:
+                        is_high_surrogate = 0xD800 <= int(buffer[index + 2:index + 6], 16) <= 0xDBFF
+                    except ValueError:
+                        is_high_surrogate = False
+                    if is_high_surrogate and buffer[index + 6:index + 8] == "\\u":
+                        if index + 12 > length:
+                            break
+                        index += 12
+                    elif is_high_surrogate and index + 8 > length:
+                        break
+                    else:
+                        index += 6
+                safe_end = index
+                continue
+            if char == '"':
+                self._done = True
+                break
+            index += 1
+            safe_end = index
+
+        raw = buffer[self._pos:safe_end]
+        self._pos = safe_end
+        if not raw:
+            return ""
+        try:
+            return self._DECODER.decode(f'"{raw}"')
+        except ValueError:
+            return raw
+
+
+def llm_http2_enabled() -> bool:
+    """作用：判断是否启用 HTTP/2；auto 模式下仅当安装了 h2 时启用。
+
+    输入参数：
+    - 无。
+
+    输出参数：
+    - 返回值类型: bool。
+    """
+
+    if settings.llm_http2 == "off":
+        return False
+    available = importlib.util.find_spec("h2") is not None
+    if settings.llm_http2 == "on" and not available:
+        raise RuntimeError("LLM_HTTP2=on 需要安装 h2（pip install 'httpx[http2]'）")
+    return available
+
+
+def build_llm_timeout(timeout: float) -> httpx.Timeout:
+    """作用：构建单次调用超时，连接阶段使用独立的较短超时。
+
+    输入参数：
+    - timeout: float。
+
+    输出参数：
+    - 返回值类型: httpx.Timeout。
+    """
+
+    return httpx.Timeout(timeout, connect=min(timeout, settings.llm_connect_timeout))
+
+
+llm_client_manager = LLMClientManager()
@@ -0,0 +1,374 @@
+from __future__ import annotations
+
+import gzip
+import json
+import os
+import queue
+import re
+import shutil
+import threading
+from pathlib import Path
+from typing import Any, BinaryIO
+
+from app.core.config import settings
+from app.core.logger import get_logger
+
+try:
+    import zstandard
+except ImportError:  # zstandard 为可选依赖，未安装时 zstd 压缩回退为 gzip
+    zstandard = None
+
+SEGMENT_PREFIX = "segment-"
+SEGMENT_SUFFIX = ".ndjson"
+INDEX_FILE_NAME = "index.ndjson"
+FLUSH_WAIT_SECONDS = 5.0
+
+_SEGMENT_NAME_PATTERN = re.compile(rf"^{SEGMENT_PREFIX}(\d+){re.escape(SEGMENT_SUFFIX)}(?:\.gz|\.zst)?$")
+_STOP = object()
+
+logger = get_logger("node_io")
+
+
+class NodeIoStore:
+    """作用：节点输入输出日志存储：NDJSON 记录由后台线程顺序追加到按大小轮转的分段文件。
+
+    轮转后的分段可选 gzip/zstd 压缩；索引记录 session_id -> (分段, 偏移, 长度)，
+    同时追加写入 index.ndjson，重启后可重建，按会话读取时只需定位对应记录。
+    每批记录落盘后才写入索引，写入失败时分段与索引都截断回上一批的末尾，索引不会指向残缺的记录；
+    轮转时只保留最近 NODE_IO_MAX_SEGMENTS 个分段，并据此压缩 index.ndjson 与内存索引。
+    """
+
+    def __init__(self, root: Path | str) -> None:
+        self.root = Path(root)
+        self._queue: queue.SimpleQueue[Any] = queue.SimpleQueue()
+        self._start_lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+        self._index_lock = threading.Lock()
+        self._index: dict[str, list[tuple[str, int, int]]] | None = None
+        self._segment_seq = 0
+        self._segment_fp: BinaryIO | None = None
+        self._segment_size = 0
+        self._segment_committed_size = 0
+        self._segment_label = ""
+        self._pending: list[tuple[str, tuple[str, int, int]]] = []
+        self._index_fp: BinaryIO | None = None
+        self._index_size = 0
+
+    def append(self, record: dict[str, Any]) -> None:
+        """作用：提交一条记录（需已转为 JSON 安全值），立即返回，由后台线程写入。
+
+        输入参数：
+        - record: dict[str, Any]，须包含 session_id。
+
+        输出参数：
+        - 无。
+        """
+
+        self._ensure_started()
+        self._queue.put(record)
+
+    def flush(self, timeout: float = FLUSH_WAIT_SECONDS) -> None:
+        """作用：等待已提交的记录全部写入文件。
+
+        输入参数：
+        - timeout: float。
+
+        输出参数：
+        - 无。
+        """
+
+        if self._thread is None:
+            return
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait(timeout)
+
+    def close(self) -> None:
+        """作用：写完队列中剩余记录后停止后台线程（应用退出时调用）。
+
+        输入参数：
+        - 无。
+
+        输出参数：
+        - 无。
+        """
+
+        with self._start_lock:
+            thread = self._thread
+            self._thread = None
+        if thread is not None:
+            self._queue.put(_STOP)
+            thread.join(FLUSH_WAIT_SECONDS)
+
+    def read_session(self, session_id: str) -> list[dict[str, Any]]:
+        """作用：按索引读取某个会话的全部记录（按写入顺序）。
+
+        输入参数：
+        - session_id: str。
+
+        输出参数：
+        - 返回值类型: list[dict[str, Any]]。
+        """
+
+        self.flush()
+        with self._index_lock:
+            entries = list(self._load_index().get(session_id, []))
+        records: list[dict[str, Any]] = []
+        by_segment: dict[str, list[tuple[int, int]]] = {}
+        for segment, offset, length in entries:
+            by_segment.setdefault(segment, []).append((offset, length))
+        for segment, positions in by_segment.items():
+            segment_path = self._resolve_segment_path(segment)
+            if segment_path is None:
+                continue
+            try:
+                fp = self._open_segment_for_read(segment_path)
+            except FileNotFoundError:
+                # 分段在定位后被轮转清理
+                continue
+            with fp:
+                for offset, length in sorted(positions):
+                    fp.seek(offset)
+                    line = fp.read(length)
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        continue
+        return records
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is not None:
+                return
+            thread = threading.Thread(target=self._run, name="node-io-writer", daemon=True)
+            thread.start()
+            self._thread = thread
+
+    def _load_index(self) -> dict[str, list[tuple[str, int, int]]]:
+        """作用：首次使用时从 index.ndjson 重建内存索引，调用方需持有索引锁。
+
+        写线程启动时即加载，之后由写线程在同一把锁内增量维护，读方不会读到缺失已缓冲未落盘的条目。
+        """
+
+        if self._index is not None:
+            return self._index
+        index: dict[str, list[tuple[str, int, int]]] = {}
+        index_path = self.root / INDEX_FILE_NAME
+        if index_path.exists():
+            with index_path.open("rb") as fp:
+                for line in fp:
+                    try:
+                        session_id, segment, offset, length = json.loads(line)
+                    except ValueError:
+                        continue
+                    index.setdefault(session_id, []).append((segment, int(offset), int(length)))
+        self._index = index
+        return index
+
+    def _resolve_segment_path(self, segment: str) -> Path | None:
+        for suffix in ("", ".gz", ".zst"):
+            path = self.root / f"{segment}{suffix}"
+            if path.exists():
+                return path
+        return None
+
+    @staticmethod
+    def _open_segment_for_read(path: Path) -> BinaryIO:
+        if path.name.endswith(".gz"):
+            return gzip.open(path, "rb")
+        if path.name.endswith(".zst"):
+            if zstandard is None:
+                raise RuntimeError("读取 .zst 分段需要安装 zstandard")
+            return zstandard.ZstdDecompressor().stream_reader(path.open("rb"), closefd=True)
+        return path.open("rb")
+
+    def _open_next_segment(self) -> None:
+        """作用：在写线程中打开新的分段文件（序号接续已有分段）。"""
+
+        if self._segment_seq == 0:
+            self._segment_seq = max(self._existing_segment_seqs(), default=0)
+        self._segment_seq += 1
+        self._segment_label = self._segment_name()
+        self._segment_fp = (self.root / self._segment_label).open("ab")
+        self._segment_size = self._segment_fp.tell()
+        self._segment_committed_size = self._segment_size
+
+    def _existing_segment_seqs(self) -> set[int]:
+        return {
+            int(match.group(1))
+            for match in (_SEGMENT_NAME_PATTERN.match(item.name) for item in self.root.iterdir())
+            if match
+        }
+
+    def _segment_name(self, seq: int | None = None) -> str:
+        return f"{SEGMENT_PREFIX}{self._segment_seq if seq is None else seq:06d}{SEGMENT_SUFFIX}"
+
+    def _rotate(self) -> None:
+        """作用：关闭当前分段并按配置压缩，然后打开下一个分段，并清理超出保留数的旧分段。"""
+
+        closed_path = self.root / self._segment_name()
+        self._segment_fp.close()
+        self._segment_fp = None
+        self._compress_segment(closed_path)
+        self._open_next_segment()
+        self._drop_old_segments()
+
+    def _drop_old_segments(self) -> None:
+        """作用：删除超出 NODE_IO_MAX_SEGMENTS 的最旧分段，并重写 index.ndjson、移除内存索引中指向它们的条目。"""
+
+        max_segments = settings.node_io_max_segments
+        if max_segments <= 0:
+            return
+        seqs = sorted(self._existing_segment_seqs())
+        if len(seqs) <= max_segments:
+            return
+        dropped = {self._segment_name(seq) for seq in seqs[:-max_segments]}
+        index_path = self.root / INDEX_FILE_NAME
+        tmp_path = index_path.with_name(f"{INDEX_FILE_NAME}.tmp")
+        with self._index_lock:
+            index = self._load_index()
+            for session_id in list(index):
+                entries = [entry for entry in index[session_id] if entry[0] not in dropped]
+                if entries:
+                    index[session_id] = entries
+                else:
+                    del index[session_id]
+            with tmp_path.open("wb") as fp:
+                for session_id, entries in index.items():
+                    for entry in entries:
+                        fp.write((json.dumps([session_id, *entry]) + "\n").encode("utf-8"))
+            self._index_fp.close()
+            os.replace(tmp_path, index_path)
+            self._index_fp = index_path.open("ab")
+            self._index_size = self._index_fp.tell()
+        for segment in dropped:
+            for suffix in ("", ".gz", ".zst"):
+                (self.root / f"{segment}{suffix}").unlink(missing_ok=True)
+
+    @staticmethod
+    def _compress_segment(path: Path) -> None:
+        compression = settings.node_io_compression
+        if compression == "none":
+            return
+        if compression == "zstd" and zstandard is not None:
+            target = path.with_name(f"{path.name}.zst")
+            tmp_path = path.with_name(f"{target.name}.tmp")
+            with path.open("rb") as src, tmp_path.open("wb") as dst:
+                zstandard.ZstdCompressor().copy_stream(src, dst)
+        else:
+            target = path.with_name(f"{path.name}.gz")
+            tmp_path = path.with_name(f"{target.name}.tmp")
+            with path.open("rb") as src, gzip.open(tmp_path, "wb") as dst:
+                shutil.copyfileobj(src, dst)
+        os.replace(tmp_path, target)
+        path.unlink(missing_ok=True)
+
+    def _write_record(self, record: dict[str, Any]) -> None:
+        line = (json.dumps(record, ensure_ascii=False, default=str) + "\n").encode("utf-8")
+        if self._segment_fp is None:
+            self._open_next_segment()
+        elif self._segment_size > 0 and self._segment_size + len(line) > settings.node_io_segment_max_bytes:
+            self._commit_pending()
+            self._rotate()
+        offset = self._segment_size
+        self._segment_fp.write(line)
+        self._segment_size += len(line)
+        self._pending.append((str(record.get("session_id") or ""), (self._segment_label, offset, len(line))))
+
+    def _commit_pending(self) -> None:
+        """作用：把本批记录刷入分段文件，成功后再写入索引（文件与内存）。"""
+
+        if self._segment_fp is not None:
+            self._segment_fp.flush()
+        self._segment_committed_size = self._segment_size
+        if not self._pending:
+            return
+        lines = b"".join((json.dumps([session_id, *entry]) + "\n").encode("utf-8") for session_id, entry in self._pending)
+        with self._index_lock:
+            self._index_fp.write(lines)
+            self._index_fp.flush()
+            self._index_size += len(lines)
+            index = self._load_index()
+            for session_id, entry in self._pending:
+                index.setdefault(session_id, []).append(entry)
+        self._pending.clear()
+
+    def _discard_pending(self) -> None:
+        """作用：写入失败后丢弃本批记录：分段与索引文件截断回上一批的末尾，之后的记录从该处继续写入。"""
+
+        dropped = len(self._pending)
+        self._pending.clear()
+        if self._segment_fp is not None:
+            segment_path = self.root / self._segment_label
+            self._segment_fp = self._reopen_truncated(self._segment_fp, segment_path, self._segment_committed_size)
+            self._segment_size = self._segment_committed_size
+        if self._index_fp is not None:
+            self._index_fp = self._reopen_truncated(self._index_fp, self.root / INDEX_FILE_NAME, self._index_size)
+        logger.warning("node io batch discarded", extra={"payload": {"segment": self._segment_label, "records": dropped}})
+
+    @staticmethod
+    def _reopen_truncated(fp: BinaryIO, path: Path, size: int) -> BinaryIO:
+        try:
+            fp.close()
+        except OSError:
+            # 缓冲区中未写出的残缺数据随后被截断
+            pass
+        with path.open("r+b") as raw_fp:
+            raw_fp.truncate(size)
+        return path.open("ab")
+
+    def _run(self) -> None:
+        """作用：写线程主循环：批量取出队列中的记录写入，队列清空时统一刷盘并写入索引。"""
+
+        self.root.mkdir(parents=True, exist_ok=True)
+        with self._index_lock:
+            self._load_index()
+        self._index_fp = (self.root / INDEX_FILE_NAME).open("ab")
+        self._index_size = self._index_fp.tell()
+        waiters: list[threading.Event] = []
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            while True:
+                if item is _STOP:
+                    stopping = True
+                elif isinstance(item, threading.Event):
+                    waiters.append(item)
+                else:
+                    try:
+                        self._write_record(item)
+                    except Exception:
+                        logger.exception("node io record dropped", extra={"payload": {"session_id": item.get("session_id")}})
+                        self._helper_recover()
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            try:
+                self._commit_pending()
+            except Exception:
+                logger.exception("node io batch flush failed", extra={"payload": {"segment": self._segment_label}})
+                self._helper_recover()
+            for waiter in waiters:
+                waiter.set()
+            waiters.clear()
+        if self._segment_fp is not None:
+            self._segment_fp.close()
+            self._segment_fp = None
+        self._index_fp.close()
+        self._index_fp = None
+
+    def _helper_recover(self) -> None:
+        """作用：丢弃失败的一批记录；无法截断时放弃当前分段，下一条记录写入新分段。"""
+
+        try:
+            self._discard_pending()
+        except Exception:
+            logger.exception("node io recovery failed", extra={"payload": {"segment": self._segment_label}})
+            self._pending.clear()
+            self._segment_fp = None
+
+
+node_io_store = NodeIoStore(settings.node_io_log_dir)
@@ -0,0 +1,176 @@
+from __future__ import annotations
+
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.services.data_version_service import get_data_versions
+
+
+@dataclass
+class ProbeMemoEntry:
+    """作用：单个字段的探测取值缓存条目。"""
+
+    values: list[str]
+    data_version: int
+    cached_at: float
+
+
+_MEMO_LOCK = threading.Lock()
+_MEMO_ENTRIES: dict[str, ProbeMemoEntry] = {}
+
+
+def build_probe_sql(field: str, limit: int) -> str:
+    """作用：构造单个字段的取值探测 SQL（去重、非空、未删除，带 LIMIT）。
+
+    输入参数：
+    - field: str，白名单中的 table.field。
+    - limit: int。
+
+    输出参数：
+    - 返回值类型: str。
+    """
+
+    table_name, column_name = field.split(".", 1)
+    return (
+        f"SELECT DISTINCT {table_name}.{column_name} AS value "
+        f"FROM {table_name} "
+        f"WHERE {table_name}.{column_name} IS NOT NULL AND {table_name}.is_deleted = 0 "
+        f"LIMIT {int(limit)}"
+    )
+
+
+def _helper_build_union_sql(fields: list[str], limit: int) -> str:
+    """作用：将多个字段的探测合并为一条 UNION ALL 语句，每个分支用派生表保留各自的 LIMIT。
+
+    取值统一转为字符，避免不同表的列类型/排序规则在 UNION 时冲突。
+
+    输入参数：
+    - fields: list[str]。
+    - limit: int。
+
+    输出参数：
+    - 返回值类型: str。
+    """
+
+    branches = [
+        f"SELECT {index} AS probe_index, CAST(p{index}.value AS CHAR) AS value "
+        f"FROM ({build_probe_sql(field, limit)}) AS p{index}"
+        for index, field in enumerate(fields)
+    ]
+    return "\nUNION ALL\n".join(branches)
+
+
+def _helper_get_memo(field: str, data_version: int) -> list[str] | None:
+    """作用：读取字段探测缓存；超过 TTL 或所在表数据版本变化时视为未命中。
+
+    输入参数：
+    - field: str。
+    - data_version: int。
+
+    输出参数：
+    - 返回值类型: list[str] | None。
+    """
+
+    with _MEMO_LOCK:
+        entry = _MEMO_ENTRIES.get(field)
+        if entry is None:
+            return None
+        expired = (time.time() - entry.cached_at) > settings.hidden_context_probe_cache_ttl_seconds
+        if expired or entry.data_version != data_version:
+            _MEMO_ENTRIES.pop(field, None)
+            return None
+        return list(entry.values)
+
+
+def _helper_put_memo(field: str, values: list[str], data_version: int) -> None:
+    """作用：写入字段探测缓存。
+
+    输入参数：
+    - field: str。
+    - values: list[str]。
+    - data_version: int。
+
+    输出参数：
+    - 无。
+    """
+
+    with _MEMO_LOCK:
+        _MEMO_ENTRIES[field] = ProbeMemoEntry(values=list(values), data_version=data_version, cached_at=time.time())
+
+
+def query_distinct_values(db: Session, fields: list[str], limit: int) -> tuple[dict[str, list[str]], dict[str, str]]:
+    """作用：一次往返查询多个字段的去重取值（UNION ALL，每个字段各自 LIMIT）。
+
+    合并查询失败时（如个别表缺少 is_deleted 列）逐字段回退执行，失败字段单独记录错误，不影响其他字段。
+
+    输入参数：
+    - db: Session。
+    - fields: list[str]，白名单中的 table.field。
+    - limit: int，每个字段的取值上限。
+
+    输出参数：
+    - 返回值类型: tuple[dict[str, list[str]], dict[str, str]]，(成功字段的取值, 失败字段的错误信息)。
+    """
+
+    values: dict[str, list[str]] = {}
+    errors: dict[str, str] = {}
+    if not fields:
+        return values, errors
+    try:
+        rows = db.execute(text(_helper_build_union_sql(fields, limit))).all()
+        values = {field: [] for field in fields}
+        for probe_index, value in rows:
+            if value is not None:
+                values[fields[int(probe_index)]].append(str(value))
+        return values, errors
+    except Exception:
+        values = {}
+    for field in fields:
+        try:
+            rows = db.execute(text(build_probe_sql(field, limit))).mappings().all()
+            values[field] = [str(row.get("value")) for row in rows if row.get("value") is not None]
+        except Exception as exc:
+            errors[field] = str(exc)
+    return values, errors
+
+
+def probe_field_values(db: Session, fields: list[str]) -> list[dict[str, Any]]:
+    """作用：批量探测字段的样例取值：先查缓存，未命中的字段合并为一条 UNION ALL 查询执行。
+
+    输入参数：
+    - db: Session。
+    - fields: list[str]，白名单中的 table.field。
+
+    输出参数：
+    - 返回值类型: list[dict[str, Any]]，按 fields 顺序返回 {field, probe_sql, values[, cached][, error]}。
+    """
+
+    limit = settings.hidden_context_probe_limit
+    versions = get_data_versions(field.split(".", 1)[0] for field in fields)
+    samples: dict[str, dict[str, Any]] = {}
+    pending: list[str] = []
+    for field in fields:
+        data_version = versions.get(field.split(".", 1)[0].lower(), 0)
+        cached_values = _helper_get_memo(field, data_version) if settings.hidden_context_probe_cache_enabled else None
+        sample: dict[str, Any] = {"field": field, "probe_sql": build_probe_sql(field, limit), "values": []}
+        if cached_values is not None:
+            sample["values"] = cached_values
+            sample["cached"] = True
+        else:
+            pending.append(field)
+        samples[field] = sample
+
+    fetched, errors = query_distinct_values(db, pending, limit)
+    for field, error in errors.items():
+        samples[field]["error"] = error
+    for field, field_values in fetched.items():
+        samples[field]["values"] = field_values
+        if settings.hidden_context_probe_cache_enabled:
+            _helper_put_memo(field, field_values, versions.get(field.split(".", 1)[0].lower(), 0))
+    return [samples[field] for field in fields]
@@ -0,0 +1,411 @@
+from __future__ import annotations
+
+import hashlib
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Any
+
+from sqlalchemy import delete, func, or_, select, update
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.models.query_template import QueryTemplate
+from app.services.schema_kb_service import get_schema_kb
+
+QUERY_CACHE_NAME_PREFIX = "answer_cache:"
+QUERY_CACHE_KIND = "answer_cache"
+
+
+@dataclass
+class QueryCacheEntry:
+    """作用：问题→SQL 缓存条目（已验证可执行的 SQL 与实体映射）。"""
+
+    cache_key: str
+    normalized_query: str
+    rewritten_query: str
+    sql: str
+    entity_mappings: list[dict[str, Any]] = field(default_factory=list)
+    sql_fields: list[str] = field(default_factory=list)
+    parse_result: dict[str, Any] | None = None
+    kb_digest: str = ""
+    cached_at: float = 0.0
+    row_updated_at: datetime | None = None
+    touched_at: float = 0.0
+
+
+_CACHE_LOCK = threading.Lock()
+_CACHE_ENTRIES: OrderedDict[str, QueryCacheEntry] = OrderedDict()
+
+
+def normalize_query(query: str) -> str:
+    """作用：归一化改写后的问题文本（全半角、大小写、空白与标点），作为缓存键的基础。
+
+    输入参数：
+    - query: str。
+
+    输出参数：
+    - 返回值类型: str。
+    """
+
+    text_value = unicodedata.normalize("NFKC", str(query or "")).lower()
+    text_value = re.sub(r"[\s　]+", " ", text_value)
+    text_value = "".join(
+        " " if unicodedata.category(ch).startswith("P") else ch for ch in text_value
+    )
+    text_value = re.sub(r"\s+", " ", text_value).strip()
+    # 中文之间/中英文之间的空白不影响语义，仅保留英文单词之间的分隔。
+    return re.sub(r"(?<=[\u4e00-\u9fff]) | (?=[\u4e00-\u9fff])", "", text_value)
+
+
+def build_query_cache_key(normalized_query: str) -> str:
+    """作用：由归一化问题生成定长缓存键（同时作为 QueryTemplate.template_name）。
+
+    输入参数：
+    - normalized_query: str。
+
+    输出参数：
+    - 返回值类型: str。
+    """
+
+    return QUERY_CACHE_NAME_PREFIX + hashlib.sha1(normalized_query.encode("utf-8")).hexdigest()
+
+
+def _helper_is_fresh(entry: QueryCacheEntry, kb_digest: str, now: float) -> bool:
+    """作用：判断条目是否在 TTL 内且与当前知识库版本一致。
+
+    输入参数：
+    - entry: QueryCacheEntry。
+    - kb_digest: str。
+    - now: float。
+
+    输出参数：
+    - 返回值类型: bool。
+    """
+
+    if entry.kb_digest != kb_digest:
+        return False
+    return (now - entry.cached_at) <= settings.query_cache_ttl_seconds
+
+
+def _helper_remember(entry: QueryCacheEntry) -> None:
+    """作用：写入内存 LRU，超出容量时淘汰最久未使用的条目。
+
+    输入参数：
+    - entry: QueryCacheEntry。
+
+    输出参数：
+    - 无。
+    """
+
+    with _CACHE_LOCK:
+        _CACHE_ENTRIES[entry.cache_key] = entry
+        _CACHE_ENTRIES.move_to_end(entry.cache_key)
+        while len(_CACHE_ENTRIES) > settings.query_cache_max_entries:
+            _CACHE_ENTRIES.popitem(last=False)
+
+
+def _helper_forget(cache_key: str) -> None:
+    """作用：从内存 LRU 移除条目。
+
+    输入参数：
+    - cache_key: str。
+
+    输出参数：
+    - 无。
+    """
+
+    with _CACHE_LOCK:
+        _CACHE_ENTRIES.pop(cache_key, None)
+
+
+def _helper_get_row(db: Session, cache_key: str) -> QueryTemplate | None:
+    """作用：读取持久化的缓存行（仅未逻辑删除的行）。
+
+    输入参数：
+    - db: Session。
+    - cache_key: str。
+
+    输出参数：
+    - 返回值类型: QueryTemplate | None。
+    """
+
+    return db.execute(
+        select(QueryTemplate).where(
+            QueryTemplate.template_name == cache_key,
+            QueryTemplate.is_deleted.is_(False),
+        )
+    ).scalars().first()
+
+
+def _helper_row_to_entry(row: QueryTemplate) -> QueryCacheEntry | None:
+    """作用：将 QueryTemplate 行还原为缓存条目。
+
+    输入参数：
+    - row: QueryTemplate。
+
+    输出参数：
+    - 返回值类型: QueryCacheEntry | None。
+    """
+
+    params = row.params_schema if isinstance(row.params_schema, dict) else {}
+    if params.get("kind") != QUERY_CACHE_KIND or not row.template_sql:
+        return None
+    return QueryCacheEntry(
+        cache_key=row.template_name,
+        normalized_query=str(params.get("normalized_query") or ""),
+        rewritten_query=str(row.template_desc or ""),
+        sql=row.template_sql,
+        entity_mappings=list(params.get("entity_mappings") or []),
+        sql_fields=list(params.get("sql_fields") or []),
+        parse_result=params.get("parse_result") if isinstance(params.get("parse_result"), dict) else None,
+        kb_digest=str(params.get("kb_digest") or ""),
+        cached_at=float(params.get("cached_at") or 0.0),
+        row_updated_at=row.updated_at,
+    )
+
+
+def _helper_row_unchanged(db: Session, entry: QueryCacheEntry) -> bool:
+    """作用：核对内存条目对应的持久化行仍有效且未被改写（其他进程的失效或刷新会改变状态或 updated_at）。
+
+    输入参数：
+    - db: Session。
+    - entry: QueryCacheEntry。
+
+    输出参数：
+    - 返回值类型: bool。
+    """
+
+    row_state = db.execute(
+        select(QueryTemplate.status, QueryTemplate.updated_at).where(
+            QueryTemplate.template_name == entry.cache_key,
+            QueryTemplate.is_deleted.is_(False),
+        )
+    ).first()
+    if row_state is None or row_state.status != "active":
+        return False
+    return entry.row_updated_at is not None and row_state.updated_at == entry.row_updated_at
+
+
+def _helper_touch_row(db: Session, entry: QueryCacheEntry, now: float) -> None:
+    """作用：命中时刷新持久化行的 last_used_at（按 QUERY_CACHE_TOUCH_INTERVAL_SECONDS 节流），作为容量淘汰的 LRU 依据。
+
+    只写 last_used_at，updated_at 保持不变，不影响其他进程对内存条目的改写判定。
+
+    输入参数：
+    - db: Session。
+    - entry: QueryCacheEntry。
+    - now: float。
+
+    输出参数：
+    - 无。
+    """
+
+    if now - entry.touched_at < settings.query_cache_touch_interval_seconds:
+        return
+    entry.touched_at = now
+    db.execute(
+        update(QueryTemplate)
+        .where(QueryTemplate.template_name == entry.cache_key)
+        .values(last_used_at=func.now(), updated_at=QueryTemplate.updated_at)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def _helper_prune_rows(db: Session, keep_key: str) -> int:
+    """作用：删除已失效或超过 TTL（按 updated_at）的持久化缓存行，并按 last_used_at 只保留最近命中的
+    query_cache_max_entries 条；由调用方提交事务。
+
+    输入参数：
+    - db: Session。
+    - keep_key: str，刚写入的缓存键，始终保留。
+
+    输出参数：
+    - 返回值类型: int，删除的行数。
+    """
+
+    cache_rows = QueryTemplate.template_name.like(f"{QUERY_CACHE_NAME_PREFIX}%")
+    # TTL 截止时间取数据库时钟，与 updated_at 的 server 端时间一致
+    db_now = db.execute(select(func.now())).scalar()
+    stale = QueryTemplate.is_deleted.is_(True)
+    if isinstance(db_now, datetime):
+        stale = or_(stale, QueryTemplate.updated_at < db_now - timedelta(seconds=settings.query_cache_ttl_seconds))
+    deleted = db.execute(
+        delete(QueryTemplate)
+        .where(cache_rows, QueryTemplate.template_name != keep_key, stale)
+        .execution_options(synchronize_session=False)
+    ).rowcount or 0
+
+    overflow_ids = db.execute(
+        select(QueryTemplate.id)
+        .where(cache_rows, QueryTemplate.template_name != keep_key)
+        .order_by(QueryTemplate.last_used_at.desc(), QueryTemplate.id.desc())
+        .offset(max(settings.query_cache_max_entries - 1, 0))
+    ).scalars().all()
+    if overflow_ids:
+        deleted += db.execute(
+            delete(QueryTemplate)
+            .where(QueryTemplate.id.in_(overflow_ids))
+            .execution_options(synchronize_session=False)
+        ).rowcount or 0
+    return deleted
+
+
+def lookup_query_cache(db: Session, rewritten_query: str) -> tuple[str, QueryCacheEntry | None]:
+    """作用：按改写后问题查找缓存；先查内存 LRU，未命中再查 QueryTemplate。
+
+    过期或知识库已变更的条目会被清除（持久化行置为逻辑删除）；内存命中需持久化行仍有效且未被改写，
+    否则以持久化行为准重新加载，其他进程的失效与刷新因此可见。
+
+    输入参数：
+    - db: Session。
+    - rewritten_query: str。
+
+    输出参数：
+    - 返回值类型: tuple[str, QueryCacheEntry | None]，缓存键与命中条目。
+    """
+
+    normalized_query = normalize_query(rewritten_query)
+    cache_key = build_query_cache_key(normalized_query)
+    if not settings.query_cache_enabled or not normalized_query:
+        return cache_key, None
+
+    kb_digest = get_schema_kb().digest
+    now = time.time()
+
+    with _CACHE_LOCK:
+        entry = _CACHE_ENTRIES.get(cache_key)
+        if entry is not None:
+            _CACHE_ENTRIES.move_to_end(cache_key)
+    if entry is not None:
+        if not _helper_is_fresh(entry, kb_digest, now):
+            invalidate_query_cache(db, cache_key)
+            return cache_key, None
+        if _helper_row_unchanged(db, entry):
+            _helper_touch_row(db, entry, now)
+            return cache_key, entry
+        _helper_forget(cache_key)
+
+    row = _helper_get_row(db, cache_key)
+    if row is None:
+        return cache_key, None
+    entry = _helper_row_to_entry(row)
+    if entry is None or row.status != "active" or not _helper_is_fresh(entry, kb_digest, now):
+        invalidate_query_cache(db, cache_key)
+        return cache_key, None
+    _helper_touch_row(db, entry, now)
+    _helper_remember(entry)
+    return cache_key, entry
+
+
+def store_query_cache(
+        db: Session,
+        cache_key: str,
+        rewritten_query: str,
+        sql_result: dict[str, Any],
+        parse_result: dict[str, Any] | None,
+        admin_id: int,
+        session_id: str,
+) -> QueryCacheEntry | None:
+    """作用：写入（或刷新）缓存条目，同时持久化到 QueryTemplate，并清理过期与超出容量的持久化行；由调用方提交事务。
+
+    输入参数：
+    - db: Session。
+    - cache_key: str。
+    - rewritten_query: str。
+    - sql_result: dict[str, Any]，已验证通过的 SQL 生成结果。
+    - parse_result: dict[str, Any] | None。
+    - admin_id: int。
+    - session_id: str。
+
+    输出参数：
+    - 返回值类型: QueryCacheEntry | None。
+    """
+
+    sql = str(sql_result.get("sql") or "").strip()
+    if not settings.query_cache_enabled or not sql:
+        return None
+
+    entry = QueryCacheEntry(
+        cache_key=cache_key,
+        normalized_query=normalize_query(rewritten_query),
+        rewritten_query=rewritten_query,
+        sql=sql,
+        entity_mappings=list(sql_result.get("entity_mappings") or []),
+        sql_fields=list(sql_result.get("sql_fields") or []),
+        parse_result=parse_result,
+        kb_digest=get_schema_kb().digest,
+        cached_at=time.time(),
+    )
+    params_schema = {
+        "kind": QUERY_CACHE_KIND,
+        "normalized_query": entry.normalized_query,
+        "entity_mappings": entry.entity_mappings,
+        "sql_fields": entry.sql_fields,
+        "parse_result": entry.parse_result,
+        "kb_digest": entry.kb_digest,
+        "cached_at": entry.cached_at,
+    }
+
+    row = db.execute(
+        select(QueryTemplate).where(QueryTemplate.template_name == cache_key)
+    ).scalars().first()
+    if row is None:
+        row = QueryTemplate(template_name=cache_key, created_by=admin_id)
+        db.add(row)
+    row.template_desc = rewritten_query
+    row.template_sql = sql
+    row.params_schema = params_schema
+    row.source_session_id = session_id
+    row.status = "active"
+    row.is_deleted = False
+    row.updated_by = admin_id
+    row.last_used_at = func.now()
+    db.flush()
+    entry.row_updated_at = row.updated_at
+    entry.touched_at = entry.cached_at
+
+    _helper_prune_rows(db, cache_key)
+    _helper_remember(entry)
+    return entry
+
+
+def invalidate_query_cache(db: Session, cache_key: str) -> None:
+    """作用：使缓存条目失效（内存移除 + 持久化行逻辑删除）；由调用方提交事务。
+
+    输入参数：
+    - db: Session。
+    - cache_key: str。
+
+    输出参数：
+    - 无。
+    """
+
+    _helper_forget(cache_key)
+    row = _helper_get_row(db, cache_key)
+    if row is not None:
+        row.is_deleted = True
+        row.status = "expired"
+        db.flush()
+
+
+def build_cached_sql_result(entry: QueryCacheEntry) -> dict[str, Any]:
+    """作用：将缓存条目还原为与 SQL 生成节点一致的输出结构。
+
+    输入参数：
+    - entry: QueryCacheEntry。
+
+    输出参数：
+    - 返回值类型: dict[str, Any]。
+    """
+
+    return {
+        "sql": entry.sql,
+        "entity_mappings": list(entry.entity_mappings),
+        "sql_fields": list(entry.sql_fields),
+        "from_cache": True,
+    }
@@ -0,0 +1,210 @@
+from __future__ import annotations
+
+import csv
+import hashlib
+import json
+import os
+import shutil
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import IO, Any, Iterable
+
+from app.core.config import settings
+
+CHAT_DOWNLOAD_URL_PREFIX = "/api/chat/downloads/"
+
+
+@dataclass
+class SpilledResult:
+    """作用：查询结果的有界表示：内存中仅保留前若干行，其余行写入本地 CSV 文件。"""
+
+    preview_rows: list[dict[str, Any]] = field(default_factory=list)
+    total_rows: int = 0
+    columns: list[str] = field(default_factory=list)
+    file_name: str | None = None
+    content_hash: str = ""
+
+
+def build_result_file_name(prefix: str) -> str:
+    """作用：生成结果文件名（位于聊天导出目录，下载接口按 admin_{id}_ 前缀鉴权）。
+
+    输入参数：
+    - prefix: str，如 admin_1_session_xxx。
+
+    输出参数：
+    - 返回值类型: str。
+    """
+
+    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+    return f"{prefix}_{timestamp}_{uuid.uuid4().hex[:8]}.csv"
+
+
+def build_result_download_url(file_name: str) -> str:
+    """作用：生成结果文件的下载地址。
+
+    输入参数：
+    - file_name: str。
+
+    输出参数：
+    - 返回值类型: str。
+    """
+
+    return f"{CHAT_DOWNLOAD_URL_PREFIX}{file_name}"
+
+
+def clone_result_file(file_name: str, prefix: str) -> str | None:
+    """作用：把聊天导出目录中的结果文件复制为新前缀的文件（优先硬链接，不重复占用磁盘）。
+
+    合并执行的问答共享同一份结果，下载接口按 admin_{id}_ 前缀鉴权，每个请求方需要一份以自己为前缀的文件。
+
+    输入参数：
+    - file_name: str，源文件名。
+    - prefix: str，新文件名前缀，如 admin_1_session_xxx。
+
+    输出参数：
+    - 返回值类型: str | None，新文件名；源文件不存在或复制失败时为 None。
+    """
+
+    export_dir = Path(settings.chat_export_dir)
+    source_path = export_dir / Path(file_name).name
+    cloned_name = build_result_file_name(prefix)
+    cloned_path = export_dir / cloned_name
+    try:
+        os.link(source_path, cloned_path)
+    except OSError:
+        try:
+            shutil.copyfile(source_path, cloned_path)
+        except OSError:
+            return None
+    return cloned_name
+
+
+def _helper_hash_line(row: dict[str, Any]) -> bytes:
+    """作用：结果行的规范化序列化（键排序），用于计算结果内容哈希。
+
+    输入参数：
+    - row: dict[str, Any]。
+
+    输出参数：
+    - 返回值类型: bytes。
+    """
+
+    return (json.dumps(row, ensure_ascii=False, sort_keys=True, default=str) + "\n").encode("utf-8")
+
+
+def hash_result_rows(rows: Iterable[dict[str, Any]]) -> str:
+    """作用：计算结果集内容哈希（sha256，与落盘时流式计算的结果一致）。
+
+    输入参数：
+    - rows: Iterable[dict[str, Any]]。
+
+    输出参数：
+    - 返回值类型: str。
+    """
+
+    digest = hashlib.sha256()
+    for row in rows:
+        digest.update(_helper_hash_line(row))
+    return digest.hexdigest()
+
+
+def build_result_digest(validate_output: dict[str, Any], sample_rows: int) -> dict[str, Any]:
+    """作用：将 sql_validate 输出中的完整结果替换为摘要（行数、列名、前若干行、内容哈希、结果文件引用），用于持久化。
+
+    已是摘要或不含结果列表时原样返回。
+
+    输入参数：
+    - validate_output: dict[str, Any]，sql_validate 节点输出。
+    - sample_rows: int，摘要保留的行数。
+
+    输出参数：
+    - 返回值类型: dict[str, Any]。
+    """
+
+    if not isinstance(validate_output, dict) or not isinstance(validate_output.get("result"), list):
+        return validate_output
+    rows = validate_output["result"]
+    result_file = validate_output.get("result_file")
+    first_row = rows[0] if rows and isinstance(rows[0], dict) else {}
+    digested = {key: value for key, value in validate_output.items() if key not in {"result", "content_hash"}}
+    digested["result_digest"] = {
+        "rows": int(validate_output.get("rows") or len(rows)),
+        "columns": [str(key) for key in first_row.keys()],
+        "sample": rows[:max(sample_rows, 0)],
+        "content_hash": validate_output.get("content_hash") or hash_result_rows(
+            row for row in rows if isinstance(row, dict)
+        ),
+        "result_file": result_file,
+        "download_url": build_result_download_url(result_file) if result_file else None,
+    }
+    return digested
+
+
+def _helper_write_row(writer: Any, columns: list[str], row: dict[str, Any]) -> None:
+    """作用：按列顺序写入一行，缺失列写空串。
+
+    输入参数：
+    - writer: Any，csv.writer 对象。
+    - columns: list[str]。
+    - row: dict[str, Any]。
+
+    输出参数：
+    - 无。
+    """
+
+    writer.writerow(["" if row.get(column) is None else row.get(column) for column in columns])
+
+
+def collect_result_rows(rows: Iterable[dict[str, Any]], preview_limit: int, file_prefix: str) -> SpilledResult:
+    """作用：流式消费查询结果：前 preview_limit 行留在内存，超出时将全部结果顺序写入 CSV 文件。
+
+    文件包含预览行在内的完整结果，可直接作为下载文件；内存占用与结果总行数无关。
+    同时流式计算完整结果的内容哈希（content_hash）。
+
+    输入参数：
+    - rows: Iterable[dict[str, Any]]，已转为 JSON 安全值的结果行。
+    - preview_limit: int。
+    - file_prefix: str，结果文件名前缀。
+
+    输出参数：
+    - 返回值类型: SpilledResult。
+    """
+
+    spilled = SpilledResult()
+    fp: IO[str] | None = None
+    writer: Any = None
+    file_path: Path | None = None
+    content_digest = hashlib.sha256()
+    try:
+        for row in rows:
+            if not spilled.columns:
+                spilled.columns = [str(key) for key in row.keys()]
+            spilled.total_rows += 1
+            content_digest.update(_helper_hash_line(row))
+            if spilled.total_rows <= preview_limit:
+                spilled.preview_rows.append(row)
+                continue
+            if fp is None:
+                export_dir = Path(settings.chat_export_dir)
+                export_dir.mkdir(parents=True, exist_ok=True)
+                spilled.file_name = build_result_file_name(file_prefix)
+                file_path = export_dir / spilled.file_name
+                fp = file_path.open("w", encoding="utf-8-sig", newline="")
+                writer = csv.writer(fp)
+                writer.writerow(spilled.columns)
+                for preview_row in spilled.preview_rows:
+                    _helper_write_row(writer, spilled.columns, preview_row)
+            _helper_write_row(writer, spilled.columns, row)
+    except BaseException:
+        if fp is not None:
+            fp.close()
+            fp = None
+            file_path.unlink(missing_ok=True)
+        raise
+    finally:
+        if fp is not None:
+            fp.close()
+    spilled.content_hash = content_digest.hexdigest()
+    return spilled
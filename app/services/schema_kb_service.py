@@ -0,0 +1,179 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+from app.core.config import settings
+from app.prompts.payload_json import PrecomputedJson
+
+
+@dataclass(frozen=True)
+class SchemaKnowledgeBase:
+    """作用：预计算后的 schema 知识库快照。
+
+    进程内共享、只读；知识库文件变更后整体替换为新快照，不做原地修改。
+    """
+
+    version: int
+    digest: str
+    field_whitelist: list[str]
+    whitelist_set: frozenset[str]
+    alias_pairs: list[dict[str, list[str]]]
+    alias_lookup: dict[str, list[str]]
+    schema_hints: list[dict[str, Any]]
+    table_hints: dict[str, dict[str, Any]]
+    column_hints: dict[str, dict[str, Any]]
+    field_whitelist_json: PrecomputedJson
+    alias_pairs_json: PrecomputedJson
+    schema_hints_json: PrecomputedJson
+    table_hints_json: dict[str, PrecomputedJson]
+
+
+_KB_LOCK = threading.Lock()
+_KB_CACHE: SchemaKnowledgeBase | None = None
+
+
+def _helper_resolve_kb_path() -> Path:
+    """作用：解析知识库文件路径，相对路径按项目根目录解析。
+
+    输入参数：
+    - 无。
+
+    输出参数：
+    - 返回值类型: Path。
+    """
+
+    kb_path = Path(settings.schema_kb_path)
+    if not kb_path.is_absolute():
+        kb_path = Path(__file__).resolve().parents[2] / kb_path
+    return kb_path
+
+
+def _helper_dedup_aliases(aliases: list[str]) -> list[str]:
+    """作用：按小写去重别名，保留首次出现顺序。
+
+    输入参数：
+    - aliases: list[str]。
+
+    输出参数：
+    - 返回值类型: list[str]。
+    """
+
+    dedup_aliases: list[str] = []
+    seen: set[str] = set()
+    for alias in aliases:
+        key = alias.lower()
+        if key in seen:
+            continue
+        seen.add(key)
+        dedup_aliases.append(alias)
+    return dedup_aliases
+
+
+def _helper_build_snapshot(kb: dict[str, Any], version: int, digest: str) -> SchemaKnowledgeBase:
+    """作用：由知识库原始 JSON 构建白名单、别名、结构化提示及其序列化片段。
+
+    输入参数：
+    - kb: dict[str, Any]。
+    - version: int，知识库文件 mtime（纳秒）。
+    - digest: str，知识库文件内容摘要，跨进程/跨机器稳定，供下游缓存判定失效。
+
+    输出参数：
+    - 返回值类型: SchemaKnowledgeBase。
+    """
+
+    fields: list[str] = []
+    alias_pairs: list[dict[str, list[str]]] = []
+    alias_lookup: dict[str, list[str]] = {}
+    schema_hints: list[dict[str, Any]] = []
+    table_hints: dict[str, dict[str, Any]] = {}
+    column_hints: dict[str, dict[str, Any]] = {}
+
+    for table in kb.get("tables", []):
+        table_name = str(table.get("name", "")).strip()
+        if not table_name:
+            continue
+        table_columns: list[dict[str, Any]] = []
+        for column in table.get("columns", []):
+            column_name = str(column.get("name", "")).strip()
+            if not column_name:
+                continue
+            field = f"{table_name}.{column_name}"
+            fields.append(field)
+
+            raw_aliases = column.get("aliases", []) or []
+            aliases = [str(item).strip() for item in raw_aliases if str(item).strip()]
+            aliases.extend([column_name, field])
+            dedup_aliases = _helper_dedup_aliases(aliases)
+
+            alias_pairs.append({field: dedup_aliases})
+            alias_lookup[field] = [alias.lower() for alias in dedup_aliases]
+            column_hint = {
+                "field": field,
+                "field_description": str(column.get("description", "")).strip(),
+                "aliases": dedup_aliases,
+            }
+            table_columns.append(column_hint)
+            column_hints[field] = column_hint
+
+        table_hint = {
+            "table": table_name,
+            "table_description": str(table.get("description", "")).strip(),
+            "columns": table_columns,
+        }
+        schema_hints.append(table_hint)
+        table_hints[table_name] = table_hint
+
+    return SchemaKnowledgeBase(
+        version=version,
+        digest=digest,
+        field_whitelist=fields,
+        whitelist_set=frozenset(fields),
+        alias_pairs=alias_pairs,
+        alias_lookup=alias_lookup,
+        schema_hints=schema_hints,
+        table_hints=table_hints,
+        column_hints=column_hints,
+        field_whitelist_json=PrecomputedJson(json.dumps(fields, ensure_ascii=False)),
+        alias_pairs_json=PrecomputedJson(json.dumps(alias_pairs, ensure_ascii=False)),
+        schema_hints_json=PrecomputedJson(json.dumps(schema_hints, ensure_ascii=False)),
+        table_hints_json={
+            name: PrecomputedJson(json.dumps(hint, ensure_ascii=False)) for name, hint in table_hints.items()
+        },
+    )
+
+
+def get_schema_kb() -> SchemaKnowledgeBase:
+    """作用：获取当前知识库快照；仅在文件 mtime 变化时重新加载。
+
+    常态路径只有一次 stat 调用，不读文件、不解析 JSON。
+
+    输入参数：
+    - 无。
+
+    输出参数：
+    - 返回值类型: SchemaKnowledgeBase。
+    """
+
+    global _KB_CACHE
+
+    kb_path = _helper_resolve_kb_path()
+    version = os.stat(kb_path).st_mtime_ns
+    cached = _KB_CACHE
+    if cached is not None and cached.version == version:
+        return cached
+
+    with _KB_LOCK:
+        cached = _KB_CACHE
+        if cached is not None and cached.version == version:
+            return cached
+        raw = kb_path.read_bytes()
+        kb = json.loads(raw.decode("utf-8"))
+        snapshot = _helper_build_snapshot(kb, version, hashlib.sha1(raw).hexdigest())
+        _KB_CACHE = snapshot
+        return snapshot
@@ -0,0 +1,407 @@
+from __future__ import annotations
+
+import json
+import math
+import re
+import threading
+from collections import deque
+from dataclasses import dataclass
+from typing import Any
+
+from app.core.config import settings
+from app.prompts.payload_json import PrecomputedJson
+from app.services.schema_kb_service import SchemaKnowledgeBase
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+STRUCTURAL_COLUMNS = ("id", "is_deleted")
+
+_ASCII_WORD_PATTERN = re.compile(r"[a-z0-9]+")
+_CJK_RUN_PATTERN = re.compile(r"[一-鿿]+")
+_FIELD_PATTERN = re.compile(r"\b([A-Za-z_][A-Za-z0-9_]*\.[A-Za-z_][A-Za-z0-9_]*)\b")
+
+
+@dataclass(frozen=True)
+class SchemaRetrievalIndex:
+    """作用：知识库的 BM25 倒排索引与外键连接图（随知识库快照整体重建）。
+
+    文档为每个字段（表名 + 字段名 + 字段描述 + 别名）与每张表（表名 + 表描述）；
+    连接图由 `<table>_id` / `<prefix>_<table>_id` 命名约定推导。外键字段的得分计入其指向的表
+    （如 student.college_id 命中“学院”时计入 college），避免到处出现的外键稀释表排序。
+    """
+
+    digest: str
+    doc_keys: tuple[str, ...]
+    doc_tables: tuple[str, ...]
+    postings: dict[str, tuple[tuple[int, int], ...]]
+    doc_lengths: tuple[int, ...]
+    avg_doc_length: float
+    table_columns: dict[str, tuple[str, ...]]
+    join_edges: dict[str, tuple[tuple[str, str, str], ...]]
+
+
+@dataclass(frozen=True)
+class SchemaSubset:
+    """作用：本次 SQL 生成提示词使用的知识库子集（已序列化）与检索统计。"""
+
+    field_whitelist_json: PrecomputedJson
+    alias_pairs_json: PrecomputedJson
+    schema_hints_json: PrecomputedJson
+    stats: dict[str, Any]
+
+
+_INDEX_LOCK = threading.Lock()
+_INDEX_CACHE: SchemaRetrievalIndex | None = None
+
+
+def tokenize_schema_text(text_value: str) -> list[str]:
+    """作用：检索分词：英文/数字按单词（下划线拆分），中文按字符二元组（单字保留为一元组）。
+
+    输入参数：
+    - text_value: str。
+
+    输出参数：
+    - 返回值类型: list[str]。
+    """
+
+    lowered = str(text_value or "").lower()
+    tokens = _ASCII_WORD_PATTERN.findall(lowered)
+    for run in _CJK_RUN_PATTERN.findall(lowered):
+        if len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[index:index + 2] for index in range(len(run) - 1))
+    return tokens
+
+
+def estimate_prompt_tokens(text_value: str) -> int:
+    """作用：粗略估算提示词 token 数（中文约每字 1 个，其余约每 4 个字符 1 个）。
+
+    输入参数：
+    - text_value: str。
+
+    输出参数：
+    - 返回值类型: int。
+    """
+
+    cjk_chars = sum(len(run) for run in _CJK_RUN_PATTERN.findall(text_value))
+    return cjk_chars + math.ceil((len(text_value) - cjk_chars) / 4)
+
+
+def _helper_resolve_join_target(column_name: str, table_names: set[str], table_name: str) -> str | None:
+    """作用：按命名约定推导外键指向的表：`class_id` -> class，`head_teacher_id` -> teacher。
+
+    输入参数：
+    - column_name: str。
+    - table_names: set[str]。
+    - table_name: str，字段所在表（不连接自身）。
+
+    输出参数：
+    - 返回值类型: str | None。
+    """
+
+    if not column_name.endswith("_id"):
+        return None
+    prefix = column_name[:-3]
+    if prefix in table_names and prefix != table_name:
+        return prefix
+    matches = [name for name in table_names if prefix.endswith(f"_{name}") and name != table_name]
+    return max(matches, key=len) if matches else None
+
+
+def build_schema_retrieval_index(kb: SchemaKnowledgeBase) -> SchemaRetrievalIndex:
+    """作用：由知识库快照构建 BM25 索引与外键连接图。
+
+    输入参数：
+    - kb: SchemaKnowledgeBase。
+
+    输出参数：
+    - 返回值类型: SchemaRetrievalIndex。
+    """
+
+    doc_keys: list[str] = []
+    doc_tables: list[str] = []
+    doc_tokens: list[list[str]] = []
+    table_columns: dict[str, tuple[str, ...]] = {}
+    table_names = set(kb.table_hints)
+    for table_hint in kb.schema_hints:
+        table_name = table_hint["table"]
+        doc_keys.append(table_name)
+        doc_tables.append(table_name)
+        doc_tokens.append(tokenize_schema_text(f"{table_name} {table_hint['table_description']}"))
+        columns: list[str] = []
+        for column_hint in table_hint["columns"]:
+            field = column_hint["field"]
+            column_name = field.split(".", 1)[1]
+            columns.append(column_name)
+            doc_keys.append(field)
+            doc_tables.append(_helper_resolve_join_target(column_name, table_names, table_name) or table_name)
+            doc_tokens.append(
+                tokenize_schema_text(
+                    " ".join([field, column_hint["field_description"], *column_hint["aliases"]])
+                )
+            )
+        table_columns[table_name] = tuple(columns)
+
+    postings: dict[str, list[tuple[int, int]]] = {}
+    for doc_index, tokens in enumerate(doc_tokens):
+        counts: dict[str, int] = {}
+        for token in tokens:
+            counts[token] = counts.get(token, 0) + 1
+        for token, count in counts.items():
+            postings.setdefault(token, []).append((doc_index, count))
+
+    join_edges: dict[str, list[tuple[str, str, str]]] = {name: [] for name in table_names}
+    for table_name, columns in table_columns.items():
+        for column_name in columns:
+            target = _helper_resolve_join_target(column_name, table_names, table_name)
+            if target is None or "id" not in table_columns[target]:
+                continue
+            # 无向边：(相邻表, 本表连接字段, 相邻表连接字段)
+            join_edges[table_name].append((target, column_name, "id"))
+            join_edges[target].append((table_name, "id", column_name))
+
+    doc_lengths = tuple(len(tokens) for tokens in doc_tokens)
+    return SchemaRetrievalIndex(
+        digest=kb.digest,
+        doc_keys=tuple(doc_keys),
+        doc_tables=tuple(doc_tables),
+        postings={token: tuple(items) for token, items in postings.items()},
+        doc_lengths=doc_lengths,
+        avg_doc_length=(sum(doc_lengths) / len(doc_lengths)) if doc_lengths else 0.0,
+        table_columns=table_columns,
+        join_edges={name: tuple(edges) for name, edges in join_edges.items()},
+    )
+
+
+def get_schema_retrieval_index(kb: SchemaKnowledgeBase) -> SchemaRetrievalIndex:
+    """作用：获取与知识库快照对应的检索索引；知识库内容变化时重建。
+
+    输入参数：
+    - kb: SchemaKnowledgeBase。
+
+    输出参数：
+    - 返回值类型: SchemaRetrievalIndex。
+    """
+
+    global _INDEX_CACHE
+
+    cached = _INDEX_CACHE
+    if cached is not None and cached.digest == kb.digest:
+        return cached
+    with _INDEX_LOCK:
+        cached = _INDEX_CACHE
+        if cached is not None and cached.digest == kb.digest:
+            return cached
+        index = build_schema_retrieval_index(kb)
+        _INDEX_CACHE = index
+        return index
+
+
+def _helper_bm25_scores(index: SchemaRetrievalIndex, query_tokens: list[str]) -> tuple[dict[str, float], dict[str, float]]:
+    """作用：计算查询对各表/字段文档的 BM25 得分（只返回得分大于 0 的文档）。
+
+    输入参数：
+    - index: SchemaRetrievalIndex。
+    - query_tokens: list[str]。
+
+    输出参数：
+    - 返回值类型: tuple[dict[str, float], dict[str, float]]，(文档键到得分, 表到得分)。
+    """
+
+    doc_count = len(index.doc_keys)
+    scores: dict[int, float] = {}
+    for token in set(query_tokens):
+        token_postings = index.postings.get(token)
+        if not token_postings:
+            continue
+        idf = math.log(1.0 + (doc_count - len(token_postings) + 0.5) / (len(token_postings) + 0.5))
+        for doc_index, term_frequency in token_postings:
+            length_norm = 1.0 - BM25_B + BM25_B * index.doc_lengths[doc_index] / (index.avg_doc_length or 1.0)
+            scores[doc_index] = scores.get(doc_index, 0.0) + idf * term_frequency * (BM25_K1 + 1.0) / (
+                term_frequency + BM25_K1 * length_norm
+            )
+    table_scores: dict[str, float] = {}
+    for doc_index, score in scores.items():
+        table_name = index.doc_tables[doc_index]
+        table_scores[table_name] = max(table_scores.get(table_name, 0.0), score)
+    return {index.doc_keys[doc_index]: score for doc_index, score in scores.items()}, table_scores
+
+
+def _helper_collect_task_terms(
+        rewritten_query: str,
+        task: dict[str, Any],
+        hidden_context: dict[str, Any] | None,
+        whitelist_set: frozenset[str],
+) -> tuple[list[str], set[str]]:
+    """作用：从改写问题、任务解析结果与隐藏上下文中提取检索词与必须保留的字段。
+
+    任务中的 table.field（维度、过滤字段）以及隐藏上下文给出的候选字段/失败 SQL 中的字段直接保留。
+
+    输入参数：
+    - rewritten_query: str。
+    - task: dict[str, Any]。
+    - hidden_context: dict[str, Any] | None。
+    - whitelist_set: frozenset[str]。
+
+    输出参数：
+    - 返回值类型: tuple[list[str], set[str]]，(检索文本片段, 必须保留的字段)。
+    """
+
+    texts: list[str] = [rewritten_query]
+    for entity in task.get("entities") or []:
+        if isinstance(entity, dict):
+            texts.extend(str(entity.get(key) or "") for key in ("type", "value"))
+    texts.extend(str(item) for item in task.get("dimensions") or [])
+    texts.extend(str(item) for item in task.get("metrics") or [])
+    for item in task.get("filters") or []:
+        if isinstance(item, dict):
+            texts.extend(str(item.get(key) or "") for key in ("field", "value"))
+
+    pinned_sources = list(texts)
+    if isinstance(hidden_context, dict):
+        pinned_sources.append(str(hidden_context.get("failed_sql") or ""))
+        for key in ("field_candidates", "value_candidates"):
+            pinned_sources.append(json.dumps(hidden_context.get(key) or [], ensure_ascii=False))
+    pinned_fields = {
+        match for source in pinned_sources for match in _FIELD_PATTERN.findall(source) if match in whitelist_set
+    }
+    return texts, pinned_fields
+
+
+def _helper_connect_tables(index: SchemaRetrievalIndex, seeds: list[str]) -> tuple[list[str], set[str]]:
+    """作用：沿外键连接图把种子表连成一棵连通子图（依次用最短路径把每张表接入已选集合）。
+
+    输入参数：
+    - index: SchemaRetrievalIndex。
+    - seeds: list[str]，按相关度排序的种子表。
+
+    输出参数：
+    - 返回值类型: tuple[list[str], set[str]]，(选中的表, 连接用到的 table.field)。
+    """
+
+    if not seeds:
+        return [], set()
+    selected: list[str] = [seeds[0]]
+    join_fields: set[str] = set()
+    for seed in seeds[1:]:
+        if seed in selected:
+            continue
+        previous: dict[str, tuple[str, str, str] | None] = {seed: None}
+        queue: deque[str] = deque([seed])
+        reached: str | None = None
+        while queue:
+            current = queue.popleft()
+            if current in selected:
+                reached = current
+                break
+            for neighbor, local_column, neighbor_column in index.join_edges.get(current, ()):
+                if neighbor not in previous:
+                    previous[neighbor] = (current, local_column, neighbor_column)
+                    queue.append(neighbor)
+        if reached is None:
+            selected.append(seed)
+            continue
+        node = reached
+        while previous[node] is not None:
+            parent, parent_column, node_column = previous[node]
+            join_fields.update({f"{parent}.{parent_column}", f"{node}.{node_column}"})
+            if parent not in selected:
+                selected.append(parent)
+            node = parent
+    return selected, join_fields
+
+
+def select_schema_subset(
+        kb: SchemaKnowledgeBase,
+        rewritten_query: str,
+        task: dict[str, Any],
+        hidden_context: dict[str, Any] | None = None,
+) -> SchemaSubset:
+    """作用：按任务相关度检索 SQL 生成所需的表与字段，只把相关子集放进提示词。
+
+    表按 BM25 得分取前 SCHEMA_RETRIEVAL_MAX_TABLES 张（任务/隐藏上下文中出现的字段所在表必选），
+    再沿外键补齐连接路径上的表；每张表保留主键、逻辑删除、连接字段与必选字段，
+    其余字段按得分补足到 SCHEMA_RETRIEVAL_MAX_COLUMNS。未启用或检索无命中时使用完整知识库。
+
+    输入参数：
+    - kb: SchemaKnowledgeBase。
+    - rewritten_query: str。
+    - task: dict[str, Any]，任务解析结果。
+    - hidden_context: dict[str, Any] | None。
+
+    输出参数：
+    - 返回值类型: SchemaSubset。
+    """
+
+    total_fields = len(kb.field_whitelist)
+    full_subset = SchemaSubset(
+        field_whitelist_json=kb.field_whitelist_json,
+        alias_pairs_json=kb.alias_pairs_json,
+        schema_hints_json=kb.schema_hints_json,
+        stats={"pruned": False, "tables": list(kb.table_hints), "fields": total_fields, "total_fields": total_fields},
+    )
+    if not settings.schema_retrieval_enabled:
+        return full_subset
+
+    index = get_schema_retrieval_index(kb)
+    texts, pinned_fields = _helper_collect_task_terms(rewritten_query, task, hidden_context, kb.whitelist_set)
+    scores, table_scores = _helper_bm25_scores(index, tokenize_schema_text(" ".join(texts)))
+    pinned_tables = list(dict.fromkeys(field.split(".", 1)[0] for field in sorted(pinned_fields)))
+    if not table_scores and not pinned_tables:
+        return full_subset
+
+    ranked_tables = sorted(table_scores, key=lambda name: -table_scores[name])
+    best_score = table_scores[ranked_tables[0]] if ranked_tables else 0.0
+    seeds = list(pinned_tables)
+    for table_name in ranked_tables:
+        if len(seeds) >= max(settings.schema_retrieval_max_tables, len(pinned_tables)):
+            break
+        if table_name not in seeds and table_scores[table_name] >= best_score * settings.schema_retrieval_min_score_ratio:
+            seeds.append(table_name)
+    seeds.sort(key=lambda name: (name not in pinned_tables, -table_scores.get(name, 0.0)))
+    selected_tables, join_fields = _helper_connect_tables(index, seeds)
+
+    selected_fields: list[str] = []
+    for table_name in selected_tables:
+        columns = index.table_columns.get(table_name, ())
+        required = {
+            f"{table_name}.{column}"
+            for column in columns
+            if column in STRUCTURAL_COLUMNS
+        } | {field for field in pinned_fields | join_fields if field.startswith(f"{table_name}.")}
+        ranked_rest = sorted(
+            (f"{table_name}.{column}" for column in columns if f"{table_name}.{column}" not in required),
+            key=lambda field: -scores.get(field, 0.0),
+        )
+        keep = set(required)
+        keep.update(ranked_rest[:max(settings.schema_retrieval_max_columns - len(required), 0)])
+        selected_fields.extend(f"{table_name}.{column}" for column in columns if f"{table_name}.{column}" in keep)
+
+    selected_set = set(selected_fields)
+    alias_pairs = [{field: kb.column_hints[field]["aliases"]} for field in selected_fields]
+    schema_hint_parts: list[str] = []
+    for table_name in selected_tables:
+        table_hint = kb.table_hints[table_name]
+        columns = [column_hint for column_hint in table_hint["columns"] if column_hint["field"] in selected_set]
+        if len(columns) == len(table_hint["columns"]):
+            # 整表保留时直接复用知识库预序列化的表描述
+            schema_hint_parts.append(kb.table_hints_json[table_name])
+            continue
+        schema_hint_parts.append(
+            json.dumps(
+                {"table": table_name, "table_description": table_hint["table_description"], "columns": columns},
+                ensure_ascii=False,
+            )
+        )
+    return SchemaSubset(
+        field_whitelist_json=PrecomputedJson(json.dumps(selected_fields, ensure_ascii=False)),
+        alias_pairs_json=PrecomputedJson(json.dumps(alias_pairs, ensure_ascii=False)),
+        schema_hints_json=PrecomputedJson("[" + ", ".join(schema_hint_parts) + "]"),
+        stats={
+            "pruned": True,
+            "tables": selected_tables,
+            "fields": len(selected_fields),
+            "total_fields": total_fields,
+        },
+    )
@@ -0,0 +1,194 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable
+
+from app.core.logger import get_logger
+from app.services.cancellation_service import CancellationToken
+from app.services.query_cache_service import normalize_query
+
+StepEventCallback = Callable[[str, str, str | None, dict[str, Any] | None], None]
+SummaryDeltaCallback = Callable[[str], None]
+
+logger = get_logger("single_flight")
+
+
+def build_flight_key(message: str, history_user_messages: list[str], model_name: str, workflow_mode: str) -> str:
+    """作用：由归一化问题、同会话历史问题、模型与工作流模式生成合并执行键；任一不同都不合并。
+
+    输入参数：
+    - message: str，当前问题。
+    - history_user_messages: list[str]，同会话最近的用户问题（意图识别的上下文）。
+    - model_name: str。
+    - workflow_mode: str。
+
+    输出参数：
+    - 返回值类型: str。
+    """
+
+    key_payload = [
+        normalize_query(message),
+        [normalize_query(item) for item in history_user_messages],
+        model_name,
+        workflow_mode,
+    ]
+    return hashlib.sha1(json.dumps(key_payload, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+@dataclass(eq=False)
+class FlightSubscriber:
+    """作用：合并执行的一个请求方：接收共享工作流的步骤事件与总结增量。"""
+
+    on_step_event: StepEventCallback | None = None
+    on_summary_delta: SummaryDeltaCallback | None = None
+
+
+class SharedFlight:
+    """作用：一次被多个相同请求共享的工作流执行。
+
+    记录已发出的步骤事件与总结增量，后加入的请求先补发已发生的事件再实时转发，每个请求看到完整的事件序列。
+    工作流使用自己的取消令牌，只有全部请求方都离开时才取消。
+    records 收集执行过程中产生、需由每个请求方以自己的身份各自落库的记录（如工作流步骤日志）。
+    """
+
+    def __init__(self, key: str) -> None:
+        self.key = key
+        self.cancel_token = CancellationToken()
+        self.task: asyncio.Task[Any] | None = None
+        self.followers = 0
+        self.records: list[Any] = []
+        self._events: list[tuple[str, tuple[Any, ...]]] = []
+        self._subscribers: list[FlightSubscriber] = []
+
+    @property
+    def joinable(self) -> bool:
+        return self.task is not None and not self.task.done() and not self.cancel_token.cancelled
+
+    def emit_step_event(
+            self,
+            step_name: str,
+            status: str,
+            error_message: str | None,
+            step_payload: dict[str, Any] | None,
+    ) -> None:
+        self._helper_broadcast("step", (step_name, status, error_message, step_payload))
+
+    def emit_summary_delta(self, delta_text: str) -> None:
+        self._helper_broadcast("delta", (delta_text,))
+
+    def subscribe(self, subscriber: FlightSubscriber) -> None:
+        """作用：加入请求方，并补发此前已发生的事件。"""
+
+        for kind, args in self._events:
+            _helper_deliver(subscriber, kind, args)
+        self._subscribers.append(subscriber)
+
+    def unsubscribe(self, subscriber: FlightSubscriber) -> None:
+        """作用：移除请求方；工作流未结束而请求方已全部离开时取消工作流。"""
+
+        if subscriber in self._subscribers:
+            self._subscribers.remove(subscriber)
+        if not self._subscribers and self.task is not None and not self.task.done():
+            self.cancel_token.cancel("all_requesters_left")
+
+    def _helper_broadcast(self, kind: str, args: tuple[Any, ...]) -> None:
+        self._events.append((kind, args))
+        for subscriber in list(self._subscribers):
+            _helper_deliver(subscriber, kind, args)
+
+
+def _helper_deliver(subscriber: FlightSubscriber, kind: str, args: tuple[Any, ...]) -> None:
+    """作用：把一个事件交给请求方回调；回调异常不影响共享工作流与其他请求方。"""
+
+    callback = subscriber.on_step_event if kind == "step" else subscriber.on_summary_delta
+    if callback is None:
+        return
+    try:
+        callback(*args)
+    except Exception:
+        return
+
+
+class SingleFlightGroup:
+    """作用：相同问题的合并执行（single-flight）：同一合并键同时只执行一次工作流，并发的相同请求挂到进行中的执行上。
+
+    只在事件循环线程中使用，不需要加锁。执行结束即从表中移除，之后的相同请求重新执行（由问题→SQL 缓存加速）。
+    """
+
+    def __init__(self) -> None:
+        self._flights: dict[str, SharedFlight] = {}
+        self._started = 0
+        self._coalesced = 0
+
+    def join(self, key: str, runner: Callable[[SharedFlight], Awaitable[Any]]) -> tuple[SharedFlight, bool]:
+        """作用：加入进行中的相同执行；没有可加入的执行时以 runner 启动一次新的执行。
+
+        输入参数：
+        - key: str，合并键（build_flight_key）。
+        - runner: Callable[[SharedFlight], Awaitable[Any]]，启动共享执行的协程工厂。
+
+        输出参数：
+        - 返回值类型: tuple[SharedFlight, bool]，第二项为 True 表示本请求发起了这次执行。
+        """
+
+        flight = self._flights.get(key)
+        if flight is not None and flight.joinable:
+            flight.followers += 1
+            self._coalesced += 1
+            return flight, False
+        flight = SharedFlight(key)
+        # 任务在下一次让出事件循环时才开始运行，发起方订阅前不会漏掉事件
+        flight.task = asyncio.get_running_loop().create_task(runner(flight))
+        flight.task.add_done_callback(lambda _task, item=flight: self._helper_forget(item))
+        self._flights[key] = flight
+        self._started += 1
+        return flight, True
+
+    async def wait(
+            self,
+            flight: SharedFlight,
+            subscriber: FlightSubscriber,
+            cancel_token: CancellationToken | None = None,
+    ) -> Any:
+        """作用：订阅共享执行的事件并等待其结果；本请求被取消时只离开，不影响其他请求方。
+
+        输入参数：
+        - flight: SharedFlight。
+        - subscriber: FlightSubscriber，本请求的事件回调。
+        - cancel_token: CancellationToken | None，本请求的取消令牌。
+
+        输出参数：
+        - 返回值类型: Any，共享执行的结果（各请求方共享同一对象，不可修改）。
+        """
+
+        flight.subscribe(subscriber)
+        try:
+            shared = asyncio.shield(flight.task)
+            if cancel_token is None:
+                return await shared
+            return await cancel_token.run(shared)
+        finally:
+            flight.unsubscribe(subscriber)
+
+    def get_stats(self) -> dict[str, Any]:
+        """作用：返回进行中的执行数、累计执行数与被合并的请求数。"""
+
+        return {
+            "in_flight": len(self._flights),
+            "followers_in_flight": sum(flight.followers for flight in self._flights.values()),
+            "started": self._started,
+            "coalesced": self._coalesced,
+        }
+
+    def _helper_forget(self, flight: SharedFlight) -> None:
+        if self._flights.get(flight.key) is flight:
+            del self._flights[flight.key]
+        if flight.task is not None and not flight.task.cancelled() and flight.task.exception() is not None:
+            # 异常已交给各请求方处理，这里取出以免事件循环报告未获取的异常
+            logger.info("shared workflow failed", extra={"payload": {"key": flight.key, "followers": flight.followers}})
+
+
+single_flight_group = SingleFlightGroup()
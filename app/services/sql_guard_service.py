@@ -0,0 +1,333 @@
+from __future__ import annotations
+
+import json
+import re
+from dataclasses import dataclass
+from functools import partial
+from typing import Any, Callable, Iterator
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.services.cancellation_service import get_mysql_connection_id, kill_mysql_query
+
+LIMITED_OPERATIONS = {"detail", "ranking"}
+MYSQL_STATEMENT_TIMEOUT_ERRNO = 3024
+MYSQL_QUERY_INTERRUPTED_ERRNO = 1317
+FETCH_BATCH_ROWS = 500
+
+_SQL_SCAN_PATTERN = re.compile(
+    r"'(?:[^'\\]|\\.|'')*'"  # 单引号字符串
+    r'|"(?:[^"\\]|\\.)*"'  # 双引号字符串
+    r"|`[^`]*`"  # 反引号标识符
+    r"|--[^\n]*|#[^\n]*|/\*.*?\*/"  # 注释
+    r"|(?P<paren>[()])"
+    r"|(?P<word>[A-Za-z_][A-Za-z0-9_]*)"
+    r"|(?P<number>\d+)",
+    flags=re.S,
+)
+_EXPLAIN_COST_KEYS = ("query_cost", "estimated_total_cost")
+_EXPLAIN_ROW_KEYS = ("rows_produced_per_join", "rows_examined_per_scan", "estimated_rows")
+
+
+@dataclass
+class SqlGuardReport:
+    """作用：单条 SQL 的执行防护结果，写入 SQL 校验输出的 guard 字段。
+
+    status 取值：ok / rejected（预估代价超限被拒绝）/ timeout（执行超时被中断）/ truncated（结果被行数上限截断）。
+    """
+
+    status: str = "ok"
+    estimated_rows: float | None = None
+    estimated_cost: float | None = None
+    limit_applied: int | None = None
+    row_cap: int = 0
+    detail: str | None = None
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "status": self.status,
+            "estimated_rows": self.estimated_rows,
+            "estimated_cost": self.estimated_cost,
+            "limit_applied": self.limit_applied,
+            "row_cap": self.row_cap,
+            "detail": self.detail,
+        }
+
+
+def _helper_scan_top_level(sql: str) -> list[tuple[str, int, int]]:
+    """作用：扫描 SQL 中位于最外层（括号深度为 0）的关键字与数字，跳过字符串与注释。
+
+    输入参数：
+    - sql: str。
+
+    输出参数：
+    - 返回值类型: list[tuple[str, int, int]]，(小写词或数字, 起始位置, 结束位置)。
+    """
+
+    depth = 0
+    tokens: list[tuple[str, int, int]] = []
+    for match in _SQL_SCAN_PATTERN.finditer(sql):
+        paren = match.group("paren")
+        if paren == "(":
+            depth += 1
+            continue
+        if paren == ")":
+            depth = max(depth - 1, 0)
+            continue
+        if depth != 0:
+            continue
+        token = match.group("word") or match.group("number")
+        if token:
+            tokens.append((token.lower(), match.start(), match.end()))
+    return tokens
+
+
+def apply_result_limit(sql: str, limit: int) -> tuple[str, int | None]:
+    """作用：为最外层查询注入 LIMIT；已有更小的 LIMIT 时保持不变，已有更大的 LIMIT 时收紧为 limit。
+
+    输入参数：
+    - sql: str。
+    - limit: int。
+
+    输出参数：
+    - 返回值类型: tuple[str, int | None]，改写后的 SQL 与实际生效的 LIMIT（未改写时为 None）。
+    """
+
+    sql = sql.strip().rstrip(";").rstrip()
+    if limit <= 0 or not sql:
+        return sql, None
+    tokens = _helper_scan_top_level(sql)
+    limit_index = next((index for index in range(len(tokens) - 1, -1, -1) if tokens[index][0] == "limit"), None)
+    if limit_index is None:
+        # 换行追加，避免 SQL 以行注释结尾时 LIMIT 被注释掉。
+        return f"{sql}\nLIMIT {limit}", limit
+
+    following = tokens[limit_index + 1:limit_index + 4]
+    count_token: tuple[str, int, int] | None = None
+    if len(following) >= 2 and following[1][0] == "offset" and following[0][0].isdigit():
+        count_token = following[0]
+    elif len(following) >= 2 and following[0][0].isdigit() and following[1][0].isdigit():
+        # LIMIT offset, count
+        count_token = following[1]
+    elif following and following[0][0].isdigit():
+        count_token = following[0]
+    if count_token is None:
+        return sql, None
+    if int(count_token[0]) <= limit:
+        return sql, None
+    return f"{sql[:count_token[1]]}{limit}{sql[count_token[2]:]}", limit
+
+
+def add_max_execution_time_hint(sql: str, timeout_ms: int) -> str:
+    """作用：在最外层 SELECT 后加入 MySQL 优化器提示 MAX_EXECUTION_TIME。
+
+    WITH 查询的提示加在 CTE 之后的主 SELECT 上；找不到最外层 SELECT 或已带提示时原样返回。
+
+    输入参数：
+    - sql: str。
+    - timeout_ms: int。
+
+    输出参数：
+    - 返回值类型: str。
+    """
+
+    if timeout_ms <= 0 or re.search(r"/\*\+[^*]*max_execution_time", sql, flags=re.I):
+        return sql
+    select_token = next((token for token in _helper_scan_top_level(sql) if token[0] == "select"), None)
+    if select_token is None:
+        return sql
+    end = select_token[2]
+    return f"{sql[:end]} /*+ MAX_EXECUTION_TIME({int(timeout_ms)}) */{sql[end:]}"
+
+
+def _helper_collect_explain_numbers(node: Any, keys: tuple[str, ...], found: list[float]) -> None:
+    """作用：递归收集 EXPLAIN JSON 中指定键的数值。
+
+    输入参数：
+    - node: Any。
+    - keys: tuple[str, ...]。
+    - found: list[float]，收集结果（原地追加）。
+
+    输出参数：
+    - 无。
+    """
+
+    if isinstance(node, dict):
+        for key, value in node.items():
+            if key in keys:
+                try:
+                    found.append(float(value))
+                except (TypeError, ValueError):
+                    pass
+            else:
+                _helper_collect_explain_numbers(value, keys, found)
+    elif isinstance(node, list):
+        for item in node:
+            _helper_collect_explain_numbers(item, keys, found)
+
+
+def estimate_sql_cost(db: Session, sql: str) -> tuple[float | None, float | None] | None:
+    """作用：通过 EXPLAIN FORMAT=JSON 预估 SQL 的代价与最大中间结果行数（仅 MySQL）。
+
+    EXPLAIN 本身报错（语法错误、字段不存在等）时直接抛出，由调用方按 SQL 执行失败处理。
+
+    输入参数：
+    - db: Session。
+    - sql: str。
+
+    输出参数：
+    - 返回值类型: tuple[float | None, float | None] | None，(预估行数, 预估代价)；非 MySQL 时为 None。
+    """
+
+    if db.get_bind().dialect.name != "mysql":
+        return None
+    explain_text = db.execute(text(f"EXPLAIN FORMAT=JSON {sql}")).scalar()
+    plan = json.loads(explain_text) if isinstance(explain_text, str) else {}
+    costs: list[float] = []
+    rows: list[float] = []
+    _helper_collect_explain_numbers(plan, _EXPLAIN_COST_KEYS, costs)
+    _helper_collect_explain_numbers(plan, _EXPLAIN_ROW_KEYS, rows)
+    return (max(rows) if rows else None), (max(costs) if costs else None)
+
+
+def check_sql_cost(estimated_rows: float | None, estimated_cost: float | None) -> str | None:
+    """作用：按配置阈值判断预估代价是否超限。
+
+    输入参数：
+    - estimated_rows: float | None。
+    - estimated_cost: float | None。
+
+    输出参数：
+    - 返回值类型: str | None，超限说明；未超限为 None。
+    """
+
+    if estimated_rows is not None and estimated_rows > settings.sql_guard_max_estimated_rows:
+        return f"预估扫描/中间结果 {estimated_rows:.0f} 行，超过上限 {settings.sql_guard_max_estimated_rows}"
+    if estimated_cost is not None and estimated_cost > settings.sql_guard_max_query_cost:
+        return f"预估查询代价 {estimated_cost:.0f}，超过上限 {settings.sql_guard_max_query_cost}"
+    return None
+
+
+class GuardedRows:
+    """作用：流式游标上的有界结果迭代器：按批读取，最多产出 row_cap 行；发现超出时置 truncated 并停止读取。
+
+    流式游标关闭时驱动会读完剩余结果，截断时先调用 abort_statement 中断语句，避免继续传输被丢弃的行。
+    """
+
+    def __init__(self, result: Any, row_cap: int, abort_statement: Callable[[Any], None] | None = None) -> None:
+        self._result = result
+        self._abort_statement = abort_statement
+        self.row_cap = row_cap
+        self.truncated = False
+
+    def __iter__(self) -> Iterator[dict[str, Any]]:
+        produced = 0
+        try:
+            while True:
+                batch = self._result.fetchmany(FETCH_BATCH_ROWS)
+                if not batch:
+                    return
+                for row in batch:
+                    if produced >= self.row_cap:
+                        self.truncated = True
+                        if self._abort_statement is not None:
+                            self._abort_statement(self._result)
+                        return
+                    produced += 1
+                    yield dict(row._mapping)
+        finally:
+            self._result.close()
+
+
+def _helper_abort_mysql_statement(db: Session, connection_id: int, result: Any) -> None:
+    """作用：截断时中断仍在流式返回的 MySQL 语句：KILL QUERY 后关闭游标，驱动读到中断错误即停止，不再读完剩余结果。
+
+    语句若在 KILL 到达前已执行完，KILL 标记可能留在连接上，随后执行一条空语句将其消耗，避免误中断本会话的下一条 SQL。
+
+    输入参数：
+    - db: Session。
+    - connection_id: int，执行该语句的 MySQL 线程号。
+    - result: Any，语句的 CursorResult。
+
+    输出参数：
+    - 无。
+    """
+
+    if not kill_mysql_query(db.get_bind(), connection_id):
+        return
+    interrupted = False
+    cursor = getattr(result, "cursor", None)
+    if cursor is not None:
+        try:
+            cursor.close()
+        except Exception as exc:
+            if not is_query_interrupted_error(exc):
+                raise
+            interrupted = True
+    if not interrupted:
+        try:
+            db.connection().exec_driver_sql("DO 0")
+        except Exception as exc:
+            if not is_query_interrupted_error(exc):
+                raise
+
+
+def execute_guarded_sql(db: Session, sql: str, row_cap: int, max_execution_ms: int | None = None) -> GuardedRows:
+    """作用：带执行时限提示执行 SQL，返回基于流式游标的有界结果迭代器。
+
+    结果须在同一会话的下一次数据库调用之前迭代完（或迭代器被关闭）。
+
+    输入参数：
+    - db: Session。
+    - sql: str。
+    - row_cap: int。
+    - max_execution_ms: int | None，执行时限，默认 SQL_GUARD_MAX_EXECUTION_MS。
+
+    输出参数：
+    - 返回值类型: GuardedRows。
+    """
+
+    if max_execution_ms is None:
+        max_execution_ms = settings.sql_guard_max_execution_ms
+    exec_sql = sql
+    abort_statement = None
+    if db.get_bind().dialect.name == "mysql":
+        exec_sql = add_max_execution_time_hint(sql, max_execution_ms)
+        connection_id = get_mysql_connection_id(db)
+        if connection_id is not None:
+            abort_statement = partial(_helper_abort_mysql_statement, db, connection_id)
+    result = db.execute(text(exec_sql), execution_options={"stream_results": True})
+    return GuardedRows(result, row_cap, abort_statement)
+
+
+def is_statement_timeout_error(exc: Exception) -> bool:
+    """作用：判断异常是否为 MAX_EXECUTION_TIME 触发的语句超时中断。
+
+    输入参数：
+    - exc: Exception。
+
+    输出参数：
+    - 返回值类型: bool。
+    """
+
+    orig = getattr(exc, "orig", None)
+    args = getattr(orig, "args", None) or ()
+    if args and args[0] == MYSQL_STATEMENT_TIMEOUT_ERRNO:
+        return True
+    return "maximum statement execution time exceeded" in str(exc).lower()
+
+
+def is_query_interrupted_error(exc: Exception) -> bool:
+    """作用：判断异常是否为 KILL QUERY 造成的语句中断（MySQL 1317）。
+
+    输入参数：
+    - exc: Exception，驱动原始异常或 SQLAlchemy 包装后的异常。
+
+    输出参数：
+    - 返回值类型: bool。
+    """
+
+    args = getattr(getattr(exc, "orig", exc), "args", None) or ()
+    return bool(args) and args[0] == MYSQL_QUERY_INTERRUPTED_ERRNO
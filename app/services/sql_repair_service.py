@@ -0,0 +1,365 @@
+from __future__ import annotations
+
+import difflib
+import re
+import threading
+from dataclasses import dataclass, field
+from typing import Any
+
+from app.core.config import settings
+
+_UNKNOWN_COLUMN_PATTERNS = (
+    re.compile(r"Unknown column '([^']+)'", flags=re.I),
+    re.compile(r"Unknown column `([^`]+)`", flags=re.I),
+    re.compile(r"no such column: ([A-Za-z0-9_.]+)", flags=re.I),
+)
+_UNKNOWN_TABLE_PATTERNS = (
+    re.compile(r"Table '(?:[^'.]+\.)?([^'.]+)' doesn't exist", flags=re.I),
+    re.compile(r"Unknown table '(?:[^'.]+\.)?([^'.]+)'", flags=re.I),
+    re.compile(r"no such table: ([A-Za-z0-9_]+)", flags=re.I),
+)
+_NON_WHITELIST_PATTERN = re.compile(r"非白名单字段: \[([^\]]*)\]")
+# 探测样例的 fuzzy / fallback_probe_topn 候选不足以确定替换值，仅采用精确与归一化匹配。
+_DETERMINISTIC_PROBE_STRATEGIES = {"exact", "normalized"}
+
+
+@dataclass
+class SqlRepairOutcome:
+    """作用：一次确定性修复的结果。rule 取值：unknown_column / unknown_table / value_literal。"""
+
+    repaired: bool = False
+    sql: str = ""
+    rules: list[str] = field(default_factory=list)
+    actions: list[dict[str, str]] = field(default_factory=list)
+    detail: str | None = None
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "repaired": self.repaired,
+            "sql": self.sql,
+            "rules": list(self.rules),
+            "actions": list(self.actions),
+            "detail": self.detail,
+        }
+
+
+def pick_field_replacement(invalid_field: str, candidates: list[str]) -> str:
+    """作用：从候选字段中为非法字段挑选替换目标：外键优先匹配同表 *_id，其次同表字段，最后取首个候选。
+
+    输入参数：
+    - invalid_field: str，非法字段（table.field 或 field）。
+    - candidates: list[str]，白名单候选字段（非空）。
+
+    输出参数：
+    - 返回值类型: str。
+    """
+
+    invalid_table = invalid_field.split(".", 1)[0].lower() if "." in invalid_field else ""
+    invalid_suffix = invalid_field.split(".", 1)[1].lower() if "." in invalid_field else invalid_field.lower()
+    if invalid_suffix.endswith("_id"):
+        for candidate in candidates:
+            candidate_lower = candidate.lower()
+            if candidate_lower.endswith("_id") and (not candidate_lower.endswith(".id")):
+                if invalid_table and (not candidate_lower.startswith(f"{invalid_table}.")):
+                    continue
+                return candidate
+    for candidate in candidates:
+        if invalid_table and candidate.lower().startswith(f"{invalid_table}."):
+            return candidate
+    return candidates[0]
+
+
+def _helper_first_match(patterns: tuple[re.Pattern[str], ...], error_text: str) -> str:
+    """作用：按顺序尝试多个报错正则，返回首个捕获内容。
+
+    输入参数：
+    - patterns: tuple[re.Pattern[str], ...]。
+    - error_text: str。
+
+    输出参数：
+    - 返回值类型: str，未匹配时为空串。
+    """
+
+    for pattern in patterns:
+        match = pattern.search(error_text)
+        if match:
+            return match.group(1).strip()
+    return ""
+
+
+def _helper_collect_missing_columns(error_text: str) -> list[str]:
+    """作用：从数据库报错（Unknown column）与 SQL 生成白名单校验报错中收集无法识别的列。
+
+    输入参数：
+    - error_text: str。
+
+    输出参数：
+    - 返回值类型: list[str]。
+    """
+
+    found: list[str] = []
+    for pattern in _UNKNOWN_COLUMN_PATTERNS:
+        found.extend(item.strip() for item in pattern.findall(error_text))
+    match = _NON_WHITELIST_PATTERN.search(error_text)
+    if match:
+        found.extend(item.strip() for item in re.findall(r"'([^']+)'", match.group(1)))
+    return list(dict.fromkeys(item for item in found if item))
+
+
+def _helper_repair_unknown_column(
+        sql: str,
+        missing: str,
+        whitelist: list[str],
+        table_names: set[str],
+        alias_lookup: dict[str, list[str]],
+) -> tuple[str, dict[str, str]] | None:
+    """作用：未知列修复：优先按 KB 别名在同表白名单中查找，其次按列名相似度查找。
+
+    只处理以物理表名限定的列；以别名/CTE 限定或未限定的列无法确定所属表，交由大模型处理。
+
+    输入参数：
+    - sql: str。
+    - missing: str，报错中的列（table.field）。
+    - whitelist: list[str]。
+    - table_names: set[str]，知识库中的物理表名（小写）。
+    - alias_lookup: dict[str, list[str]]，字段 -> 小写别名列表。
+
+    输出参数：
+    - 返回值类型: tuple[str, dict[str, str]] | None，(改写后 SQL, 修复动作)。
+    """
+
+    if "." not in missing:
+        return None
+    table_name, column_name = missing.split(".", 1)
+    if table_name.lower() not in table_names:
+        return None
+    same_table_fields = [item for item in whitelist if item.lower().startswith(f"{table_name.lower()}.")]
+    candidates = [item for item in same_table_fields if column_name.lower() in alias_lookup.get(item, [])]
+    if not candidates:
+        columns = {item.split(".", 1)[1].lower(): item for item in same_table_fields}
+        close = difflib.get_close_matches(column_name.lower(), list(columns), n=3, cutoff=0.75)
+        candidates = [columns[item] for item in close]
+    if not candidates:
+        return None
+    target = pick_field_replacement(missing, candidates)
+    pattern = re.compile(rf"(?<![\w.]){re.escape(missing)}\b", flags=re.I)
+    if target.lower() == missing.lower() or not pattern.search(sql):
+        return None
+    return pattern.sub(target, sql), {"rule": "unknown_column", "from": missing, "to": target}
+
+
+def _helper_repair_unknown_table(sql: str, missing: str, table_names: set[str]) -> tuple[str, dict[str, str]] | None:
+    """作用：未知表修复：按名称相似度在知识库表名中查找唯一最接近的表并整体替换该标识符。
+
+    输入参数：
+    - sql: str。
+    - missing: str，报错中的表名。
+    - table_names: set[str]。
+
+    输出参数：
+    - 返回值类型: tuple[str, dict[str, str]] | None。
+    """
+
+    close = difflib.get_close_matches(missing.lower(), sorted(table_names), n=2, cutoff=0.8)
+    if len(close) != 1:
+        return None
+    pattern = re.compile(rf"(?<![\w.`]){re.escape(missing)}(?![\w`])", flags=re.I)
+    if not pattern.search(sql):
+        return None
+    return pattern.sub(close[0], sql), {"rule": "unknown_table", "from": missing, "to": close[0]}
+
+
+def _helper_repair_value_literals(sql: str, hidden_context_result: dict[str, Any]) -> tuple[str, list[dict[str, str]]]:
+    """作用：取值修复：将 SQL 中不在取值集合内的字符串字面量替换为高置信度候选值（保留 LIKE 通配符）。
+
+    输入参数：
+    - sql: str。
+    - hidden_context_result: dict[str, Any]。
+
+    输出参数：
+    - 返回值类型: tuple[str, list[dict[str, str]]]。
+    """
+
+    actions: list[dict[str, str]] = []
+    for item in hidden_context_result.get("value_candidates") or []:
+        if not isinstance(item, dict):
+            continue
+        original = str(item.get("original_value", "")).strip()
+        candidates = [str(value).strip() for value in item.get("candidates") or [] if str(value).strip()]
+        strategy = str(item.get("match_strategy", ""))
+        if not original or not candidates or candidates[0] == original:
+            continue
+        if strategy.startswith("dictionary_"):
+            scores = item.get("scores") or []
+            top_score = float(scores[0]) if scores else 0.0
+            second_score = float(scores[1]) if len(scores) > 1 else 0.0
+            # 需要足够高的得分且与次优候选拉开差距，避免在两个相近取值之间随意选择。
+            if top_score < settings.sql_repair_min_value_score or top_score - second_score < 0.1:
+                continue
+        elif strategy not in _DETERMINISTIC_PROBE_STRATEGIES or len(candidates) != 1:
+            continue
+        target = candidates[0]
+        pattern = re.compile(rf"'(%?){re.escape(original.replace(chr(39), chr(39) * 2))}(%?)'")
+        if not pattern.search(sql):
+            continue
+        escaped_target = target.replace("'", "''")
+        sql = pattern.sub(lambda match: f"'{match.group(1)}{escaped_target}{match.group(2)}'", sql)
+        actions.append(
+            {"rule": "value_literal", "field": str(item.get("field", "")), "from": original, "to": target}
+        )
+    return sql, actions
+
+
+def repair_sql(
+        failed_sql: str,
+        hidden_context_result: dict[str, Any],
+        whitelist: list[str],
+        table_names: set[str],
+        alias_lookup: dict[str, list[str]],
+) -> SqlRepairOutcome:
+    """作用：基于报错信息、KB 别名/白名单与隐藏上下文的取值候选对失败 SQL 做规则化改写，不调用大模型。
+
+    输入参数：
+    - failed_sql: str。
+    - hidden_context_result: dict[str, Any]，hidden_context 节点输出。
+    - whitelist: list[str]，字段白名单。
+    - table_names: set[str]，知识库中的物理表名（小写）。
+    - alias_lookup: dict[str, list[str]]，字段 -> 小写别名列表。
+
+    输出参数：
+    - 返回值类型: SqlRepairOutcome。
+    """
+
+    outcome = SqlRepairOutcome(sql=failed_sql)
+    if not failed_sql:
+        outcome.detail = "无可修复的 SQL"
+        return outcome
+    error_text = str(hidden_context_result.get("error") or "")
+    retry_reason = str(hidden_context_result.get("retry_reason") or "")
+    sql = failed_sql
+    if retry_reason == "sql_error":
+        whitelist_keys = {item.lower() for item in whitelist}
+        table_fixes: dict[str, str] = {}
+        missing_table = _helper_first_match(_UNKNOWN_TABLE_PATTERNS, error_text)
+        if missing_table:
+            repaired = _helper_repair_unknown_table(sql, missing_table, table_names)
+            if repaired is not None:
+                sql, action = repaired
+                outcome.actions.append(action)
+                table_fixes[missing_table.lower()] = action["to"]
+        for missing in _helper_collect_missing_columns(error_text):
+            if "." in missing:
+                table_name, column_name = missing.split(".", 1)
+                if table_name.lower() not in table_names:
+                    # 表名写错时先修正表名，修正后列若已合法则无需再修列。
+                    if table_name.lower() not in table_fixes:
+                        repaired = _helper_repair_unknown_table(sql, table_name, table_names)
+                        if repaired is None:
+                            continue
+                        sql, action = repaired
+                        outcome.actions.append(action)
+                        table_fixes[table_name.lower()] = action["to"]
+                    missing = f"{table_fixes[table_name.lower()]}.{column_name}"
+                    if missing.lower() in whitelist_keys:
+                        continue
+            repaired = _helper_repair_unknown_column(sql, missing, whitelist, table_names, alias_lookup)
+            if repaired is not None:
+                sql, action = repaired
+                outcome.actions.append(action)
+    elif retry_reason in {"empty_result", "zero_metric_result"}:
+        sql, actions = _helper_repair_value_literals(sql, hidden_context_result)
+        outcome.actions.extend(actions)
+
+    if not outcome.actions or sql == failed_sql:
+        outcome.actions = []
+        outcome.detail = "没有适用的确定性修复规则"
+        return outcome
+    outcome.repaired = True
+    outcome.sql = sql
+    outcome.rules = list(dict.fromkeys(action["rule"] for action in outcome.actions))
+    return outcome
+
+
+_STATS_LOCK = threading.Lock()
+_STATS: dict[str, float] = {
+    "attempts": 0,
+    "repaired": 0,
+    "verified": 0,
+    "repair_ms_total": 0.0,
+    "llm_generation_count": 0,
+    "llm_generation_ms_total": 0.0,
+}
+
+
+def record_llm_generation_latency(elapsed_ms: float) -> None:
+    """作用：记录一次大模型 SQL 生成耗时，用于估算确定性修复节省的时间。
+
+    输入参数：
+    - elapsed_ms: float。
+
+    输出参数：
+    - 无。
+    """
+
+    with _STATS_LOCK:
+        _STATS["llm_generation_count"] += 1
+        _STATS["llm_generation_ms_total"] += elapsed_ms
+
+
+def record_repair_attempt(repaired: bool, elapsed_ms: float) -> None:
+    """作用：记录一次修复尝试（是否产出改写 SQL 及耗时）。
+
+    输入参数：
+    - repaired: bool。
+    - elapsed_ms: float。
+
+    输出参数：
+    - 无。
+    """
+
+    with _STATS_LOCK:
+        _STATS["attempts"] += 1
+        _STATS["repair_ms_total"] += elapsed_ms
+        if repaired:
+            _STATS["repaired"] += 1
+
+
+def record_repair_verified() -> None:
+    """作用：记录一次修复后的 SQL 校验通过（有效且非空结果）。
+
+    输入参数：
+    - 无。
+
+    输出参数：
+    - 无。
+    """
+
+    with _STATS_LOCK:
+        _STATS["verified"] += 1
+
+
+def get_repair_stats() -> dict[str, Any]:
+    """作用：汇总进程内确定性修复统计：尝试数、改写数、校验通过数、成功率与估算节省时间。
+
+    节省时间 = 校验通过次数 × 平均大模型 SQL 生成耗时 − 全部修复尝试耗时。
+
+    输入参数：
+    - 无。
+
+    输出参数：
+    - 返回值类型: dict[str, Any]。
+    """
+
+    with _STATS_LOCK:
+        stats = dict(_STATS)
+    attempts = int(stats["attempts"])
+    llm_count = int(stats["llm_generation_count"])
+    avg_llm_ms = stats["llm_generation_ms_total"] / llm_count if llm_count else 0.0
+    return {
+        "attempts": attempts,
+        "repaired": int(stats["repaired"]),
+        "verified": int(stats["verified"]),
+        "success_rate": round(stats["verified"] / attempts, 4) if attempts else 0.0,
+        "avg_llm_generation_ms": round(avg_llm_ms, 1),
+        "estimated_saved_ms": round(max(stats["verified"] * avg_llm_ms - stats["repair_ms_total"], 0.0), 1),
+    }
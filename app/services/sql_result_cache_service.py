@@ -0,0 +1,323 @@
+from __future__ import annotations
+
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any
+
+from app.core.config import settings
+from app.services.data_version_service import get_data_versions
+
+_SQL_TOKEN_PATTERN = re.compile(
+    r"'(?:[^'\\]|\\.|'')*'"  # 单引号字符串
+    r'|"(?:[^"\\]|\\.)*"'  # 双引号字符串
+    r"|`[^`]*`"  # 反引号标识符
+    r"|--[^\n]*"  # 行注释
+    r"|#[^\n]*"
+    r"|/\*.*?\*/"  # 块注释
+    r"|\s+"
+    r"|[^'\"`\s\-#/]+|[\-#/]",
+    flags=re.S,
+)
+_SQL_WORD_PATTERN = re.compile(
+    r"'(?:[^'\\]|\\.|'')*'"
+    r'|"(?:[^"\\]|\\.)*"'
+    r"|`[^`]*`"
+    r"|[a-z_][a-z0-9_$]*"
+    r"|\d+(?:\.\d+)?"
+    r"|\S"
+)
+_SQL_IDENTIFIER_PATTERN = re.compile(r"[a-z_][a-z0-9_$]*")
+# 结束 FROM 表列表的子句关键字
+_SQL_FROM_LIST_TERMINATORS = frozenset({
+    "where", "group", "having", "order", "limit", "union", "except", "intersect", "window", "for", "lock", "into",
+})
+# 后接括号但不是函数调用的关键字（括号内可能是子查询或派生表）
+_SQL_NON_FUNCTION_KEYWORDS = frozenset({
+    "select", "from", "join", "straight_join", "on", "using", "where", "and", "or", "not", "in", "exists", "any",
+    "all", "some", "as", "union", "except", "intersect", "lateral", "having", "by", "when", "then", "else",
+    "with", "recursive", "is", "like", "between",
+})
+
+
+@dataclass
+class SqlResultCacheEntry:
+    """作用：SQL 结果缓存条目，按列存储以减少重复键名占用。"""
+
+    fingerprint: str
+    columns: tuple[str, ...]
+    column_values: tuple[tuple[Any, ...], ...]
+    row_count: int
+    table_versions: dict[str, int]
+    cached_at: float
+
+    @property
+    def cell_count(self) -> int:
+        return max(self.row_count, 1) * max(len(self.columns), 1)
+
+
+_CACHE_LOCK = threading.Lock()
+_CACHE_ENTRIES: OrderedDict[str, SqlResultCacheEntry] = OrderedDict()
+_CACHE_CELLS = 0
+
+
+def normalize_sql(sql: str) -> str:
+    """作用：归一化 SQL：去注释、压缩字符串外的空白、关键字与标识符小写、去尾分号；字符串字面量保持原样。
+
+    输入参数：
+    - sql: str。
+
+    输出参数：
+    - 返回值类型: str。
+    """
+
+    parts: list[str] = []
+    for token in _SQL_TOKEN_PATTERN.findall(str(sql or "")):
+        if token.startswith(("--", "#", "/*")) or token.isspace():
+            if parts and parts[-1] != " ":
+                parts.append(" ")
+            continue
+        if token.startswith(("'", '"')):
+            parts.append(token)
+            continue
+        parts.append(token.lower())
+    return "".join(parts).strip().rstrip(";").strip()
+
+
+def build_sql_fingerprint(sql: str) -> str:
+    """作用：计算 SQL 指纹（归一化后的 sha1）。
+
+    输入参数：
+    - sql: str。
+
+    输出参数：
+    - 返回值类型: str。
+    """
+
+    return hashlib.sha1(normalize_sql(sql).encode("utf-8")).hexdigest()
+
+
+def _helper_tokenize_identifiers(normalized_sql: str) -> list[str]:
+    """作用：把归一化 SQL 切分为标识符/关键字、字符串、数字与单个符号；反引号标识符去掉反引号。
+
+    输入参数：
+    - normalized_sql: str，normalize_sql 的输出。
+
+    输出参数：
+    - 返回值类型: list[str]。
+    """
+
+    tokens: list[str] = []
+    for token in _SQL_WORD_PATTERN.findall(normalized_sql):
+        tokens.append(token[1:-1] if token.startswith("`") else token)
+    return tokens
+
+
+def extract_sql_tables(sql: str) -> set[str] | None:
+    """作用：提取 SQL 引用的全部物理表名（排除 CTE 名），用于结果缓存按表失效。
+
+    逐层扫描括号：FROM 后的表列表（含逗号分隔的多表、JOIN、括号嵌套的 JOIN）、派生表与任意位置的子查询都会被识别；
+    函数调用括号内的 FROM（如 EXTRACT(YEAR FROM ...)）不计入。
+
+    输入参数：
+    - sql: str。
+
+    输出参数：
+    - 返回值类型: set[str] | None，无法可靠确定引用的表（表函数、括号不配对、表名缺失等）时为 None，调用方不应缓存。
+    """
+
+    tokens = _helper_tokenize_identifiers(normalize_sql(sql))
+    cte_names: set[str] = set()
+    tables: set[str] = set()
+    # 每层括号一个帧：in_from 表示处于 FROM 表列表中，expect 表示下一个标识符是表名，call 表示函数调用括号
+    frames: list[dict[str, bool]] = [{"in_from": False, "expect": False, "call": False}]
+    index = 0
+    while index < len(tokens):
+        token = tokens[index]
+        frame = frames[-1]
+        following = tokens[index + 1] if index + 1 < len(tokens) else ""
+        if token in {"with", ","} and _helper_is_cte_definition(tokens, index + 1):
+            cte_names.add(tokens[index + 2] if tokens[index + 1] == "recursive" else tokens[index + 1])
+        if token == "(":
+            previous = tokens[index - 1] if index > 0 else ""
+            is_call = (
+                not frame["expect"]
+                and _SQL_IDENTIFIER_PATTERN.fullmatch(previous) is not None
+                and previous not in _SQL_NON_FUNCTION_KEYWORDS
+            )
+            frames.append({"in_from": frame["expect"], "expect": frame["expect"], "call": is_call})
+        elif token == ")":
+            if len(frames) == 1:
+                return None
+            frames.pop()
+            frames[-1]["expect"] = False
+        elif token == "select":
+            frame.update(in_from=False, expect=False, call=False)
+        elif frame["call"]:
+            pass
+        elif token == "from":
+            frame.update(in_from=True, expect=True)
+        elif token in {"join", "straight_join"}:
+            if not frame["in_from"]:
+                return None
+            frame["expect"] = True
+        elif token == "," and frame["in_from"]:
+            frame["expect"] = True
+        elif token in _SQL_FROM_LIST_TERMINATORS:
+            frame.update(in_from=False, expect=False)
+        elif frame["expect"] and token == "lateral":
+            pass
+        elif frame["expect"]:
+            if _SQL_IDENTIFIER_PATTERN.fullmatch(token) is None:
+                return None
+            # 库名限定的表名（db.table）取最后一段
+            while following == "." and index + 2 < len(tokens):
+                index += 2
+                token = tokens[index]
+                following = tokens[index + 1] if index + 1 < len(tokens) else ""
+            if following == "(":
+                # 表函数（如 JSON_TABLE）无法确定数据来源
+                return None
+            if token != "dual":
+                tables.add(token)
+            frame["expect"] = False
+        index += 1
+    if len(frames) != 1 or frames[0]["expect"]:
+        return None
+    return tables - cte_names
+
+
+def _helper_is_cte_definition(tokens: list[str], index: int) -> bool:
+    """作用：判断 tokens[index:] 是否为 CTE 定义的开头：[recursive] name [(列...)] as (。
+
+    输入参数：
+    - tokens: list[str]。
+    - index: int。
+
+    输出参数：
+    - 返回值类型: bool。
+    """
+
+    if index < len(tokens) and tokens[index] == "recursive":
+        index += 1
+    if index >= len(tokens) or _SQL_IDENTIFIER_PATTERN.fullmatch(tokens[index]) is None:
+        return False
+    index += 1
+    if index < len(tokens) and tokens[index] == "(":
+        depth = 0
+        while index < len(tokens):
+            if tokens[index] == "(":
+                depth += 1
+            elif tokens[index] == ")":
+                depth -= 1
+                if depth == 0:
+                    break
+            index += 1
+        index += 1
+    return tokens[index:index + 2] == ["as", "("]
+
+
+def _helper_evict_locked() -> None:
+    """作用：按条目数与单元格总量淘汰最久未使用的条目，调用方需持有锁。
+
+    输入参数：
+    - 无。
+
+    输出参数：
+    - 无。
+    """
+
+    global _CACHE_CELLS
+    while _CACHE_ENTRIES and (
+            len(_CACHE_ENTRIES) > settings.sql_result_cache_max_entries
+            or _CACHE_CELLS > settings.sql_result_cache_max_cells
+    ):
+        _, evicted = _CACHE_ENTRIES.popitem(last=False)
+        _CACHE_CELLS -= evicted.cell_count
+
+
+def _helper_drop_locked(fingerprint: str) -> None:
+    """作用：移除指定条目，调用方需持有锁。
+
+    输入参数：
+    - fingerprint: str。
+
+    输出参数：
+    - 无。
+    """
+
+    global _CACHE_CELLS
+    entry = _CACHE_ENTRIES.pop(fingerprint, None)
+    if entry is not None:
+        _CACHE_CELLS -= entry.cell_count
+
+
+def get_cached_sql_result(sql: str) -> list[dict[str, Any]] | None:
+    """作用：按 SQL 指纹读取缓存结果；所涉表数据版本变化或超过 TTL 时视为未命中。
+
+    输入参数：
+    - sql: str。
+
+    输出参数：
+    - 返回值类型: list[dict[str, Any]] | None，命中时返回新构造的行列表。
+    """
+
+    if not settings.sql_result_cache_enabled:
+        return None
+    fingerprint = build_sql_fingerprint(sql)
+    with _CACHE_LOCK:
+        entry = _CACHE_ENTRIES.get(fingerprint)
+        if entry is None:
+            return None
+        expired = (time.time() - entry.cached_at) > settings.sql_result_cache_ttl_seconds
+        if expired or get_data_versions(entry.table_versions.keys()) != entry.table_versions:
+            _helper_drop_locked(fingerprint)
+            return None
+        _CACHE_ENTRIES.move_to_end(fingerprint)
+        columns = entry.columns
+        column_values = entry.column_values
+        row_count = entry.row_count
+    if not columns:
+        return [{} for _ in range(row_count)]
+    return [dict(zip(columns, values)) for values in zip(*column_values)]
+
+
+def put_cached_sql_result(sql: str, rows: list[dict[str, Any]], table_versions: dict[str, int]) -> bool:
+    """作用：按列存储 SQL 结果；单条结果超过总容量的 1/8 时不缓存。
+
+    table_versions 应在执行 SQL 之前读取，避免执行期间的并发写入被误认为已包含在结果中。
+
+    输入参数：
+    - sql: str。
+    - rows: list[dict[str, Any]]，已转为 JSON 安全值的结果行。
+    - table_versions: dict[str, int]。
+
+    输出参数：
+    - 返回值类型: bool，是否写入缓存。
+    """
+
+    global _CACHE_CELLS
+    if not settings.sql_result_cache_enabled or not table_versions:
+        return False
+    columns: tuple[str, ...] = tuple(rows[0].keys()) if rows else ()
+    if any(tuple(row.keys()) != columns for row in rows):
+        return False
+    entry = SqlResultCacheEntry(
+        fingerprint=build_sql_fingerprint(sql),
+        columns=columns,
+        column_values=tuple(tuple(row[column] for row in rows) for column in columns),
+        row_count=len(rows),
+        table_versions=dict(table_versions),
+        cached_at=time.time(),
+    )
+    if entry.cell_count > settings.sql_result_cache_max_cells // 8:
+        return False
+    with _CACHE_LOCK:
+        _helper_drop_locked(entry.fingerprint)
+        _CACHE_ENTRIES[entry.fingerprint] = entry
+        _CACHE_CELLS += entry.cell_count
+        _helper_evict_locked()
+    return True
@@ -0,0 +1,297 @@
+from __future__ import annotations
+
+import re
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any
+
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.services.data_version_service import get_data_versions
+from app.services.probe_value_service import query_distinct_values
+
+try:
+    from pypinyin import Style, lazy_pinyin
+except ImportError:  # pypinyin 为可选依赖，未安装时仅使用 n-gram 匹配
+    Style = None
+    lazy_pinyin = None
+
+DEFAULT_DICTIONARY_FIELDS = (
+    "college.college_name",
+    "major.major_name",
+    "major.degree_type",
+    "class.class_name",
+    "student.gender",
+    "student.status",
+    "teacher.gender",
+    "teacher.title",
+    "teacher.status",
+    "course.course_name",
+    "course.course_type",
+    "course_class.term",
+    "enroll.status",
+    "score.term",
+    "score.score_level",
+    "attendance.status",
+)
+
+_NORMALIZE_PATTERN = re.compile(r"[\s\-_·・()（）\[\]【】]+")
+_CJK_PATTERN = re.compile(r"[一-鿿]")
+
+
+@dataclass(frozen=True)
+class FieldValueIndex:
+    """作用：单个分类字段的取值字典及其 n-gram / 拼音倒排索引（只读快照，刷新时整体替换）。"""
+
+    field: str
+    values: tuple[str, ...]
+    normalized: tuple[str, ...]
+    exact_index: dict[str, int]
+    gram_index: dict[str, tuple[int, ...]]
+    pinyin_index: dict[str, tuple[int, ...]]
+    data_version: int
+    loaded_at: float
+
+
+@dataclass(frozen=True)
+class ValueMatch:
+    """作用：取值匹配结果。strategy 取值：exact / pinyin / pinyin_initials / subsequence / ngram。"""
+
+    value: str
+    score: float
+    strategy: str
+
+
+_DICT_LOCK = threading.Lock()
+_DICT_INDEXES: dict[str, FieldValueIndex] = {}
+
+
+def normalize_value(value: str) -> str:
+    """作用：取值归一化：小写并去除空白与常见分隔符、括号。
+
+    输入参数：
+    - value: str。
+
+    输出参数：
+    - 返回值类型: str。
+    """
+
+    return _NORMALIZE_PATTERN.sub("", str(value or "").lower())
+
+
+def _helper_grams(normalized: str) -> set[str]:
+    """作用：切分字符二元组；单字符取值退化为一元组。
+
+    输入参数：
+    - normalized: str。
+
+    输出参数：
+    - 返回值类型: set[str]。
+    """
+
+    if len(normalized) < 2:
+        return {normalized} if normalized else set()
+    return {normalized[index:index + 2] for index in range(len(normalized) - 1)}
+
+
+def _helper_pinyin_keys(normalized: str) -> tuple[str, str] | None:
+    """作用：计算含中文取值的全拼与首字母串；未安装 pypinyin 或不含中文时为 None。
+
+    输入参数：
+    - normalized: str。
+
+    输出参数：
+    - 返回值类型: tuple[str, str] | None，(全拼, 首字母)。
+    """
+
+    if lazy_pinyin is None or not _CJK_PATTERN.search(normalized):
+        return None
+    full = "".join(lazy_pinyin(normalized))
+    initials = "".join(lazy_pinyin(normalized, style=Style.FIRST_LETTER))
+    return full.lower(), initials.lower()
+
+
+def _helper_is_subsequence(short: str, long: str) -> bool:
+    """作用：判断 short 的字符是否按顺序出现在 long 中（如“计算机学院”之于“计算机科学与技术学院”）。
+
+    输入参数：
+    - short: str。
+    - long: str。
+
+    输出参数：
+    - 返回值类型: bool。
+    """
+
+    remaining = iter(long)
+    return all(char in remaining for char in short)
+
+
+def build_field_value_index(field: str, values: list[str], data_version: int) -> FieldValueIndex:
+    """作用：为字段取值构建 n-gram 与拼音倒排索引。
+
+    输入参数：
+    - field: str。
+    - values: list[str]。
+    - data_version: int，所在表的数据版本号。
+
+    输出参数：
+    - 返回值类型: FieldValueIndex。
+    """
+
+    dedup_values: list[str] = []
+    normalized_values: list[str] = []
+    seen: set[str] = set()
+    for value in values:
+        value_text = str(value).strip()
+        normalized = normalize_value(value_text)
+        if not normalized or normalized in seen:
+            continue
+        seen.add(normalized)
+        dedup_values.append(value_text)
+        normalized_values.append(normalized)
+
+    gram_postings: dict[str, list[int]] = {}
+    pinyin_postings: dict[str, list[int]] = {}
+    for index, normalized in enumerate(normalized_values):
+        for gram in _helper_grams(normalized):
+            gram_postings.setdefault(gram, []).append(index)
+        pinyin_keys = _helper_pinyin_keys(normalized)
+        if pinyin_keys is not None:
+            for key in set(pinyin_keys):
+                pinyin_postings.setdefault(key, []).append(index)
+
+    return FieldValueIndex(
+        field=field,
+        values=tuple(dedup_values),
+        normalized=tuple(normalized_values),
+        exact_index={normalized: index for index, normalized in enumerate(normalized_values)},
+        gram_index={gram: tuple(postings) for gram, postings in gram_postings.items()},
+        pinyin_index={key: tuple(postings) for key, postings in pinyin_postings.items()},
+        data_version=data_version,
+        loaded_at=time.time(),
+    )
+
+
+def get_dictionary_fields() -> list[str]:
+    """作用：获取启用取值字典的字段列表（VALUE_DICTIONARY_FIELDS 未配置时使用内置分类/名称字段）。
+
+    输入参数：
+    - 无。
+
+    输出参数：
+    - 返回值类型: list[str]。
+    """
+
+    return list(settings.value_dictionary_fields or DEFAULT_DICTIONARY_FIELDS)
+
+
+def ensure_value_indexes(db: Session, fields: list[str]) -> dict[str, FieldValueIndex]:
+    """作用：获取字段的取值字典；首次使用、所在表数据版本变化或超过 TTL 时重新加载。
+
+    需要加载的字段合并为一条 UNION ALL 查询；加载失败的字段本次不返回。
+
+    输入参数：
+    - db: Session。
+    - fields: list[str]，候选字段（不在字典字段列表中的会被忽略）。
+
+    输出参数：
+    - 返回值类型: dict[str, FieldValueIndex]。
+    """
+
+    if not settings.value_dictionary_enabled:
+        return {}
+    dictionary_fields = set(get_dictionary_fields())
+    target_fields = list(dict.fromkeys(field for field in fields if field in dictionary_fields))
+    if not target_fields:
+        return {}
+    versions = get_data_versions(field.split(".", 1)[0] for field in target_fields)
+    now = time.time()
+    indexes: dict[str, FieldValueIndex] = {}
+    stale_fields: list[str] = []
+    with _DICT_LOCK:
+        for field in target_fields:
+            index = _DICT_INDEXES.get(field)
+            data_version = versions.get(field.split(".", 1)[0].lower(), 0)
+            if (
+                    index is None
+                    or index.data_version != data_version
+                    or (now - index.loaded_at) > settings.value_dictionary_ttl_seconds
+            ):
+                stale_fields.append(field)
+            else:
+                indexes[field] = index
+
+    if stale_fields:
+        fetched, _ = query_distinct_values(db, stale_fields, settings.value_dictionary_max_values)
+        built = {
+            field: build_field_value_index(field, values, versions.get(field.split(".", 1)[0].lower(), 0))
+            for field, values in fetched.items()
+        }
+        with _DICT_LOCK:
+            _DICT_INDEXES.update(built)
+        indexes.update(built)
+    return indexes
+
+
+def match_field_value(index: FieldValueIndex, raw_value: Any, top_k: int = 8) -> list[ValueMatch]:
+    """作用：在字段取值字典中查找与用户取值最接近的候选值。
+
+    依次考虑：归一化精确匹配、拼音全拼/首字母匹配、字符顺序包含（缩写）与二元组 Dice 相似度；
+    低于 VALUE_DICTIONARY_MIN_SCORE 的候选被丢弃。
+
+    输入参数：
+    - index: FieldValueIndex。
+    - raw_value: Any，用户/任务解析给出的取值。
+    - top_k: int。
+
+    输出参数：
+    - 返回值类型: list[ValueMatch]，按得分降序。
+    """
+
+    query = normalize_value(str(raw_value or ""))
+    if not query or not index.values:
+        return []
+
+    scores: dict[int, tuple[float, str]] = {}
+
+    def _helper_offer(candidate: int, score: float, strategy: str) -> None:
+        if score > scores.get(candidate, (0.0, ""))[0]:
+            scores[candidate] = (score, strategy)
+
+    exact_candidate = index.exact_index.get(query)
+    if exact_candidate is not None:
+        _helper_offer(exact_candidate, 1.0, "exact")
+    if index.pinyin_index:
+        query_pinyin = _helper_pinyin_keys(query)
+        if query_pinyin is not None:
+            for candidate in index.pinyin_index.get(query_pinyin[0], ()):
+                _helper_offer(candidate, 0.95, "pinyin")
+        elif query.isascii() and query.isalpha():
+            for candidate in index.pinyin_index.get(query, ()):
+                _helper_offer(candidate, 0.9, "pinyin_initials")
+
+    query_grams = _helper_grams(query)
+    overlaps: dict[int, int] = {}
+    for gram in query_grams:
+        for candidate in index.gram_index.get(gram, ()):
+            overlaps[candidate] = overlaps.get(candidate, 0) + 1
+    for candidate, overlap in overlaps.items():
+        normalized = index.normalized[candidate]
+        candidate_gram_count = len(_helper_grams(normalized))
+        dice = 2.0 * overlap / (len(query_grams) + candidate_gram_count)
+        _helper_offer(candidate, round(dice, 4), "ngram")
+        short, long = (query, normalized) if len(query) <= len(normalized) else (normalized, query)
+        if len(short) >= 2 and _helper_is_subsequence(short, long):
+            _helper_offer(candidate, round(0.6 + 0.3 * len(short) / len(long), 4), "subsequence")
+
+    ranked = sorted(
+        (
+            (score, strategy, candidate)
+            for candidate, (score, strategy) in scores.items()
+            if score >= settings.value_dictionary_min_score
+        ),
+        key=lambda item: (-item[0], len(index.values[item[2]])),
+    )
+    return [ValueMatch(value=index.values[candidate], score=score, strategy=strategy) for score, strategy, candidate in ranked[:top_k]]
@@ -0,0 +1,198 @@
+from __future__ import annotations
+
+import queue
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any
+
+from sqlalchemy import Table
+from sqlalchemy.engine import Engine
+
+from app.core.config import settings
+from app.core.logger import get_logger
+
+FLUSH_WAIT_SECONDS = 5.0
+
+logger = get_logger("write_behind")
+_STOP = object()
+
+
+@dataclass
+class PendingInsert:
+    """作用：一次提交的待写入行（同一张表，同一事务内写入，如一轮问答的用户与助手消息）。"""
+
+    bind: Engine
+    table: Table
+    rows: list[dict[str, Any]]
+
+
+class WriteBehindQueue:
+    """作用：工作流日志与会话历史的后写队列：请求路径只入队，由后台线程跨请求攒批后多行 INSERT。
+
+    攒够 WRITE_BEHIND_BATCH_ROWS 行或距首条入队超过 WRITE_BEHIND_FLUSH_INTERVAL_MS 时写入；
+    队列满或未启用时 submit 返回 False，由调用方改为同步写入。
+    """
+
+    def __init__(self) -> None:
+        self._queue: queue.Queue[Any] = queue.Queue(maxsize=max(settings.write_behind_queue_size, 1))
+        self._start_lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+        self._pending_lock = threading.Lock()
+        self._pending: dict[int, PendingInsert] = {}
+
+    def submit(self, bind: Engine, table: Table, rows: list[dict[str, Any]]) -> bool:
+        """作用：提交待写入行，立即返回。
+
+        输入参数：
+        - bind: Engine，写入的数据库（取自请求 Session，保证与同步写入一致）。
+        - table: Table。
+        - rows: list[dict[str, Any]]，列名到值，键需一致。
+
+        输出参数：
+        - 返回值类型: bool，False 表示未启用或队列已满，调用方需同步写入。
+        """
+
+        if not settings.write_behind_enabled or not rows:
+            return False
+        self._ensure_started()
+        item = PendingInsert(bind=bind, table=table, rows=rows)
+        with self._pending_lock:
+            self._pending[id(item)] = item
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            with self._pending_lock:
+                self._pending.pop(id(item), None)
+            return False
+        return True
+
+    def has_pending(self, table_name: str, session_id: str | None = None, admin_id: int | None = None) -> bool:
+        """作用：判断某会话（或某管理员）是否还有未写入数据库的行（用于读取会话历史前按需刷盘）。
+
+        输入参数：
+        - table_name: str。
+        - session_id: str | None，按会话匹配。
+        - admin_id: int | None，按管理员匹配；两者都给出时需同时匹配。
+
+        输出参数：
+        - 返回值类型: bool。
+        """
+
+        def _helper_matches(row: dict[str, Any]) -> bool:
+            return (session_id is None or row.get("session_id") == session_id) and (
+                admin_id is None or row.get("admin_id") == admin_id
+            )
+
+        with self._pending_lock:
+            return any(
+                item.table.name == table_name and any(_helper_matches(row) for row in item.rows)
+                for item in self._pending.values()
+            )
+
+    def flush(self, timeout: float = FLUSH_WAIT_SECONDS) -> None:
+        """作用：立即写入已入队的行并等待完成；队列已满时入队标记也只等待 timeout，总等待不超过 timeout。
+
+        输入参数：
+        - timeout: float。
+
+        输出参数：
+        - 无。
+        """
+
+        if self._thread is None:
+            return
+        deadline = time.monotonic() + timeout
+        done = threading.Event()
+        try:
+            self._queue.put(done, timeout=timeout)
+        except queue.Full:
+            return
+        done.wait(max(deadline - time.monotonic(), 0.0))
+
+    def close(self) -> None:
+        """作用：写完队列中剩余的行后停止后台线程（应用退出时调用）。
+
+        输入参数：
+        - 无。
+
+        输出参数：
+        - 无。
+        """
+
+        with self._start_lock:
+            thread = self._thread
+            self._thread = None
+        if thread is not None:
+            self._queue.put(_STOP)
+            thread.join(FLUSH_WAIT_SECONDS)
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is not None:
+                return
+            thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+            thread.start()
+            self._thread = thread
+
+    def _write_items(self, items: list[PendingInsert]) -> None:
+        """作用：按数据库分组，每组一个事务，同表的行合并为一条多行 INSERT；失败时逐项重试。"""
+
+        groups: dict[Engine, dict[Table, list[dict[str, Any]]]] = {}
+        for item in items:
+            groups.setdefault(item.bind, {}).setdefault(item.table, []).extend(item.rows)
+        for bind, tables in groups.items():
+            try:
+                with bind.begin() as conn:
+                    for table, rows in tables.items():
+                        conn.execute(table.insert(), rows)
+            except Exception:
+                self._retry_items([item for item in items if item.bind is bind])
+        with self._pending_lock:
+            for item in items:
+                self._pending.pop(id(item), None)
+
+    @staticmethod
+    def _retry_items(items: list[PendingInsert]) -> None:
+        """作用：批量写入失败后逐项写入，避免个别异常行拖累整批；仍失败的记录日志后丢弃。"""
+
+        for item in items:
+            try:
+                with item.bind.begin() as conn:
+                    conn.execute(item.table.insert(), item.rows)
+            except Exception:
+                logger.exception("write-behind insert dropped", extra={"payload": {"table": item.table.name, "rows": len(item.rows)}})
+
+    def _run(self) -> None:
+        """作用：后台线程主循环：攒批，按行数或时间间隔写入；收到 flush/停止信号时立即写入。"""
+
+        batch: list[PendingInsert] = []
+        batch_rows = 0
+        deadline = 0.0
+        interval = max(settings.write_behind_flush_interval_ms, 0) / 1000.0
+        while True:
+            timeout = max(deadline - time.monotonic(), 0.0) if batch else None
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            if isinstance(item, PendingInsert):
+                if not batch:
+                    deadline = time.monotonic() + interval
+                batch.append(item)
+                batch_rows += len(item.rows)
+                if batch_rows < settings.write_behind_batch_rows:
+                    continue
+            if batch:
+                self._write_items(batch)
+                batch = []
+                batch_rows = 0
+            if isinstance(item, threading.Event):
+                item.set()
+            elif item is _STOP:
+                return
+
+
+write_behind_queue = WriteBehindQueue()
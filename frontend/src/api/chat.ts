@@ -88,15 +88,17 @@ export type ChatResponse = {
 
 export type ChatStreamEventName =
   | "workflow_start"
+  | "queued"
   | "step_start"
   | "step_end"
+  | "summary_delta"
   | "workflow_error"
   | "workflow_end";
 
 export type ChatStreamEventData = {
   session_id: string;
   step: string;
-  status: "start" | "end" | "error";
+  status: "start" | "end" | "error" | "delta" | "queued";
   message: string;
   timestamp: string;
   seq: number;
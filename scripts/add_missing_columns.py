@@ -0,0 +1,47 @@
+import argparse
+import os
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+
+from app import models
+from app.db.session import engine
+
+
+def add_missing_columns(bind: Engine, dry_run: bool) -> list[str]:
+    # create_all 不会修改已存在的表：为已有表补齐模型中后续新增的可空列（如 query_template.last_used_at）
+    inspector = inspect(bind)
+    added: list[str] = []
+    model_classes = (getattr(models, name) for name in models.__all__)
+    for table in (model.__table__ for model in model_classes if hasattr(model, "__table__")):
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing or not column.nullable:
+                continue
+            column_type = column.type.compile(dialect=bind.dialect)
+            added.append(f"{table.name}.{column.name}")
+            if not dry_run:
+                with bind.begin() as connection:
+                    connection.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type} NULL"))
+    return added
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Add nullable model columns that are missing from existing tables")
+    parser.add_argument("--dry-run", action="store_true", help="only list columns that would be added")
+    args = parser.parse_args()
+
+    added = add_missing_columns(engine, args.dry_run)
+    action = "would add" if args.dry_run else "added"
+    print(f"{action} {len(added)} columns" + (f": {', '.join(added)}" if added else ""))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+import argparse
+import os
+import statistics
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from app.services.chat_graph import _helper_build_graph, get_chat_graph
+
+
+def measure_costs(fn, rounds: int) -> list[float]:
+    costs: list[float] = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        fn()
+        costs.append((time.perf_counter() - started) * 1000)
+    return costs
+
+
+def format_costs(label: str, costs: list[float]) -> str:
+    ordered = sorted(costs)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    return (
+        f"{label:<28} mean={statistics.mean(costs):8.3f}ms "
+        f"p50={statistics.median(costs):8.3f}ms p95={p95:8.3f}ms"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="对比每请求构建编译工作流图与进程级复用已编译图的开销")
+    parser.add_argument("--rounds", type=int, default=200, help="每种方式的测量轮数（默认 200）")
+    args = parser.parse_args()
+
+    # 预热：排除首次导入与编译的冷启动成本
+    get_chat_graph()
+    _helper_build_graph()
+
+    per_request = measure_costs(_helper_build_graph, args.rounds)
+    shared = measure_costs(get_chat_graph, args.rounds)
+
+    print(format_costs("build+compile per request", per_request))
+    print(format_costs("shared compiled graph", shared))
+    print(f"saved per request ≈ {statistics.mean(per_request) - statistics.mean(shared):.3f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+import argparse
+import os
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.db.session import SessionLocal
+from app.models.workflow_log import WorkflowLog
+from app.services.result_spill_service import build_result_digest
+
+
+def compact_workflow_logs(db: Session, batch_size: int, sample_rows: int, dry_run: bool) -> tuple[int, int]:
+    # 按主键分批扫描 sql_validate 日志，将 output_json 中的完整结果替换为摘要；每批单独提交
+    scanned = 0
+    compacted = 0
+    last_id = 0
+    while True:
+        rows = (
+            db.query(WorkflowLog)
+            .filter(WorkflowLog.step_name == "sql_validate", WorkflowLog.id > last_id)
+            .order_by(WorkflowLog.id.asc())
+            .limit(batch_size)
+            .all()
+        )
+        if not rows:
+            break
+        for row in rows:
+            scanned += 1
+            output_json = row.output_json
+            if isinstance(output_json, dict) and isinstance(output_json.get("result"), list):
+                compacted += 1
+                if not dry_run:
+                    row.output_json = build_result_digest(output_json, sample_rows)
+        last_id = rows[-1].id
+        if dry_run:
+            db.rollback()
+        else:
+            db.commit()
+        db.expunge_all()
+    return scanned, compacted
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compact sql_validate workflow logs into result digests")
+    parser.add_argument("--batch-size", type=int, default=500, help="rows per batch")
+    parser.add_argument(
+        "--sample-rows",
+        type=int,
+        default=settings.workflow_log_result_sample_rows,
+        help="rows kept in each digest",
+    )
+    parser.add_argument("--dry-run", action="store_true", help="only count rows that would be compacted")
+    parser.add_argument("--optimize", action="store_true", help="run OPTIMIZE TABLE workflow_log afterwards (MySQL)")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        scanned, compacted = compact_workflow_logs(db, max(args.batch_size, 1), args.sample_rows, args.dry_run)
+        action = "would compact" if args.dry_run else "compacted"
+        print(f"scanned {scanned} sql_validate logs, {action} {compacted}")
+        if args.optimize and not args.dry_run and compacted:
+            # 更新后 InnoDB 不会自动回收空间，需重建表释放磁盘与缓冲池占用
+            db.execute(text("OPTIMIZE TABLE workflow_log"))
+            db.commit()
+            print("workflow_log optimized")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+import time
+
+from sqlalchemy import create_engine, event
+
+from app.services import cancellation_service
+from app.services.cancellation_service import CancellationToken
+
+
+def test_kill_query_does_not_wait_for_exhausted_pool(tmp_path):
+    bind = create_engine(f"sqlite:///{tmp_path / 'kill.db'}", pool_size=1, max_overflow=0, pool_timeout=3)
+    statements = []
+    event.listen(
+        cancellation_service._helper_get_kill_engine(bind),
+        "before_cursor_execute",
+        lambda conn, cursor, statement, *args: statements.append(statement),
+    )
+    token = CancellationToken()
+    token._bind = bind
+    token._connection_id = 42
+    with bind.connect():
+        # 业务连接池已被正在执行的语句占满
+        started_at = time.perf_counter()
+        token._helper_kill_running_query()
+        elapsed = time.perf_counter() - started_at
+    assert statements == ["KILL QUERY 42"]
+    assert elapsed < 1
+
+
+def test_kill_query_skipped_after_detach(tmp_path):
+    bind = create_engine(f"sqlite:///{tmp_path / 'kill.db'}")
+    statements = []
+    event.listen(
+        cancellation_service._helper_get_kill_engine(bind),
+        "before_cursor_execute",
+        lambda conn, cursor, statement, *args: statements.append(statement),
+    )
+    token = CancellationToken()
+    token._bind = bind
+    token._connection_id = 42
+    original_connect = cancellation_service._helper_get_kill_engine(bind).connect
+
+    def _connect_then_detach():
+        connection = original_connect()
+        token.detach_connection()
+        return connection
+
+    cancellation_service._helper_get_kill_engine(bind).connect = _connect_then_detach
+    try:
+        token._helper_kill_running_query()
+    finally:
+        del cancellation_service._helper_get_kill_engine(bind).connect
+    assert statements == []
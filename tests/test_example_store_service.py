@@ -0,0 +1,39 @@
+from app.services.example_store_service import convert_example_sql, parse_testset_examples
+
+WHITELIST = frozenset(
+    {
+        "student.id", "student.student_no", "student.real_name", "student.is_deleted",
+        "score.student_id", "score.score_value", "score.is_deleted",
+    }
+)
+
+
+def test_convert_example_sql_resolves_aliases_and_wraps_in_cte():
+    sql = (
+        "SELECT\n  st.student_no,\n  AVG(sc.score_value) AS avg_score\nFROM score sc\n"
+        "JOIN student st ON st.id = sc.student_id AND st.is_deleted = 0\n"
+        "WHERE sc.is_deleted = 0\nGROUP BY st.student_no\nORDER BY avg_score DESC, st.student_no\nLIMIT 10;"
+    )
+    assert convert_example_sql(sql) == (
+        "WITH base AS (SELECT student.student_no, AVG(score.score_value) AS avg_score FROM score "
+        "JOIN student ON student.id = score.student_id AND student.is_deleted = 0 "
+        "WHERE score.is_deleted = 0 GROUP BY student.student_no) "
+        "SELECT base.student_no, base.avg_score FROM base ORDER BY avg_score DESC, base.student_no LIMIT 10"
+    )
+
+
+def test_convert_example_sql_rejects_self_join():
+    sql = "SELECT a.id FROM student a JOIN student b ON a.id = b.id"
+    assert convert_example_sql(sql) is None
+
+
+def test_parse_testset_examples_keeps_only_examples_passing_generation_checks():
+    markdown_text = (
+        "问题：查询学号 `S00001` 的学生。\n\n```sql\nSELECT s.student_no, s.real_name FROM student s "
+        "WHERE s.is_deleted = 0 AND s.student_no = 'S00001';\n```\n\n"
+        "问题：学生人数。\n\n```sql\nSELECT (SELECT COUNT(*) FROM student WHERE is_deleted = 0) AS student_cnt;\n```\n\n"
+        "问题：学生手机号。\n\n```sql\nSELECT s.phone FROM student s;\n```\n"
+    )
+    examples = parse_testset_examples(markdown_text, WHITELIST)
+    assert [example.question for example in examples] == ["查询学号 S00001 的学生。"]
+    assert examples[0].sql.startswith("WITH base AS (SELECT student.student_no, student.real_name FROM student ")
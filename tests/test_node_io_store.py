@@ -0,0 +1,52 @@
+import json
+
+from app.core.config import settings
+from app.services.node_io_store import INDEX_FILE_NAME, NodeIoStore
+
+
+class _FailingWriter:
+    """作用：模拟磁盘写满：写出半行后抛出 OSError。"""
+
+    def __init__(self, fp):
+        self.fp = fp
+
+    def write(self, data):
+        self.fp.write(data[: len(data) // 2])
+        raise OSError("No space left on device")
+
+    def __getattr__(self, name):
+        return getattr(self.fp, name)
+
+
+def test_failed_write_keeps_segment_and_index_consistent(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "node_io_compression", "none")
+    store = NodeIoStore(tmp_path)
+    store.append({"session_id": "s1", "step_name": "a"})
+    store.flush()
+    store._segment_fp = _FailingWriter(store._segment_fp)
+    store.append({"session_id": "s1", "step_name": "b"})
+    store.flush()
+    store.append({"session_id": "s1", "step_name": "c"})
+    store.close()
+
+    assert [record["step_name"] for record in store.read_session("s1")] == ["a", "c"]
+    segment_lines = (tmp_path / "segment-000001.ndjson").read_bytes().splitlines()
+    assert [json.loads(line)["step_name"] for line in segment_lines] == ["a", "c"]
+    assert [record["step_name"] for record in NodeIoStore(tmp_path).read_session("s1")] == ["a", "c"]
+
+
+def test_rotation_drops_old_segments_and_compacts_index(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "node_io_compression", "none")
+    monkeypatch.setattr(settings, "node_io_segment_max_bytes", 1)
+    monkeypatch.setattr(settings, "node_io_max_segments", 2)
+    store = NodeIoStore(tmp_path)
+    for index in range(5):
+        store.append({"session_id": f"s{index}", "step_name": "a"})
+    store.close()
+
+    assert sorted(path.name for path in tmp_path.glob("segment-*")) == ["segment-000004.ndjson", "segment-000005.ndjson"]
+    assert len((tmp_path / INDEX_FILE_NAME).read_bytes().splitlines()) == 2
+    assert store.read_session("s0") == []
+    assert set(store._index) == {"s3", "s4"}
+    reloaded = NodeIoStore(tmp_path)
+    assert [len(reloaded.read_session(f"s{index}")) for index in range(5)] == [0, 0, 0, 1, 1]
@@ -0,0 +1,89 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine, select, update
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.models.query_template import QueryTemplate
+from app.services import query_cache_service
+from app.services.query_cache_service import build_query_cache_key, lookup_query_cache, normalize_query, store_query_cache
+
+
+@pytest.fixture()
+def db(monkeypatch):
+    monkeypatch.setattr(settings, "query_cache_enabled", True)
+    monkeypatch.setattr(settings, "query_cache_max_entries", 2)
+    monkeypatch.setattr(settings, "query_cache_ttl_seconds", 3600)
+    query_cache_service._CACHE_ENTRIES.clear()
+    engine = create_engine("sqlite://")
+    QueryTemplate.__table__.create(engine)
+    with Session(engine) as session:
+        yield session
+    query_cache_service._CACHE_ENTRIES.clear()
+
+
+def _store(db, question):
+    cache_key = build_query_cache_key(normalize_query(question))
+    store_query_cache(db, cache_key, question, {"sql": f"SELECT '{question}'"}, None, admin_id=1, session_id="s")
+    db.commit()
+    return cache_key
+
+
+def test_store_evicts_least_recently_used_rows(db, monkeypatch):
+    monkeypatch.setattr(settings, "query_cache_touch_interval_seconds", 0)
+    hot_key = _store(db, "各学院平均分")
+    cold_key = _store(db, "各专业人数")
+    db.execute(update(QueryTemplate).values(last_used_at=datetime(2000, 1, 1)))
+    db.commit()
+    assert lookup_query_cache(db, "各学院平均分")[1] is not None
+    db.commit()
+    new_key = _store(db, "各班级人数")
+    names = set(db.execute(select(QueryTemplate.template_name)).scalars())
+    assert names == {hot_key, new_key}
+    assert cold_key not in names
+
+
+def test_hit_touch_is_throttled_and_keeps_updated_at(db, monkeypatch):
+    monkeypatch.setattr(settings, "query_cache_touch_interval_seconds", 3600)
+    cache_key = _store(db, "各学院学生人数")
+    old_used_at = datetime(2000, 1, 1)
+    db.execute(update(QueryTemplate).values(last_used_at=old_used_at, updated_at=QueryTemplate.updated_at))
+    db.commit()
+    updated_at = db.execute(select(QueryTemplate.updated_at)).scalar()
+    assert lookup_query_cache(db, "各学院学生人数")[1] is not None
+    row = db.execute(select(QueryTemplate.last_used_at, QueryTemplate.updated_at)).first()
+    assert row.last_used_at == old_used_at
+    assert row.updated_at == updated_at
+
+    monkeypatch.setattr(settings, "query_cache_touch_interval_seconds", 0)
+    assert lookup_query_cache(db, "各学院学生人数")[1] is query_cache_service._CACHE_ENTRIES[cache_key]
+    row = db.execute(select(QueryTemplate.last_used_at, QueryTemplate.updated_at)).first()
+    assert row.last_used_at > old_used_at
+    assert row.updated_at == updated_at
+
+
+def test_store_deletes_rows_past_ttl(db):
+    old_key = _store(db, "旧问题")
+    db.execute(
+        update(QueryTemplate)
+        .where(QueryTemplate.template_name == old_key)
+        .values(updated_at=datetime.now() - timedelta(days=2))
+    )
+    db.commit()
+    new_key = _store(db, "新问题")
+    names = set(db.execute(select(QueryTemplate.template_name)).scalars())
+    assert names == {new_key}
+
+
+def test_memory_hit_sees_invalidation_from_other_process(db):
+    cache_key = _store(db, "各学院学生人数")
+    assert lookup_query_cache(db, "各学院学生人数")[1] is not None
+    db.execute(
+        update(QueryTemplate)
+        .where(QueryTemplate.template_name == cache_key)
+        .values(is_deleted=True, status="expired")
+    )
+    db.commit()
+    assert lookup_query_cache(db, "各学院学生人数") == (cache_key, None)
+    assert cache_key not in query_cache_service._CACHE_ENTRIES
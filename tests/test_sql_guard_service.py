@@ -0,0 +1,62 @@
+from types import SimpleNamespace
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+
+from app.services import sql_guard_service
+from app.services.sql_guard_service import GuardedRows, execute_guarded_sql
+
+
+class _EndlessResult:
+    """作用：模拟流式游标：每批都有数据，关闭时若未被中断会读完剩余结果。"""
+
+    def __init__(self):
+        self.fetch_calls = 0
+        self.closed = False
+        self.drained = False
+        self.aborted = False
+
+    def fetchmany(self, size):
+        self.fetch_calls += 1
+        return [SimpleNamespace(_mapping={"id": self.fetch_calls * size + index}) for index in range(size)]
+
+    def close(self):
+        self.closed = True
+        self.drained = not self.aborted
+
+
+def test_row_cap_stops_fetch_and_aborts_statement():
+    result = _EndlessResult()
+
+    def _abort(aborted_result):
+        aborted_result.aborted = True
+
+    guarded_rows = GuardedRows(result, row_cap=3, abort_statement=_abort)
+    assert len(list(guarded_rows)) == 3
+    assert guarded_rows.truncated
+    assert result.fetch_calls == 1
+    assert result.aborted and result.closed and not result.drained
+
+
+def test_abort_mysql_statement_kills_instead_of_draining(monkeypatch):
+    killed = []
+    monkeypatch.setattr(sql_guard_service, "kill_mysql_query", lambda bind, connection_id: killed.append(connection_id) or True)
+
+    class _InterruptedCursor:
+        def close(self):
+            raise RuntimeError(1317, "Query execution was interrupted")
+
+    db = SimpleNamespace(get_bind=lambda: None, connection=lambda: None)
+    sql_guard_service._helper_abort_mysql_statement(db, 42, SimpleNamespace(cursor=_InterruptedCursor()))
+    assert killed == [42]
+
+
+def test_execute_guarded_sql_truncates_without_mysql():
+    engine = create_engine("sqlite://")
+    with Session(engine) as db:
+        db.execute(text("CREATE TABLE t (id INTEGER)"))
+        db.execute(text("INSERT INTO t (id) VALUES (1), (2), (3)"))
+        guarded_rows = execute_guarded_sql(db, "SELECT id FROM t ORDER BY id", row_cap=2)
+        assert list(guarded_rows) == [{"id": 1}, {"id": 2}]
+        assert guarded_rows.truncated
+        assert db.execute(text("SELECT COUNT(*) FROM t")).scalar() == 3
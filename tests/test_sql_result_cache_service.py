@@ -0,0 +1,28 @@
+from app.services.sql_result_cache_service import extract_sql_tables
+
+
+def test_extract_sql_tables_comma_join():
+    sql = "SELECT s.student_no, sc.score FROM score sc, student s WHERE sc.student_id = s.id"
+    assert extract_sql_tables(sql) == {"score", "student"}
+
+
+def test_extract_sql_tables_comma_join_with_derived_table_and_join():
+    sql = (
+        "SELECT * FROM (SELECT id FROM student) t, course c "
+        "JOIN course_class cc ON cc.course_id = c.id, (SELECT 1 FROM score, class) u"
+    )
+    assert extract_sql_tables(sql) == {"student", "course", "course_class", "score", "class"}
+
+
+def test_extract_sql_tables_subqueries_and_cte():
+    sql = (
+        "WITH base AS (SELECT student.id FROM student, college WHERE student.college_id = college.id) "
+        "SELECT EXTRACT(YEAR FROM NOW()), (SELECT COUNT(*) FROM teacher) FROM base "
+        "WHERE base.id IN (SELECT score.student_id FROM score)"
+    )
+    assert extract_sql_tables(sql) == {"student", "college", "teacher", "score"}
+
+
+def test_extract_sql_tables_unresolvable_returns_none():
+    assert extract_sql_tables("SELECT * FROM JSON_TABLE('[]', '$[*]' COLUMNS (a INT PATH '$')) jt") is None
+    assert extract_sql_tables("SELECT * FROM student WHERE (id = 1") is None
@@ -0,0 +1,28 @@
+import threading
+import time
+
+from app.core.config import settings
+from app.services.write_behind_service import WriteBehindQueue
+
+
+def test_flush_gives_up_when_queue_stays_full(monkeypatch):
+    monkeypatch.setattr(settings, "write_behind_queue_size", 1)
+    write_queue = WriteBehindQueue()
+    # 写线程卡住：队列已满且无人消费
+    write_queue._thread = threading.Thread(target=lambda: None)
+    write_queue._queue.put_nowait(object())
+    started_at = time.perf_counter()
+    write_queue.flush(timeout=0.2)
+    assert time.perf_counter() - started_at < 1
+
+
+def test_has_pending_is_scoped_to_admin_and_session(monkeypatch):
+    monkeypatch.setattr(settings, "write_behind_enabled", True)
+    write_queue = WriteBehindQueue()
+    monkeypatch.setattr(write_queue, "_ensure_started", lambda: None)
+    table = type("T", (), {"name": "chat_history"})()
+    assert write_queue.submit(None, table, [{"admin_id": 1, "session_id": "s1"}])
+    assert write_queue.has_pending("chat_history", "s1", admin_id=1)
+    assert write_queue.has_pending("chat_history", admin_id=1)
+    assert not write_queue.has_pending("chat_history", "s2", admin_id=1)
+    assert not write_queue.has_pending("chat_history", admin_id=2)